@@ -1,16 +1,40 @@
-import paho.mqtt.client as mqtt
 import time
 from kivy.uix.screenmanager import Screen
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
 from kivy.uix.textinput import TextInput
 from kivy.uix.button import Button
 from kivy.uix.popup import Popup
 from kivy.clock import Clock
-from kivy.app import App
 from datetime import datetime
 
+MAX_ROWS = 1000  # Messages kept in the chat view
+TRIM_BATCH = 100  # Overflow allowed before the oldest rows are dropped
+
+
+class ChatRow(Label):
+    """One message in the chat view; RecycleView reuses a few of these for the visible rows"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.markup = True
+        self.halign = 'left'
+        self.valign = 'top'
+        self.font_size = '14sp'
+        self.size_hint_y = None
+        self.bind(width=self._update_text_size, texture_size=self._update_height)
+
+    def _update_text_size(self, instance, width):
+        self.text_size = (width, None)
+
+    def _update_height(self, instance, size):
+        # The layout keeps each row's measured height, so rows are only measured when shown
+        self.height = size[1]
+
+
 class MQTTChatScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -19,6 +43,9 @@ class MQTTChatScreen(Screen):
         self.username = "User"  # Default username
         self.main_app = None  # Reference to main app
         self.online_users = []  # List of online users
+        self.pending_rows = []  # Rows added since the last frame
+        self.flush_rows = Clock.create_trigger(self._flush_rows)
+        self._scroll_anchor = None  # 'bottom', or the offset from the top to hold, until the user scrolls
 
         # Main layout
         layout = BoxLayout(orientation='vertical', padding=[10, 10, 10, 10], spacing=10)
@@ -40,6 +67,7 @@ class MQTTChatScreen(Screen):
             text_size=(None, None)  # Will be set dynamically
         )
         self.room_label.bind(size=self._update_room_label_text_size)
+        self.room_label.bind(on_touch_down=self._toggle_debug_overlay)
         
         # Users button (shows count and opens user list)
         self.users_button = Button(
@@ -65,21 +93,22 @@ class MQTTChatScreen(Screen):
         top_bar.add_widget(self.disconnect_button)
         layout.add_widget(top_bar)
 
-        # Message display area with proper scrolling
-        self.scrollview = ScrollView()
-        
-        self.message_log = Label(
-            size_hint_y=None, 
-            text_size=(None, None), 
-            halign='left', 
-            valign='top',
-            markup=True,
-            font_size='14sp',
-            padding=[10, 10]
+        # Message display area: only the visible rows are rendered
+        self.message_view = RecycleView(do_scroll_x=False)
+        self.message_view.viewclass = ChatRow
+        self.message_rows = RecycleBoxLayout(
+            orientation='vertical',
+            size_hint_y=None,
+            default_size=(None, 40),
+            default_size_hint=(1, None),
+            padding=[10, 10],
+            spacing=10
         )
-        self.message_log.bind(texture_size=self.update_log_height)
-        self.scrollview.add_widget(self.message_log)
-        layout.add_widget(self.scrollview)
+        self.message_rows.bind(minimum_height=self.message_rows.setter('height'))
+        self.message_rows.bind(height=self._update_scroll)
+        self.message_view.bind(on_scroll_start=self._release_scroll)
+        self.message_view.add_widget(self.message_rows)
+        layout.add_widget(self.message_view)
 
         # Message input area
         input_area = BoxLayout(
@@ -109,6 +138,20 @@ class MQTTChatScreen(Screen):
         layout.add_widget(input_area)
 
         self.add_widget(layout)
+
+        # Debug overlay with the inbound queue stats (double-tap the room name to show it)
+        self.debug_overlay = Label(
+            size_hint=(None, None),
+            size=('260dp', '105dp'),
+            pos_hint={'right': 1, 'top': 0.9},
+            font_size='12sp',
+            color=(1, 1, 0, 1),
+            halign='right',
+            valign='top',
+            opacity=0
+        )
+        self.debug_overlay.bind(size=self.debug_overlay.setter('text_size'))
+        self.add_widget(self.debug_overlay)
         
         # Initialize with welcome message
         self.clear_messages()
@@ -118,18 +161,65 @@ class MQTTChatScreen(Screen):
         # Set text_size to enable proper text wrapping
         self.room_label.text_size = (size[0], None)
 
-    def update_log_height(self, instance, value):
-        """Update the height of the message log and scroll to bottom"""
-        # Set minimum height to fill the scroll area
-        min_height = self.scrollview.height if self.scrollview.height > 0 else 400
-        self.message_log.height = max(value[1], min_height)
-        
-        # Set text_size for proper word wrapping
-        available_width = self.scrollview.width - 20 if self.scrollview.width > 0 else 300
-        self.message_log.text_size = (available_width, None)
-        
-        # Scroll to bottom after a short delay
-        Clock.schedule_once(lambda dt: setattr(self.scrollview, 'scroll_y', 0), 0.1)
+    def _toggle_debug_overlay(self, instance, touch):
+        """Show or hide the debug overlay on a double tap of the room name"""
+        if instance.collide_point(*touch.pos) and touch.is_double_tap:
+            self.debug_overlay.opacity = 0 if self.debug_overlay.opacity else 1
+
+    def show_queue_stats(self, stats, power=None):
+        """Put the inbound queue and power policy stats in the debug overlay"""
+        if not self.debug_overlay.opacity:
+            return
+        text = (f"Queue: {stats['depth']} (max {stats['max_depth']})\n"
+                f"Drain: {stats['avg_drain_ms']:.1f} ms avg, {stats['max_drain_ms']:.1f} ms max\n"
+                f"Events: {stats['enqueued']} in {stats['drains']} frames")
+        if power:
+            text += (f"\nPower: {power['state']}, {power['wakeups']:.0f} wakeups/h\n"
+                     f"Traffic: {power['bytes_in'] / 1024:.1f} KB/h in, {power['bytes_out'] / 1024:.1f} KB/h out")
+        self.debug_overlay.text = text
+
+    def at_bottom(self):
+        """True when the newest message is in view (or everything fits)"""
+        view = self.message_view
+        return self.message_rows.height <= view.height or view.scroll_y <= 0.01
+
+    def add_row(self, formatted_message):
+        """Queue a formatted message; rows are added to the view once per frame"""
+        self.pending_rows.append({'text': formatted_message})
+        self.flush_rows()
+
+    def _flush_rows(self, dt):
+        """Add the queued rows, dropping the oldest once the view holds too many"""
+        rows, self.pending_rows = self.pending_rows, []
+        if not rows:
+            return
+        data = self.message_view.data
+        following = self.at_bottom()
+        if following:
+            self._scroll_anchor = 'bottom'
+        else:
+            # New rows go below: hold the rows being read where they are
+            view = self.message_view
+            self._scroll_anchor = (1 - view.scroll_y) * (self.message_rows.height - view.height)
+        data.extend(rows)
+        # Trim in batches, and while reading older messages only at twice the limit
+        limit = MAX_ROWS + TRIM_BATCH if following else 2 * MAX_ROWS
+        if len(data) > limit:
+            del data[:len(data) - MAX_ROWS]
+
+    def _update_scroll(self, instance, height):
+        """Keep the view on the bottom, or on the rows being read, as rows are added and measured"""
+        view = self.message_view
+        if self._scroll_anchor is None or height <= view.height:
+            return
+        if self._scroll_anchor == 'bottom':
+            view.scroll_y = 0
+        else:
+            view.scroll_y = max(0, 1 - self._scroll_anchor / (height - view.height))
+
+    def _release_scroll(self, instance, touch):
+        """The user took over scrolling"""
+        self._scroll_anchor = None
 
     def show_users_popup(self, instance):
         """Show popup with list of online users"""
@@ -181,6 +271,46 @@ class MQTTChatScreen(Screen):
         
         popup.open()
 
+    def ask_file_offer(self, sender, name, size, on_answer):
+        """Ask whether to download an offered file; on_answer(True/False) gets the choice"""
+        content_layout = BoxLayout(orientation='vertical', spacing=10, padding=20)
+        offer_label = Label(
+            text=f"{sender} is sending {name} ({size / 1e6:.1f} MB).\n\nDownload it?",
+            font_size='16sp',
+            halign='center',
+            valign='middle'
+        )
+        content_layout.add_widget(offer_label)
+
+        button_layout = BoxLayout(orientation='horizontal', size_hint_y=None, height='60dp', spacing=15)
+        ignore_button = Button(text='Ignore', size_hint_x=0.5, font_size='16sp',
+                               background_color=[0.5, 0.5, 0.5, 1])
+        download_button = Button(text='Download', size_hint_x=0.5, font_size='16sp',
+                                 background_color=[0.3, 0.6, 0.3, 1])
+        button_layout.add_widget(ignore_button)
+        button_layout.add_widget(download_button)
+        content_layout.add_widget(button_layout)
+
+        popup = Popup(
+            title='File Offered',
+            content=content_layout,
+            size_hint=(0.9, 0.5),
+            auto_dismiss=False  # An answer is needed either way
+        )
+
+        def answer(accepted):
+            popup.dismiss()
+            on_answer(accepted)
+
+        ignore_button.bind(on_release=lambda instance: answer(False))
+        download_button.bind(on_release=lambda instance: answer(True))
+
+        def update_label_size(dt):
+            offer_label.text_size = (popup.width - 40, None)
+        Clock.schedule_once(update_label_size, 0.1)
+
+        popup.open()
+
     def setup(self, mqtt_client, topic, username="User", main_app=None):
         """Set up the chat screen with MQTT client and topic"""
         self.mqtt_client = mqtt_client
@@ -195,7 +325,18 @@ class MQTTChatScreen(Screen):
 
     def clear_messages(self):
         """Clear all messages from the chat"""
-        self.message_log.text = ""
+        self.pending_rows = []
+        self._scroll_anchor = None
+        self.message_view.data = []
+        self.message_view.scroll_y = 1
+
+    def add_lines(self, lines):
+        """Add a frame's worth of queued ("chat" | "system", args) lines"""
+        for kind, args in lines:
+            if kind == "chat":
+                self.add_chat_message(*args)
+            else:
+                self.add_system_message(*args)
 
     def add_chat_message(self, username, message_text, timestamp):
         """Add a chat message to the log (called from main app)"""
@@ -205,24 +346,17 @@ class MQTTChatScreen(Screen):
         # Use different colors for different users
         username_color = "4488ff" if username != self.username else "44aa44"
         formatted_message = f"[color=888888][size=12sp]{time_str}[/size][/color]\n[color={username_color}][size=14sp][b]{username}:[/b][/color] [size=14sp]{message_text}[/size]"
-        
-        if self.message_log.text:
-            self.message_log.text += "\n\n" + formatted_message
-        else:
-            self.message_log.text = formatted_message
+        self.add_row(formatted_message)
 
-    def add_system_message(self, message_text):
+    def add_system_message(self, message_text, timestamp=None):
         """Add a system message to the chat log"""
-        timestamp = time.time()
+        if timestamp is None:
+            timestamp = time.time()
         time_str = datetime.fromtimestamp(timestamp).strftime("%I:%M %p")
         
         # System messages with distinct styling
         formatted_message = f"[color=888888][size=12sp]{time_str}[/size][/color]\n[color=00aa00][size=13sp][i]* {message_text}[/i][/size][/color]"
-        
-        if self.message_log.text:
-            self.message_log.text += "\n\n" + formatted_message
-        else:
-            self.message_log.text = formatted_message
+        self.add_row(formatted_message)
 
     def update_users_list(self, users_list):
         """Update the online users list (called from main app)"""
@@ -1,353 +1,331 @@
-import paho.mqtt.client as mqtt
-import json
-import base64
-import hashlib
-import time
+import importlib.util
+import os
+import sys
 import threading
+import time
 from kivy.app import App
-from kivy.uix.screenmanager import ScreenManager, Screen
+from kivy.uix.screenmanager import ScreenManager
 from kivy.clock import Clock
 from connection_screen import ConnectionScreen
 from chat_screen import MQTTChatScreen
-from datetime import datetime
 
-# Import cryptography for proper encryption
+# The shared chat engine lives in mqchat_core at the repository root. Buildozer
+# packages a copy placed next to this file; when running from a checkout we
+# fall back to the parent directory.
+if importlib.util.find_spec("mqchat_core") is None:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Import cryptography for proper encryption (the engine needs it)
 try:
-    from cryptography.fernet import Fernet
+    from mqchat_core import (ChatEngine, LoopDriver, EVENT_CONNECTED, EVENT_CONNECTION_FAILED,
+                             EVENT_DISCONNECTED, EVENT_CHAT_MESSAGE, EVENT_SYSTEM_MESSAGE,
+                             EVENT_USERS_CHANGED, EVENT_KEY_ROTATED, EVENT_KEY_DERIVED,
+                             EVENT_FILE_OFFERED, EVENT_FILE_DONE)
+    from mqchat_core.roster import SortedRoster
+    from mqchat_core.dispatch import EventQueue, FrameTimer, coalesce
+    from mqchat_core.power import PowerPolicy, app_state
+    from mqchat_core.session import load_install_id
+    from mqchat_core.mqtt5 import known_protocols
     ENCRYPTION_AVAILABLE = True
 except ImportError:
     print("Warning: cryptography package not available. Install with: pip install cryptography")
     ENCRYPTION_AVAILABLE = False
-    Fernet = None
+    ChatEngine = None
+
+FRAME_BUDGET_MS = 8     # Max time spent applying events per frame
+DRAIN_CHUNK = 500       # Events taken from the queue per budget check
+
+# Service the MQTT socket and timed jobs from the Kivy clock instead of network
+# and scheduler threads (see mqchat_core.eventloop)
+NETWORK_ON_CLOCK = False
+
+NETWORK_CHECK_INTERVAL = 60  # Seconds between checks for a metered network while on screen
+
+
+def network_metered():
+    """True on a metered (usually cellular) network; always False off Android"""
+    try:
+        from jnius import autoclass
+    except ImportError:
+        return False
+    try:
+        activity = autoclass('org.kivy.android.PythonActivity').mActivity
+        context = autoclass('android.content.Context')
+        manager = activity.getSystemService(context.CONNECTIVITY_SERVICE)
+        return bool(manager.isActiveNetworkMetered())
+    except Exception as e:
+        print(f"Could not check the network type: {e}")
+        return False
 
 class MQTTChatApp(App):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.mqtt_client = None
         self.username = "User"  # Chat display name
-        self.cipher = None  # Encryption cipher
-        self.connected = False
-        self.channel = ""
-        self.heartbeat_timer = None
-        self.online_users = set()
-        self.user_cleanup_timer = None  # New: Timer for cleaning stale users
-        
-        # MQTT topics
-        self.messages_topic = ""
-        self.presence_topic = ""
-        self.userlist_topic = ""
-        
+
+        # Chat engine (MQTT client, cipher, roster and heartbeat - same as desktop).
+        # Engine events arrive on paho's network thread; handlers queue them in
+        # the inbox and the Kivy main thread applies them once per frame.
+        self.engine = None
+        if ENCRYPTION_AVAILABLE:
+            self.inbox = EventQueue()
+            self.last_stats_update = 0
+            self.roster = SortedRoster()  # Users in display order, updated from roster changes
+            self.driver = LoopDriver() if NETWORK_ON_CLOCK else None
+            # The install id keeps our MQTT client id unique when others share our nickname
+            self.engine = ChatEngine(driver=self.driver, install_id=load_install_id("mqchat_install_id"))
+            known_protocols.open("mqchat_protocols.json")  # So "auto" rooms skip a refused v5 attempt
+            # Keepalive pings and heartbeats follow the app's state (see mqchat_core.power)
+            self.power = PowerPolicy(self.engine)
+            self.paused = False
+            self.engine.on(EVENT_CONNECTED, self.on_engine_connected)
+            self.engine.on(EVENT_CONNECTION_FAILED, self.on_engine_connection_failed)
+            self.engine.on(EVENT_DISCONNECTED, self.on_engine_disconnected)
+            self.engine.on(EVENT_CHAT_MESSAGE, self.on_engine_chat_message)
+            self.engine.on(EVENT_SYSTEM_MESSAGE, self.on_engine_system_message)
+            self.engine.on(EVENT_USERS_CHANGED, self.on_engine_users_changed)
+            self.engine.on(EVENT_KEY_ROTATED, self.on_engine_key_rotated)
+            self.engine.on(EVENT_KEY_DERIVED, self.on_engine_key_derived)
+            self.engine.on(EVENT_FILE_OFFERED, self.on_engine_file_offered)
+            self.engine.on(EVENT_FILE_DONE, self.on_engine_file_done)
+
+    @property
+    def connected(self):
+        return bool(self.engine and self.engine.connected)
+
+    @property
+    def mqtt_client(self):
+        return self.engine.mqtt_client if self.engine else None
+
+    @property
+    def channel(self):
+        return self.engine.channel if self.engine else ""
+
     def build(self):
+        # Received files go to app storage (the working directory may be read-only)
+        if self.engine:
+            self.engine.files.download_dir = os.path.join(self.user_data_dir, "received_files")
+
         # Create screen manager
         self.screen_manager = ScreenManager()
-        
+
         # Create connection screen
         self.connection_screen = ConnectionScreen(name='connection')
         self.connection_screen.set_main_app(self)
-        
+
         # Create chat screen
         self.chat_screen = MQTTChatScreen(name='chat')
-        
+
         # Add screens to manager
         self.screen_manager.add_widget(self.connection_screen)
         self.screen_manager.add_widget(self.chat_screen)
-        
+
+        # Apply queued engine events every frame
+        if self.engine:
+            Clock.schedule_interval(self._drain_events, 0)
+            Clock.schedule_interval(self.update_power_state, NETWORK_CHECK_INTERVAL)
+            if self.driver is not None:
+                # Read and write the socket every frame (select() doesn't block)
+                Clock.schedule_interval(self.driver.poll, 0)
+
         return self.screen_manager
-    
-    def derive_key(self, password):
-        """Derive a Fernet key from a password (same as desktop version)"""
-        if not ENCRYPTION_AVAILABLE:
-            return None
-        # Use SHA256 to create a 32-byte key, then base64 encode for Fernet
-        hash_obj = hashlib.sha256(password.encode())
-        key = base64.urlsafe_b64encode(hash_obj.digest())
-        return key
-    
-    def connect_to_mqtt(self, server, port, room, encryption_key, mqtt_username=None, mqtt_password=None):
+
+    def connect_to_mqtt(self, server, port, room, encryption_key, mqtt_username=None, mqtt_password=None,
+                        options=None):
         """Connect to MQTT broker with full encryption and authentication"""
         try:
-            self.channel = room
-            
             # Validate encryption
             if not ENCRYPTION_AVAILABLE:
                 Clock.schedule_once(lambda dt: self.show_error("Cryptography package not installed! Please install: pip install cryptography"))
                 return
-                
+
             if not encryption_key:
                 Clock.schedule_once(lambda dt: self.show_error("Encryption key is required!"))
                 return
-            
-            # Setup encryption (same method as desktop)
-            key = self.derive_key(encryption_key)
-            self.cipher = Fernet(key)
-            
-            # Setup topics (same as desktop)
-            self.messages_topic = f"chat/{self.channel}/messages"
-            self.presence_topic = f"chat/{self.channel}/presence"
-            self.userlist_topic = f"chat/{self.channel}/users"
-            
-            # Create MQTT client (fix deprecation warning like desktop)
-            self.mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-            self.mqtt_client.on_connect = self.on_mqtt_connect
-            self.mqtt_client.on_message = self.on_mqtt_message
-            self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
-            
-            # Set MQTT authentication if provided (like desktop)
-            if mqtt_username and mqtt_username.strip():
-                self.mqtt_client.username_pw_set(mqtt_username.strip(), mqtt_password.strip() if mqtt_password else "")
-                print(f"Using MQTT authentication for user: {mqtt_username}")
-            else:
-                print("Connecting with anonymous MQTT access")
-            
-            # Set last will (sent when we disconnect unexpectedly) - like desktop
-            will_msg = json.dumps({"user": self.username, "status": "offline", "timestamp": time.time()})
-            self.mqtt_client.will_set(f"{self.presence_topic}/{self.username}", will_msg, retain=True)
-            
-            # Connect
+
+            # Connect (the engine sets up encryption, topics and last will like desktop)
             print(f"Connecting to {server}:{port}")
-            self.mqtt_client.connect(server, port, 60)
-            self.mqtt_client.loop_start()
-            
+            self.engine.connect(server, port, room, self.username, encryption_key,
+                                (mqtt_username or "").strip(), (mqtt_password or "").strip(),
+                                options=options)
+
         except Exception as e:
             error_msg = f"Connection failed: {str(e)}"
             print(error_msg)
             Clock.schedule_once(lambda dt: self.show_error(error_msg))
-    
-    def on_mqtt_connect(self, client, userdata, flags, rc):
-        """Called when MQTT connects (same logic as desktop)"""
-        if rc == 0:
-            self.connected = True
-            print("Connected to MQTT broker")
-            
-            # Clear our presence first (in case of reconnection)
-            self.clear_my_presence()
-            
-            # Subscribe to topics
-            client.subscribe(self.messages_topic)
-            client.subscribe(f"{self.presence_topic}/+")
-            
-            # Announce our presence
-            self.announce_presence("online")
-            
-            # Start heartbeat and user cleanup
-            self.start_heartbeat()
-            self.start_user_cleanup()
-            
-            # Switch to chat screen and set it up
-            Clock.schedule_once(lambda dt: self.setup_chat_screen())
+
+    def on_engine_connected(self):
+        """Called when the engine has joined the room"""
+        print("Connected to MQTT broker")
+
+        # The engine runs the heartbeat and evicts stale users (see mqchat_core.presence)
+
+        # Switch to chat screen and set it up
+        self.inbox.put("call", self.setup_chat_screen)
+
+    def on_engine_connection_failed(self, rc):
+        """Called when the broker refuses the connection"""
+        error_msg = f"MQTT connection failed with code {rc}"
+        print(error_msg)
+        self.inbox.put("call", self.show_error, error_msg)
+
+    def on_engine_chat_message(self, username, message, timestamp):
+        """Show a chat message (ours or someone else's) on the chat screen"""
+        self.inbox.put("chat", username, message, timestamp)
+
+    def on_engine_system_message(self, message):
+        """Show a system message on the chat screen"""
+        self.inbox.put("system", message, time.time())
+
+    def on_engine_users_changed(self, changes):
+        """Queue roster changes; the users list is refreshed once per frame"""
+        self.inbox.put("users", changes)
+
+    def on_engine_key_rotated(self, epoch, new_passphrase, old_passphrase):
+        """Keep the connection screen and saved rooms on the room's current key"""
+        self.inbox.put("call", self.connection_screen.update_room_key,
+                       self.channel, old_passphrase, new_passphrase)
+
+    def on_engine_key_derived(self, cache_id, key, passphrase):
+        """Save a freshly derived scrypt key so the next connect skips the KDF"""
+        self.inbox.put("call", self.connection_screen.store_derived_key,
+                       self.channel, passphrase, cache_id, key)
+
+    def on_engine_file_offered(self, transfer_id, sender, name, size):
+        """Someone offered a file to the room: ask before downloading it"""
+        self.on_engine_system_message(f"{sender} is sending {name} ({size / 1e6:.1f} MB)")
+        self.inbox.put("call", self.chat_screen.ask_file_offer, sender, name, size,
+                       lambda accepted: self.answer_file_offer(transfer_id, accepted))
+
+    def answer_file_offer(self, transfer_id, accepted):
+        """Download or ignore an offered file (runs when the user answers)"""
+        if accepted:
+            self.engine.accept_file(transfer_id)
         else:
-            error_msg = f"MQTT connection failed with code {rc}"
-            print(error_msg)
-            Clock.schedule_once(lambda dt: self.show_error(error_msg))
-    
-    def clear_my_presence(self):
-        """Clear our own presence message to prevent duplicates"""
-        if self.mqtt_client and self.username:
-            # Send empty retained message to clear our presence
-            self.mqtt_client.publish(f"{self.presence_topic}/{self.username}", "", retain=True)
-    
-    def start_user_cleanup(self):
-        """Start periodic cleanup of stale users"""
-        if self.connected:
-            self.cleanup_stale_users()
-            # Schedule next cleanup in 60 seconds
-            self.user_cleanup_timer = threading.Timer(60.0, self.start_user_cleanup)
-            self.user_cleanup_timer.start()
-    
-    def cleanup_stale_users(self):
-        """Remove users who haven't sent heartbeat recently"""
-        # For now, we'll rely on retained messages and proper disconnect handling
-        # This can be enhanced later with timestamp tracking
-        pass
-    
-    def on_mqtt_message(self, client, userdata, msg):
-        """Called when MQTT message received (same logic as desktop)"""
-        try:
-            topic = msg.topic
-            payload = msg.payload.decode()
-            
-            if topic == self.messages_topic:
-                self.handle_chat_message(payload)
-            elif topic.startswith(self.presence_topic):
-                self.handle_presence_message(topic, payload)
-                
-        except Exception as e:
-            print(f"Error handling message: {e}")
-    
-    def handle_chat_message(self, encrypted_payload):
-        """Handle incoming chat message (same decryption as desktop)"""
-        try:
-            # Decrypt message (same as desktop)
-            encrypted_data = base64.b64decode(encrypted_payload.encode())
-            decrypted_data = self.cipher.decrypt(encrypted_data)
-            message_data = json.loads(decrypted_data.decode())
-            
-            username = message_data.get("user", "Unknown")
-            message = message_data.get("message", "")
-            timestamp = message_data.get("timestamp", time.time())
-            
-            # Don't show our own messages (we already displayed them)
-            if username != self.username:
-                Clock.schedule_once(lambda dt: self.chat_screen.add_chat_message(username, message, timestamp))
-                
-        except Exception as e:
-            print(f"Error decrypting message: {e}")
-    
-    def handle_presence_message(self, topic, payload):
-        """Handle user presence updates (improved logic)"""
-        try:
-            # Extract username from topic
-            user_from_topic = topic.split('/')[-1]
-            
-            # Handle empty payload (user leaving)
-            if not payload.strip():
-                if user_from_topic in self.online_users:
-                    self.online_users.remove(user_from_topic)
-                    if user_from_topic != self.username:
-                        Clock.schedule_once(lambda dt: self.chat_screen.add_system_message(f"{user_from_topic} left the chat"))
-                Clock.schedule_once(lambda dt: self.chat_screen.update_users_list(list(self.online_users)))
-                return
-            
-            data = json.loads(payload)
-            user = data.get("user", "")
-            status = data.get("status", "")
-            
-            # Ensure user from topic matches user in payload
-            if user != user_from_topic:
-                print(f"Warning: User mismatch in presence message: {user} vs {user_from_topic}")
-                return
-            
-            if status == "online":
-                if user not in self.online_users:
-                    self.online_users.add(user)
-                    if user != self.username:  # Don't announce ourselves
-                        Clock.schedule_once(lambda dt: self.chat_screen.add_system_message(f"{user} joined the chat"))
-            elif status == "offline":
-                if user in self.online_users:
-                    self.online_users.remove(user)
-                    if user != self.username:
-                        Clock.schedule_once(lambda dt: self.chat_screen.add_system_message(f"{user} left the chat"))
-                        
-            # Update users list on chat screen
-            Clock.schedule_once(lambda dt: self.chat_screen.update_users_list(list(self.online_users)))
-            
-        except Exception as e:
-            print(f"Error handling presence: {e}")
-    
-    def announce_presence(self, status):
-        """Announce our online/offline status (same as desktop)"""
-        if self.mqtt_client and self.connected:
-            presence_data = {
-                "user": self.username,
-                "status": status,
-                "timestamp": time.time()
-            }
-            self.mqtt_client.publish(f"{self.presence_topic}/{self.username}", 
-                                   json.dumps(presence_data), retain=True)
-    
-    def start_heartbeat(self):
-        """Start sending periodic heartbeat to show we're online (same as desktop)"""
-        if self.connected:
-            self.announce_presence("online")
-            # Schedule next heartbeat in 30 seconds
-            self.heartbeat_timer = threading.Timer(30.0, self.start_heartbeat)
-            self.heartbeat_timer.start()
-    
+            self.engine.decline_file(transfer_id)
+
+    def on_engine_file_done(self, transfer_id, direction, name, path, error):
+        """Report a finished (or failed) file transfer"""
+        if error:
+            self.on_engine_system_message(f"File {name}: {error}")
+        elif direction == "receive":
+            self.on_engine_system_message(f"Received {name} - saved to {path}")
+
+    def _drain_events(self, dt):
+        """Apply queued engine events to the screens (runs every frame)"""
+        timer = FrameTimer(FRAME_BUDGET_MS)
+
+        # Take events in chunks until the queue is empty or the frame budget is spent
+        roster_changed = False
+        while len(self.inbox) and not timer.expired():
+            roster_changed |= self.apply_event_steps(coalesce(self.inbox.drain(DRAIN_CHUNK)))
+
+        # Only the roster state at the end of the frame reaches the screen
+        if roster_changed:
+            self.chat_screen.update_users_list(list(self.roster))
+        self.inbox.record_drain(timer.elapsed())
+        self.update_queue_stats()
+
+    def apply_event_steps(self, steps):
+        """Apply coalesced engine events; returns True if the roster changed"""
+        roster_changed = False
+        for step, value in steps:
+            if step == "lines":
+                self.chat_screen.add_lines(value)
+            elif step == "users":
+                roster_changed |= bool(self.roster.apply(value))
+            else:
+                callback, *args = value
+                callback(*args)
+        return roster_changed
+
+    def update_queue_stats(self):
+        """Refresh the chat screen's debug overlay (at most once a second)"""
+        now = time.time()
+        if now - self.last_stats_update < 1:
+            return
+        self.last_stats_update = now
+        self.chat_screen.show_queue_stats(self.inbox.stats(), self.power.stats())
+
+    def update_power_state(self, *args):
+        """Pick the power profile for the app's current state"""
+        # Any screen counts as the foreground: connecting from the connection screen with the
+        # background profile would negotiate its 300 s keepalive, then reconnect on reaching chat
+        visible = not self.paused
+        self.power.set_state(app_state(visible, visible and network_metered()))
+
+    def on_pause(self):
+        """Going to the background: keep the connection, but ping rarely and stop heartbeats"""
+        if self.engine:
+            self.paused = True
+            self.update_power_state()
+        return True
+
+    def on_resume(self):
+        if self.engine:
+            self.paused = False
+            self.update_power_state()
+
     def send_message(self, message_text):
         """Send an encrypted message (same encryption as desktop)"""
         if not self.connected or not message_text.strip():
             return False
-            
+
         try:
-            # Create message data (same format as desktop)
-            message_data = {
-                "user": self.username,
-                "message": message_text.strip(),
-                "timestamp": time.time()
-            }
-            
-            # Encrypt message (same method as desktop)
-            json_data = json.dumps(message_data)
-            encrypted_data = self.cipher.encrypt(json_data.encode())
-            encrypted_payload = base64.b64encode(encrypted_data).decode()
-            
-            # Publish to MQTT
-            self.mqtt_client.publish(self.messages_topic, encrypted_payload)
-            
-            # Add to our own chat display
-            Clock.schedule_once(lambda dt: self.chat_screen.add_chat_message(
-                self.username, message_text.strip(), message_data["timestamp"]))
-            
+            # /rotate announces a new room key epoch
+            if message_text.split()[0] == "/rotate":
+                return self.engine.rotate_key() is not None
+
+            # Encrypt, publish and echo to our own chat display
+            self.engine.send_message(message_text)
             return True
-            
+
         except Exception as e:
             print(f"Failed to send message: {str(e)}")
             return False
-    
-    def on_mqtt_disconnect(self, client, userdata, rc):
+
+    def on_engine_disconnected(self, rc):
         """Called when MQTT disconnects (same as desktop)"""
-        self.connected = False
-        if self.heartbeat_timer:
-            self.heartbeat_timer.cancel()
-            self.heartbeat_timer = None
-        if self.user_cleanup_timer:
-            self.user_cleanup_timer.cancel()
-            self.user_cleanup_timer = None
         print("Disconnected from MQTT broker")
-    
+
     def setup_chat_screen(self):
         """Set up the chat screen with MQTT client and room"""
         self.chat_screen.setup(self.mqtt_client, self.channel, self.username, self)
         self.screen_manager.current = 'chat'
-    
+
     def switch_to_connection(self):
         """Switch back to connection screen and disconnect"""
         def _disconnect_worker():
             """Worker function to handle disconnect in background"""
             try:
-                if self.connected and self.mqtt_client:
-                    # Announce offline status and clear our presence
-                    self.announce_presence("offline")
-                    time.sleep(0.5)  # Give time for message to send
-                    self.clear_my_presence()
-                    
-                    # Stop the MQTT loop and disconnect
-                    self.mqtt_client.loop_stop()
-                    self.mqtt_client.disconnect()
-                    
-                # Cancel timers
-                if self.heartbeat_timer:
-                    self.heartbeat_timer.cancel()
-                    self.heartbeat_timer = None
-                if self.user_cleanup_timer:
-                    self.user_cleanup_timer.cancel()
-                    self.user_cleanup_timer = None
-                    
+                if self.engine:
+                    # Announce offline status, clear our presence and disconnect
+                    self.engine.disconnect()
+
             except Exception as e:
                 print(f"Error during disconnect: {e}")
             finally:
                 # Update GUI in main thread
                 Clock.schedule_once(lambda dt: self._finish_disconnect())
-        
+
         # Update status immediately
-        self.connected = False
-        
+        if self.engine:
+            self.engine.connected = False
+
         # Run disconnect in background thread to avoid GUI freeze
         disconnect_thread = threading.Thread(target=_disconnect_worker, daemon=True)
         disconnect_thread.start()
-    
+
     def _finish_disconnect(self):
         """Finish disconnect process in main GUI thread"""
-        self.connected = False
-        self.online_users.clear()
+        if self.engine:
+            self.engine.reset_users()
+            self.engine.mqtt_client = None
         self.screen_manager.current = 'connection'
-        if self.mqtt_client:
-            self.mqtt_client = None
-    
+
     def show_error(self, message):
         """Show error message (can be implemented as popup or system message)"""
         print(f"Error: {message}")
         # For now, just print. Could be enhanced with popup later.
 
 if __name__ == '__main__':
-    MQTTChatApp().run()
\ No newline at end of file
+    MQTTChatApp().run()
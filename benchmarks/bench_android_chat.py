@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+MQChat Android chat view benchmark
+Fills the Android chat screen with --messages messages, then times Kivy
+frames while one new message arrives per frame, and while the user scrolls
+up through the history. Compares the RecycleView chat screen with the old
+layout (one markup Label whose text grows with every message).
+
+    python benchmarks/bench_android_chat.py --messages 10000
+    KIVY_GL_BACKEND=mock python benchmarks/bench_android_chat.py   # no display
+
+Frame times cover Kivy's clock: layout, text measuring and texture uploads.
+With the mock GL backend nothing is drawn, so the GPU side isn't included.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+
+from kivy.config import Config
+
+Config.set("graphics", "maxfps", "0")  # Don't sleep between timed frames
+
+from kivy.clock import Clock
+from kivy.uix.label import Label
+from kivy.uix.scrollview import ScrollView
+
+import benchutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "AndroidApp"))
+from chat_screen import MQTTChatScreen
+
+SCREEN_SIZE = (720, 1280)
+
+
+class LabelChatScreen(MQTTChatScreen):
+    """The chat screen as it was: every message re-renders one ever-growing Label"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.scrollview = ScrollView()
+        self.message_log = Label(size_hint_y=None, text_size=(None, None), halign='left', valign='top',
+                                 markup=True, font_size='14sp', padding=[10, 10])
+        self.message_log.bind(texture_size=self.update_log_height)
+        self.scrollview.add_widget(self.message_log)
+        layout = self.message_view.parent
+        index = layout.children.index(self.message_view)
+        layout.remove_widget(self.message_view)
+        layout.add_widget(self.scrollview, index=index)
+
+    def update_log_height(self, instance, value):
+        min_height = self.scrollview.height if self.scrollview.height > 0 else 400
+        self.message_log.height = max(value[1], min_height)
+        available_width = self.scrollview.width - 20 if self.scrollview.width > 0 else 300
+        self.message_log.text_size = (available_width, None)
+        Clock.schedule_once(lambda dt: setattr(self.scrollview, 'scroll_y', 0), 0.1)
+
+    def add_row(self, formatted_message):
+        if self.message_log.text:
+            self.message_log.text += "\n\n" + formatted_message
+        else:
+            self.message_log.text = formatted_message
+
+    def preload(self, rows, batch):
+        # Re-rendering the whole text per message makes filling quadratic: set it once
+        self.message_log.text = "\n\n".join(rows)
+        Clock.tick()
+
+    @property
+    def scroller(self):
+        return self.scrollview
+
+
+class RowChatScreen(MQTTChatScreen):
+    def preload(self, rows, batch):
+        for start in range(0, len(rows), batch):
+            for row in rows[start:start + batch]:
+                self.add_row(row)
+            Clock.tick()
+
+    @property
+    def scroller(self):
+        return self.message_view
+
+
+def frames(count):
+    """Tick the clock count times; returns each frame's time in ms"""
+    times = []
+    for _ in range(count):
+        started = time.perf_counter()
+        Clock.tick()
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def run(screen_class, messages, batch, measure):
+    screen = screen_class(name="chat")
+    screen.size = SCREEN_SIZE
+    screen.username = "me"
+    now = time.time()
+    rows = []
+    screen.add_row = rows.append
+    for i in range(messages):
+        screen.add_chat_message(f"user{i % 20}", f"message number {i}, a line or so of ordinary chat text", now)
+    del screen.add_row
+    fill_started = time.perf_counter()
+    screen.preload(rows, batch)
+    frames(5)  # Let layout settle
+    fill = time.perf_counter() - fill_started
+
+    arriving = []
+    for i in range(measure):
+        screen.add_chat_message("user1", f"new message {i}", now)
+        arriving.extend(frames(1))
+
+    scrolling = []
+    scroller = screen.scroller
+    for i in range(measure):
+        scroller.scroll_y = min(1.0, 0.02 * (i + 1))
+        scrolling.extend(frames(1))
+    return fill, arriving, scrolling
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Android chat view frame times")
+    parser.add_argument("--messages", type=int, default=10000, help="messages in the chat before timing")
+    parser.add_argument("--batch", type=int, default=20, help="messages per frame while filling")
+    parser.add_argument("--frames", type=int, default=50, help="frames timed per phase")
+    parser.add_argument("--skip-label", action="store_true", help="only run the RecycleView screen")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Android chat view: {args.messages:,} messages, {args.frames} frames per phase")
+    print(f"{'view':<12} {'fill s':>8} {'new msg p50 ms':>15} {'p99 ms':>8} {'scroll p50 ms':>14} {'p99 ms':>8}")
+    screens = [("RecycleView", RowChatScreen)]
+    if not args.skip_label:
+        screens.append(("Label", LabelChatScreen))
+    for name, screen_class in screens:
+        fill, arriving, scrolling = run(screen_class, args.messages, args.batch, args.frames)
+        print(f"{name:<12} {fill:>8.1f} {benchutil.percentile(arriving, 50):>15.2f} "
+              f"{benchutil.percentile(arriving, 99):>8.2f} {benchutil.percentile(scrolling, 50):>14.2f} "
+              f"{benchutil.percentile(scrolling, 99):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
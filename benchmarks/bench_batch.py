@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+MQChat outbound batching benchmark
+Sends bursts of chat lines through ChatEngine with batching off and with a
+batch window, against a fake MQTT client that only records publishes, and
+reports frames published, frames saved and CPU time per message.
+
+    python benchmarks/bench_batch.py --burst 40 --bursts 50
+"""
+
+import argparse
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine
+
+
+class RecordingClient:
+    """Stands in for paho: keeps published payloads instead of sending them"""
+
+    def __init__(self):
+        self.payloads = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.payloads.append(payload)
+
+
+def run(suite, window_ms, burst, bursts, size):
+    engine = ChatEngine(username="bot", channel="bench")
+    engine.apply_room_options({"wire_version": 2, "cipher_suite": suite, "batch_window_ms": window_ms})
+    engine.set_encryption_key("supersecretkey123")
+    engine.mqtt_client = RecordingClient()
+    engine.connected = True
+
+    text = "x" * size
+    busy = 0.0
+    for _ in range(bursts):
+        start = time.perf_counter()
+        for _ in range(burst):
+            engine.send_message(text)
+        if engine.batcher is not None:
+            engine.batcher.flush()  # End of the window
+        busy += time.perf_counter() - start
+
+    payloads = engine.mqtt_client.payloads
+    messages = burst * bursts
+    return len(payloads), engine.stats["frames_saved"], busy / messages * 1e6, sum(map(len, payloads))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark outbound batching")
+    parser.add_argument("--burst", type=int, default=40, help="messages per burst")
+    parser.add_argument("--bursts", type=int, default=50, help="number of bursts")
+    parser.add_argument("--size", type=int, default=80, help="chat text length in characters")
+    parser.add_argument("--window", type=float, default=10, help="batch window in ms")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Outbound batching: {args.bursts} bursts of {args.burst} messages")
+    print(f"{'suite':<8} {'mode':<16} {'frames':>8} {'saved':>8} {'us/msg':>8} {'bytes':>10}")
+    for suite in ("fernet", "aes-gcm"):
+        for label, window in (("unbatched", 0), (f"{args.window:g} ms window", args.window)):
+            frames, saved, micros, total = run(suite, window, args.burst, args.bursts, args.size)
+            print(f"{suite:<8} {label:<16} {frames:>8,} {saved:>8,} {micros:>8.1f} {total:>10,}")
+
+
+if __name__ == "__main__":
+    main()
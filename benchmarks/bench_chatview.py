@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+MQChat chat view soak benchmark
+Feeds a long run of messages through ChatLog, the bounded chat view the
+desktop app uses, in frame-sized batches, and checks that memory stays flat
+and that inserting a batch takes as long at the end as at the start.
+
+    python benchmarks/bench_chatview.py --messages 1000000
+    python benchmarks/bench_chatview.py --tk        # render into a real Tk Text widget
+
+Without --tk the edits are applied to a list of lines standing in for the
+widget. --unbounded appends every line without ChatLog (the old behaviour)
+for comparison. Exits with an error when the checks fail.
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+import benchutil
+
+from mqchat_core.chatlog import ChatLog
+
+
+def format_line(kind, args):
+    """Same layout as the desktop chat"""
+    if kind == "chat":
+        username, message, timestamp = args
+        time_str = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+        return f"[{time_str}] {username}: {message}\n"
+    message, timestamp = args
+    time_str = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+    return f"[{time_str}] *** {message} ***\n"
+
+
+class LinesView:
+    """Stand-in for the Tk Text widget"""
+
+    def __init__(self):
+        self.lines = []
+
+    def apply(self, edits):
+        for edit, value in edits:
+            if edit == "append":
+                self.lines.extend(value.splitlines(True))
+            elif edit == "prepend":
+                self.lines[:0] = value.splitlines(True)
+            elif edit == "trim_top":
+                del self.lines[:value]
+            elif edit == "trim_bottom":
+                del self.lines[len(self.lines) - value:]
+            elif edit == "replace":
+                self.lines = value.splitlines(True)
+
+    def line_count(self):
+        return len(self.lines)
+
+
+class TkView:
+    """A real Text widget in a hidden window, edited the way the desktop app does it"""
+
+    def __init__(self):
+        import tkinter as tk
+        self.tk = tk
+        self.root = tk.Tk()
+        self.root.withdraw()
+        self.text = tk.Text(self.root)
+
+    def apply(self, edits):
+        text = self.text
+        for edit, value in edits:
+            if edit == "append":
+                text.insert(self.tk.END, value)
+            elif edit == "prepend":
+                text.insert("1.0", value)
+            elif edit == "trim_top":
+                text.delete("1.0", f"{value + 1}.0")
+            elif edit == "trim_bottom":
+                text.delete(f"end-1c - {value} lines", "end-1c")
+            elif edit == "replace":
+                text.delete("1.0", self.tk.END)
+                text.insert(self.tk.END, value)
+        text.see(self.tk.END)
+        self.root.update_idletasks()
+
+    def line_count(self):
+        return int(self.text.index("end-1c").split(".")[0]) - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the bounded chat view")
+    parser.add_argument("--messages", type=int, default=1000000, help="messages to insert")
+    parser.add_argument("--batch", type=int, default=20, help="messages per frame")
+    parser.add_argument("--tk", action="store_true", help="render into a Tk Text widget")
+    parser.add_argument("--unbounded", action="store_true", help="append without ChatLog (old behaviour)")
+    args = parser.parse_args()
+
+    view = TkView() if args.tk else LinesView()
+    chat_log = ChatLog(format_line)
+    mode = "unbounded" if args.unbounded else f"ChatLog window {chat_log.window}"
+    benchutil.print_header(f"Chat view soak: {args.messages:,} messages, {mode}, "
+                           f"{'Tk Text' if args.tk else 'line list'}")
+
+    blocks = 10
+    block_size = args.messages // blocks
+    now = time.time()
+    print(f"{'messages':>10} {'us/batch':>10} {'RSS MB':>8} {'lines':>8}")
+    block_times = []
+    rss = []
+    for block in range(blocks):
+        elapsed = 0.0
+        for start in range(block * block_size, (block + 1) * block_size, args.batch):
+            lines = [("chat", (f"user{i % 50}", f"message number {i} in the soak test", now + i))
+                     for i in range(start, start + args.batch)]
+            t0 = time.perf_counter()
+            if args.unbounded:
+                view.apply([("append", "".join(format_line(kind, line) for kind, line in lines))])
+            else:
+                view.apply(chat_log.append(lines))
+            elapsed += time.perf_counter() - t0
+        block_times.append(elapsed / (block_size / args.batch) * 1e6)
+        rss.append(benchutil.current_rss_mb())
+        rss_text = f"{rss[-1]:.0f}" if rss[-1] is not None else "n/a"
+        print(f"{(block + 1) * block_size:>10,} {block_times[-1]:>10.1f} {rss_text:>8} {view.line_count():>8,}")
+
+    # The first block warms up the buffer; after that nothing should grow
+    failures = []
+    if block_times[-1] > block_times[1] * 1.5 + 20:
+        failures.append(f"insert time grew from {block_times[1]:.1f} to {block_times[-1]:.1f} us/batch")
+    if rss[1] is not None and rss[-1] - rss[1] > 10:
+        failures.append(f"RSS grew from {rss[1]:.0f} to {rss[-1]:.0f} MB")
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+    print("PASS: flat memory and constant insert time")
+
+
+if __name__ == "__main__":
+    main()
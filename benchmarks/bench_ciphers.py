@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+MQChat cipher suite microbenchmark
+Compares encrypt/decrypt throughput of the Fernet, AES-GCM and
+ChaCha20-Poly1305 suites across message sizes (raw bytes in and out, the
+way wire format v2 uses them).
+
+    python benchmarks/bench_ciphers.py
+"""
+
+import argparse
+import os
+import time
+
+import benchutil
+
+from mqchat_core import CipherSet, CIPHER_SUITES, derive_key
+from mqchat_core.wire import header_v2
+
+
+def time_loop(func, data, aad, seconds):
+    """Run func(data, aad) repeatedly for about `seconds`; return seconds per call"""
+    count = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(50):
+            func(data, aad)
+        count += 50
+        now = time.perf_counter()
+        if now >= deadline:
+            return (now - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cipher suites")
+    parser.add_argument("--sizes", default="16,128,1024,16384,65536", help="comma separated sizes")
+    parser.add_argument("--seconds", type=float, default=0.3, help="time per measurement")
+    args = parser.parse_args()
+
+    ciphers = CipherSet(derive_key("supersecretkey123"))
+
+    benchutil.print_header("Cipher suites: encrypt / decrypt")
+    print(f"{'suite':<20} {'size':>7} | {'enc us':>8} {'enc MB/s':>9} | {'dec us':>8} {'dec MB/s':>9} | {'overhead':>8}")
+    for name in CIPHER_SUITES:
+        suite = ciphers.by_name(name)
+        aad = header_v2(suite=suite.suite_id)
+        for size in [int(s) for s in args.sizes.split(",")]:
+            plaintext = os.urandom(size)
+            sealed = suite.encrypt(plaintext, aad)
+            enc = time_loop(suite.encrypt, plaintext, aad, args.seconds)
+            dec = time_loop(suite.decrypt, sealed, aad, args.seconds)
+            print(f"{name:<20} {size:>7} | {enc * 1e6:>8.1f} {size / enc / 1e6:>9.1f} | "
+                  f"{dec * 1e6:>8.1f} {size / dec / 1e6:>9.1f} | {len(sealed) - size:>6} B")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+MQChat compression benchmark
+Bytes on the wire and send + receive time per message for each compression
+setting (wire v2, AES-GCM), over chat-like text of several lengths. The
+trained dictionary rows train a room dictionary on a separate sample of
+messages first.
+
+    python benchmarks/bench_compress.py --messages 2000
+"""
+
+import argparse
+import random
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine
+from mqchat_core.compress import encode_dictionary, train_dictionary, zstd_available
+
+WORDS = ("the to and you that it is in for of on with this was have just but not what can "
+         "meeting deploy server error build release ticket review merge branch tomorrow today "
+         "thanks please check logs again broker restart connection timeout retry").split()
+LOG_LINE = "2025-01-01 12:00:{:02d} WARN mqtt.client: connection to broker lost, retrying in {}s\n"
+
+
+def make_text(rng, size):
+    """Chat-like text of about `size` characters (long messages look like pasted logs)"""
+    if size > 400:
+        lines = [LOG_LINE.format(i % 60, rng.randint(1, 30)) for i in range(size // len(LOG_LINE) + 1)]
+        return "".join(lines)[:size]
+    words = []
+    while sum(len(w) + 1 for w in words) < size:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:size]
+
+
+def measure(options, texts):
+    """Return (payload bytes, microseconds per message for encrypt + decrypt)"""
+    sender = ChatEngine(username="alice", channel="bench")
+    sender.apply_room_options(options)
+    sender.set_encryption_key("supersecretkey123")
+    receiver = ChatEngine(username="bob", channel="bench")
+    receiver.apply_room_options(options)
+    receiver.set_encryption_key("supersecretkey123")
+
+    start = time.perf_counter()
+    total = 0
+    for text in texts:
+        payload = sender.encrypt_message({"user": "alice", "message": text, "timestamp": time.time()})
+        receiver.decrypt_message(payload)
+        total += len(payload)
+    elapsed = time.perf_counter() - start
+    return total / len(texts), elapsed / len(texts) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark payload compression")
+    parser.add_argument("--messages", type=int, default=2000, help="messages per size")
+    parser.add_argument("--sizes", default="5,40,200,2000", help="comma separated text sizes")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    samples = [f'{{"user": "alice", "message": "{make_text(rng, rng.choice((10, 40, 120)))}", '
+               f'"timestamp": 1735732800.0}}' for _ in range(500)]
+
+    settings = [("off", {"compression": "none"}),
+                ("zlib", {"compression": "zlib"}),
+                ("zlib + room dict", {"compression": "zlib",
+                                      "compression_dict": encode_dictionary(train_dictionary(samples))})]
+    if zstd_available():
+        settings += [("zstd", {"compression": "zstd"}),
+                     ("zstd + room dict", {"compression": "zstd",
+                                           "compression_dict": encode_dictionary(
+                                               train_dictionary(samples, "zstd"))})]
+    else:
+        print("(zstandard not installed - skipping zstd)")
+
+    benchutil.print_header(f"Compression ({args.messages:,} messages per size)")
+    print(f"{'setting':<18} {'text':>6} | {'bytes':>7} {'saved':>6} | {'us/msg':>8}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        texts = [make_text(rng, size) for _ in range(args.messages)]
+        baseline = None
+        for label, options in settings:
+            room_options = dict(options, wire_version=2, cipher_suite="aes-gcm")
+            size_bytes, micros = measure(room_options, texts)
+            baseline = baseline or size_bytes
+            print(f"{label:<18} {size:>6} | {size_bytes:>7.0f} {1 - size_bytes / baseline:>6.0%} | {micros:>8.1f}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+MQChat connect/disconnect benchmark
+Joins and leaves a room on a live broker --rounds times per presence mode,
+with another member already in the room (so there is a retained presence
+record to receive), and reports the engine's timings: connect() to CONNACK,
+to the first message and to every SUBACK, then disconnect() to the leave
+being acknowledged and to the connection closing.
+
+    python benchmarks/bench_connect.py --host 127.0.0.1 --rounds 20
+"""
+
+import argparse
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine
+from mqchat_core.presence import PRESENCE_MODES
+
+STEPS = ("connect", "first_message", "subscribed", "leave", "disconnect")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark joining and leaving a room")
+    parser.add_argument("--host", default="127.0.0.1", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--rounds", type=int, default=20, help="joins per presence mode")
+    args = parser.parse_args()
+
+    room = f"bench-connect-{int(time.time())}"
+    member = ChatEngine()
+    member.connect(args.host, args.port, room, "member", "bench-key")
+    time.sleep(0.5)
+
+    benchutil.print_header(f"Connect/disconnect: {args.rounds} rounds per mode against {args.host}:{args.port}")
+    print(f"{'mode':<10} {'step':<14} {'p50 ms':>8} {'p99 ms':>8}")
+    for mode in PRESENCE_MODES:
+        samples = {step: [] for step in STEPS}
+        for _ in range(args.rounds):
+            engine = ChatEngine()
+            engine.connect(args.host, args.port, room, "bench", "bench-key", options={"presence": mode})
+            deadline = time.monotonic() + 5
+            while "first_message" not in engine.timings or "subscribed" not in engine.timings:
+                if time.monotonic() > deadline:
+                    raise SystemExit("Timed out waiting to join - is the broker running?")
+                time.sleep(0.001)
+            engine.disconnect()
+            for step in STEPS:
+                samples[step].append(engine.timings[step])
+        for step in STEPS:
+            print(f"{mode:<10} {step:<14} {benchutil.percentile(samples[step], 50):>8.1f} "
+                  f"{benchutil.percentile(samples[step], 99):>8.1f}")
+    member.disconnect()
+
+
+if __name__ == "__main__":
+    main()
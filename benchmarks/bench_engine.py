@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+MQChat engine benchmark
+Pumps synthetic encrypted chat traffic through ChatEngine without a broker or
+a display and reports throughput and p50/p99 per-message latency.
+
+    python benchmarks/bench_engine.py --messages 20000 --size 80
+"""
+
+import argparse
+import time
+
+import benchutil
+import paho.mqtt.client as mqtt
+
+from mqchat_core import ChatEngine, EVENT_CHAT_MESSAGE
+
+
+def make_engine(username, channel, key):
+    """Build an offline engine (no MQTT client) ready to encrypt/decrypt"""
+    engine = ChatEngine(username=username, channel=channel)
+    engine.set_encryption_key(key)
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ChatEngine message handling")
+    parser.add_argument("--messages", type=int, default=20000, help="messages to process")
+    parser.add_argument("--size", type=int, default=80, help="chat text length in characters")
+    parser.add_argument("--channel", default="bench", help="channel name")
+    parser.add_argument("--key", default="supersecretkey123", help="room passphrase")
+    args = parser.parse_args()
+
+    sender = make_engine("bench-sender", args.channel, args.key)
+    receiver = make_engine("bench-receiver", args.channel, args.key)
+
+    delivered = []
+    receiver.on(EVENT_CHAT_MESSAGE, lambda user, message, timestamp: delivered.append(user))
+
+    text = ("x" * args.size)
+
+    benchutil.print_header(f"ChatEngine: {args.messages:,} messages of {args.size} chars")
+
+    # Outbound: json + encrypt + wire encoding (what send_message does before publish)
+    samples = []
+    payloads = []
+    start = time.perf_counter()
+    for i in range(args.messages):
+        t0 = time.perf_counter()
+        payloads.append(sender.encrypt_message({"user": sender.username, "message": text,
+                                                "timestamp": time.time()}))
+        samples.append(time.perf_counter() - t0)
+    benchutil.print_latency("encode (send path)", args.messages, time.perf_counter() - start, samples)
+
+    # Inbound: full on_mqtt_message path with real paho message objects
+    messages = []
+    for payload in payloads:
+        msg = mqtt.MQTTMessage(topic=receiver.messages_topic.encode())
+        msg.payload = payload.encode() if isinstance(payload, str) else payload
+        messages.append(msg)
+
+    samples = []
+    start = time.perf_counter()
+    for msg in messages:
+        t0 = time.perf_counter()
+        receiver.on_mqtt_message(None, None, msg)
+        samples.append(time.perf_counter() - t0)
+    benchutil.print_latency("decode (receive path)", args.messages, time.perf_counter() - start, samples)
+
+    payload_bytes = sum(len(m.payload) for m in messages) / len(messages)
+    print(f"\nAverage payload: {payload_bytes:.0f} bytes for {args.size} chars of text")
+    print(f"Delivered to front end: {len(delivered):,}/{args.messages:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+MQChat main-loop networking benchmark
+Receives a steady stream of chat messages for --seconds in a process that
+runs a 60 fps main loop, as Kivy does, once with paho's network thread and
+the scheduler thread (the default) and once with a LoopDriver polled from
+that loop (NETWORK_ON_CLOCK on Android, NETWORK_ON_MAIN_LOOP on desktop).
+Reports the process's threads, context switches and CPU time per second:
+the wakeups that keep a phone's CPU out of its deep sleep states.
+
+The messages come from a separate sender process, so its threads aren't
+counted.
+
+    python benchmarks/bench_eventloop.py --host 127.0.0.1 --rate 20 --seconds 10
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine, LoopDriver, EVENT_CHAT_MESSAGE
+
+FRAME = 1 / 60
+
+
+def send(host, port, room, rate, seconds):
+    """Sender process: chat at rate messages/second"""
+    engine = ChatEngine()
+    engine.connect(host, port, room, "sender", "bench-key")
+    time.sleep(1.0)
+    for i in range(int(rate * seconds)):
+        engine.send_message(f"message {i} of the event loop benchmark")
+        time.sleep(1 / rate)
+    engine.disconnect()
+
+
+def usage():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_nvcsw + ru.ru_nivcsw, ru.ru_utime + ru.ru_stime
+
+
+def run(mode, host, port, room, rate, seconds):
+    threads = threading.active_count()
+    driver = LoopDriver() if mode == "main loop" else None
+    engine = ChatEngine(driver=driver)
+    received = []
+    engine.on(EVENT_CHAT_MESSAGE, lambda user, text, timestamp: received.append(text))
+    engine.connect(host, port, room, "receiver", "bench-key")
+
+    def frame():
+        if driver is not None:
+            driver.poll()
+        time.sleep(FRAME)
+
+    deadline = time.monotonic() + 5
+    while "subscribed" not in engine.timings:
+        if time.monotonic() > deadline:
+            raise SystemExit("Timed out waiting to join - is the broker running?")
+        frame()
+    sender = subprocess.Popen([sys.executable, __file__, "--send", "--host", host, "--port", str(port),
+                               "--room", room, "--rate", str(rate), "--seconds", str(seconds)])
+    while len(received) < 1:
+        frame()
+
+    switches, cpu = usage()
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        frame()
+    elapsed = time.monotonic() - started
+    switches_after, cpu_after = usage()
+    added = threading.active_count() - threads
+    count = len(received)
+
+    sender.wait()
+    disconnect = threading.Thread(target=engine.disconnect)
+    disconnect.start()
+    while disconnect.is_alive():
+        frame()
+    return added, count / elapsed, (switches_after - switches) / elapsed, (cpu_after - cpu) / elapsed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark network thread vs main-loop networking")
+    parser.add_argument("--host", default="127.0.0.1", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--rate", type=float, default=20, help="chat messages per second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--room", default="")
+    parser.add_argument("--send", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.send:
+        send(args.host, args.port, args.room, args.rate, args.seconds + 2)
+        return
+
+    benchutil.print_header(f"Network thread vs main loop: {args.rate:g} msg/s for {args.seconds:g} s, 60 fps loop")
+    print(f"{'mode':<10} {'threads':>8} {'msgs/s':>8} {'switches/s':>11} {'CPU ms/s':>9}")
+    for mode in ("thread", "main loop"):
+        room = f"bench-eventloop-{int(time.time())}-{mode[0]}"
+        threads, rate, switches, cpu = run(mode, args.host, args.port, room, args.rate, args.seconds)
+        print(f"{mode:<10} {threads:>8} {rate:>8.1f} {switches:>11.0f} {cpu:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+MQChat presence expiry benchmark
+Simulated time: N heartbeat members refresh their presence every 30 seconds
+and --vanish of them per second drop off without a last will. Once a second
+we look for records that expired (2.5 heartbeat intervals without a
+refresh), either by scanning every member's last-seen time or by ticking the
+timing wheel LivenessProbe uses. Both must find the same members.
+
+    python benchmarks/bench_expiry.py --users 1000 10000 100000
+"""
+
+import argparse
+import heapq
+import random
+import time
+
+import benchutil
+
+from mqchat_core.presence import DOUBT_FACTOR, EXPIRY_TICK, HEARTBEAT_INTERVAL
+from mqchat_core.timingwheel import TimingWheel
+
+EXPIRY = HEARTBEAT_INTERVAL * DOUBT_FACTOR
+
+
+def traffic(users, seconds, vanish, seed=1):
+    """Per-tick lists of (user, alive) refreshes; alive False marks the member's last heartbeat"""
+    rng = random.Random(seed)
+    ticks = [[] for _ in range(int(seconds / EXPIRY_TICK))]
+    events = [(rng.uniform(0, HEARTBEAT_INTERVAL), user) for user in range(users)]
+    heapq.heapify(events)
+    leaving = set(rng.sample(range(users), min(users, int(vanish * seconds))))
+    leave_at = {user: rng.uniform(0, seconds) for user in leaving}
+    while events and events[0][0] < seconds:
+        at, user = heapq.heappop(events)
+        ticks[int(at / EXPIRY_TICK)].append((user, at))
+        if at < leave_at.get(user, seconds):
+            heapq.heappush(events, (at + HEARTBEAT_INTERVAL, user))
+    return ticks
+
+
+def run_scan(ticks):
+    last_seen = {}
+    expired = []
+    samples = []
+    for index, refreshes in enumerate(ticks):
+        for user, at in refreshes:
+            last_seen[user] = at
+        now = (index + 1) * EXPIRY_TICK
+        t0 = time.perf_counter()
+        gone = [user for user, seen in last_seen.items() if now - seen >= EXPIRY]
+        for user in gone:
+            del last_seen[user]
+        samples.append(time.perf_counter() - t0)
+        expired.extend(sorted(gone))
+    return expired, samples
+
+
+def run_wheel(ticks):
+    wheel = TimingWheel(tick=EXPIRY_TICK)
+    expired = []
+    samples = []
+    for index, refreshes in enumerate(ticks):
+        for user, at in refreshes:
+            wheel.schedule(user, at + EXPIRY)
+        now = (index + 1) * EXPIRY_TICK
+        t0 = time.perf_counter()
+        gone = wheel.advance(now)
+        samples.append(time.perf_counter() - t0)
+        expired.extend(sorted(gone))
+    return expired, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark stale presence expiry")
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000], help="room sizes")
+    parser.add_argument("--seconds", type=float, default=600, help="simulated seconds")
+    parser.add_argument("--vanish", type=float, default=1, help="members lost without a will per second")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Presence expiry: {args.seconds:g} s simulated, one check per "
+                           f"{EXPIRY_TICK:g} s, {args.vanish:g} member(s) vanishing per second")
+    print(f"{'users':>7} {'method':<12} {'tick p50 us':>12} {'tick p99 us':>12} {'total ms':>10} {'evicted':>8}")
+    for users in args.users:
+        ticks = traffic(users, args.seconds, args.vanish)
+        results = []
+        for name, run in (("full scan", run_scan), ("timing wheel", run_wheel)):
+            expired, samples = run(ticks)
+            results.append(expired)
+            print(f"{users:>7} {name:<12} {benchutil.percentile(samples, 50) * 1e6:>12.1f} "
+                  f"{benchutil.percentile(samples, 99) * 1e6:>12.1f} {sum(samples) * 1e3:>10.1f} "
+                  f"{len(expired):>8}")
+        assert results[0] == results[1], "scan and wheel evicted different members"
+
+
+if __name__ == "__main__":
+    main()
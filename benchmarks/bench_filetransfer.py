@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+MQChat file transfer benchmark
+Sends a file between two ChatEngines through a real MQTT broker and reports
+throughput and the process's peak memory, which should stay far below the
+file size because neither side holds the whole file.
+
+    python benchmarks/bench_filetransfer.py --host localhost --size-mb 100
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine, EVENT_CONNECTED, EVENT_FILE_DONE, EVENT_FILE_OFFERED
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far (MB), or None if unavailable"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+
+def make_file(path, size_mb):
+    """Write a file of random data without holding it in memory"""
+    block = 1024 * 1024
+    with open(path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(block))
+
+
+def connect(host, port, channel, username, options, download_dir):
+    engine = ChatEngine()
+    engine.files.download_dir = download_dir
+    connected = threading.Event()
+    engine.on(EVENT_CONNECTED, connected.set)
+    engine.connect(host, port, channel, username, "bench file key", options=options)
+    if not connected.wait(10):
+        raise SystemExit(f"Could not connect to {host}:{port}")
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark file transfer through a broker")
+    parser.add_argument("--host", default="localhost", help="MQTT broker host")
+    parser.add_argument("--port", type=int, default=1883, help="MQTT broker port")
+    parser.add_argument("--size-mb", type=int, default=100, help="file size in MB")
+    parser.add_argument("--chunk-kb", type=int, default=64, help="chunk size in KB")
+    parser.add_argument("--window", type=int, default=16, help="chunks in flight")
+    parser.add_argument("--suite", default="aes-gcm", help="cipher suite")
+    args = parser.parse_args()
+
+    options = {"wire_version": 2, "cipher_suite": args.suite, "file_chunk_kb": args.chunk_kb,
+               "file_window": args.window, "file_max_mb": args.size_mb + 1}
+    channel = f"bench-files-{os.getpid()}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "payload.bin")
+        make_file(source, args.size_mb)
+
+        sender = connect(args.host, args.port, channel, "sender", options, os.path.join(tmp, "sender"))
+        receiver = connect(args.host, args.port, channel, "receiver", options, os.path.join(tmp, "receiver"))
+        time.sleep(0.5)
+
+        received = threading.Event()
+        result = {}
+
+        def on_done(transfer_id, direction, name, path, error):
+            if direction == "receive":
+                result.update(path=path, error=error)
+                received.set()
+        receiver.on(EVENT_FILE_DONE, on_done)
+        receiver.on(EVENT_FILE_OFFERED, lambda transfer_id, *offer: receiver.accept_file(transfer_id))
+
+        rss_before = peak_rss_mb()
+        start = time.perf_counter()
+        sender.send_file(source)
+        if not received.wait(600):
+            raise SystemExit("Transfer timed out")
+        elapsed = time.perf_counter() - start
+        rss_after = peak_rss_mb()
+
+        sender.disconnect()
+        receiver.disconnect()
+
+        benchutil.print_header(f"File transfer: {args.size_mb} MB, {args.chunk_kb} KB chunks, "
+                               f"window {args.window}, {args.suite}")
+        if result["error"]:
+            print(f"Transfer failed: {result['error']}")
+            return
+        print(f"Time:        {elapsed:.2f} s")
+        print(f"Throughput:  {args.size_mb / elapsed:.1f} MB/s (end to end, including the hash check)")
+        if rss_after is not None:
+            print(f"Peak RSS:    {rss_after:.0f} MB (was {rss_before:.0f} MB before the transfer)")
+        print(f"Chunks:      {sender.files.stats['chunks_sent']:,} sent, "
+              f"{sender.files.stats['chunks_resent']:,} resent, "
+              f"{receiver.files.stats['resend_requests']:,} resend requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+MQChat message history benchmark
+Bulk-inserts synthetic chat messages through MessageHistory's batched writer,
+then times searches (common word, rare word, two words) and loading the
+latest messages of a room.
+
+    python benchmarks/bench_history.py --messages 1000000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import benchutil
+
+from mqchat_core import MessageHistory, derive_key
+
+COMMON_WORDS = ("the to and you that it is in for of on with this was have just but not what "
+                "can lol ok yes no thanks deploy build test server meeting lunch").split()
+
+
+def make_messages(count, rooms, rare_used, seed=1):
+    """Synthetic (channel, user, message, timestamp) tuples; rare words used in room-0 go to rare_used"""
+    rng = random.Random(seed)
+    rare_words = [f"zx{i:05d}" for i in range(20000)]
+    start = time.time() - count
+    for i in range(count):
+        words = rng.choices(COMMON_WORDS, k=rng.randint(3, 14))
+        if rng.random() < 0.2:
+            words.append(rng.choice(rare_words))
+            if i % rooms == 0:
+                rare_used.append(words[-1])
+        yield (f"room-{i % rooms}", f"user{rng.randint(0, 49)}", " ".join(words), start + i)
+
+
+def timed_queries(func, queries):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local message history")
+    parser.add_argument("--messages", type=int, default=1000000, help="messages to insert")
+    parser.add_argument("--rooms", type=int, default=10, help="rooms the messages are spread over")
+    parser.add_argument("--queries", type=int, default=200, help="searches per query type")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.db")
+        history = MessageHistory(path, derive_key("mqtt_chat_config_key_v1"))
+
+        benchutil.print_header(f"Message history: {args.messages:,} messages, {args.rooms} rooms")
+        rare_used = []
+        start = time.perf_counter()
+        for item in make_messages(args.messages, args.rooms, rare_used):
+            history.append(*item)
+        queued = time.perf_counter() - start
+        history.flush()
+        elapsed = time.perf_counter() - start
+        size_mb = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)) / 1e6
+        print(f"insert: {args.messages / elapsed:,.0f} msg/s ({elapsed:.1f} s, "
+              f"{queued:.1f} s to queue), {history.stats['batches']:,} batches, {size_mb:.0f} MB on disk")
+
+        rng = random.Random(2)
+        room = "room-0"
+        print(f"\n{'query (limit 200)':<28} {'results':>8} {'p50 ms':>9} {'p99 ms':>9}")
+        for label, queries in (
+                ("common word", [rng.choice(COMMON_WORDS) for _ in range(args.queries)]),
+                ("rare word", [rng.choice(rare_used) for _ in range(args.queries)]),
+                ("two words", [" ".join(rng.sample(COMMON_WORDS, 2)) for _ in range(args.queries)]),
+                ("no match", ["nosuchword"] * args.queries)):
+            results = len(history.search(room, queries[0], 200))
+            samples = timed_queries(lambda query: history.search(room, query, 200), queries)
+            print(f"{label:<28} {results:>8} {benchutil.percentile(samples, 50) * 1e3:>9.2f} "
+                  f"{benchutil.percentile(samples, 99) * 1e3:>9.2f}")
+
+        samples = timed_queries(lambda _: history.recent(room, 50), range(args.queries))
+        print(f"{'latest 50 messages':<28} {50:>8} {benchutil.percentile(samples, 50) * 1e3:>9.2f} "
+              f"{benchutil.percentile(samples, 99) * 1e3:>9.2f}")
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
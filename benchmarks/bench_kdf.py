@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+MQChat key derivation benchmark
+Times the key setup part of ChatEngine.connect (room options + passphrase ->
+keyring) for the legacy SHA-256 derivation and for scrypt with a cold cache,
+a cache loaded from the saved room and the in-process cache. A cache hit
+should cost the same as the legacy path.
+
+    python benchmarks/bench_kdf.py
+"""
+
+import argparse
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine, EVENT_KEY_DERIVED, KDF_LEGACY, KDF_SCRYPT
+from mqchat_core import keys
+
+
+def time_key_setup(options, runs, clear_process_cache):
+    """Time apply_room_options + set_encryption_key; return per-run seconds"""
+    samples = []
+    for _ in range(runs):
+        if clear_process_cache:
+            keys._derived_keys.clear()
+        engine = ChatEngine("bench")
+        start = time.perf_counter()
+        engine.apply_room_options(options)
+        engine.set_encryption_key("supersecretkey123")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    p50 = benchutil.percentile(samples, 50) * 1e3
+    p99 = benchutil.percentile(samples, 99) * 1e3
+    print(f"{label:<32} p50 {p50:>9.3f} ms   p99 {p99:>9.3f} ms   ({len(samples)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark room key derivation")
+    parser.add_argument("--runs", type=int, default=200, help="runs per cached measurement")
+    parser.add_argument("--cold-runs", type=int, default=10, help="runs with an empty cache")
+    args = parser.parse_args()
+
+    benchutil.print_header("Connect key setup: legacy vs scrypt")
+
+    report("sha256 (legacy)", time_key_setup({"kdf": KDF_LEGACY}, args.runs, True))
+    report("scrypt, cold cache", time_key_setup({"kdf": KDF_SCRYPT}, args.cold_runs, True))
+
+    # What a front end persists after the first derivation
+    saved = {}
+    keys._derived_keys.clear()
+    engine = ChatEngine("bench")
+    engine.on(EVENT_KEY_DERIVED, lambda cache_id, key, passphrase: saved.update({cache_id: key}))
+    engine.apply_room_options({"kdf": KDF_SCRYPT})
+    engine.set_encryption_key("supersecretkey123")
+
+    report("scrypt, saved room cache", time_key_setup({"kdf": KDF_SCRYPT, "derived_keys": saved},
+                                                      args.runs, True))
+    report("scrypt, process cache", time_key_setup({"kdf": KDF_SCRYPT}, args.runs, False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+MQChat MQTT v5 benchmark
+Runs a sender and a receiver in one room against a small in-process broker
+that counts every byte it reads and writes, once on MQTT 3.1.1 and once on
+v5, and reports per chat message: bytes the sender puts on the wire, bytes
+the broker sends back to the sender (its own message, which v5's no-local
+subscription suppresses), and the sender's CPU time decrypting and
+discarding those echoes. CPU times are per message: the sender's publish
+call, its echo handling, and the whole process (both clients and broker).
+
+The broker only does what the benchmark needs (no retained messages or
+sessions; deliveries go out at QoS 0), so treat byte counts as the protocol
+overhead of each version rather than as any real broker's numbers.
+
+    python benchmarks/bench_mqtt5.py --messages 2000
+"""
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+import benchutil
+
+import paho.mqtt.client as mqtt
+
+from mqchat_core import ChatEngine
+from mqchat_core.mqtt5 import PROTOCOL_V311, PROTOCOL_V5
+
+TOPIC_ALIAS_MAXIMUM = 10
+
+
+def read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, pos
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte, value = value & 0x7F, value >> 7
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def packet(first_byte, body):
+    return bytes([first_byte]) + varint(len(body)) + body
+
+
+def mqtt_string(text):
+    data = text.encode()
+    return struct.pack("!H", len(data)) + data
+
+
+def skip_properties(data, pos):
+    """Return (the topic alias, if any, position after the properties)"""
+    length, pos = read_varint(data, pos)
+    end = pos + length
+    alias = None
+    while pos < end:
+        prop = data[pos]
+        if prop == 0x23:  # Topic alias
+            alias = struct.unpack_from("!H", data, pos + 1)[0]
+            pos += 3
+        elif prop in (0x02, 0x11):  # Message expiry interval, session expiry interval
+            pos += 5
+        else:
+            raise ValueError(f"Unexpected property {prop:#x}")
+    return alias, end
+
+
+class Connection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.v5 = False
+        self.client_id = ""
+        self.subscriptions = []  # (filter, no_local)
+        self.aliases = {}  # alias -> topic, set by this client
+        self.bytes_in = {}  # topic -> PUBLISH bytes read from this client
+        self.bytes_out = {}  # topic -> PUBLISH bytes sent to this client
+        self.lock = threading.Lock()
+
+    def send(self, data):
+        with self.lock:
+            self.sock.sendall(data)
+
+
+class SinkBroker:
+    """Just enough of an MQTT 3.1.1/v5 broker to route one room and count its bytes"""
+
+    def __init__(self):
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen()
+        self.port = self.server.getsockname()[1]
+        self.connections = []
+        self.lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            sock, _ = self.server.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = Connection(sock)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def client(self, client_id):
+        with self.lock:
+            return next(conn for conn in reversed(self.connections) if conn.client_id == client_id)
+
+    def _serve(self, conn):
+        buffer = b""
+        try:
+            while True:
+                chunk = conn.sock.recv(65536)
+                if not chunk:
+                    break
+                buffer += chunk
+                while len(buffer) >= 2:
+                    try:
+                        length, body_start = read_varint(buffer, 1)
+                    except IndexError:
+                        break
+                    if len(buffer) < body_start + length:
+                        break
+                    if self._handle(conn, buffer[0], buffer[body_start:body_start + length],
+                                    body_start + length) is False:
+                        return
+                    buffer = buffer[body_start + length:]
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                if conn in self.connections:
+                    self.connections.remove(conn)
+            conn.sock.close()
+
+    def _handle(self, conn, first_byte, body, size):
+        kind = first_byte >> 4
+        if kind == 1:  # CONNECT
+            name_length = struct.unpack_from("!H", body)[0]
+            conn.v5 = body[2 + name_length] == 5
+            pos = 2 + name_length + 4
+            if conn.v5:
+                _, pos = skip_properties(body, pos)
+            id_length = struct.unpack_from("!H", body, pos)[0]
+            conn.client_id = body[pos + 2:pos + 2 + id_length].decode()
+            with self.lock:
+                self.connections.append(conn)
+            if conn.v5:
+                conn.send(packet(0x20, b"\x00\x00" + varint(3) + b"\x22" + struct.pack("!H", TOPIC_ALIAS_MAXIMUM)))
+            else:
+                conn.send(packet(0x20, b"\x00\x00"))
+        elif kind == 8:  # SUBSCRIBE
+            packet_id = body[:2]
+            pos = 2
+            if conn.v5:
+                _, pos = skip_properties(body, pos)
+            granted = bytearray()
+            while pos < len(body):
+                filter_length = struct.unpack_from("!H", body, pos)[0]
+                topic_filter = body[pos + 2:pos + 2 + filter_length].decode()
+                options = body[pos + 2 + filter_length]
+                pos += 3 + filter_length
+                conn.subscriptions.append((topic_filter, conn.v5 and bool(options & 0x04)))
+                granted.append(options & 0x03)
+            conn.send(packet(0x90, packet_id + (b"\x00" if conn.v5 else b"") + bytes(granted)))
+        elif kind == 3:  # PUBLISH
+            qos = (first_byte >> 1) & 0x03
+            topic_length = struct.unpack_from("!H", body)[0]
+            topic = body[2:2 + topic_length].decode()
+            pos = 2 + topic_length
+            packet_id = body[pos:pos + 2] if qos else b""
+            pos += len(packet_id)
+            if conn.v5:
+                alias, pos = skip_properties(body, pos)
+                if alias is not None:
+                    if topic:
+                        conn.aliases[alias] = topic
+                    else:
+                        topic = conn.aliases[alias]
+            conn.bytes_in[topic] = conn.bytes_in.get(topic, 0) + size
+            self._route(conn, topic, body[pos:])
+            if qos:
+                conn.send(packet(0x40, packet_id))
+        elif kind == 12:  # PINGREQ
+            conn.send(b"\xd0\x00")
+        elif kind == 14:  # DISCONNECT
+            return False
+
+    def _route(self, sender, topic, payload):
+        with self.lock:
+            receivers = list(self.connections)
+        for conn in receivers:
+            for topic_filter, no_local in conn.subscriptions:
+                if mqtt.topic_matches_sub(topic_filter, topic) and not (no_local and conn is sender):
+                    data = packet(0x30, mqtt_string(topic) + (b"\x00" if conn.v5 else b"") + payload)
+                    conn.bytes_out[topic] = conn.bytes_out.get(topic, 0) + len(data)
+                    conn.send(data)
+                    break
+
+
+def wait_for(condition, what, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise SystemExit(f"Timed out waiting for {what}")
+        time.sleep(0.005)
+
+
+def run(broker, protocol, messages, room):
+    options = {"mqtt_protocol": protocol}
+    sender, receiver = ChatEngine(), ChatEngine()
+    received = []
+    receiver.on("chat_message", lambda user, text, timestamp: received.append(text))
+    for engine, name in ((receiver, "receiver"), (sender, "sender")):
+        engine.connect("127.0.0.1", broker.port, room, name, "bench-key", options=options)
+        wait_for(lambda: "subscribed" in engine.timings, f"{name} to join")
+
+    # Time the sender publishing, and handling its own messages coming back
+    cpu_used = {}
+
+    def timed(method):
+        def wrapper(payload):
+            started = time.thread_time()
+            result = method(payload)
+            cpu_used[method.__name__] = cpu_used.get(method.__name__, 0.0) + time.thread_time() - started
+            return result
+        return wrapper
+    sender.publish_chat = timed(sender.publish_chat)
+    sender.handle_chat_message = timed(sender.handle_chat_message)
+
+    conn = broker.client(sender.mqtt_client._client_id.decode())
+    cpu_started = time.process_time()
+    for i in range(messages):
+        sender.send_message(f"benchmark message {i} with a line or so of ordinary chat text")
+    wait_for(lambda: len(received) >= messages, "the receiver to get every message")
+    time.sleep(0.2)  # Let the last echoes (on 3.1.1) arrive
+    cpu = time.process_time() - cpu_started
+
+    up = conn.bytes_in.get(sender.messages_topic, 0) / messages
+    echo = conn.bytes_out.get(sender.messages_topic, 0) / messages
+    for engine in (sender, receiver):
+        engine.disconnect()
+    return (up, echo, cpu_used.get("publish_chat", 0.0) / messages * 1e6,
+            cpu_used.get("handle_chat_message", 0.0) / messages * 1e6, cpu / messages * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MQTT 3.1.1 vs v5 bytes and CPU per chat message")
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    broker = SinkBroker()
+    room = f"bench-mqtt5-{int(time.time())}"
+    benchutil.print_header(f"MQTT 3.1.1 vs v5: {args.messages} chat messages, room {room!r}")
+    print(f"{'protocol':<10} {'sent B/msg':>11} {'echoed B/msg':>13} {'publish CPU us':>15} "
+          f"{'echo CPU us':>12} {'process CPU us':>15}")
+    for protocol in (PROTOCOL_V311, PROTOCOL_V5):
+        up, echo, publish_cpu, echo_cpu, cpu = run(broker, protocol, args.messages, room)
+        print(f"{protocol:<10} {up:>11.1f} {echo:>13.1f} {publish_cpu:>15.1f} {echo_cpu:>12.1f} {cpu:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+MQChat power policy benchmark
+Keeps an idle connection to a live broker in a heartbeat room and counts
+the radio wakeups and bytes it costs per hour: with the desktop settings,
+then under each PowerPolicy profile. Time runs --scale times faster, with
+the keepalive, heartbeat and radio tail all shortened to match, so the
+default scale of 60 measures an hour in a minute per row.
+
+    python benchmarks/bench_power.py --host 127.0.0.1 --scale 60 --hours 1
+"""
+
+import argparse
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine, PowerPolicy, TrafficMeter
+from mqchat_core.power import PROFILES, FOREGROUND, FOREGROUND_METERED, BACKGROUND
+from mqchat_core.presence import HEARTBEAT_INTERVAL
+from mqchat_core.session import KEEPALIVE
+
+
+def run(host, port, room, scale, hours, profile=None):
+    """Wakeups, bytes in and bytes out per (simulated) hour for one idle connection"""
+    meter = TrafficMeter(clock=lambda: time.monotonic() * scale)
+    engine = ChatEngine()
+    if profile is None:
+        # The desktop settings, as the Android app had them
+        engine.session_options.update(keepalive=max(1, round(KEEPALIVE / scale)), meter=meter)
+        engine.heartbeat_interval = HEARTBEAT_INTERVAL / scale
+    else:
+        profiles = {state: (max(1, round(keepalive / scale)), heartbeat / scale)
+                    for state, (keepalive, heartbeat) in PROFILES.items()}
+        policy = PowerPolicy(engine, profiles=profiles, state=profile)
+        policy.meter = meter
+        engine.session_options["meter"] = meter
+    engine.connect(host, port, room, "phone", "bench-key", options={"presence": "heartbeat"})
+
+    deadline = time.monotonic() + 5
+    while "subscribed" not in engine.timings:
+        if time.monotonic() > deadline:
+            raise SystemExit("Timed out waiting to join - is the broker running?")
+        time.sleep(0.01)
+    time.sleep(1.0)  # Let the joining traffic pass
+    meter.reset()
+    time.sleep(hours * 3600 / scale)
+    stats = meter.per_hour()
+    engine.disconnect()
+    return stats["wakeups"], stats["bytes_in"], stats["bytes_out"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark radio wakeups and traffic per power profile")
+    parser.add_argument("--host", default="127.0.0.1", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--scale", type=float, default=60, help="simulated seconds per real second")
+    parser.add_argument("--hours", type=float, default=1, help="simulated hours per row")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Idle heartbeat room for {args.hours:g} h at {args.scale:g}x speed")
+    print(f"{'settings':<20} {'wakeups/h':>10} {'bytes/h in':>11} {'bytes/h out':>12}")
+    for label, profile in (("desktop", None), (FOREGROUND, FOREGROUND),
+                           (FOREGROUND_METERED, FOREGROUND_METERED), (BACKGROUND, BACKGROUND)):
+        room = f"bench-power-{int(time.time())}-{label}"
+        wakeups, bytes_in, bytes_out = run(args.host, args.port, room, args.scale, args.hours, profile)
+        print(f"{label:<20} {wakeups:>10.0f} {bytes_in:>11,.0f} {bytes_out:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
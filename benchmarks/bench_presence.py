@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+MQChat presence load model
+Counts the broker traffic presence generates in a room of N users, for the
+heartbeat and lean presence modes. Each member is a ChatEngine publishing
+through a counting broker: every publish on a room topic is delivered to
+all N members, and a member joining also receives every retained presence
+record. Simulated time: heartbeats are every 30 seconds (heartbeat mode),
+and each member reconnects --reconnects times an hour.
+
+    python benchmarks/bench_presence.py --users 50 500 5000
+"""
+
+import argparse
+import heapq
+import random
+
+import benchutil
+
+from mqchat_core import ChatEngine
+from mqchat_core.presence import HEARTBEAT_INTERVAL, PRESENCE_MODES, PRESENCE_HEARTBEAT
+
+
+class CountingBroker:
+    """Counts publishes and deliveries; every member subscribes to the room's presence and probe topics"""
+
+    def __init__(self, members):
+        self.members = members
+        self.retained = {}
+        self.publishes = 0
+        self.deliveries = 0
+        self.delivered_bytes = 0
+
+    def publish(self, topic, payload, retain):
+        payload = payload.encode() if isinstance(payload, str) else payload
+        self.publishes += 1
+        self.deliveries += self.members
+        self.delivered_bytes += len(payload) * self.members
+        if retain:
+            if payload:
+                self.retained[topic] = payload
+            else:
+                self.retained.pop(topic, None)
+
+    def catch_up(self):
+        """A new subscription receives every retained presence record"""
+        self.deliveries += len(self.retained)
+        self.delivered_bytes += sum(len(payload) for payload in self.retained.values())
+
+
+class BrokerClient:
+    """The part of the paho client the engine uses for presence"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload or b"", retain)
+
+    def is_connected(self):
+        return True
+
+
+def simulate(users, mode, seconds, reconnects_per_hour, seed=1):
+    rng = random.Random(seed)
+    broker = CountingBroker(users)
+    engines = []
+    for i in range(users):
+        engine = ChatEngine(username=f"user{i:05d}", channel="load")
+        engine.apply_room_options({"presence": mode})
+        engine.mqtt_client = BrokerClient(broker)
+        engine.connected = True
+        engine.announce_presence("online")
+        engines.append(engine)
+
+    # Measure steady state only: the room is already full when the clock starts
+    broker.publishes = broker.deliveries = broker.delivered_bytes = 0
+    events = []
+    for engine in engines:
+        if mode == PRESENCE_HEARTBEAT:
+            heapq.heappush(events, (rng.uniform(0, HEARTBEAT_INTERVAL), "heartbeat", engine.username))
+        if reconnects_per_hour:
+            heapq.heappush(events, (rng.expovariate(reconnects_per_hour / 3600.0), "reconnect", engine.username))
+    by_name = {engine.username: engine for engine in engines}
+
+    while events and events[0][0] < seconds:
+        at, kind, name = heapq.heappop(events)
+        engine = by_name[name]
+        if kind == "heartbeat":
+            engine.announce_presence("online")
+            heapq.heappush(events, (at + HEARTBEAT_INTERVAL, kind, name))
+        else:
+            # What disconnect() and on_mqtt_connect() publish and receive
+            if mode == PRESENCE_HEARTBEAT:
+                engine._publish_presence("offline")
+            engine.clear_my_presence()
+            broker.catch_up()
+            if mode == PRESENCE_HEARTBEAT:
+                engine.clear_my_presence()
+            engine.announce_presence("online")
+            heapq.heappush(events, (at + rng.expovariate(reconnects_per_hour / 3600.0), kind, name))
+
+    return broker.publishes / seconds, broker.deliveries / seconds, broker.delivered_bytes / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model the broker load of presence")
+    parser.add_argument("--users", type=int, nargs="+", default=[50, 500, 5000], help="room sizes")
+    parser.add_argument("--seconds", type=float, default=300, help="simulated seconds")
+    parser.add_argument("--reconnects", type=float, default=1, help="reconnects per member per hour")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Presence broker load: {args.seconds:g} s simulated, "
+                           f"{args.reconnects:g} reconnect(s) per member per hour")
+    print(f"{'users':>6} {'mode':<10} {'publishes/s':>12} {'deliveries/s':>14} {'delivered KB/s':>15}")
+    for users in args.users:
+        for mode in PRESENCE_MODES:
+            publishes, deliveries, delivered_bytes = simulate(users, mode, args.seconds, args.reconnects)
+            print(f"{users:>6} {mode:<10} {publishes:>12,.1f} {deliveries:>14,.0f} {delivered_bytes / 1024:>15,.1f}")
+
+
+if __name__ == "__main__":
+    main()
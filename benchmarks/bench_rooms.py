@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+MQChat multi-room benchmark
+Joins --rooms rooms on a live broker twice: each room on its own connection
+(ChatEngine.connect), then every room on one shared BrokerSession. Reports
+broker connections, threads started, time until every room has its SUBACKs,
+and the keepalive pings the connections cost per hour. Then, offline, times
+routing one inbound message to its room with the session's TopicRouter
+against scanning each open room's if/startswith chain in turn.
+
+    python benchmarks/bench_rooms.py --host 127.0.0.1 --rooms 30
+"""
+
+import argparse
+import secrets
+import threading
+import time
+
+import benchutil
+
+from mqchat_core import BrokerSession, ChatEngine
+from mqchat_core.session import KEEPALIVE, TopicRouter, session_client_id
+
+
+def wait_joined(engines, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not all("subscribed" in engine.timings for engine in engines):
+        if time.monotonic() > deadline:
+            raise SystemExit("Timed out waiting to join - is the broker running?")
+        time.sleep(0.001)
+
+
+def run_private(host, port, rooms, prefix):
+    threads = threading.active_count()
+    started = time.perf_counter()
+    engines = []
+    for i in range(rooms):
+        engine = ChatEngine()
+        engine.connect(host, port, f"{prefix}-{i}", "bench", "bench-key")
+        engines.append(engine)
+    wait_joined(engines)
+    joined = (time.perf_counter() - started) * 1000
+    added = threading.active_count() - threads
+    for engine in engines:
+        engine.disconnect()
+    return rooms, added, joined
+
+
+def run_shared(host, port, rooms, prefix):
+    threads = threading.active_count()
+    started = time.perf_counter()
+    session = BrokerSession(host, port, client_id=session_client_id(secrets.token_hex(16), "bench"))
+    engines = []
+    for i in range(rooms):
+        engine = ChatEngine()
+        engine.join(session, f"{prefix}-{i}", "bench", "bench-key")
+        engines.append(engine)
+    session.connect()
+    wait_joined(engines)
+    joined = (time.perf_counter() - started) * 1000
+    added = threading.active_count() - threads
+    for engine in engines:
+        engine.disconnect()
+    session.close()
+    return 1, added, joined
+
+
+def chain_match(engine, topic):
+    """The per-room dispatch the engine used before routers: one if/elif chain"""
+    if topic == engine.messages_topic:
+        return 0
+    elif topic.startswith(engine.presence_topic):
+        return 1
+    elif topic == engine.keys_topic:
+        return 2
+    elif topic == engine.probe_topic:
+        return 3
+    elif topic.startswith(engine.files_topic + "/"):
+        return 4
+    return None
+
+
+def bench_routing(rooms, prefix, lookups):
+    engines = []
+    router = TopicRouter()
+    for i in range(rooms):
+        engine = ChatEngine()
+        engine.setup_room(f"{prefix}-{i}", "bench", "bench-key")
+        engines.append(engine)
+        for topic, handler in engine.routes():
+            router.add(topic, (engine, handler))
+    # A mix of inbound traffic spread across the rooms: mostly chat, some presence and file chunks
+    topics = []
+    for i in range(lookups):
+        engine = engines[i * 7 % rooms]
+        kind = i % 10
+        if kind < 7:
+            topics.append(engine.messages_topic)
+        elif kind < 9:
+            topics.append(f"{engine.presence_topic}/user{i % 50}")
+        else:
+            topics.append(f"{engine.files_topic}/abc123/{i % 16}")
+
+    started = time.perf_counter()
+    for topic in topics:
+        for engine in engines:
+            if chain_match(engine, topic) is not None:
+                break
+    chain = (time.perf_counter() - started) / lookups * 1e9
+
+    started = time.perf_counter()
+    for topic in topics:
+        router.match(topic)
+    routed = (time.perf_counter() - started) / lookups * 1e9
+    return chain, routed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark one connection per room vs one shared connection")
+    parser.add_argument("--host", default="127.0.0.1", help="MQTT broker")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--rooms", type=int, default=30)
+    parser.add_argument("--lookups", type=int, default=200000, help="inbound topics to route offline")
+    args = parser.parse_args()
+
+    prefix = f"bench-rooms-{int(time.time())}"
+    benchutil.print_header(f"{args.rooms} rooms against {args.host}:{args.port}")
+    print(f"{'layout':<12} {'connections':>12} {'threads':>8} {'all joined ms':>14} {'pings/hour':>11}")
+    for name, run in (("per room", run_private), ("shared", run_shared)):
+        connections, threads, joined = run(args.host, args.port, args.rooms, f"{prefix}-{name[0]}")
+        print(f"{name:<12} {connections:>12} {threads:>8} {joined:>14.1f} {connections * 3600 // KEEPALIVE:>11}")
+
+    benchutil.print_header(f"Routing {args.lookups} inbound messages across {args.rooms} rooms")
+    chain, routed = bench_routing(args.rooms, prefix, args.lookups)
+    print(f"{'if/startswith per room':<24} {chain:>8.0f} ns/msg")
+    print(f"{'TopicRouter':<24} {routed:>8.0f} ns/msg")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+MQChat saved room store benchmark
+Compares the old single encrypted JSON file (rewritten on every change) with
+the per-room RoomStore for startup and for saving one room, at a given
+number of saved rooms. Then compares the Android app's old plain <room>.json
+files (listed and parsed whenever the Saved Rooms spinner is used) with a
+preloaded RoomStore.
+
+    python benchmarks/bench_roomstore.py --rooms 500
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import benchutil
+
+from cryptography.fernet import Fernet
+
+from mqchat_core import RoomStore, derive_key
+
+
+def make_room(i):
+    return {
+        "server": "broker.example.com",
+        "port": "1883",
+        "channel": f"team-{i}",
+        "username": "alice",
+        "encryption_key": f"team key {i}",
+        "mqtt_username": "",
+        "mqtt_password": "",
+        "saved_date": "2025-01-01T00:00:00",
+        "wire_version": 2,
+        "cipher_suite": "aes-gcm",
+    }
+
+
+def timed(func, repeat):
+    """Return the median seconds per call of func()"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return benchutil.percentile(samples, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the saved room store")
+    parser.add_argument("--rooms", type=int, default=500, help="number of saved rooms")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement")
+    args = parser.parse_args()
+
+    cipher = Fernet(derive_key("mqtt_chat_config_key_v1"))
+    rooms = {f"Room {i}": make_room(i) for i in range(args.rooms)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_file = os.path.join(tmp, "mqtt_chat_rooms.json")
+
+        def legacy_save():
+            with open(legacy_file, 'wb') as f:
+                f.write(cipher.encrypt(json.dumps(rooms).encode()))
+
+        def legacy_load():
+            with open(legacy_file, 'rb') as f:
+                return json.loads(cipher.decrypt(f.read()).decode())
+
+        legacy_save()
+        store = RoomStore(os.path.join(tmp, "store"), cipher)
+        store.update(rooms)
+
+        def store_save():
+            store["Room 0"] = rooms["Room 0"]
+
+        def store_load():
+            RoomStore(os.path.join(tmp, "store"), cipher)
+
+        def store_open_room():
+            RoomStore(os.path.join(tmp, "store"), cipher)["Room 1"]
+
+        benchutil.print_header(f"Saved rooms: {args.rooms} rooms")
+        print(f"{'operation':<36} {'ms':>10}")
+        for label, func in (("single file: startup (decrypt all)", legacy_load),
+                            ("single file: save one room", legacy_save),
+                            ("room store: startup (index only)", store_load),
+                            ("room store: startup + open a room", store_open_room),
+                            ("room store: save one room", store_save)):
+            print(f"{label:<36} {timed(func, args.repeat) * 1e3:>10.2f}")
+
+        json_dir = os.path.join(tmp, "rooms")
+        os.makedirs(json_dir)
+        for name, config in rooms.items():
+            with open(os.path.join(json_dir, f"{name}.json"), 'w') as f:
+                json.dump(config, f, indent=2)
+        android_store = RoomStore(os.path.join(tmp, "android"), cipher)
+        android_store.update(rooms)
+
+        def json_list():
+            return [f[:-5] for f in os.listdir(json_dir) if f.endswith('.json')]
+
+        def json_open_room():
+            with open(os.path.join(json_dir, "Room 1.json"), 'r') as f:
+                return json.load(f)
+
+        def json_save():
+            with open(os.path.join(json_dir, "Room 0.json"), 'w') as f:
+                json.dump(rooms["Room 0"], f, indent=2)
+
+        def store_preload():
+            RoomStore(os.path.join(tmp, "android"), cipher).preload()
+
+        benchutil.print_header(f"Android saved rooms: {args.rooms} rooms")
+        print(f"{'operation':<36} {'ms':>10}")
+        for label, func in (("json files: list rooms", json_list),
+                            ("json files: open a room", json_open_room),
+                            ("json files: save one room", json_save),
+                            ("room store: startup (preload all)", store_preload),
+                            ("room store: list rooms", lambda: sorted(android_store)),
+                            ("room store: open a room", lambda: android_store["Room 1"]),
+                            ("room store: save one room", lambda: android_store.update({"Room 0": rooms["Room 0"]}))):
+            print(f"{label:<36} {timed(func, args.repeat) * 1e3:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+MQChat roster benchmark
+Simulates a large room: every user's retained presence arriving on join, then
+steady traffic of 30-second heartbeats from everyone plus a little churn.
+Compares the old handling (sort the whole roster on every presence message
+and rebuild the users list every frame) with roster changes applied as row
+edits through SortedRoster.
+
+    python benchmarks/bench_roster.py --users 10000
+    python benchmarks/bench_roster.py --tk          # edit a real Tk Listbox
+"""
+
+import argparse
+import json
+import random
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine, EVENT_USERS_CHANGED
+from mqchat_core.dispatch import EventQueue, coalesce
+from mqchat_core.roster import SortedRoster
+
+FRAME = 1 / 30.0  # Seconds per GUI frame
+HEARTBEAT_INTERVAL = 30.0
+
+
+class ListView:
+    """Stand-in for the Tk Listbox (a list: inserts and deletes shift the rows after them)"""
+
+    def __init__(self):
+        self.rows = []
+
+    def insert_rows(self, index, users):
+        self.rows[index:index] = users
+
+    def delete_rows(self, first, last=None):
+        del self.rows[first:(last if last is not None else first) + 1]
+
+    def size(self):
+        return len(self.rows)
+
+
+class TkListView:
+    def __init__(self):
+        import tkinter as tk
+        self.root = tk.Tk()
+        self.root.withdraw()
+        self.listbox = tk.Listbox(self.root)
+
+    def insert_rows(self, index, users):
+        self.listbox.insert(index, *users)
+
+    def delete_rows(self, first, last=None):
+        self.listbox.delete(first, last if last is not None else first)
+
+    def size(self):
+        return self.listbox.size()
+
+
+def presence_traffic(users, seconds, churn, seed=1):
+    """Frames of (user, status) presence messages: the join flood, then heartbeats and churn"""
+    rng = random.Random(seed)
+    names = [f"user{rng.randrange(10 ** 8):08d}" for _ in range(users)]
+    online = list(names)
+    frames = [[(name, "online") for name in names[i:i + 500]] for i in range(0, users, 500)]
+
+    heartbeats_per_frame = users / HEARTBEAT_INTERVAL * FRAME
+    owed = 0.0
+    next_name = 0
+    for frame in range(int(seconds / FRAME)):
+        messages = []
+        owed += heartbeats_per_frame
+        while owed >= 1:
+            messages.append((rng.choice(online), "online"))
+            owed -= 1
+        if rng.random() < churn * FRAME:
+            index = rng.randrange(len(online))
+            messages.append((online[index], "offline"))
+            online[index] = f"late{next_name:06d}"
+            next_name += 1
+            messages.append((online[index], "online"))
+        frames.append(messages)
+    return frames
+
+
+def run_old(frames, view):
+    """The previous behaviour: sorted(users) per message, full list rebuild per frame"""
+    online = set()
+    inbox = EventQueue()
+    engine_time = 0.0
+    frame_samples = []
+    for messages in frames:
+        t0 = time.perf_counter()
+        for user, status in messages:
+            payload = json.dumps({"user": user, "status": status, "timestamp": time.time()})
+            data = json.loads(payload)
+            if data["status"] == "online":
+                online.add(user)
+            else:
+                online.discard(user)
+            inbox.put("users", sorted(online))
+        engine_time += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        latest = None
+        for kind, args in inbox.drain():
+            latest = args[0]
+        if latest is not None:
+            view.delete_rows(0, view.size())
+            view.insert_rows(0, latest)
+        frame_samples.append(time.perf_counter() - t0)
+    return engine_time, frame_samples
+
+
+def run_new(frames, view):
+    """ChatEngine roster changes, coalesced per frame and applied as row edits"""
+    engine = ChatEngine(username="bench", channel="bench")
+    inbox = EventQueue()
+    engine.on(EVENT_USERS_CHANGED, lambda changes: inbox.put("users", changes))
+    roster_view = SortedRoster()
+    engine_time = 0.0
+    frame_samples = []
+    for messages in frames:
+        t0 = time.perf_counter()
+        for user, status in messages:
+            payload = json.dumps({"user": user, "status": status, "timestamp": time.time()})
+            engine.handle_presence_message(f"{engine.presence_topic}/{user}", payload)
+        engine_time += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for step, value in coalesce(inbox.drain()):
+            if step != "users":
+                continue
+            edits = roster_view.apply(value)
+            if len(edits) > len(roster_view) // 2:
+                view.delete_rows(0, view.size())
+                view.insert_rows(0, list(roster_view))
+                continue
+            for edit, index, user in edits:
+                if edit == "insert":
+                    view.insert_rows(index, [user])
+                else:
+                    view.delete_rows(index)
+        frame_samples.append(time.perf_counter() - t0)
+    return engine_time, frame_samples, roster_view
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark roster updates in a large room")
+    parser.add_argument("--users", type=int, default=10000, help="users in the room")
+    parser.add_argument("--seconds", type=float, default=60, help="simulated seconds after joining")
+    parser.add_argument("--churn", type=float, default=2, help="users replaced per second")
+    parser.add_argument("--tk", action="store_true", help="edit a real Tk Listbox")
+    args = parser.parse_args()
+
+    frames = presence_traffic(args.users, args.seconds, args.churn)
+    messages = sum(len(frame) for frame in frames)
+    make_view = TkListView if args.tk else ListView
+    benchutil.print_header(f"Roster: {args.users:,} users, {messages:,} presence messages "
+                           f"over {len(frames):,} frames")
+
+    print(f"{'':<28} {'engine us/msg':>14} {'frame p50 ms':>13} {'frame p99 ms':>13} {'total s':>8}")
+    old_view = make_view()
+    engine_time, samples = run_old(frames, old_view)
+    print(f"{'sorted list + rebuild':<28} {engine_time / messages * 1e6:>14.1f} "
+          f"{benchutil.percentile(samples, 50) * 1e3:>13.3f} {benchutil.percentile(samples, 99) * 1e3:>13.3f} "
+          f"{engine_time + sum(samples):>8.2f}")
+
+    new_view = make_view()
+    engine_time, samples, roster_view = run_new(frames, new_view)
+    print(f"{'roster changes + row edits':<28} {engine_time / messages * 1e6:>14.1f} "
+          f"{benchutil.percentile(samples, 50) * 1e3:>13.3f} {benchutil.percentile(samples, 99) * 1e3:>13.3f} "
+          f"{engine_time + sum(samples):>8.2f}")
+
+    if not args.tk:
+        assert new_view.rows == old_view.rows == roster_view.users, "roster views disagree"
+    print(f"\nFinal roster: {new_view.size():,} users")
+
+
+if __name__ == "__main__":
+    main()
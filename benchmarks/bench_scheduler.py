@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+MQChat scheduler benchmark
+Runs --rooms rooms' worth of periodic jobs (a heartbeat each, started at the
+same moment as if the app had just reconnected everywhere) for --seconds,
+with the interval scaled down so the run is short. Compares chained
+threading.Timer jobs (the old heartbeat) with the shared Scheduler, and
+reports threads started, peak live threads, lateness and the biggest burst
+of jobs firing within one 10 ms window.
+
+    python benchmarks/bench_scheduler.py --rooms 200
+"""
+
+import argparse
+import threading
+import time
+
+import benchutil
+
+from mqchat_core.scheduler import Scheduler
+
+BURST_WINDOW = 0.010  # Seconds
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fired = []  # (actual, due)
+        self.peak_threads = threading.active_count()
+
+    def record(self, due):
+        now = time.monotonic()
+        with self.lock:
+            self.fired.append((now, due))
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+
+def run_timers(rooms, interval, seconds):
+    """The old way: every job re-arms a new threading.Timer after it runs"""
+    recorder = Recorder()
+    started = [0]
+    stop_at = time.monotonic() + seconds + interval / 2
+    lock = threading.Lock()
+
+    def heartbeat(due):
+        recorder.record(due)
+        if due + interval < stop_at:
+            arm(due + interval)
+
+    def arm(due):
+        timer = threading.Timer(max(0.0, due - time.monotonic()), heartbeat, args=(due,))
+        timer.daemon = True
+        with lock:
+            started[0] += 1
+        timer.start()
+
+    start = time.monotonic()
+    for _ in range(rooms):
+        arm(start + interval)
+    time.sleep(seconds + 0.2)
+    return recorder, started[0]
+
+
+def run_scheduler(rooms, interval, seconds, jitter):
+    recorder = Recorder()
+    scheduler = Scheduler()
+    jobs = []
+    for _ in range(rooms):
+        def heartbeat():
+            recorder.record(time.monotonic())
+        jobs.append(scheduler.call_every(interval, heartbeat, name="heartbeat", jitter=jitter))
+    time.sleep(seconds + 0.2)
+    for job in jobs:
+        job.cancel()
+    recorder.late_ms = scheduler.stats["max_late_ms"]
+    return recorder, 1  # Its one thread
+
+
+def biggest_burst(fired):
+    times = sorted(actual for actual, _ in fired)
+    biggest = first = 0
+    for last, when in enumerate(times):
+        while when - times[first] > BURST_WINDOW:
+            first += 1
+        biggest = max(biggest, last - first + 1)
+    return biggest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark periodic jobs: Timer threads vs one scheduler")
+    parser.add_argument("--rooms", type=int, default=200, help="rooms (one heartbeat job each)")
+    parser.add_argument("--interval", type=float, default=0.5, help="heartbeat interval (scaled down from 30 s)")
+    parser.add_argument("--seconds", type=float, default=5, help="run time")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Scheduler: {args.rooms} heartbeats every {args.interval:g} s for {args.seconds:g} s")
+    print(f"{'':<24} {'runs':>6} {'threads started':>16} {'peak threads':>13} {'max late ms':>12} "
+          f"{'max burst/10ms':>15}")
+
+    recorder, started = run_timers(args.rooms, args.interval, args.seconds)
+    late = max((actual - due) * 1000 for actual, due in recorder.fired)
+    print(f"{'threading.Timer chains':<24} {len(recorder.fired):>6} {started:>16} {recorder.peak_threads:>13} "
+          f"{late:>12.1f} {biggest_burst(recorder.fired):>15}")
+
+    for jitter in (0.0, 0.1):
+        recorder, started = run_scheduler(args.rooms, args.interval, args.seconds, jitter)
+        print(f"{f'scheduler, jitter {jitter:g}':<24} {len(recorder.fired):>6} {started:>16} "
+              f"{recorder.peak_threads:>13} {recorder.late_ms:>12.1f} {biggest_burst(recorder.fired):>15}")
+
+
+if __name__ == "__main__":
+    main()
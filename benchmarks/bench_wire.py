@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+MQChat wire format benchmark
+Compares bytes per message and receive-side decode time for the v1 (double
+base64) and v2 (binary envelope) chat payload formats.
+
+    python benchmarks/bench_wire.py --messages 10000
+"""
+
+import argparse
+import time
+
+import benchutil
+
+from mqchat_core import ChatEngine, WIRE_V1, WIRE_V2
+
+
+def measure(wire_version, text, count):
+    """Return (payload bytes, decode seconds per message) for one format"""
+    engine = ChatEngine(username="bench", channel="bench")
+    engine.set_encryption_key("supersecretkey123")
+    engine.apply_room_options({"wire_version": wire_version})
+
+    payloads = [engine.encrypt_message({"user": "bench", "message": text, "timestamp": time.time()})
+                for _ in range(count)]
+
+    start = time.perf_counter()
+    for payload in payloads:
+        engine.decrypt_message(payload)
+    elapsed = time.perf_counter() - start
+
+    size = sum(len(p) for p in payloads) / count
+    return size, elapsed / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark wire format v1 vs v2")
+    parser.add_argument("--messages", type=int, default=10000, help="messages per size")
+    parser.add_argument("--sizes", default="5,80,500,4000", help="comma separated text sizes")
+    args = parser.parse_args()
+
+    benchutil.print_header(f"Wire format v1 vs v2 ({args.messages:,} messages per size)")
+    print(f"{'text':>6} | {'v1 bytes':>9} {'v2 bytes':>9} {'saved':>6} | "
+          f"{'v1 decode':>10} {'v2 decode':>10} {'faster':>6}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        text = "x" * size
+        v1_size, v1_time = measure(WIRE_V1, text, args.messages)
+        v2_size, v2_time = measure(WIRE_V2, text, args.messages)
+        print(f"{size:>6} | {v1_size:>9.0f} {v2_size:>9.0f} {1 - v2_size / v1_size:>6.0%} | "
+              f"{v1_time * 1e6:>8.1f}us {v2_time * 1e6:>8.1f}us {1 - v2_time / v1_time:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
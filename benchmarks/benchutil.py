@@ -0,0 +1,45 @@
+"""
+Shared helpers for the MQChat benchmark scripts
+"""
+
+import os
+import sys
+
+# Make the repository root importable when run as `python benchmarks/<script>.py`
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def percentile(samples, pct):
+    """Return the pct-th percentile (0-100) of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_header(title):
+    """Print a benchmark section header"""
+    print("=" * 60)
+    print(f"  {title}")
+    print("=" * 60)
+
+
+def print_latency(label, count, elapsed, samples):
+    """Print throughput and p50/p99 latency for a timed loop"""
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    p50 = percentile(samples, 50) * 1e6
+    p99 = percentile(samples, 99) * 1e6
+    print(f"{label:<28} {rate:>12,.0f} msg/s   p50 {p50:>8.1f} us   p99 {p99:>8.1f} us")
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB (None where it can't be read)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
@@ -1,1125 +1,1647 @@
-#!/usr/bin/env python3
-"""
-MQChat by James Powell
-A simple encrypted group chat using MQTT as the relay server
-FINAL VERSION - Anti-spam join detection
-"""
-
-import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext, simpledialog
-import paho.mqtt.client as mqtt
-import json
-import base64
-import hashlib
-import time
-import threading
-import os
-from datetime import datetime
-from cryptography.fernet import Fernet
-
-class SecureMQTTChat:
-    def __init__(self):
-        self.root = tk.Tk()
-        self.root.title("MQChat by James Powell")
-        self.root.geometry("900x800")
-        
-        # MQTT and crypto variables
-        self.mqtt_client = None
-        self.cipher = None
-        self.connected = False
-        self.username = ""
-        self.channel = ""
-        self.encryption_key = ""
-        
-        # Topics
-        self.messages_topic = ""
-        self.presence_topic = ""
-        self.userlist_topic = ""
-        
-        # User tracking
-        self.online_users = set()
-        self.heartbeat_timer = None
-        self.recent_joins = {}  # Track recent joins to prevent spam
-        
-        # Room management
-        self.config_file = "mqtt_chat_rooms.json"
-        self.config_cipher = None
-        self.saved_rooms = {}
-        
-        self.setup_gui()
-        self.load_saved_rooms()
-        
-    def clear_my_presence(self):
-        """Clear our own presence message to prevent duplicates"""
-        if self.mqtt_client and self.username:
-            self.mqtt_client.publish(f"{self.presence_topic}/{self.username}", "", retain=True)
-
-    def force_clean_users(self):
-        """Force clean the users list by removing duplicates"""
-        # Convert to list, remove duplicates, convert back to set
-        unique_users = list(set(self.online_users))
-        self.online_users = set(unique_users)
-        self.update_users_list()
-
-    def nuclear_clean_users(self):
-        """Nuclear option - completely rebuild user list"""
-        print("Nuclear clean - rebuilding user list")
-        self.online_users.clear()
-        self.online_users.add(self.username)  # Add ourselves back
-        self.update_users_list()
-        
-    def clear_connection_fields(self):
-        """Clear all connection fields"""
-        self.server_entry.delete(0, tk.END)
-        self.server_entry.insert(0, "localhost")
-        
-        self.port_entry.delete(0, tk.END)
-        self.port_entry.insert(0, "1883")
-        
-        self.channel_entry.delete(0, tk.END)
-        self.channel_entry.insert(0, "general")
-        
-        self.username_entry.delete(0, tk.END)
-        
-        self.mqtt_username_entry.delete(0, tk.END)
-        self.mqtt_password_entry.delete(0, tk.END)
-        
-        self.key_entry.delete(0, tk.END)
-        self.key_entry.insert(0, "supersecretkey123")
-        
-        # Clear dropdown selection
-        self.rooms_var.set("")
-        
-        self.update_key_display()
-        messagebox.showinfo("Cleared", "All fields cleared to defaults!")
-        
-    def setup_gui(self):
-        """Create the GUI layout"""
-        # Create notebook for tabs
-        notebook = ttk.Notebook(self.root)
-        notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # Connection tab
-        self.connection_frame = ttk.Frame(notebook)
-        notebook.add(self.connection_frame, text="Connection")
-        self.setup_connection_tab()
-        
-        # Chat tab
-        self.chat_frame = ttk.Frame(notebook)
-        notebook.add(self.chat_frame, text="Chat")
-        self.setup_chat_tab()
-        
-        # Room Management tab
-        self.rooms_frame = ttk.Frame(notebook)
-        notebook.add(self.rooms_frame, text="Saved Rooms")
-        self.setup_rooms_tab()
-        
-    def setup_connection_tab(self):
-        """Setup the connection configuration tab"""
-        # Title
-        title_label = tk.Label(self.connection_frame, text="MQTT Chat Configuration", 
-                              font=("Arial", 16, "bold"))
-        title_label.pack(pady=20)
-        
-        # Quick Load Frame
-        quick_frame = tk.LabelFrame(self.connection_frame, text="Quick Connect", 
-                                   font=("Arial", 10, "bold"))
-        quick_frame.pack(pady=10, padx=20, fill=tk.X)
-        
-        # Saved rooms dropdown
-        rooms_frame = tk.Frame(quick_frame)
-        rooms_frame.pack(pady=10)
-        
-        tk.Label(rooms_frame, text="Saved Rooms:").pack(side=tk.LEFT, padx=5)
-        self.rooms_var = tk.StringVar()
-        self.rooms_dropdown = ttk.Combobox(rooms_frame, textvariable=self.rooms_var, 
-                                          state="readonly", width=25)
-        self.rooms_dropdown.pack(side=tk.LEFT, padx=5)
-        self.rooms_dropdown.bind('<<ComboboxSelected>>', self.load_room_config)
-        
-        load_btn = tk.Button(rooms_frame, text="Load Room", command=self.load_room_config,
-                           bg="#4CAF50", fg="white")
-        load_btn.pack(side=tk.LEFT, padx=5)
-        
-        # Configuration frame
-        config_frame = tk.LabelFrame(self.connection_frame, text="Manual Configuration", 
-                                    font=("Arial", 10, "bold"))
-        config_frame.pack(pady=10, padx=20, fill=tk.X)
-        
-        # Create inner frame for grid layout
-        inner_config = tk.Frame(config_frame)
-        inner_config.pack(pady=10)
-        
-        # MQTT Server
-        tk.Label(inner_config, text="MQTT Server:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
-        self.server_entry = tk.Entry(inner_config, width=30)
-        self.server_entry.grid(row=0, column=1, padx=5, pady=5)
-        self.server_entry.insert(0, "localhost")
-        
-        # Port
-        tk.Label(inner_config, text="Port:").grid(row=1, column=0, sticky="e", padx=5, pady=5)
-        self.port_entry = tk.Entry(inner_config, width=30)
-        self.port_entry.grid(row=1, column=1, padx=5, pady=5)
-        self.port_entry.insert(0, "1883")
-        
-        # Channel/Room
-        tk.Label(inner_config, text="Channel:").grid(row=2, column=0, sticky="e", padx=5, pady=5)
-        self.channel_entry = tk.Entry(inner_config, width=30)
-        self.channel_entry.grid(row=2, column=1, padx=5, pady=5)
-        self.channel_entry.insert(0, "general")
-        
-        # MQTT Authentication frame
-        auth_frame = tk.LabelFrame(inner_config, text="MQTT Authentication (Optional)", 
-                                  font=("Arial", 9, "italic"))
-        auth_frame.grid(row=3, column=0, columnspan=3, sticky="ew", padx=5, pady=10)
-        
-        # MQTT Username
-        tk.Label(auth_frame, text="MQTT Username:").grid(row=0, column=0, sticky="e", padx=5, pady=3)
-        self.mqtt_username_entry = tk.Entry(auth_frame, width=25)
-        self.mqtt_username_entry.grid(row=0, column=1, padx=5, pady=3)
-        
-        # MQTT Password
-        tk.Label(auth_frame, text="MQTT Password:").grid(row=1, column=0, sticky="e", padx=5, pady=3)
-        self.mqtt_password_entry = tk.Entry(auth_frame, width=25, show="*")
-        self.mqtt_password_entry.grid(row=1, column=1, padx=5, pady=3)
-        
-        # Show MQTT password checkbox
-        self.show_mqtt_password_var = tk.BooleanVar()
-        show_mqtt_pass_btn = tk.Checkbutton(auth_frame, text="Show Password", 
-                                           variable=self.show_mqtt_password_var,
-                                           command=self.toggle_mqtt_password_visibility)
-        show_mqtt_pass_btn.grid(row=1, column=2, sticky="w", padx=5, pady=3)
-        
-        # Help text
-        help_label = tk.Label(auth_frame, text="Leave blank for anonymous connection", 
-                             font=("Arial", 8), fg="gray")
-        help_label.grid(row=2, column=0, columnspan=3, pady=3)
-        
-        # Chat Username
-        tk.Label(inner_config, text="Chat Username:").grid(row=4, column=0, sticky="e", padx=5, pady=5)
-        self.username_entry = tk.Entry(inner_config, width=30)
-        self.username_entry.grid(row=4, column=1, padx=5, pady=5)
-        
-        # Encryption Key
-        tk.Label(inner_config, text="Encryption Key:").grid(row=5, column=0, sticky="e", padx=5, pady=5)
-        self.key_entry = tk.Entry(inner_config, width=30, show="*")
-        self.key_entry.grid(row=5, column=1, padx=5, pady=5)
-        self.key_entry.insert(0, "supersecretkey123")
-        
-        # Key buttons frame
-        key_buttons_frame = tk.Frame(inner_config)
-        key_buttons_frame.grid(row=5, column=2, padx=5, pady=5)
-        
-        # Generate key button
-        generate_btn = tk.Button(key_buttons_frame, text="Generate", command=self.generate_key)
-        generate_btn.pack(side=tk.TOP, pady=(0, 2))
-        
-        # Copy key button
-        copy_btn = tk.Button(key_buttons_frame, text="Copy Key", command=self.copy_key)
-        copy_btn.pack(side=tk.TOP)
-        
-        # Show/Hide key button
-        self.show_key_var = tk.BooleanVar()
-        show_key_btn = tk.Checkbutton(inner_config, text="Show Key", variable=self.show_key_var, 
-                                     command=self.toggle_key_visibility)
-        show_key_btn.grid(row=6, column=1, sticky="w", padx=5, pady=5)
-        
-        # Key display area (for easy copying)
-        tk.Label(inner_config, text="Share this key:").grid(row=7, column=0, sticky="e", padx=5, pady=5)
-        self.key_display = tk.Text(inner_config, height=3, width=35, wrap=tk.WORD, state=tk.DISABLED)
-        self.key_display.grid(row=7, column=1, padx=5, pady=5)
-        self.update_key_display()
-        
-        # Buttons frame
-        buttons_frame = tk.Frame(self.connection_frame)
-        buttons_frame.pack(pady=20)
-        
-        # Save current room button
-        save_room_btn = tk.Button(buttons_frame, text="💾 Save Current Room", 
-                                 command=self.save_current_room, bg="#2196F3", fg="white",
-                                 font=("Arial", 10, "bold"))
-        save_room_btn.pack(side=tk.LEFT, padx=5)
-        
-        # Connect button
-        self.connect_btn = tk.Button(buttons_frame, text="🔗 Connect", command=self.connect_mqtt, 
-                                   bg="green", fg="white", font=("Arial", 12, "bold"))
-        self.connect_btn.pack(side=tk.LEFT, padx=5)
-        
-        # Clear fields button
-        clear_btn = tk.Button(buttons_frame, text="🗑️ Clear Fields", command=self.clear_connection_fields,
-                             bg="#FF9800", fg="white", font=("Arial", 10, "bold"))
-        clear_btn.pack(side=tk.LEFT, padx=5)
-        
-        # Status label
-        self.status_label = tk.Label(self.connection_frame, text="Not connected", fg="red",
-                                   font=("Arial", 10, "bold"))
-        self.status_label.pack(pady=10)
-        
-    def setup_chat_tab(self):
-        """Setup the chat interface tab"""
-        # Main chat frame
-        main_frame = tk.Frame(self.chat_frame)
-        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # Chat display frame (left side)
-        chat_display_frame = tk.Frame(main_frame)
-        chat_display_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        # Chat header with room name
-        self.chat_header = tk.Label(chat_display_frame, text="Chat Messages", 
-                                   font=("Arial", 12, "bold"), bg="#E3F2FD", relief=tk.RAISED, pady=5)
-        self.chat_header.pack(fill=tk.X, pady=(0, 5))
-        
-        # Chat messages area
-        self.chat_display = scrolledtext.ScrolledText(chat_display_frame, state=tk.DISABLED, 
-                                                     wrap=tk.WORD, height=20)
-        self.chat_display.pack(fill=tk.BOTH, expand=True, pady=5)
-        
-        # Message input frame
-        input_frame = tk.Frame(chat_display_frame)
-        input_frame.pack(fill=tk.X, pady=5)
-        
-        self.message_entry = tk.Entry(input_frame)
-        self.message_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        self.message_entry.bind("<Return>", self.send_message)
-        
-        send_btn = tk.Button(input_frame, text="Send", command=self.send_message)
-        send_btn.pack(side=tk.RIGHT, padx=(5, 0))
-        
-        # Users list frame (right side)
-        users_frame = tk.Frame(main_frame, width=200)
-        users_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0))
-        users_frame.pack_propagate(False)
-        
-        tk.Label(users_frame, text="Online Users", font=("Arial", 12, "bold")).pack()
-        self.users_listbox = tk.Listbox(users_frame, width=25)
-        self.users_listbox.pack(fill=tk.BOTH, expand=True, pady=5)
-        
-        # Disconnect button
-        disconnect_btn = tk.Button(users_frame, text="Disconnect", command=self.disconnect_mqtt,
-                                 bg="red", fg="white")
-        disconnect_btn.pack(fill=tk.X, pady=5)
-        
-        # Add debug button for cleaning users
-        debug_btn = tk.Button(users_frame, text="🧹 Clean Users", command=self.force_clean_users,
-                             bg="orange", fg="white", font=("Arial", 8))
-        debug_btn.pack(fill=tk.X, pady=2)
-        
-    def setup_rooms_tab(self):
-        """Setup the room management tab"""
-        title_label = tk.Label(self.rooms_frame, text="Saved Chat Rooms", 
-                              font=("Arial", 16, "bold"))
-        title_label.pack(pady=20)
-        
-        # Main container
-        main_container = tk.Frame(self.rooms_frame)
-        main_container.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
-        
-        # Left side - Room list
-        left_frame = tk.Frame(main_container)
-        left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        
-        tk.Label(left_frame, text="Saved Rooms:", font=("Arial", 12, "bold")).pack(anchor="w")
-        
-        # Rooms listbox with scrollbar
-        listbox_frame = tk.Frame(left_frame)
-        listbox_frame.pack(fill=tk.BOTH, expand=True, pady=5)
-        
-        self.rooms_listbox = tk.Listbox(listbox_frame, font=("Arial", 10))
-        scrollbar = tk.Scrollbar(listbox_frame, orient=tk.VERTICAL, command=self.rooms_listbox.yview)
-        self.rooms_listbox.config(yscrollcommand=scrollbar.set)
-        
-        self.rooms_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        self.rooms_listbox.bind('<<ListboxSelect>>', self.on_room_select)
-        
-        # Buttons frame
-        buttons_frame = tk.Frame(left_frame)
-        buttons_frame.pack(fill=tk.X, pady=10)
-        
-        edit_btn = tk.Button(buttons_frame, text="✏️ Edit", command=self.edit_room,
-                           bg="#FF9800", fg="white")
-        edit_btn.pack(side=tk.LEFT, padx=(0, 5))
-        
-        delete_btn = tk.Button(buttons_frame, text="🗑️ Delete", command=self.delete_room,
-                             bg="#F44336", fg="white")
-        delete_btn.pack(side=tk.LEFT, padx=5)
-        
-        quick_connect_btn = tk.Button(buttons_frame, text="🚀 Quick Connect", 
-                                    command=self.quick_connect_room,
-                                    bg="#4CAF50", fg="white", font=("Arial", 10, "bold"))
-        quick_connect_btn.pack(side=tk.RIGHT)
-        
-        # Right side - Room details
-        right_frame = tk.LabelFrame(main_container, text="Room Details", 
-                                   font=("Arial", 10, "bold"))
-        right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(20, 0))
-        
-        # Room details display
-        self.room_details = tk.Text(right_frame, height=15, width=40, wrap=tk.WORD, 
-                                   state=tk.DISABLED, font=("Arial", 9))
-        self.room_details.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        # Import/Export buttons
-        import_export_frame = tk.Frame(right_frame)
-        import_export_frame.pack(fill=tk.X, padx=10, pady=10)
-        
-        export_btn = tk.Button(import_export_frame, text="📤 Export All", 
-                             command=self.export_rooms, bg="#9C27B0", fg="white")
-        export_btn.pack(side=tk.LEFT, padx=(0, 5))
-        
-        import_btn = tk.Button(import_export_frame, text="📥 Import", 
-                             command=self.import_rooms, bg="#607D8B", fg="white")
-        import_btn.pack(side=tk.LEFT)
-        
-    def get_config_cipher(self):
-        """Get or create cipher for config file encryption"""
-        if not self.config_cipher:
-            # Use a fixed key for config encryption (in real app, use keyring/OS keystore)
-            config_key = self.derive_key("mqtt_chat_config_key_v1")
-            self.config_cipher = Fernet(config_key)
-        return self.config_cipher
-        
-    def save_current_room(self):
-        """Save current room configuration"""
-        server = self.server_entry.get().strip()
-        port = self.port_entry.get().strip()
-        channel = self.channel_entry.get().strip()
-        username = self.username_entry.get().strip()
-        key = self.key_entry.get().strip()
-        
-        if not all([server, port, channel, username, key]):
-            messagebox.showerror("Error", "Please fill in all fields before saving")
-            return
-            
-        # Ask for room name
-        room_name = simpledialog.askstring("Save Room", "Enter a name for this room:")
-        if not room_name:
-            return
-            
-        # Check if room name already exists
-        if room_name in self.saved_rooms:
-            if not messagebox.askyesno("Overwrite", f"Room '{room_name}' already exists. Overwrite?"):
-                return
-                
-        # Save room config
-        self.saved_rooms[room_name] = {
-            "server": server,
-            "port": port,
-            "channel": channel,
-            "username": username,
-            "encryption_key": key,
-            "mqtt_username": self.mqtt_username_entry.get().strip(),
-            "mqtt_password": self.mqtt_password_entry.get().strip(),
-            "saved_date": datetime.now().isoformat()
-        }
-        
-        self.save_rooms_to_file()
-        self.refresh_rooms_display()
-        messagebox.showinfo("Saved", f"Room '{room_name}' saved successfully!")
-        
-    def load_room_config(self, event=None):
-        """Load selected room configuration"""
-        selected_room = self.rooms_var.get()
-        if not selected_room or selected_room not in self.saved_rooms:
-            return
-            
-        config = self.saved_rooms[selected_room]
-        
-        # Load into connection fields
-        self.server_entry.delete(0, tk.END)
-        self.server_entry.insert(0, config["server"])
-        
-        self.port_entry.delete(0, tk.END)
-        self.port_entry.insert(0, config["port"])
-        
-        self.channel_entry.delete(0, tk.END)
-        self.channel_entry.insert(0, config["channel"])
-        
-        self.username_entry.delete(0, tk.END)
-        self.username_entry.insert(0, config["username"])
-        
-        self.key_entry.delete(0, tk.END)
-        self.key_entry.insert(0, config["encryption_key"])
-        
-        # Load MQTT authentication if present
-        self.mqtt_username_entry.delete(0, tk.END)
-        self.mqtt_username_entry.insert(0, config.get("mqtt_username", ""))
-        
-        self.mqtt_password_entry.delete(0, tk.END)
-        self.mqtt_password_entry.insert(0, config.get("mqtt_password", ""))
-        
-        self.update_key_display()
-        messagebox.showinfo("Loaded", f"Room '{selected_room}' configuration loaded!")
-        
-    def quick_connect_room(self):
-        """Quick connect to selected room from rooms tab"""
-        selection = self.rooms_listbox.curselection()
-        if not selection:
-            messagebox.showwarning("No Selection", "Please select a room first")
-            return
-            
-        room_name = self.rooms_listbox.get(selection[0])
-        
-        # Load the room config
-        self.rooms_var.set(room_name)
-        self.load_room_config()
-        
-        # Switch to connection tab and connect
-        notebook = self.root.children['!notebook']
-        notebook.select(0)  # Switch to connection tab
-        
-        # Connect after a brief delay to allow tab switch
-        self.root.after(100, self.connect_mqtt)
-        
-    def on_room_select(self, event):
-        """Handle room selection in rooms list"""
-        selection = self.rooms_listbox.curselection()
-        if not selection:
-            return
-            
-        room_name = self.rooms_listbox.get(selection[0])
-        if room_name in self.saved_rooms:
-            self.show_room_details(room_name, self.saved_rooms[room_name])
-            
-    def show_room_details(self, room_name, config):
-        """Show room details in the details panel"""
-        details = f"Room Name: {room_name}\n\n"
-        details += f"Server: {config['server']}\n"
-        details += f"Port: {config['port']}\n"
-        details += f"Channel: {config['channel']}\n"
-        details += f"Chat Username: {config['username']}\n"
-        
-        # Show MQTT auth status
-        mqtt_user = config.get('mqtt_username', '')
-        if mqtt_user:
-            details += f"MQTT Username: {mqtt_user}\n"
-            details += f"MQTT Password: {'*' * len(config.get('mqtt_password', ''))}\n"
-        else:
-            details += f"MQTT Auth: Anonymous\n"
-            
-        details += f"Encryption Key: {'*' * len(config['encryption_key'])}\n\n"
-        details += f"Saved: {config.get('saved_date', 'Unknown')}\n"
-        
-        self.room_details.config(state=tk.NORMAL)
-        self.room_details.delete(1.0, tk.END)
-        self.room_details.insert(tk.END, details)
-        self.room_details.config(state=tk.DISABLED)
-        
-    def edit_room(self):
-        """Edit selected room"""
-        selection = self.rooms_listbox.curselection()
-        if not selection:
-            messagebox.showwarning("No Selection", "Please select a room to edit")
-            return
-            
-        room_name = self.rooms_listbox.get(selection[0])
-        config = self.saved_rooms[room_name]
-        
-        # Create edit dialog
-        edit_window = tk.Toplevel(self.root)
-        edit_window.title(f"Edit Room: {room_name}")
-        edit_window.geometry("400x300")
-        edit_window.transient(self.root)
-        edit_window.grab_set()
-        
-        # Edit form
-        tk.Label(edit_window, text="Server:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
-        server_entry = tk.Entry(edit_window, width=30)
-        server_entry.grid(row=0, column=1, padx=5, pady=5)
-        server_entry.insert(0, config["server"])
-        
-        tk.Label(edit_window, text="Port:").grid(row=1, column=0, sticky="e", padx=5, pady=5)
-        port_entry = tk.Entry(edit_window, width=30)
-        port_entry.grid(row=1, column=1, padx=5, pady=5)
-        port_entry.insert(0, config["port"])
-        
-        tk.Label(edit_window, text="Channel:").grid(row=2, column=0, sticky="e", padx=5, pady=5)
-        channel_entry = tk.Entry(edit_window, width=30)
-        channel_entry.grid(row=2, column=1, padx=5, pady=5)
-        channel_entry.insert(0, config["channel"])
-        
-        tk.Label(edit_window, text="Chat Username:").grid(row=3, column=0, sticky="e", padx=5, pady=5)
-        username_entry = tk.Entry(edit_window, width=30)
-        username_entry.grid(row=3, column=1, padx=5, pady=5)
-        username_entry.insert(0, config["username"])
-        
-        tk.Label(edit_window, text="MQTT Username:").grid(row=4, column=0, sticky="e", padx=5, pady=5)
-        mqtt_user_entry = tk.Entry(edit_window, width=30)
-        mqtt_user_entry.grid(row=4, column=1, padx=5, pady=5)
-        mqtt_user_entry.insert(0, config.get("mqtt_username", ""))
-        
-        tk.Label(edit_window, text="MQTT Password:").grid(row=5, column=0, sticky="e", padx=5, pady=5)
-        mqtt_pass_entry = tk.Entry(edit_window, width=30, show="*")
-        mqtt_pass_entry.grid(row=5, column=1, padx=5, pady=5)
-        mqtt_pass_entry.insert(0, config.get("mqtt_password", ""))
-        
-        tk.Label(edit_window, text="Encryption Key:").grid(row=6, column=0, sticky="e", padx=5, pady=5)
-        key_entry = tk.Entry(edit_window, width=30)
-        key_entry.grid(row=6, column=1, padx=5, pady=5)
-        key_entry.insert(0, config["encryption_key"])
-        
-        def save_changes():
-            new_config = {
-                "server": server_entry.get().strip(),
-                "port": port_entry.get().strip(),
-                "channel": channel_entry.get().strip(),
-                "username": username_entry.get().strip(),
-                "encryption_key": key_entry.get().strip(),
-                "mqtt_username": mqtt_user_entry.get().strip(),
-                "mqtt_password": mqtt_pass_entry.get().strip(),
-                "saved_date": config.get("saved_date", datetime.now().isoformat())
-            }
-            
-            if not all([new_config["server"], new_config["port"], new_config["channel"], 
-                       new_config["username"], new_config["encryption_key"]]):
-                messagebox.showerror("Error", "Please fill in all fields")
-                return
-                
-            self.saved_rooms[room_name] = new_config
-            self.save_rooms_to_file()
-            self.refresh_rooms_display()
-            edit_window.destroy()
-            messagebox.showinfo("Updated", f"Room '{room_name}' updated successfully!")
-        
-        # Buttons
-        button_frame = tk.Frame(edit_window)
-        button_frame.grid(row=7, column=0, columnspan=2, pady=20)
-        
-        tk.Button(button_frame, text="Save Changes", command=save_changes,
-                 bg="#4CAF50", fg="white").pack(side=tk.LEFT, padx=5)
-        tk.Button(button_frame, text="Cancel", command=edit_window.destroy,
-                 bg="#F44336", fg="white").pack(side=tk.LEFT, padx=5)
-        
-    def delete_room(self):
-        """Delete selected room"""
-        selection = self.rooms_listbox.curselection()
-        if not selection:
-            messagebox.showwarning("No Selection", "Please select a room to delete")
-            return
-            
-        room_name = self.rooms_listbox.get(selection[0])
-        
-        if messagebox.askyesno("Delete Room", f"Are you sure you want to delete room '{room_name}'?"):
-            del self.saved_rooms[room_name]
-            self.save_rooms_to_file()
-            self.refresh_rooms_display()
-            messagebox.showinfo("Deleted", f"Room '{room_name}' deleted successfully!")
-            
-    def export_rooms(self):
-        """Export all rooms to a file"""
-        if not self.saved_rooms:
-            messagebox.showwarning("No Rooms", "No rooms to export")
-            return
-            
-        from tkinter import filedialog
-        filename = filedialog.asksaveasfilename(
-            defaultextension=".json",
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
-            title="Export Rooms"
-        )
-        
-        if filename:
-            try:
-                with open(filename, 'w') as f:
-                    json.dump(self.saved_rooms, f, indent=2)
-                messagebox.showinfo("Exported", f"Rooms exported to {filename}")
-            except Exception as e:
-                messagebox.showerror("Export Error", f"Failed to export: {str(e)}")
-                
-    def import_rooms(self):
-        """Import rooms from a file"""
-        from tkinter import filedialog
-        filename = filedialog.askopenfilename(
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
-            title="Import Rooms"
-        )
-        
-        if filename:
-            try:
-                with open(filename, 'r') as f:
-                    imported_rooms = json.load(f)
-                
-                # Merge with existing rooms
-                conflicts = []
-                for room_name in imported_rooms:
-                    if room_name in self.saved_rooms:
-                        conflicts.append(room_name)
-                
-                if conflicts:
-                    message = f"The following rooms already exist:\n{', '.join(conflicts)}\n\nOverwrite them?"
-                    if not messagebox.askyesno("Import Conflicts", message):
-                        return
-                
-                self.saved_rooms.update(imported_rooms)
-                self.save_rooms_to_file()
-                self.refresh_rooms_display()
-                messagebox.showinfo("Imported", f"Successfully imported {len(imported_rooms)} room(s)")
-                
-            except Exception as e:
-                messagebox.showerror("Import Error", f"Failed to import: {str(e)}")
-                
-    def save_rooms_to_file(self):
-        """Save rooms to encrypted file"""
-        try:
-            cipher = self.get_config_cipher()
-            data = json.dumps(self.saved_rooms).encode()
-            encrypted_data = cipher.encrypt(data)
-            
-            with open(self.config_file, 'wb') as f:
-                f.write(encrypted_data)
-                
-        except Exception as e:
-            messagebox.showerror("Save Error", f"Failed to save rooms: {str(e)}")
-            
-    def load_saved_rooms(self):
-        """Load rooms from encrypted file"""
-        if not os.path.exists(self.config_file):
-            return
-            
-        try:
-            cipher = self.get_config_cipher()
-            
-            with open(self.config_file, 'rb') as f:
-                encrypted_data = f.read()
-                
-            decrypted_data = cipher.decrypt(encrypted_data)
-            self.saved_rooms = json.loads(decrypted_data.decode())
-            self.refresh_rooms_display()
-            
-        except Exception as e:
-            print(f"Failed to load saved rooms: {e}")
-            # If loading fails, start with empty rooms
-            self.saved_rooms = {}
-            
-    def refresh_rooms_display(self):
-        """Refresh the rooms display in both dropdown and listbox"""
-        # Update dropdown
-        room_names = list(self.saved_rooms.keys())
-        self.rooms_dropdown['values'] = room_names
-        
-        # Update listbox
-        self.rooms_listbox.delete(0, tk.END)
-        for room_name in sorted(room_names):
-            self.rooms_listbox.insert(tk.END, room_name)
-            
-        # Clear details if no rooms
-        if not room_names:
-            self.room_details.config(state=tk.NORMAL)
-            self.room_details.delete(1.0, tk.END)
-            self.room_details.insert(tk.END, "No saved rooms")
-            self.room_details.config(state=tk.DISABLED)
-        
-    def generate_key(self):
-        """Generate a new encryption key"""
-        key = Fernet.generate_key()
-        self.key_entry.delete(0, tk.END)
-        self.key_entry.insert(0, key.decode())
-        self.update_key_display()
-        
-    def copy_key(self):
-        """Copy the encryption key to clipboard"""
-        key = self.key_entry.get()
-        self.root.clipboard_clear()
-        self.root.clipboard_append(key)
-        self.root.update()  # Required on some systems
-        messagebox.showinfo("Copied", "Encryption key copied to clipboard!")
-        
-    def toggle_mqtt_password_visibility(self):
-        """Toggle showing/hiding the MQTT password"""
-        if self.show_mqtt_password_var.get():
-            self.mqtt_password_entry.config(show="")
-        else:
-            self.mqtt_password_entry.config(show="*")
-            
-    def toggle_key_visibility(self):
-        """Toggle showing/hiding the key in the entry field"""
-        if self.show_key_var.get():
-            self.key_entry.config(show="")
-        else:
-            self.key_entry.config(show="*")
-            
-    def update_key_display(self):
-        """Update the key display area"""
-        key = self.key_entry.get()
-        self.key_display.config(state=tk.NORMAL)
-        self.key_display.delete(1.0, tk.END)
-        self.key_display.insert(tk.END, key)
-        self.key_display.config(state=tk.DISABLED)
-        
-        # Bind key entry changes to update display
-        self.key_entry.bind('<KeyRelease>', lambda e: self.update_key_display())
-        
-    def derive_key(self, password):
-        """Derive a Fernet key from a password"""
-        # Use SHA256 to create a 32-byte key, then base64 encode for Fernet
-        hash_obj = hashlib.sha256(password.encode())
-        key = base64.urlsafe_b64encode(hash_obj.digest())
-        return key
-        
-    def connect_mqtt(self):
-        """Connect to MQTT broker"""
-        try:
-            # Get connection details
-            server = self.server_entry.get().strip()
-            port = int(self.port_entry.get().strip())
-            self.channel = self.channel_entry.get().strip()
-            self.username = self.username_entry.get().strip()
-            encryption_key = self.key_entry.get().strip()
-            
-            # Get MQTT authentication (optional)
-            mqtt_username = self.mqtt_username_entry.get().strip()
-            mqtt_password = self.mqtt_password_entry.get().strip()
-            
-            if not all([server, self.channel, self.username, encryption_key]):
-                messagebox.showerror("Error", "Please fill in all required fields")
-                return
-                
-            # Setup encryption
-            key = self.derive_key(encryption_key)
-            self.cipher = Fernet(key)
-            
-            # Setup topics
-            self.messages_topic = f"chat/{self.channel}/messages"
-            self.presence_topic = f"chat/{self.channel}/presence"
-            self.userlist_topic = f"chat/{self.channel}/users"
-            
-            # Setup MQTT client (fix deprecation warning)
-            self.mqtt_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
-            self.mqtt_client.on_connect = self.on_mqtt_connect
-            self.mqtt_client.on_message = self.on_mqtt_message
-            self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
-            
-            # Set MQTT authentication if provided
-            if mqtt_username:
-                self.mqtt_client.username_pw_set(mqtt_username, mqtt_password)
-                self.add_system_message(f"Using MQTT authentication for user: {mqtt_username}")
-            else:
-                self.add_system_message("Connecting with anonymous MQTT access")
-            
-            # Set last will (sent when we disconnect unexpectedly)
-            will_msg = json.dumps({"user": self.username, "status": "offline", "timestamp": time.time()})
-            self.mqtt_client.will_set(f"{self.presence_topic}/{self.username}", will_msg, retain=True)
-            
-            # Connect
-            self.status_label.config(text="Connecting...", fg="orange")
-            self.mqtt_client.connect(server, port, 60)
-            self.mqtt_client.loop_start()
-            
-        except Exception as e:
-            messagebox.showerror("Connection Error", f"Failed to connect: {str(e)}")
-            self.status_label.config(text="Connection failed", fg="red")
-            
-    def on_mqtt_connect(self, client, userdata, flags, rc):
-        """Called when MQTT connects - ENHANCED VERSION"""
-        if rc == 0:
-            self.connected = True
-            self.status_label.config(text="Connected", fg="green")
-            
-            # ENHANCED CLEANUP
-            self.clear_my_presence()
-            time.sleep(0.2)  # Give time for clearing
-            
-            # Clear our local user list
-            self.online_users.clear()
-            self.recent_joins.clear()  # Clear join tracking
-            self.update_users_list()
-            
-            # Subscribe to topics
-            client.subscribe(self.messages_topic)
-            client.subscribe(f"{self.presence_topic}/+")
-            
-            # Announce our presence
-            self.announce_presence("online")
-            
-            # Start heartbeat
-            self.start_heartbeat()
-            
-            # Update chat header with room name
-            self.chat_header.config(text=f"Chat Messages - #{self.channel}")
-            
-            # Add welcome message
-            self.add_system_message("Connected to chat!")
-            
-        else:
-            self.status_label.config(text=f"Connection failed (code {rc})", fg="red")
-            
-    def on_mqtt_message(self, client, userdata, msg):
-        """Called when MQTT message received"""
-        try:
-            topic = msg.topic
-            payload = msg.payload.decode()
-            
-            if topic == self.messages_topic:
-                self.handle_chat_message(payload)
-            elif topic.startswith(self.presence_topic):
-                self.handle_presence_message(topic, payload)
-                
-        except Exception as e:
-            print(f"Error handling message: {e}")
-            
-    def on_mqtt_disconnect(self, client, userdata, rc):
-        """Called when MQTT disconnects"""
-        self.connected = False
-        self.status_label.config(text="Disconnected", fg="red")
-        if self.heartbeat_timer:
-            self.heartbeat_timer.cancel()
-            
-    def handle_chat_message(self, encrypted_payload):
-        """Handle incoming chat message"""
-        try:
-            # Decrypt message
-            encrypted_data = base64.b64decode(encrypted_payload.encode())
-            decrypted_data = self.cipher.decrypt(encrypted_data)
-            message_data = json.loads(decrypted_data.decode())
-            
-            username = message_data.get("user", "Unknown")
-            message = message_data.get("message", "")
-            timestamp = message_data.get("timestamp", time.time())
-            
-            # Don't show our own messages (we already displayed them)
-            if username != self.username:
-                self.add_chat_message(username, message, timestamp)
-                
-        except Exception as e:
-            print(f"Error decrypting message: {e}")
-            
-    def handle_presence_message(self, topic, payload):
-        """Handle user presence updates - ANTI-SPAM DUPLICATE PREVENTION"""
-        try:
-            # Extract username from topic path
-            user_from_topic = topic.split('/')[-1]
-            
-            # Handle empty payload (user leaving/clearing presence)
-            if not payload.strip():
-                # Remove user from list if present
-                if user_from_topic in self.online_users:
-                    self.online_users.remove(user_from_topic)
-                    if user_from_topic != self.username:
-                        self.add_system_message(f"{user_from_topic} left the chat")
-                    # Clear from recent joins when they leave
-                    if user_from_topic in self.recent_joins:
-                        del self.recent_joins[user_from_topic]
-                self.update_users_list()
-                return
-            
-            # Parse the JSON payload
-            data = json.loads(payload)
-            user = data.get("user", "")
-            status = data.get("status", "")
-            
-            # Validate that topic user matches payload user
-            if user != user_from_topic:
-                print(f"Warning: User mismatch - topic: {user_from_topic}, payload: {user}")
-                return
-            
-            # ANTI-SPAM DUPLICATE PREVENTION
-            if status == "online":
-                # Check if user is already in the list
-                was_already_online = user in self.online_users
-                
-                # Add user to list (set automatically prevents duplicates)
-                self.online_users.add(user)
-                
-                # Anti-spam: Only announce if it's a NEW join AND we haven't announced recently
-                current_time = time.time()
-                last_join_time = self.recent_joins.get(user, 0)
-                
-                # Only announce if: 1) Not already online, 2) Not ourselves, 3) Haven't announced in last 60 seconds
-                if (not was_already_online and 
-                    user != self.username and 
-                    current_time - last_join_time > 60):
-                    
-                    self.add_system_message(f"{user} joined the chat")
-                    self.recent_joins[user] = current_time
-                    
-            elif status == "offline":
-                # Remove user if present
-                if user in self.online_users:
-                    self.online_users.remove(user)
-                    if user != self.username:
-                        self.add_system_message(f"{user} left the chat")
-                    # Clear from recent joins when they leave
-                    if user in self.recent_joins:
-                        del self.recent_joins[user]
-            
-            # Update the display
-            self.update_users_list()
-            
-        except json.JSONDecodeError:
-            print(f"Invalid JSON in presence message: {payload}")
-        except Exception as e:
-            print(f"Error handling presence: {e}")
-            
-    def send_message(self, event=None):
-        """Send a chat message"""
-        if not self.connected:
-            return
-            
-        message_text = self.message_entry.get().strip()
-        if not message_text:
-            return
-            
-        try:
-            # Create message data
-            message_data = {
-                "user": self.username,
-                "message": message_text,
-                "timestamp": time.time()
-            }
-            
-            # Encrypt message
-            json_data = json.dumps(message_data)
-            encrypted_data = self.cipher.encrypt(json_data.encode())
-            encrypted_payload = base64.b64encode(encrypted_data).decode()
-            
-            # Publish to MQTT
-            self.mqtt_client.publish(self.messages_topic, encrypted_payload)
-            
-            # Add to our own chat display
-            self.add_chat_message(self.username, message_text, message_data["timestamp"])
-            
-            # Clear input
-            self.message_entry.delete(0, tk.END)
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to send message: {str(e)}")
-            
-    def announce_presence(self, status):
-        """Announce our online/offline status"""
-        if self.mqtt_client and self.connected:
-            presence_data = {
-                "user": self.username,
-                "status": status,
-                "timestamp": time.time()
-            }
-            self.mqtt_client.publish(f"{self.presence_topic}/{self.username}", 
-                                   json.dumps(presence_data), retain=True)
-            
-    def start_heartbeat(self):
-        """Start sending periodic heartbeat to show we're online"""
-        if self.connected:
-            self.announce_presence("online")
-            # Schedule next heartbeat in 30 seconds
-            self.heartbeat_timer = threading.Timer(30.0, self.start_heartbeat)
-            self.heartbeat_timer.start()
-            
-    def disconnect_mqtt(self):
-        """Disconnect from MQTT"""
-        def _disconnect_worker():
-            """Worker function to handle disconnect in background"""
-            try:
-                if self.connected and self.mqtt_client:
-                    # Announce offline status
-                    self.announce_presence("offline")
-                    time.sleep(0.5)  # Give time for message to send
-                    self.clear_my_presence()  # Clear our retained presence
-                    
-                    # Stop the MQTT loop and disconnect
-                    self.mqtt_client.loop_stop()
-                    self.mqtt_client.disconnect()
-                    
-                # Cancel heartbeat timer
-                if self.heartbeat_timer:
-                    self.heartbeat_timer.cancel()
-                    self.heartbeat_timer = None
-                    
-            except Exception as e:
-                print(f"Error during disconnect: {e}")
-            finally:
-                # Update GUI in main thread
-                self.root.after(0, self._finish_disconnect)
-        
-        # Update status immediately
-        self.status_label.config(text="Disconnecting...", fg="orange")
-        self.connected = False
-        
-        # Run disconnect in background thread to avoid GUI freeze
-        disconnect_thread = threading.Thread(target=_disconnect_worker, daemon=True)
-        disconnect_thread.start()
-        
-    def _finish_disconnect(self):
-        """Finish disconnect process in main GUI thread"""
-        self.connected = False
-        self.online_users.clear()
-        self.recent_joins.clear()  # Clear join tracking
-        self.update_users_list()
-        self.add_system_message("Disconnected from chat")
-        self.status_label.config(text="Disconnected", fg="red")
-        
-        # Reset chat header
-        self.chat_header.config(text="Chat Messages")
-        
-    def add_chat_message(self, username, message, timestamp):
-        """Add a chat message to the display"""
-        time_str = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
-        
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"[{time_str}] {username}: {message}\n")
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
-        
-    def add_system_message(self, message):
-        """Add a system message to the display"""
-        time_str = datetime.now().strftime("%H:%M:%S")
-        
-        self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.insert(tk.END, f"[{time_str}] *** {message} ***\n")
-        self.chat_display.config(state=tk.DISABLED)
-        self.chat_display.see(tk.END)
-        
-    def update_users_list(self):
-        """Update the online users list"""
-        self.users_listbox.delete(0, tk.END)
-        for user in sorted(self.online_users):
-            self.users_listbox.insert(tk.END, user)
-            
-    def on_closing(self):
-        """Handle window closing"""
-        def _cleanup_and_exit():
-            """Cleanup function that runs in background"""
-            try:
-                if self.connected and self.mqtt_client:
-                    self.announce_presence("offline")
-                    time.sleep(0.5)  # Give time for message to send
-                    self.clear_my_presence()  # Clear our retained presence
-                    self.mqtt_client.loop_stop()
-                    self.mqtt_client.disconnect()
-                if self.heartbeat_timer:
-                    self.heartbeat_timer.cancel()
-            except:
-                pass  # Ignore errors during cleanup
-            finally:
-                # Destroy window in main thread
-                self.root.after(0, self.root.destroy)
-        
-        # Set connected to False immediately
-        self.connected = False
-        
-        # Run cleanup in background thread
-        cleanup_thread = threading.Thread(target=_cleanup_and_exit, daemon=True)
-        cleanup_thread.start()
-        
-        # Give a short timeout for cleanup, then force close
-        self.root.after(1000, self.root.destroy)
-        
-    def run(self):
-        """Start the application"""
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.root.mainloop()
-
-if __name__ == "__main__":
-    # Check for required packages
-    try:
-        import paho.mqtt.client as mqtt
-        from cryptography.fernet import Fernet
-    except ImportError as e:
-        print(f"Missing required package: {e}")
-        print("\nPlease install required packages:")
-        print("pip install paho-mqtt cryptography")
-        input("Press Enter to exit...")
-        exit(1)
-        
-    app = SecureMQTTChat()
+#!/usr/bin/env python3
+"""
+MQChat by James Powell
+A simple encrypted group chat using MQTT as the relay server
+FINAL VERSION - Anti-spam join detection
+"""
+
+import tkinter as tk
+from tkinter import ttk, messagebox, scrolledtext, simpledialog
+import importlib.util
+import json
+import threading
+import time
+import os
+from datetime import datetime
+from cryptography.fernet import Fernet
+
+from mqchat_core import (ChatEngine, BrokerSession, LoopDriver, derive_key, ROOM_OPTION_DEFAULTS, NEW_ROOM_OPTIONS,
+                         EVENT_CONNECTED, EVENT_CONNECTION_FAILED, EVENT_DISCONNECTED,
+                         EVENT_RECONNECTING, EVENT_RECONNECTED,
+                         EVENT_CHAT_MESSAGE, EVENT_SYSTEM_MESSAGE, EVENT_USERS_CHANGED,
+                         EVENT_KEY_ROTATED, EVENT_KEY_DERIVED, EVENT_FILE_OFFERED, EVENT_FILE_PROGRESS,
+                         EVENT_FILE_DONE, EVENT_UNREAD_CHANGED)
+from mqchat_core.session import load_install_id, session_client_id
+from mqchat_core.mqtt5 import known_protocols
+from mqchat_core.dispatch import EventQueue, FrameTimer, coalesce
+from mqchat_core.roomstore import RoomStore
+from mqchat_core.history import MessageHistory
+from mqchat_core.chatlog import ChatLog
+from mqchat_core.roster import SortedRoster
+
+# Inbound events are applied to Tk once per frame
+FRAME_INTERVAL_MS = 33   # ~30 frames per second
+FRAME_BUDGET_MS = 12     # Max time spent applying events per frame
+DRAIN_CHUNK = 500        # Events taken from the queue per budget check
+
+# Service the MQTT socket and timed jobs from the Tk loop (file handlers where
+# Tk has them) instead of network and scheduler threads; see mqchat_core.eventloop
+NETWORK_ON_MAIN_LOOP = False
+
+HISTORY_ON_CONNECT = 50  # Stored messages shown when joining a room
+SEARCH_LIMIT = 200       # Results shown per history search
+
+# Advanced room option choices (label -> stored value)
+WIRE_FORMAT_CHOICES = {
+    "v1 (compatible)": 1,
+    "v2 (binary, smaller)": 2,
+}
+CIPHER_SUITE_CHOICES = {
+    "Fernet (AES-CBC + HMAC)": "fernet",
+    "AES-256-GCM": "aes-gcm",
+    "ChaCha20-Poly1305": "chacha20-poly1305",
+}
+COMPRESSION_CHOICES = {
+    "Off": "none",
+    "zlib": "zlib",
+    "zstd (needs zstandard)": "zstd",
+}
+BATCH_WINDOW_CHOICES = {
+    "Off": 0,
+    "5 ms": 5,
+    "10 ms": 10,
+    "20 ms": 20,
+}
+PRESENCE_CHOICES = {
+    "Lean (on change only)": "lean",
+    "Heartbeat (every 30 s)": "heartbeat",
+}
+MQTT_PROTOCOL_CHOICES = {
+    "Auto (v5, else 3.1.1)": "auto",
+    "MQTT 5": "5",
+    "MQTT 3.1.1": "3.1.1",
+}
+KDF_CHOICES = {
+    "scrypt (memory-hard)": "scrypt",
+    "SHA-256 (legacy)": "sha256",
+}
+
+class SecureMQTTChat:
+    def __init__(self):
+        self.root = tk.Tk()
+        self.root.title("MQChat by James Powell")
+        self.root.geometry("900x800")
+        
+        # One broker session carries every open room; each room has its own chat
+        # engine (cipher, roster and timers) and self.engine is the one on screen.
+        # Engine events arrive on paho's network thread, so they are queued here
+        # and applied to the widgets from the Tk main loop by _drain_events.
+        self.inbox = EventQueue()
+        self.loop_driver = LoopDriver() if NETWORK_ON_MAIN_LOOP else None
+        self.file_handlers = {}  # Socket fd -> session watched by a Tk file handler
+        self.install_id = load_install_id("mqtt_chat_install_id")  # Makes our MQTT client ids unique
+        known_protocols.open("mqtt_chat_protocols.json")  # The protocol each broker settled on under "auto"
+        self.session = None
+        self.engine = ChatEngine(driver=self.loop_driver)
+        self.watch_room(self.engine)
+        self.roster_view = SortedRoster()  # Mirror of the users listbox rows
+        self.transfer_progress = {}  # transfer id -> progress line
+        self.last_stats_update = 0
+        
+        # Room management (one encrypted record per room, see mqchat_core.roomstore)
+        self.config_file = "mqtt_chat_rooms.json"  # Old single-file format, migrated on start
+        self.rooms_dir = "mqtt_chat_rooms"
+        self.config_cipher = None
+        self.saved_rooms = {}
+        
+        # Local message history (encrypted SQLite, see mqchat_core.history)
+        self.history_file = "mqtt_chat_history.db"
+        self.history = None
+        
+        # Messages of the current room; only a window of them is rendered (see mqchat_core.chatlog)
+        self.chat_log = ChatLog(self.format_line)
+        self.chat_scroll_pending = False
+        self.history_page_pending = False  # A page of stored messages is being fetched
+        
+        self.setup_gui()
+        self.load_saved_rooms()
+        self.open_history()
+        
+    def watch_room(self, engine):
+        """Queue a room's events for the widgets (rooms off screen only record history and unread counts)"""
+        def shown(callback):
+            return lambda *args: callback(*args) if engine is self.engine else None
+        
+        engine.on(EVENT_CONNECTED, shown(lambda: self.inbox.put("call", self.on_engine_connected)))
+        engine.on(EVENT_CONNECTION_FAILED,
+                  shown(lambda rc: self.inbox.put("call", self.on_engine_connection_failed, rc)))
+        engine.on(EVENT_DISCONNECTED,
+                  shown(lambda rc: self.inbox.put("call", self.on_engine_disconnected, rc)))
+        engine.on(EVENT_RECONNECTING,
+                  shown(lambda attempt, delay: self.inbox.put("call", self.on_engine_reconnecting, attempt, delay)))
+        engine.on(EVENT_RECONNECTED,
+                  shown(lambda session_present: self.inbox.put("call", self.on_engine_reconnected)))
+        engine.on(EVENT_CHAT_MESSAGE, shown(lambda *args: self.inbox.put("chat", *args)))
+        engine.on(EVENT_CHAT_MESSAGE, lambda *args: self.record_history(engine.channel, *args))
+        engine.on(EVENT_SYSTEM_MESSAGE,
+                  shown(lambda message: self.inbox.put("system", message, time.time())))
+        engine.on(EVENT_USERS_CHANGED, shown(lambda changes: self.inbox.put("users", changes)))
+        engine.on(EVENT_KEY_ROTATED,
+                  lambda *args: self.inbox.put("call", self.on_engine_key_rotated, engine.channel, *args))
+        engine.on(EVENT_KEY_DERIVED,
+                  lambda *args: self.inbox.put("call", self.on_engine_key_derived, engine.channel, *args))
+        engine.on(EVENT_FILE_OFFERED,
+                  lambda *args: self.inbox.put("call", self.on_engine_file_offered, engine, *args))
+        engine.on(EVENT_FILE_PROGRESS,
+                  shown(lambda *args: self.inbox.put("call", self.on_engine_file_progress, *args)))
+        engine.on(EVENT_FILE_DONE,
+                  shown(lambda *args: self.inbox.put("call", self.on_engine_file_done, *args)))
+        
+    def force_clean_users(self):
+        """Force clean the users list by removing duplicates"""
+        self.engine.clean_users()
+
+    def show_scheduled_jobs(self):
+        """Show what the engine's scheduler is waiting to run (for debugging)"""
+        scheduler = self.engine.scheduler
+        lines = [f"{name}: in {due_in:.1f} s" + (f", every {interval:g} s" if interval else "")
+                 + f" ({runs} runs)" for name, due_in, interval, runs in scheduler.jobs()]
+        lines.append(f"\n{scheduler.stats['runs']} runs, {scheduler.stats['errors']} errors, "
+                     f"at most {scheduler.stats['max_late_ms']:.0f} ms late")
+        messagebox.showinfo("Scheduled Jobs", "\n".join(lines))
+
+    def nuclear_clean_users(self):
+        """Nuclear option - completely rebuild user list"""
+        print("Nuclear clean - rebuilding user list")
+        self.engine.rebuild_users()
+        
+    def clear_connection_fields(self):
+        """Clear all connection fields"""
+        self.server_entry.delete(0, tk.END)
+        self.server_entry.insert(0, "localhost")
+        
+        self.port_entry.delete(0, tk.END)
+        self.port_entry.insert(0, "1883")
+        
+        self.channel_entry.delete(0, tk.END)
+        self.channel_entry.insert(0, "general")
+        
+        self.username_entry.delete(0, tk.END)
+        
+        self.mqtt_username_entry.delete(0, tk.END)
+        self.mqtt_password_entry.delete(0, tk.END)
+        
+        self.key_entry.delete(0, tk.END)
+        self.key_entry.insert(0, "supersecretkey123")
+        
+        # Clear dropdown selection
+        self.rooms_var.set("")
+        
+        self.set_room_options(NEW_ROOM_OPTIONS)
+        self.update_key_display()
+        messagebox.showinfo("Cleared", "All fields cleared to defaults!")
+        
+    def setup_gui(self):
+        """Create the GUI layout"""
+        # Create notebook for tabs
+        notebook = ttk.Notebook(self.root)
+        notebook.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # Connection tab
+        self.connection_frame = ttk.Frame(notebook)
+        notebook.add(self.connection_frame, text="Connection")
+        self.setup_connection_tab()
+        
+        # Chat tab
+        self.chat_frame = ttk.Frame(notebook)
+        notebook.add(self.chat_frame, text="Chat")
+        self.setup_chat_tab()
+        
+        # Room Management tab
+        self.rooms_frame = ttk.Frame(notebook)
+        notebook.add(self.rooms_frame, text="Saved Rooms")
+        self.setup_rooms_tab()
+        
+    def setup_connection_tab(self):
+        """Setup the connection configuration tab"""
+        # Title
+        title_label = tk.Label(self.connection_frame, text="MQTT Chat Configuration", 
+                              font=("Arial", 16, "bold"))
+        title_label.pack(pady=20)
+        
+        # Quick Load Frame
+        quick_frame = tk.LabelFrame(self.connection_frame, text="Quick Connect", 
+                                   font=("Arial", 10, "bold"))
+        quick_frame.pack(pady=10, padx=20, fill=tk.X)
+        
+        # Saved rooms dropdown
+        rooms_frame = tk.Frame(quick_frame)
+        rooms_frame.pack(pady=10)
+        
+        tk.Label(rooms_frame, text="Saved Rooms:").pack(side=tk.LEFT, padx=5)
+        self.rooms_var = tk.StringVar()
+        self.rooms_dropdown = ttk.Combobox(rooms_frame, textvariable=self.rooms_var, 
+                                          state="readonly", width=25)
+        self.rooms_dropdown.pack(side=tk.LEFT, padx=5)
+        self.rooms_dropdown.bind('<<ComboboxSelected>>', self.load_room_config)
+        
+        load_btn = tk.Button(rooms_frame, text="Load Room", command=self.load_room_config,
+                           bg="#4CAF50", fg="white")
+        load_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Configuration frame
+        config_frame = tk.LabelFrame(self.connection_frame, text="Manual Configuration", 
+                                    font=("Arial", 10, "bold"))
+        config_frame.pack(pady=10, padx=20, fill=tk.X)
+        
+        # Create inner frame for grid layout
+        inner_config = tk.Frame(config_frame)
+        inner_config.pack(pady=10)
+        
+        # MQTT Server
+        tk.Label(inner_config, text="MQTT Server:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
+        self.server_entry = tk.Entry(inner_config, width=30)
+        self.server_entry.grid(row=0, column=1, padx=5, pady=5)
+        self.server_entry.insert(0, "localhost")
+        
+        # Port
+        tk.Label(inner_config, text="Port:").grid(row=1, column=0, sticky="e", padx=5, pady=5)
+        self.port_entry = tk.Entry(inner_config, width=30)
+        self.port_entry.grid(row=1, column=1, padx=5, pady=5)
+        self.port_entry.insert(0, "1883")
+        
+        # Channel/Room
+        tk.Label(inner_config, text="Channel:").grid(row=2, column=0, sticky="e", padx=5, pady=5)
+        self.channel_entry = tk.Entry(inner_config, width=30)
+        self.channel_entry.grid(row=2, column=1, padx=5, pady=5)
+        self.channel_entry.insert(0, "general")
+        
+        # MQTT Authentication frame
+        auth_frame = tk.LabelFrame(inner_config, text="MQTT Authentication (Optional)", 
+                                  font=("Arial", 9, "italic"))
+        auth_frame.grid(row=3, column=0, columnspan=3, sticky="ew", padx=5, pady=10)
+        
+        # MQTT Username
+        tk.Label(auth_frame, text="MQTT Username:").grid(row=0, column=0, sticky="e", padx=5, pady=3)
+        self.mqtt_username_entry = tk.Entry(auth_frame, width=25)
+        self.mqtt_username_entry.grid(row=0, column=1, padx=5, pady=3)
+        
+        # MQTT Password
+        tk.Label(auth_frame, text="MQTT Password:").grid(row=1, column=0, sticky="e", padx=5, pady=3)
+        self.mqtt_password_entry = tk.Entry(auth_frame, width=25, show="*")
+        self.mqtt_password_entry.grid(row=1, column=1, padx=5, pady=3)
+        
+        # Show MQTT password checkbox
+        self.show_mqtt_password_var = tk.BooleanVar()
+        show_mqtt_pass_btn = tk.Checkbutton(auth_frame, text="Show Password", 
+                                           variable=self.show_mqtt_password_var,
+                                           command=self.toggle_mqtt_password_visibility)
+        show_mqtt_pass_btn.grid(row=1, column=2, sticky="w", padx=5, pady=3)
+        
+        # Help text
+        help_label = tk.Label(auth_frame, text="Leave blank for anonymous connection", 
+                             font=("Arial", 8), fg="gray")
+        help_label.grid(row=2, column=0, columnspan=3, pady=3)
+        
+        # Chat Username
+        tk.Label(inner_config, text="Chat Username:").grid(row=4, column=0, sticky="e", padx=5, pady=5)
+        self.username_entry = tk.Entry(inner_config, width=30)
+        self.username_entry.grid(row=4, column=1, padx=5, pady=5)
+        
+        # Encryption Key
+        tk.Label(inner_config, text="Encryption Key:").grid(row=5, column=0, sticky="e", padx=5, pady=5)
+        self.key_entry = tk.Entry(inner_config, width=30, show="*")
+        self.key_entry.grid(row=5, column=1, padx=5, pady=5)
+        self.key_entry.insert(0, "supersecretkey123")
+        
+        # Key buttons frame
+        key_buttons_frame = tk.Frame(inner_config)
+        key_buttons_frame.grid(row=5, column=2, padx=5, pady=5)
+        
+        # Generate key button
+        generate_btn = tk.Button(key_buttons_frame, text="Generate", command=self.generate_key)
+        generate_btn.pack(side=tk.TOP, pady=(0, 2))
+        
+        # Copy key button
+        copy_btn = tk.Button(key_buttons_frame, text="Copy Key", command=self.copy_key)
+        copy_btn.pack(side=tk.TOP)
+        
+        # Show/Hide key button
+        self.show_key_var = tk.BooleanVar()
+        show_key_btn = tk.Checkbutton(inner_config, text="Show Key", variable=self.show_key_var, 
+                                     command=self.toggle_key_visibility)
+        show_key_btn.grid(row=6, column=1, sticky="w", padx=5, pady=5)
+        
+        # Key display area (for easy copying)
+        tk.Label(inner_config, text="Share this key:").grid(row=7, column=0, sticky="e", padx=5, pady=5)
+        self.key_display = tk.Text(inner_config, height=3, width=35, wrap=tk.WORD, state=tk.DISABLED)
+        self.key_display.grid(row=7, column=1, padx=5, pady=5)
+        self.update_key_display()
+        
+        # Advanced per-room options (saved with the room)
+        advanced_frame = tk.LabelFrame(inner_config, text="Advanced Options",
+                                       font=("Arial", 9, "italic"))
+        advanced_frame.grid(row=8, column=0, columnspan=3, sticky="ew", padx=5, pady=10)
+        
+        tk.Label(advanced_frame, text="Wire Format:").grid(row=0, column=0, sticky="e", padx=5, pady=3)
+        self.wire_format_var = tk.StringVar()
+        ttk.Combobox(advanced_frame, textvariable=self.wire_format_var, state="readonly", width=22,
+                     values=list(WIRE_FORMAT_CHOICES)).grid(row=0, column=1, sticky="w", padx=5, pady=3)
+        
+        tk.Label(advanced_frame, text="Cipher Suite:").grid(row=1, column=0, sticky="e", padx=5, pady=3)
+        self.cipher_suite_var = tk.StringVar()
+        cipher_combo = ttk.Combobox(advanced_frame, textvariable=self.cipher_suite_var, state="readonly",
+                                    width=22, values=list(CIPHER_SUITE_CHOICES))
+        cipher_combo.grid(row=1, column=1, sticky="w", padx=5, pady=3)
+        cipher_combo.bind('<<ComboboxSelected>>', self.on_cipher_suite_selected)
+        
+        tk.Label(advanced_frame, text="Key Derivation:").grid(row=2, column=0, sticky="e", padx=5, pady=3)
+        self.kdf_var = tk.StringVar()
+        ttk.Combobox(advanced_frame, textvariable=self.kdf_var, state="readonly", width=22,
+                     values=list(KDF_CHOICES)).grid(row=2, column=1, sticky="w", padx=5, pady=3)
+        
+        tk.Label(advanced_frame, text="Compression:").grid(row=3, column=0, sticky="e", padx=5, pady=3)
+        self.compression_var = tk.StringVar()
+        compression_combo = ttk.Combobox(advanced_frame, textvariable=self.compression_var, state="readonly",
+                                         width=22, values=list(COMPRESSION_CHOICES))
+        compression_combo.grid(row=3, column=1, sticky="w", padx=5, pady=3)
+        compression_combo.bind('<<ComboboxSelected>>', self.on_cipher_suite_selected)
+        
+        tk.Label(advanced_frame, text="Send Batching:").grid(row=4, column=0, sticky="e", padx=5, pady=3)
+        self.batch_window_var = tk.StringVar()
+        batch_combo = ttk.Combobox(advanced_frame, textvariable=self.batch_window_var, state="readonly",
+                                   width=22, values=list(BATCH_WINDOW_CHOICES))
+        batch_combo.grid(row=4, column=1, sticky="w", padx=5, pady=3)
+        batch_combo.bind('<<ComboboxSelected>>', self.on_cipher_suite_selected)
+        
+        tk.Label(advanced_frame, text="Presence:").grid(row=5, column=0, sticky="e", padx=5, pady=3)
+        self.presence_var = tk.StringVar()
+        ttk.Combobox(advanced_frame, textvariable=self.presence_var, state="readonly", width=22,
+                     values=list(PRESENCE_CHOICES)).grid(row=5, column=1, sticky="w", padx=5, pady=3)
+        
+        tk.Label(advanced_frame, text="MQTT Protocol:").grid(row=6, column=0, sticky="e", padx=5, pady=3)
+        self.mqtt_protocol_var = tk.StringVar()
+        ttk.Combobox(advanced_frame, textvariable=self.mqtt_protocol_var, state="readonly", width=22,
+                     values=list(MQTT_PROTOCOL_CHOICES)).grid(row=6, column=1, sticky="w", padx=5, pady=3)
+        
+        tk.Label(advanced_frame, text="Use v2 / AEAD / compression / batching only once everyone in the room has updated\n"
+                                      "Everyone in a room must use the same key derivation",
+                 font=("Arial", 8), fg="gray").grid(row=7, column=0, columnspan=2, pady=3)
+        self.set_room_options(NEW_ROOM_OPTIONS)
+        
+        # Buttons frame
+        buttons_frame = tk.Frame(self.connection_frame)
+        buttons_frame.pack(pady=20)
+        
+        # Save current room button
+        save_room_btn = tk.Button(buttons_frame, text="💾 Save Current Room", 
+                                 command=self.save_current_room, bg="#2196F3", fg="white",
+                                 font=("Arial", 10, "bold"))
+        save_room_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Connect button
+        self.connect_btn = tk.Button(buttons_frame, text="🔗 Connect", command=self.connect_mqtt, 
+                                   bg="green", fg="white", font=("Arial", 12, "bold"))
+        self.connect_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Clear fields button
+        clear_btn = tk.Button(buttons_frame, text="🗑️ Clear Fields", command=self.clear_connection_fields,
+                             bg="#FF9800", fg="white", font=("Arial", 10, "bold"))
+        clear_btn.pack(side=tk.LEFT, padx=5)
+        
+        # Status label
+        self.status_label = tk.Label(self.connection_frame, text="Not connected", fg="red",
+                                   font=("Arial", 10, "bold"))
+        self.status_label.pack(pady=10)
+        
+    def setup_chat_tab(self):
+        """Setup the chat interface tab"""
+        # Main chat frame
+        main_frame = tk.Frame(self.chat_frame)
+        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # Chat display frame (left side)
+        chat_display_frame = tk.Frame(main_frame)
+        chat_display_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        # Chat header with room name
+        self.chat_header = tk.Label(chat_display_frame, text="Chat Messages", 
+                                   font=("Arial", 12, "bold"), bg="#E3F2FD", relief=tk.RAISED, pady=5)
+        self.chat_header.pack(fill=tk.X, pady=(0, 5))
+        
+        # History search
+        search_frame = tk.Frame(chat_display_frame)
+        search_frame.pack(fill=tk.X)
+        
+        self.search_entry = tk.Entry(search_frame)
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.search_entry.bind("<Return>", self.search_history)
+        
+        search_btn = tk.Button(search_frame, text="🔍 Search", command=self.search_history)
+        search_btn.pack(side=tk.RIGHT, padx=(5, 0))
+        
+        # Chat messages area
+        self.chat_display = scrolledtext.ScrolledText(chat_display_frame, state=tk.DISABLED, 
+                                                     wrap=tk.WORD, height=20)
+        self.chat_display.pack(fill=tk.BOTH, expand=True, pady=5)
+        self.chat_display.config(yscrollcommand=self.on_chat_scroll)
+        
+        # Shown while scrolled up and new messages are waiting below
+        self.latest_btn = tk.Button(chat_display_frame, text="", command=self.jump_to_latest,
+                                    font=("Arial", 8))
+        
+        # Message input frame
+        input_frame = tk.Frame(chat_display_frame)
+        self.chat_input_frame = input_frame
+        input_frame.pack(fill=tk.X, pady=5)
+        
+        self.message_entry = tk.Entry(input_frame)
+        self.message_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.message_entry.bind("<Return>", self.send_message)
+        
+        send_btn = tk.Button(input_frame, text="Send", command=self.send_message)
+        send_btn.pack(side=tk.RIGHT, padx=(5, 0))
+        
+        file_btn = tk.Button(input_frame, text="📎 File", command=self.send_file)
+        file_btn.pack(side=tk.RIGHT, padx=(5, 0))
+        
+        # File transfer progress (one line per active transfer)
+        self.transfer_label = tk.Label(chat_display_frame, text="", font=("Arial", 8), fg="gray",
+                                       justify=tk.LEFT, anchor="w")
+        self.transfer_label.pack(fill=tk.X)
+        
+        # Users list frame (right side)
+        users_frame = tk.Frame(main_frame, width=200)
+        users_frame.pack(side=tk.RIGHT, fill=tk.Y, padx=(10, 0))
+        users_frame.pack_propagate(False)
+        
+        # Rooms open on this broker connection, with unread counts
+        tk.Label(users_frame, text="Open Rooms", font=("Arial", 12, "bold")).pack()
+        self.open_rooms_listbox = tk.Listbox(users_frame, width=25, height=5, exportselection=False)
+        self.open_rooms_listbox.pack(fill=tk.X, pady=5)
+        self.open_rooms_listbox.bind('<<ListboxSelect>>', self.on_open_room_select)
+        
+        leave_btn = tk.Button(users_frame, text="Leave Room", command=self.leave_room,
+                              bg="#607D8B", fg="white", font=("Arial", 8))
+        leave_btn.pack(fill=tk.X, pady=(0, 5))
+        
+        tk.Label(users_frame, text="Online Users", font=("Arial", 12, "bold")).pack()
+        self.users_listbox = tk.Listbox(users_frame, width=25)
+        self.users_listbox.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        # Disconnect button
+        disconnect_btn = tk.Button(users_frame, text="Disconnect", command=self.disconnect_mqtt,
+                                 bg="red", fg="white")
+        disconnect_btn.pack(fill=tk.X, pady=5)
+        
+        # Add debug button for cleaning users
+        debug_btn = tk.Button(users_frame, text="🧹 Clean Users", command=self.force_clean_users,
+                             bg="orange", fg="white", font=("Arial", 8))
+        debug_btn.pack(fill=tk.X, pady=2)
+        
+        jobs_btn = tk.Button(users_frame, text="⏱ Scheduled Jobs", command=self.show_scheduled_jobs,
+                             bg="gray", fg="white", font=("Arial", 8))
+        jobs_btn.pack(fill=tk.X, pady=2)
+        
+        # Dispatch queue stats (depth and time spent applying events)
+        self.queue_stats_label = tk.Label(users_frame, text="", font=("Arial", 7), fg="gray",
+                                          justify=tk.LEFT, anchor="w")
+        self.queue_stats_label.pack(fill=tk.X)
+        
+    def setup_rooms_tab(self):
+        """Setup the room management tab"""
+        title_label = tk.Label(self.rooms_frame, text="Saved Chat Rooms", 
+                              font=("Arial", 16, "bold"))
+        title_label.pack(pady=20)
+        
+        # Main container
+        main_container = tk.Frame(self.rooms_frame)
+        main_container.pack(fill=tk.BOTH, expand=True, padx=20, pady=10)
+        
+        # Left side - Room list
+        left_frame = tk.Frame(main_container)
+        left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        
+        tk.Label(left_frame, text="Saved Rooms:", font=("Arial", 12, "bold")).pack(anchor="w")
+        
+        # Rooms listbox with scrollbar
+        listbox_frame = tk.Frame(left_frame)
+        listbox_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        self.rooms_listbox = tk.Listbox(listbox_frame, font=("Arial", 10))
+        scrollbar = tk.Scrollbar(listbox_frame, orient=tk.VERTICAL, command=self.rooms_listbox.yview)
+        self.rooms_listbox.config(yscrollcommand=scrollbar.set)
+        
+        self.rooms_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.rooms_listbox.bind('<<ListboxSelect>>', self.on_room_select)
+        
+        # Buttons frame
+        buttons_frame = tk.Frame(left_frame)
+        buttons_frame.pack(fill=tk.X, pady=10)
+        
+        edit_btn = tk.Button(buttons_frame, text="✏️ Edit", command=self.edit_room,
+                           bg="#FF9800", fg="white")
+        edit_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        delete_btn = tk.Button(buttons_frame, text="🗑️ Delete", command=self.delete_room,
+                             bg="#F44336", fg="white")
+        delete_btn.pack(side=tk.LEFT, padx=5)
+        
+        quick_connect_btn = tk.Button(buttons_frame, text="🚀 Quick Connect", 
+                                    command=self.quick_connect_room,
+                                    bg="#4CAF50", fg="white", font=("Arial", 10, "bold"))
+        quick_connect_btn.pack(side=tk.RIGHT)
+        
+        # Right side - Room details
+        right_frame = tk.LabelFrame(main_container, text="Room Details", 
+                                   font=("Arial", 10, "bold"))
+        right_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True, padx=(20, 0))
+        
+        # Room details display
+        self.room_details = tk.Text(right_frame, height=15, width=40, wrap=tk.WORD, 
+                                   state=tk.DISABLED, font=("Arial", 9))
+        self.room_details.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        # Import/Export buttons
+        import_export_frame = tk.Frame(right_frame)
+        import_export_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        export_btn = tk.Button(import_export_frame, text="📤 Export All", 
+                             command=self.export_rooms, bg="#9C27B0", fg="white")
+        export_btn.pack(side=tk.LEFT, padx=(0, 5))
+        
+        import_btn = tk.Button(import_export_frame, text="📥 Import", 
+                             command=self.import_rooms, bg="#607D8B", fg="white")
+        import_btn.pack(side=tk.LEFT)
+        
+    def get_room_options(self):
+        """Read the advanced per-room options from the connection tab"""
+        return {
+            "wire_version": WIRE_FORMAT_CHOICES[self.wire_format_var.get()],
+            "cipher_suite": CIPHER_SUITE_CHOICES[self.cipher_suite_var.get()],
+            "kdf": KDF_CHOICES[self.kdf_var.get()],
+            "compression": COMPRESSION_CHOICES[self.compression_var.get()],
+            "batch_window_ms": self.get_batch_window(),
+            "presence": PRESENCE_CHOICES[self.presence_var.get()],
+            "mqtt_protocol": MQTT_PROTOCOL_CHOICES[self.mqtt_protocol_var.get()],
+        }
+        
+    def set_room_options(self, config):
+        """Show a room's advanced options (defaults for keys it doesn't have)"""
+        wire_version = config.get("wire_version", ROOM_OPTION_DEFAULTS["wire_version"])
+        for label, value in WIRE_FORMAT_CHOICES.items():
+            if value == wire_version:
+                self.wire_format_var.set(label)
+                
+        cipher_suite = config.get("cipher_suite", ROOM_OPTION_DEFAULTS["cipher_suite"])
+        for label, value in CIPHER_SUITE_CHOICES.items():
+            if value == cipher_suite:
+                self.cipher_suite_var.set(label)
+                
+        kdf = config.get("kdf", ROOM_OPTION_DEFAULTS["kdf"])
+        for label, value in KDF_CHOICES.items():
+            if value == kdf:
+                self.kdf_var.set(label)
+                
+        compression = config.get("compression", ROOM_OPTION_DEFAULTS["compression"])
+        for label, value in COMPRESSION_CHOICES.items():
+            if value == compression:
+                self.compression_var.set(label)
+                
+        batch_window = config.get("batch_window_ms", ROOM_OPTION_DEFAULTS["batch_window_ms"])
+        self.batch_window_var.set(next((label for label, value in BATCH_WINDOW_CHOICES.items()
+                                        if value == batch_window), f"{batch_window:g} ms"))
+        
+        presence = config.get("presence", ROOM_OPTION_DEFAULTS["presence"])
+        for label, value in PRESENCE_CHOICES.items():
+            if value == presence:
+                self.presence_var.set(label)
+                
+        mqtt_protocol = config.get("mqtt_protocol", ROOM_OPTION_DEFAULTS["mqtt_protocol"])
+        for label, value in MQTT_PROTOCOL_CHOICES.items():
+            if value == mqtt_protocol:
+                self.mqtt_protocol_var.set(label)
+                
+    def get_batch_window(self):
+        """Batch window in ms (saved rooms may use values not in the dropdown)"""
+        label = self.batch_window_var.get()
+        if label in BATCH_WINDOW_CHOICES:
+            return BATCH_WINDOW_CHOICES[label]
+        return float(label.split()[0])
+        
+    def on_cipher_suite_selected(self, event=None):
+        """AEAD suites, compression and batching are only carried by wire format v2, so switch to it"""
+        if (CIPHER_SUITE_CHOICES[self.cipher_suite_var.get()] != "fernet" or
+                COMPRESSION_CHOICES[self.compression_var.get()] != "none" or
+                self.get_batch_window()):
+            for label, value in WIRE_FORMAT_CHOICES.items():
+                if value == 2:
+                    self.wire_format_var.set(label)
+        
+    def derived_keys_for(self, channel):
+        """Cached scrypt results for a channel, from saved rooms and the current session"""
+        derived_keys = {}
+        for room_name in self.saved_room_names(channel):
+            derived_keys.update(self.saved_rooms[room_name].get("derived_keys", {}))
+        if self.engine.channel == channel:
+            derived_keys.update(self.engine.key_cache)
+        return derived_keys
+        
+    def get_config_key(self):
+        """Key for the local encrypted files (saved rooms and history)"""
+        # Use a fixed key for config encryption (in real app, use keyring/OS keystore)
+        return derive_key("mqtt_chat_config_key_v1")
+        
+    def get_config_cipher(self):
+        """Get or create cipher for config file encryption"""
+        if not self.config_cipher:
+            self.config_cipher = Fernet(self.get_config_key())
+        return self.config_cipher
+        
+    def save_current_room(self):
+        """Save current room configuration"""
+        server = self.server_entry.get().strip()
+        port = self.port_entry.get().strip()
+        channel = self.channel_entry.get().strip()
+        username = self.username_entry.get().strip()
+        key = self.key_entry.get().strip()
+        
+        if not all([server, port, channel, username, key]):
+            messagebox.showerror("Error", "Please fill in all fields before saving")
+            return
+            
+        # Ask for room name
+        room_name = simpledialog.askstring("Save Room", "Enter a name for this room:")
+        if not room_name:
+            return
+            
+        # Check if room name already exists
+        if room_name in self.saved_rooms:
+            if not messagebox.askyesno("Overwrite", f"Room '{room_name}' already exists. Overwrite?"):
+                return
+                
+        # Save room config
+        config = {
+            "server": server,
+            "port": port,
+            "channel": channel,
+            "username": username,
+            "encryption_key": key,
+            "mqtt_username": self.mqtt_username_entry.get().strip(),
+            "mqtt_password": self.mqtt_password_entry.get().strip(),
+            "saved_date": datetime.now().isoformat(),
+            "derived_keys": self.derived_keys_for(channel),
+            **self.get_room_options()
+        }
+        if not self.store_rooms({room_name: config}):
+            return
+            
+        self.refresh_rooms_display()
+        messagebox.showinfo("Saved", f"Room '{room_name}' saved successfully!")
+        
+    def load_room_config(self, event=None):
+        """Load selected room configuration"""
+        selected_room = self.rooms_var.get()
+        if not selected_room or selected_room not in self.saved_rooms:
+            return
+            
+        config = self.saved_rooms[selected_room]
+        
+        # Load into connection fields
+        self.server_entry.delete(0, tk.END)
+        self.server_entry.insert(0, config["server"])
+        
+        self.port_entry.delete(0, tk.END)
+        self.port_entry.insert(0, config["port"])
+        
+        self.channel_entry.delete(0, tk.END)
+        self.channel_entry.insert(0, config["channel"])
+        
+        self.username_entry.delete(0, tk.END)
+        self.username_entry.insert(0, config["username"])
+        
+        self.key_entry.delete(0, tk.END)
+        self.key_entry.insert(0, config["encryption_key"])
+        
+        # Load MQTT authentication if present
+        self.mqtt_username_entry.delete(0, tk.END)
+        self.mqtt_username_entry.insert(0, config.get("mqtt_username", ""))
+        
+        self.mqtt_password_entry.delete(0, tk.END)
+        self.mqtt_password_entry.insert(0, config.get("mqtt_password", ""))
+        
+        self.set_room_options(config)
+        self.update_key_display()
+        messagebox.showinfo("Loaded", f"Room '{selected_room}' configuration loaded!")
+        
+    def quick_connect_room(self):
+        """Quick connect to selected room from rooms tab"""
+        selection = self.rooms_listbox.curselection()
+        if not selection:
+            messagebox.showwarning("No Selection", "Please select a room first")
+            return
+            
+        room_name = self.rooms_listbox.get(selection[0])
+        
+        # Load the room config
+        self.rooms_var.set(room_name)
+        self.load_room_config()
+        
+        # Switch to connection tab and connect
+        notebook = self.root.children['!notebook']
+        notebook.select(0)  # Switch to connection tab
+        
+        # Connect after a brief delay to allow tab switch
+        self.root.after(100, self.connect_mqtt)
+        
+    def on_room_select(self, event):
+        """Handle room selection in rooms list"""
+        selection = self.rooms_listbox.curselection()
+        if not selection:
+            return
+            
+        room_name = self.rooms_listbox.get(selection[0])
+        if room_name in self.saved_rooms:
+            self.show_room_details(room_name, self.saved_rooms[room_name])
+            
+    def show_room_details(self, room_name, config):
+        """Show room details in the details panel"""
+        details = f"Room Name: {room_name}\n\n"
+        details += f"Server: {config['server']}\n"
+        details += f"Port: {config['port']}\n"
+        details += f"Channel: {config['channel']}\n"
+        details += f"Chat Username: {config['username']}\n"
+        
+        # Show MQTT auth status
+        mqtt_user = config.get('mqtt_username', '')
+        if mqtt_user:
+            details += f"MQTT Username: {mqtt_user}\n"
+            details += f"MQTT Password: {'*' * len(config.get('mqtt_password', ''))}\n"
+        else:
+            details += f"MQTT Auth: Anonymous\n"
+            
+        details += f"Encryption Key: {'*' * len(config['encryption_key'])}\n"
+        details += f"Wire Format: v{config.get('wire_version', ROOM_OPTION_DEFAULTS['wire_version'])}\n"
+        details += f"Cipher Suite: {config.get('cipher_suite', ROOM_OPTION_DEFAULTS['cipher_suite'])}\n"
+        details += f"Key Derivation: {config.get('kdf', ROOM_OPTION_DEFAULTS['kdf'])}\n"
+        details += f"Compression: {config.get('compression', ROOM_OPTION_DEFAULTS['compression'])}\n"
+        details += f"Send Batching: {config.get('batch_window_ms', ROOM_OPTION_DEFAULTS['batch_window_ms']):g} ms\n"
+        details += f"Presence: {config.get('presence', ROOM_OPTION_DEFAULTS['presence'])}\n\n"
+        details += f"Saved: {config.get('saved_date', 'Unknown')}\n"
+        
+        self.room_details.config(state=tk.NORMAL)
+        self.room_details.delete(1.0, tk.END)
+        self.room_details.insert(tk.END, details)
+        self.room_details.config(state=tk.DISABLED)
+        
+    def edit_room(self):
+        """Edit selected room"""
+        selection = self.rooms_listbox.curselection()
+        if not selection:
+            messagebox.showwarning("No Selection", "Please select a room to edit")
+            return
+            
+        room_name = self.rooms_listbox.get(selection[0])
+        config = self.saved_rooms[room_name]
+        
+        # Create edit dialog
+        edit_window = tk.Toplevel(self.root)
+        edit_window.title(f"Edit Room: {room_name}")
+        edit_window.geometry("400x300")
+        edit_window.transient(self.root)
+        edit_window.grab_set()
+        
+        # Edit form
+        tk.Label(edit_window, text="Server:").grid(row=0, column=0, sticky="e", padx=5, pady=5)
+        server_entry = tk.Entry(edit_window, width=30)
+        server_entry.grid(row=0, column=1, padx=5, pady=5)
+        server_entry.insert(0, config["server"])
+        
+        tk.Label(edit_window, text="Port:").grid(row=1, column=0, sticky="e", padx=5, pady=5)
+        port_entry = tk.Entry(edit_window, width=30)
+        port_entry.grid(row=1, column=1, padx=5, pady=5)
+        port_entry.insert(0, config["port"])
+        
+        tk.Label(edit_window, text="Channel:").grid(row=2, column=0, sticky="e", padx=5, pady=5)
+        channel_entry = tk.Entry(edit_window, width=30)
+        channel_entry.grid(row=2, column=1, padx=5, pady=5)
+        channel_entry.insert(0, config["channel"])
+        
+        tk.Label(edit_window, text="Chat Username:").grid(row=3, column=0, sticky="e", padx=5, pady=5)
+        username_entry = tk.Entry(edit_window, width=30)
+        username_entry.grid(row=3, column=1, padx=5, pady=5)
+        username_entry.insert(0, config["username"])
+        
+        tk.Label(edit_window, text="MQTT Username:").grid(row=4, column=0, sticky="e", padx=5, pady=5)
+        mqtt_user_entry = tk.Entry(edit_window, width=30)
+        mqtt_user_entry.grid(row=4, column=1, padx=5, pady=5)
+        mqtt_user_entry.insert(0, config.get("mqtt_username", ""))
+        
+        tk.Label(edit_window, text="MQTT Password:").grid(row=5, column=0, sticky="e", padx=5, pady=5)
+        mqtt_pass_entry = tk.Entry(edit_window, width=30, show="*")
+        mqtt_pass_entry.grid(row=5, column=1, padx=5, pady=5)
+        mqtt_pass_entry.insert(0, config.get("mqtt_password", ""))
+        
+        tk.Label(edit_window, text="Encryption Key:").grid(row=6, column=0, sticky="e", padx=5, pady=5)
+        key_entry = tk.Entry(edit_window, width=30)
+        key_entry.grid(row=6, column=1, padx=5, pady=5)
+        key_entry.insert(0, config["encryption_key"])
+        
+        def save_changes():
+            # Start from the existing config so advanced options are kept
+            new_config = dict(config)
+            new_config.update({
+                "server": server_entry.get().strip(),
+                "port": port_entry.get().strip(),
+                "channel": channel_entry.get().strip(),
+                "username": username_entry.get().strip(),
+                "encryption_key": key_entry.get().strip(),
+                "mqtt_username": mqtt_user_entry.get().strip(),
+                "mqtt_password": mqtt_pass_entry.get().strip(),
+                "saved_date": config.get("saved_date", datetime.now().isoformat())
+            })
+            
+            if not all([new_config["server"], new_config["port"], new_config["channel"], 
+                       new_config["username"], new_config["encryption_key"]]):
+                messagebox.showerror("Error", "Please fill in all fields")
+                return
+                
+            if not self.store_rooms({room_name: new_config}):
+                return
+            self.refresh_rooms_display()
+            edit_window.destroy()
+            messagebox.showinfo("Updated", f"Room '{room_name}' updated successfully!")
+        
+        # Buttons
+        button_frame = tk.Frame(edit_window)
+        button_frame.grid(row=7, column=0, columnspan=2, pady=20)
+        
+        tk.Button(button_frame, text="Save Changes", command=save_changes,
+                 bg="#4CAF50", fg="white").pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="Cancel", command=edit_window.destroy,
+                 bg="#F44336", fg="white").pack(side=tk.LEFT, padx=5)
+        
+    def delete_room(self):
+        """Delete selected room"""
+        selection = self.rooms_listbox.curselection()
+        if not selection:
+            messagebox.showwarning("No Selection", "Please select a room to delete")
+            return
+            
+        room_name = self.rooms_listbox.get(selection[0])
+        
+        if messagebox.askyesno("Delete Room", f"Are you sure you want to delete room '{room_name}'?"):
+            try:
+                del self.saved_rooms[room_name]
+            except Exception as e:
+                messagebox.showerror("Save Error", f"Failed to delete room: {str(e)}")
+                return
+            self.refresh_rooms_display()
+            messagebox.showinfo("Deleted", f"Room '{room_name}' deleted successfully!")
+            
+    def export_rooms(self):
+        """Export all rooms to a file"""
+        if not self.saved_rooms:
+            messagebox.showwarning("No Rooms", "No rooms to export")
+            return
+            
+        from tkinter import filedialog
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            title="Export Rooms"
+        )
+        
+        if filename:
+            try:
+                with open(filename, 'w') as f:
+                    json.dump(dict(self.saved_rooms), f, indent=2)
+                messagebox.showinfo("Exported", f"Rooms exported to {filename}")
+            except Exception as e:
+                messagebox.showerror("Export Error", f"Failed to export: {str(e)}")
+                
+    def import_rooms(self):
+        """Import rooms from a file"""
+        from tkinter import filedialog
+        filename = filedialog.askopenfilename(
+            filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+            title="Import Rooms"
+        )
+        
+        if filename:
+            try:
+                with open(filename, 'r') as f:
+                    imported_rooms = json.load(f)
+                
+                # Merge with existing rooms
+                conflicts = []
+                for room_name in imported_rooms:
+                    if room_name in self.saved_rooms:
+                        conflicts.append(room_name)
+                
+                if conflicts:
+                    message = f"The following rooms already exist:\n{', '.join(conflicts)}\n\nOverwrite them?"
+                    if not messagebox.askyesno("Import Conflicts", message):
+                        return
+                
+                if not self.store_rooms(imported_rooms):
+                    return
+                self.refresh_rooms_display()
+                messagebox.showinfo("Imported", f"Successfully imported {len(imported_rooms)} room(s)")
+                
+            except Exception as e:
+                messagebox.showerror("Import Error", f"Failed to import: {str(e)}")
+                
+    def saved_room_names(self, channel):
+        """Names of the saved rooms for a channel (read from the store index)"""
+        if isinstance(self.saved_rooms, RoomStore):
+            return self.saved_rooms.names_for_channel(channel)
+        return [name for name, config in self.saved_rooms.items() if config.get("channel") == channel]
+        
+    def store_rooms(self, rooms):
+        """Write room configs to the encrypted room store (only those records change)"""
+        try:
+            self.saved_rooms.update(rooms)
+            return True
+        except Exception as e:
+            messagebox.showerror("Save Error", f"Failed to save rooms: {str(e)}")
+            return False
+            
+    def load_saved_rooms(self):
+        """Open the encrypted room store (room details are decrypted when first used)"""
+        try:
+            self.saved_rooms = RoomStore(self.rooms_dir, self.get_config_cipher())
+        except Exception as e:
+            print(f"Failed to load saved rooms: {e}")
+            # If loading fails, start with empty rooms
+            self.saved_rooms = {}
+            return
+            
+        try:
+            migrated = self.saved_rooms.migrate(self.config_file)
+            if migrated:
+                print(f"Moved {migrated} saved room(s) to {self.rooms_dir}/")
+        except Exception as e:
+            print(f"Failed to migrate {self.config_file}: {e}")
+            
+        self.refresh_rooms_display()
+            
+    def refresh_rooms_display(self):
+        """Refresh the rooms display in both dropdown and listbox"""
+        # Update dropdown
+        room_names = list(self.saved_rooms.keys())
+        self.rooms_dropdown['values'] = room_names
+        
+        # Update listbox
+        self.rooms_listbox.delete(0, tk.END)
+        for room_name in sorted(room_names):
+            self.rooms_listbox.insert(tk.END, room_name)
+            
+        # Clear details if no rooms
+        if not room_names:
+            self.room_details.config(state=tk.NORMAL)
+            self.room_details.delete(1.0, tk.END)
+            self.room_details.insert(tk.END, "No saved rooms")
+            self.room_details.config(state=tk.DISABLED)
+        
+    def generate_key(self):
+        """Generate a new encryption key"""
+        key = Fernet.generate_key()
+        self.key_entry.delete(0, tk.END)
+        self.key_entry.insert(0, key.decode())
+        self.update_key_display()
+        
+    def copy_key(self):
+        """Copy the encryption key to clipboard"""
+        key = self.key_entry.get()
+        self.root.clipboard_clear()
+        self.root.clipboard_append(key)
+        self.root.update()  # Required on some systems
+        messagebox.showinfo("Copied", "Encryption key copied to clipboard!")
+        
+    def toggle_mqtt_password_visibility(self):
+        """Toggle showing/hiding the MQTT password"""
+        if self.show_mqtt_password_var.get():
+            self.mqtt_password_entry.config(show="")
+        else:
+            self.mqtt_password_entry.config(show="*")
+            
+    def toggle_key_visibility(self):
+        """Toggle showing/hiding the key in the entry field"""
+        if self.show_key_var.get():
+            self.key_entry.config(show="")
+        else:
+            self.key_entry.config(show="*")
+            
+    def update_key_display(self):
+        """Update the key display area"""
+        key = self.key_entry.get()
+        self.key_display.config(state=tk.NORMAL)
+        self.key_display.delete(1.0, tk.END)
+        self.key_display.insert(tk.END, key)
+        self.key_display.config(state=tk.DISABLED)
+        
+        # Bind key entry changes to update display
+        self.key_entry.bind('<KeyRelease>', lambda e: self.update_key_display())
+        
+    def connect_mqtt(self):
+        """Connect to MQTT broker, or join another room on the open connection"""
+        new_session = False
+        try:
+            # Get connection details
+            server = self.server_entry.get().strip()
+            port = int(self.port_entry.get().strip())
+            channel = self.channel_entry.get().strip()
+            username = self.username_entry.get().strip()
+            encryption_key = self.key_entry.get().strip()
+            
+            # Get MQTT authentication (optional)
+            mqtt_username = self.mqtt_username_entry.get().strip()
+            mqtt_password = self.mqtt_password_entry.get().strip()
+            
+            if not all([server, channel, username, encryption_key]):
+                messagebox.showerror("Error", "Please fill in all required fields")
+                return
+                
+            # Further rooms on the same broker join the open connection
+            broker = (server, port, mqtt_username, mqtt_password)
+            if self.session is not None:
+                if (self.session.server, self.session.port, self.session.mqtt_username,
+                        self.session.mqtt_password) != broker:
+                    messagebox.showerror("Error", "Disconnect first to join rooms on another broker")
+                    return
+                if channel in self.session.rooms:
+                    self.show_room(self.session.rooms[channel])
+                    self.root.children['!notebook'].select(1)  # Switch to chat tab
+                    return
+                    
+            options = self.get_room_options()
+            options["derived_keys"] = self.derived_keys_for(channel)
+            if self.session is None:
+                new_session = True
+                self.session = BrokerSession(server, port, mqtt_username, mqtt_password,
+                                             client_id=session_client_id(self.install_id, username),
+                                             mqtt_protocol=options["mqtt_protocol"], driver=self.loop_driver)
+                self.session.on(EVENT_UNREAD_CHANGED,
+                                lambda channel, count: self.inbox.put("call", self.refresh_open_rooms))
+                                
+            # Join (the engine sets up encryption and topics; the session subscribes it)
+            previous = self.engine
+            engine = ChatEngine(driver=self.loop_driver)
+            self.watch_room(engine)
+            self.engine = engine
+            try:
+                engine.join(self.session, channel, username, encryption_key, options=options)
+            except Exception:
+                self.engine = previous
+                raise
+            self.show_room(engine)
+            if new_session:
+                self.status_label.config(text="Connecting...", fg="orange")
+                if mqtt_username:
+                    self.add_system_message(f"Using MQTT authentication for user: {mqtt_username}")
+                else:
+                    self.add_system_message("Connecting with anonymous MQTT access")
+                self.session.connect()
+            
+        except Exception as e:
+            if new_session:
+                self.session = None  # Never reached the broker
+            messagebox.showerror("Connection Error", f"Failed to connect: {str(e)}")
+            self.status_label.config(text="Connection failed", fg="red")
+            
+    def show_room(self, engine):
+        """Put an open room on screen: its stored messages, users and status"""
+        # Apply what the previous room already queued before switching
+        self.apply_event_steps(coalesce(self.inbox.drain()))
+        self.engine = engine
+        if self.session is not None:
+            self.session.set_active(engine.channel)
+        self.chat_header.config(text=f"Chat Messages - #{engine.channel}")
+        self.show_recent_history()
+        self.update_users_list()
+        if engine.connected:
+            self.status_label.config(text="Connected", fg="green")
+        self.refresh_open_rooms()
+        
+    def refresh_open_rooms(self):
+        """Show the open rooms with their unread counts, selecting the one on screen"""
+        self.open_rooms_listbox.delete(0, tk.END)
+        if self.session is None:
+            return
+        for index, channel in enumerate(sorted(self.session.rooms)):
+            unread = self.session.unread.get(channel, 0)
+            self.open_rooms_listbox.insert(tk.END, f"#{channel}" + (f" ({unread})" if unread else ""))
+            if channel == self.engine.channel:
+                self.open_rooms_listbox.selection_set(index)
+                
+    def on_open_room_select(self, event):
+        """Switch to the room picked in the open rooms list"""
+        selection = self.open_rooms_listbox.curselection()
+        if not selection or self.session is None:
+            return
+        channel = sorted(self.session.rooms)[selection[0]]
+        if channel != self.engine.channel:
+            self.show_room(self.session.rooms[channel])
+            
+    def leave_room(self):
+        """Leave the room on screen, keeping the other open rooms"""
+        if self.session is None or len(self.session.rooms) <= 1:
+            self.disconnect_mqtt()
+            return
+        engine = self.engine
+        engine.connected = False
+        self.show_room(next(other for other in self.session.rooms.values() if other is not engine))
+        
+        def _leave_worker():
+            try:
+                engine.disconnect()
+            except Exception as e:
+                print(f"Error leaving #{engine.channel}: {e}")
+            finally:
+                self.inbox.put("call", self.refresh_open_rooms)
+                
+        threading.Thread(target=_leave_worker, daemon=True).start()
+            
+    def on_engine_connected(self):
+        """Called when the engine has joined the room"""
+        self.status_label.config(text="Connected", fg="green")
+        
+        # Update chat header with room name
+        self.chat_header.config(text=f"Chat Messages - #{self.engine.channel}")
+        
+        # Show where the conversation left off, then the welcome message
+        self.show_recent_history()
+        self.add_system_message("Connected to chat!")
+        
+    def on_engine_connection_failed(self, rc):
+        """Called when the broker refuses the connection"""
+        self.status_label.config(text=f"Connection failed (code {rc})", fg="red")
+        
+    def on_engine_disconnected(self, rc):
+        """Called when MQTT disconnects"""
+        self.status_label.config(text="Disconnected", fg="red")
+        
+    def on_engine_reconnecting(self, attempt, delay):
+        """Called when the engine lost the broker and is about to retry"""
+        self.status_label.config(text=f"Reconnecting in {delay:.0f} s (attempt {attempt})...", fg="orange")
+        
+    def on_engine_reconnected(self):
+        """Called when the engine is back in the room (roster and chat view carry on)"""
+        self.status_label.config(text="Connected", fg="green")
+            
+    def send_message(self, event=None):
+        """Send a chat message"""
+        if not self.engine.connected:
+            return
+            
+        message_text = self.message_entry.get().strip()
+        if not message_text:
+            return
+            
+        # Chat commands
+        if message_text.split()[0] == "/rotate":
+            self.rotate_room_key(message_text)
+            return
+            
+        try:
+            # Encrypt, publish and echo to our own chat display
+            self.engine.send_message(message_text)
+            
+            # Clear input
+            self.message_entry.delete(0, tk.END)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to send message: {str(e)}")
+            
+    def open_history(self):
+        """Open the local message history database"""
+        try:
+            self.history = MessageHistory(self.history_file, self.get_config_key())
+        except Exception as e:
+            print(f"Message history disabled: {e}")
+            self.history = None
+            
+    def record_history(self, channel, username, message, timestamp):
+        """Store a chat message (runs on the network thread; the write happens in the background)"""
+        if self.history is not None:
+            self.history.append(channel, username, message, timestamp)
+            
+    def show_recent_history(self):
+        """Start the chat view with the last stored messages of the room being joined"""
+        self.apply_chat_edits(self.chat_log.clear())
+        if self.history is None:
+            return
+        # Query behind the queued writes, on the history writer, so Tk never waits for the disk
+        engine = self.engine
+        self.history.recent_after_writes(
+            engine.channel, HISTORY_ON_CONNECT,
+            lambda messages: self.inbox.put("call", self.show_stored_messages, engine, messages))
+        
+    def show_stored_messages(self, engine, messages):
+        """Put a room's stored messages above its live ones (if the room is still on screen)"""
+        if engine is not self.engine:
+            return
+        self.chat_log.prepend_history(self.history_entries(messages))
+        self.apply_chat_edits(self.chat_log.latest())
+        
+    def show_history_page(self, engine, before_id, messages):
+        """Render a page of stored messages fetched while scrolling up (if the view still ends there)"""
+        self.history_page_pending = False
+        if engine is not self.engine or self.chat_log.oldest_history_id() != before_id:
+            return
+        if self.chat_log.prepend_history(self.history_entries(messages)):
+            self.apply_chat_edits(self.chat_log.older())
+        
+    def history_entries(self, messages):
+        """Stored messages as chat log entries"""
+        return [("chat", (username, message, timestamp), history_id)
+                for history_id, username, message, timestamp in messages]
+        
+    def search_history(self, event=None):
+        """Search the current room's stored messages and show the results"""
+        query = self.search_entry.get().strip()
+        if not query or self.history is None:
+            return
+        channel = self.engine.channel or self.channel_entry.get().strip()
+        
+        start = time.perf_counter()
+        results = self.history.search(channel, query, SEARCH_LIMIT)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        window = tk.Toplevel(self.root)
+        window.title(f"Search #{channel}: {query}")
+        window.geometry("600x400")
+        tk.Label(window, text=f"{len(results)} message(s) in {elapsed_ms:.1f} ms (newest first)",
+                 font=("Arial", 9), fg="gray").pack(fill=tk.X, padx=10, pady=(10, 0))
+        results_text = scrolledtext.ScrolledText(window, wrap=tk.WORD)
+        results_text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        for _, username, message, timestamp in results:
+            date_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+            results_text.insert(tk.END, f"[{date_str}] {username}: {message}\n")
+        if not results:
+            results_text.insert(tk.END, "No messages found (search matches whole words)\n")
+        results_text.config(state=tk.DISABLED)
+        
+    def send_file(self):
+        """Pick a file and stream it to the room"""
+        if not self.engine.connected:
+            return
+            
+        from tkinter import filedialog
+        path = filedialog.askopenfilename(title="Send File")
+        if not path:
+            return
+            
+        try:
+            self.engine.send_file(path)
+            self.add_system_message(f"Sending {os.path.basename(path)} "
+                                    f"({os.path.getsize(path) / 1e6:.1f} MB)")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to send file: {str(e)}")
+            
+    def on_engine_file_offered(self, engine, transfer_id, sender, name, size):
+        """Someone offered a file to one of our rooms: ask before downloading it"""
+        if engine is self.engine:
+            self.add_system_message(f"{sender} is sending {name} ({size / 1e6:.1f} MB)")
+        # The dialog is modal: ask once this event drain is over, so the rest of it isn't held up
+        self.root.after_idle(self.ask_file_offer, engine, transfer_id, sender, name, size)
+
+    def ask_file_offer(self, engine, transfer_id, sender, name, size):
+        """Ask whether to download an offered file"""
+        if messagebox.askyesno("File Offered", f"{sender} is sending {name} ({size / 1e6:.1f} MB) "
+                                               f"to #{engine.channel}.\n\nDownload it?"):
+            engine.accept_file(transfer_id)
+        else:
+            engine.decline_file(transfer_id)
+        
+    def on_engine_file_progress(self, transfer_id, direction, name, done_bytes, total_bytes):
+        """Show how far along a transfer is"""
+        arrow = "⬆" if direction == "send" else "⬇"
+        percent = done_bytes * 100 // total_bytes if total_bytes else 100
+        self.transfer_progress[transfer_id] = (f"{arrow} {name}: {percent}% "
+                                               f"({done_bytes / 1e6:.1f} of {total_bytes / 1e6:.1f} MB)")
+        self.transfer_label.config(text="\n".join(self.transfer_progress.values()))
+        
+    def on_engine_file_done(self, transfer_id, direction, name, path, error):
+        """A transfer finished or failed"""
+        self.transfer_progress.pop(transfer_id, None)
+        self.transfer_label.config(text="\n".join(self.transfer_progress.values()))
+        if error:
+            self.add_system_message(f"File {name}: {error}")
+        elif direction == "send":
+            self.add_system_message(f"Sent {name}")
+        else:
+            self.add_system_message(f"Received {name} - saved to {os.path.abspath(path)}")
+            
+    def rotate_room_key(self, command):
+        """Handle /rotate [grace minutes] - announce a new room key epoch"""
+        args = command.split()[1:]
+        try:
+            grace_minutes = float(args[0]) if args else 10
+        except ValueError:
+            messagebox.showerror("Error", "Usage: /rotate [grace minutes]")
+            return
+            
+        if not messagebox.askyesno("Rotate Key",
+                                   f"Rotate the key for #{self.engine.channel}?\n\n"
+                                   f"Everyone online switches to the new key now. The old key "
+                                   f"stops working in {grace_minutes:g} minute(s)."):
+            return
+            
+        try:
+            self.engine.rotate_key(grace=grace_minutes * 60)
+            self.message_entry.delete(0, tk.END)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to rotate key: {str(e)}")
+            
+    def on_engine_key_rotated(self, channel, epoch, new_passphrase, old_passphrase):
+        """Keep the connection tab and saved rooms on the room's current key"""
+        if self.key_entry.get().strip() == old_passphrase:
+            self.key_entry.delete(0, tk.END)
+            self.key_entry.insert(0, new_passphrase)
+            self.update_key_display()
+            
+        updated = {}
+        for room_name in self.saved_room_names(channel):
+            config = self.saved_rooms[room_name]
+            if config.get("encryption_key") == old_passphrase:
+                updated[room_name] = dict(config, encryption_key=new_passphrase)
+        if updated and self.store_rooms(updated):
+            self.add_system_message("Saved room updated with the new key")
+            
+    def on_engine_key_derived(self, channel, cache_id, key, passphrase):
+        """Store a freshly derived scrypt key in the saved rooms that use it"""
+        updated = {}
+        for room_name in self.saved_room_names(channel):
+            config = self.saved_rooms[room_name]
+            if config.get("encryption_key") == passphrase:
+                derived_keys = dict(config.get("derived_keys", {}), **{cache_id: key})
+                updated[room_name] = dict(config, derived_keys=derived_keys)
+        if updated:
+            self.store_rooms(updated)
+            
+    def disconnect_mqtt(self):
+        """Leave every open room and disconnect from MQTT"""
+        session, self.session = self.session, None
+        engines = list(session.rooms.values()) if session is not None else [self.engine]
+        
+        def _disconnect_worker():
+            """Worker function to handle disconnect in background"""
+            try:
+                for engine in engines:
+                    engine.disconnect()
+                if session is not None:
+                    session.close()
+            except Exception as e:
+                print(f"Error during disconnect: {e}")
+            finally:
+                # Update GUI in main thread
+                self.root.after(0, self._finish_disconnect)
+        
+        # Update status immediately
+        self.status_label.config(text="Disconnecting...", fg="orange")
+        for engine in engines:
+            engine.connected = False
+        
+        # Run disconnect in background thread to avoid GUI freeze
+        disconnect_thread = threading.Thread(target=_disconnect_worker, daemon=True)
+        disconnect_thread.start()
+        
+    def _finish_disconnect(self):
+        """Finish disconnect process in main GUI thread"""
+        self.engine.reset_users()
+        self.add_system_message("Disconnected from chat")
+        self.status_label.config(text="Disconnected", fg="red")
+        
+        # Reset chat header
+        self.chat_header.config(text="Chat Messages")
+        self.refresh_open_rooms()
+        
+    def _drain_events(self):
+        """Apply queued engine events to the widgets (runs every frame)"""
+        timer = FrameTimer(FRAME_BUDGET_MS)
+        
+        # Take events in chunks until the queue is empty or the frame budget is spent
+        while len(self.inbox) and not timer.expired():
+            self.apply_event_steps(coalesce(self.inbox.drain(DRAIN_CHUNK)))
+                    
+        self.inbox.record_drain(timer.elapsed())
+        self.update_queue_stats()
+        self.root.after(FRAME_INTERVAL_MS, self._drain_events)
+        
+    def _poll_network(self):
+        """Service the MQTT socket and run timed jobs on the Tk loop (NETWORK_ON_MAIN_LOOP)"""
+        self.loop_driver.poll()
+        self._watch_sockets()
+        delay = self.loop_driver.next_due_in(FRAME_INTERVAL_MS / 1000)
+        self.root.after(max(1, int(delay * 1000)), self._poll_network)
+        
+    def _watch_sockets(self):
+        """Keep a Tk file handler on each open MQTT socket, so messages are read as they arrive"""
+        if not hasattr(self.root.tk, "createfilehandler"):
+            return  # Windows Tk has no file handlers: the polls read the socket
+        sockets = {sock.fileno(): session for sock, session in self.loop_driver.sockets().items()}
+        for fd, session in list(self.file_handlers.items()):
+            if sockets.get(fd) is not session:
+                self.root.tk.deletefilehandler(fd)
+                del self.file_handlers[fd]
+        for fd, session in sockets.items():
+            if fd not in self.file_handlers:
+                self.root.tk.createfilehandler(fd, tk.READABLE,
+                                               lambda fd, mask, session=session: self._on_socket_readable(session))
+                self.file_handlers[fd] = session
+                
+    def _on_socket_readable(self, session):
+        """Tk file handler: read what arrived (dropping the handler if that closed the socket)"""
+        self.loop_driver.service(session, readable=True)
+        self._watch_sockets()
+        
+    def apply_event_steps(self, steps):
+        """Apply coalesced engine events to the widgets"""
+        for step, value in steps:
+            if step == "lines":
+                # All pending chat/system lines in one insert
+                self.append_chat_lines(value)
+            elif step == "users":
+                # Every roster change of the frame, applied as row edits
+                self.apply_roster_changes(value)
+            else:
+                callback, *args = value
+                callback(*args)
+                
+    def update_queue_stats(self):
+        """Refresh the dispatch queue stats label (at most once a second)"""
+        now = time.time()
+        if now - self.last_stats_update < 1:
+            return
+        self.last_stats_update = now
+        stats = self.inbox.stats()
+        timings = self.engine.timings
+        joined = f"Joined in {timings['first_message']:.0f} ms\n" if "first_message" in timings else ""
+        self.queue_stats_label.config(
+            text=joined +
+                 f"Queue: {stats['depth']} (max {stats['max_depth']})\n"
+                 f"Drain: {stats['avg_drain_ms']:.1f} ms avg, {stats['max_drain_ms']:.1f} ms max\n"
+                 f"Frames saved: {self.engine.stats['frames_saved']}\n"
+                 f"Stale users evicted: {self.engine.probe.stats['evicted']}")
+        
+    def format_line(self, kind, args):
+        """Format a queued chat or system event as a display line"""
+        if kind == "chat":
+            username, message, timestamp = args
+            time_str = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+            return f"[{time_str}] {username}: {message}\n"
+        message, timestamp = args
+        time_str = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+        return f"[{time_str}] *** {message} ***\n"
+        
+    def append_chat_lines(self, lines):
+        """Add (kind, args) lines to the chat log and render them with a single insert"""
+        self.apply_chat_edits(self.chat_log.append(lines))
+        
+    def apply_chat_edits(self, edits):
+        """Apply the chat log's edits to the chat display"""
+        if not edits:
+            return
+        prepended = 0
+        self.chat_display.config(state=tk.NORMAL)
+        for edit, value in edits:
+            if edit == "append":
+                self.chat_display.insert(tk.END, value)
+            elif edit == "prepend":
+                self.chat_display.insert("1.0", value)
+                prepended += value.count("\n")
+            elif edit == "trim_top":
+                self.chat_display.delete("1.0", f"{value + 1}.0")
+            elif edit == "trim_bottom":
+                self.chat_display.delete(f"end-1c - {value} lines", "end-1c")
+            elif edit == "replace":
+                self.chat_display.delete("1.0", tk.END)
+                self.chat_display.insert(tk.END, value)
+        self.chat_display.config(state=tk.DISABLED)
+        
+        if prepended:
+            # Keep the line that was at the top in place
+            self.chat_display.yview(f"{prepended + 1}.0")
+        elif self.chat_log.following:
+            self.chat_display.see(tk.END)
+        self.update_latest_button()
+        
+    def update_latest_button(self):
+        """Show how many new messages are waiting below while scrolled up"""
+        unseen = self.chat_log.unseen
+        if unseen:
+            self.latest_btn.config(text=f"⬇ {unseen} newer message(s)")
+            if not self.latest_btn.winfo_ismapped():
+                self.latest_btn.pack(fill=tk.X, before=self.chat_input_frame)
+        elif self.latest_btn.winfo_ismapped():
+            self.latest_btn.pack_forget()
+            
+    def jump_to_latest(self):
+        """Render the newest messages and follow the bottom again"""
+        self.apply_chat_edits(self.chat_log.latest())
+        
+    def on_chat_scroll(self, first, last):
+        """Scrollbar update; loads the next page when the view reaches either end"""
+        self.chat_display.vbar.set(first, last)
+        if self.chat_scroll_pending:
+            return
+        if float(first) <= 0.0 or (float(last) >= 1.0 and not self.chat_log.following):
+            self.chat_scroll_pending = True
+            self.root.after_idle(self.load_chat_page)
+            
+    def load_chat_page(self):
+        """Render an older or newer page, depending on which end is in view"""
+        self.chat_scroll_pending = False
+        first, last = self.chat_display.yview()
+        if first <= 0.0:
+            edits = self.chat_log.older()
+            if not edits and self.history is not None and self.chat_log.has_room():
+                # Past the start of the buffer: fetch a page from the message history on its
+                # writer thread, and render it when it comes back through the inbox
+                oldest_id = self.chat_log.oldest_history_id()
+                if oldest_id is not None and not self.history_page_pending:
+                    self.history_page_pending = True
+                    engine = self.engine
+                    self.history.recent_after_writes(
+                        engine.channel, self.chat_log.page,
+                        lambda messages: self.inbox.put("call", self.show_history_page, engine, oldest_id, messages),
+                        before_id=oldest_id)
+            self.apply_chat_edits(edits)
+        elif last >= 1.0:
+            self.apply_chat_edits(self.chat_log.newer())
+            
+    def add_chat_message(self, username, message, timestamp):
+        """Add a chat message to the display"""
+        self.append_chat_lines([("chat", (username, message, timestamp))])
+        
+    def add_system_message(self, message):
+        """Add a system message to the display"""
+        self.append_chat_lines([("system", (message, time.time()))])
+        
+    def apply_roster_changes(self, changes):
+        """Insert and delete just the users listbox rows that changed"""
+        edits = self.roster_view.apply(changes)
+        if len(edits) > len(self.roster_view) // 2:
+            # Mostly new rows (joining a big room): one bulk insert is cheaper
+            self.users_listbox.delete(0, tk.END)
+            self.users_listbox.insert(tk.END, *self.roster_view)
+            return
+        for edit, index, user in edits:
+            if edit == "insert":
+                self.users_listbox.insert(index, user)
+            else:
+                self.users_listbox.delete(index)
+                
+    def update_users_list(self, users=None):
+        """Rebuild the online users list"""
+        if users is None:
+            users = self.engine.online_users
+        self.roster_view = SortedRoster(users)
+        self.users_listbox.delete(0, tk.END)
+        self.users_listbox.insert(tk.END, *self.roster_view)
+            
+    def on_closing(self):
+        """Handle window closing"""
+        session = self.session
+        engines = list(session.rooms.values()) if session is not None else [self.engine]
+        
+        def _cleanup_and_exit():
+            """Cleanup function that runs in background"""
+            try:
+                for engine in engines:
+                    engine.disconnect()
+                if session is not None:
+                    session.close()
+                if self.history is not None:
+                    self.history.close()
+            except:
+                pass  # Ignore errors during cleanup
+            finally:
+                # Destroy window in main thread
+                self.root.after(0, self.root.destroy)
+        
+        # Set connected to False immediately
+        for engine in engines:
+            engine.connected = False
+        
+        # Run cleanup in background thread
+        cleanup_thread = threading.Thread(target=_cleanup_and_exit, daemon=True)
+        cleanup_thread.start()
+        
+        # Give a short timeout for cleanup, then force close
+        self.root.after(1000, self.root.destroy)
+        
+    def run(self):
+        """Start the application"""
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.root.after(FRAME_INTERVAL_MS, self._drain_events)
+        if self.loop_driver is not None:
+            self.root.after(FRAME_INTERVAL_MS, self._poll_network)
+        self.root.mainloop()
+
+if __name__ == "__main__":
+    # Check for required packages
+    missing = [package for package in ("paho", "cryptography") if importlib.util.find_spec(package) is None]
+    if missing:
+        print(f"Missing required package: {', '.join(missing)}")
+        print("\nPlease install required packages:")
+        print("pip install paho-mqtt cryptography")
+        input("Press Enter to exit...")
+        exit(1)
+        
+    app = SecureMQTTChat()
     app.run()
\ No newline at end of file
@@ -0,0 +1,30 @@
+"""
+MQChat core - the GUI-free chat engine shared by the desktop and Android apps
+"""
+
+from .engine import (
+    ChatEngine,
+    ROOM_OPTION_DEFAULTS,
+    NEW_ROOM_OPTIONS,
+    EVENT_CONNECTED,
+    EVENT_CONNECTION_FAILED,
+    EVENT_DISCONNECTED,
+    EVENT_RECONNECTING,
+    EVENT_RECONNECTED,
+    EVENT_CHAT_MESSAGE,
+    EVENT_SYSTEM_MESSAGE,
+    EVENT_USERS_CHANGED,
+    EVENT_KEY_ROTATED,
+    EVENT_KEY_DERIVED,
+)
+from .session import BrokerSession, new_mqtt_client, EVENT_UNREAD_CHANGED
+from .eventloop import LoopDriver
+from .power import PowerPolicy, TrafficMeter
+from .transfer import EVENT_FILE_OFFERED, EVENT_FILE_PROGRESS, EVENT_FILE_DONE
+from .wire import WIRE_V1, WIRE_V2
+from .ciphers import CipherSet, SUITES as CIPHER_SUITES
+from .compress import COMPRESSIONS, train_dictionary
+from .keys import RoomKeyring, key_fingerprint, derive_key, derive_room_key, KDF_LEGACY, KDF_SCRYPT
+from .roomstore import RoomStore
+from .history import MessageHistory
+from .chatlog import ChatLog
@@ -0,0 +1,78 @@
+"""
+MQChat outbound batching
+Messages sent in a burst (bots, pasted text) are held for a short window and
+published as one encrypted frame, saving an encrypt and a broker fan-out per
+message. The frame's plaintext is a JSON list of the usual message dicts and
+its v2 header carries FLAG_BATCH; receivers unpack it into individual chat
+lines in order.
+"""
+
+import threading
+
+from .scheduler import default_scheduler
+
+DEFAULT_MAX_MESSAGES = 50  # Flush early once this many messages are waiting
+DEFAULT_MAX_BYTES = 32 * 1024  # ...or once their JSON reaches this size
+
+
+class OutboundBatcher:
+    """Collects messages for window_ms, then hands the whole batch to flush_callback
+
+    The messages were echoed locally when added, so if flush_callback raises,
+    error_callback(batch, error) is told which of them never left.
+    """
+
+    def __init__(self, flush_callback, window_ms, max_messages=DEFAULT_MAX_MESSAGES,
+                 max_bytes=DEFAULT_MAX_BYTES, scheduler=None, error_callback=None):
+        self.flush_callback = flush_callback
+        self.error_callback = error_callback
+        self.scheduler = scheduler or default_scheduler()
+        self.window = window_ms / 1000.0
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_bytes = 0
+        self._timer = None
+        self.stats = {"messages": 0, "frames": 0, "frames_saved": 0}
+
+    def add(self, message_data, size):
+        """Queue one message dict (about `size` bytes of JSON); sent when the window ends or a cap is hit"""
+        # Sending under the lock keeps batches in order when the timer and a cap flush race
+        with self._lock:
+            self._pending.append(message_data)
+            self._pending_bytes += size
+            if len(self._pending) >= self.max_messages or self._pending_bytes >= self.max_bytes:
+                self._send(self._take())
+            elif self._timer is None:
+                self._timer = self.scheduler.call_later(self.window, self.flush, name="send batch")
+
+    def flush(self):
+        """Send whatever is waiting now"""
+        with self._lock:
+            batch = self._take()
+            if batch:
+                self._send(batch)
+
+    def _take(self):
+        """Remove and return the pending messages (caller holds the lock)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_bytes = self._pending, [], 0
+        return batch
+
+    def _send(self, batch):
+        self.stats["messages"] += len(batch)
+        self.stats["frames"] += 1
+        self.stats["frames_saved"] = self.stats["messages"] - self.stats["frames"]
+        try:
+            self.flush_callback(batch)
+        except Exception as e:
+            print(f"Error sending message batch: {e}")
+            if self.error_callback is not None:
+                self.error_callback(batch, e)
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,166 @@
+"""
+MQChat chat log
+The messages of the current room live in a ring buffer; only a bounded
+window of them is rendered in the chat widget. ChatLog does the bookkeeping
+and returns the edits a view has to make, so the GUI only applies them:
+
+    ("append", text)         add lines at the bottom
+    ("prepend", text)        add lines at the top (an older page)
+    ("trim_top", lines)      delete this many lines from the top
+    ("trim_bottom", lines)   delete this many lines from the bottom
+    ("replace", text)        replace everything (jump back to the latest page)
+
+While the view follows the bottom, new messages are appended and the top is
+trimmed in batches once the window overflows. Scrolling to the top renders
+the previous page from the buffer (trimming the bottom), after which new
+messages are only buffered until the view scrolls back down.
+"""
+
+from collections import deque
+
+DEFAULT_CAPACITY = 10000  # Messages kept in memory
+DEFAULT_WINDOW = 500  # Messages rendered in the widget
+DEFAULT_PAGE = 100  # Messages rendered per scroll step
+DEFAULT_TRIM_BATCH = 100  # Overflow allowed before the widget is trimmed
+
+
+class ChatLog:
+    """Ring buffer of (kind, args, history_id) entries plus the rendered window over it"""
+
+    def __init__(self, format_entry, capacity=DEFAULT_CAPACITY, window=DEFAULT_WINDOW,
+                 page=DEFAULT_PAGE, trim_batch=DEFAULT_TRIM_BATCH):
+        if capacity < window + trim_batch + page:
+            raise ValueError("capacity must exceed the rendered window")
+        self.format_entry = format_entry  # (kind, args) -> display text ending in "\n"
+        self.window = window
+        self.page = page
+        self.trim_batch = trim_batch
+
+        self.entries = deque(maxlen=capacity)
+        self.first_seq = 0  # Sequence number of entries[0]
+        self.render_start = 0  # Rendered entries are [render_start, render_end)
+        self.render_end = 0
+        self.rendered_lines = deque()  # Display lines of each rendered entry
+        self.stats = {"trimmed": 0, "pages_loaded": 0}
+
+    @property
+    def next_seq(self):
+        return self.first_seq + len(self.entries)
+
+    @property
+    def following(self):
+        """True when the newest message is rendered (the view tracks the bottom)"""
+        return self.render_end == self.next_seq
+
+    @property
+    def rendered(self):
+        return self.render_end - self.render_start
+
+    @property
+    def unseen(self):
+        """Buffered messages below the rendered window"""
+        return self.next_seq - self.render_end
+
+    def _entry(self, seq):
+        return self.entries[seq - self.first_seq]
+
+    def _render(self, start, end):
+        """Display text of entries [start, end) and the line count of each"""
+        texts = [self.format_entry(kind, args)
+                 for kind, args, _ in (self._entry(seq) for seq in range(start, end))]
+        return "".join(texts), [text.count("\n") for text in texts]
+
+    def clear(self):
+        """Forget every message (switching rooms); returns the view edits"""
+        self.entries.clear()
+        self.first_seq = self.render_start = self.render_end = 0
+        self.rendered_lines.clear()
+        return [("replace", "")]
+
+    def append(self, lines):
+        """Add (kind, args) lines at the bottom; returns the view edits"""
+        was_following = self.following
+        start = self.next_seq
+        for kind, args in lines:
+            if len(self.entries) == self.entries.maxlen:
+                self.first_seq += 1
+            self.entries.append((kind, args, None))
+        if not was_following:
+            return []
+        if self.render_start < self.first_seq:
+            return self.latest()  # More lines than the buffer holds arrived at once
+
+        text, counts = self._render(start, self.next_seq)
+        edits = [("append", text)]
+        self.rendered_lines.extend(counts)
+        self.render_end = self.next_seq
+        if self.rendered > self.window + self.trim_batch:
+            edits.append(self._trim_top(self.rendered - self.window))
+        return edits
+
+    def prepend_history(self, lines):
+        """Add stored (kind, args, history_id) entries above the oldest one; returns the number added"""
+        added = 0
+        for entry in reversed(lines):
+            if len(self.entries) == self.entries.maxlen:
+                break
+            self.entries.appendleft(entry)
+            self.first_seq -= 1
+            added += 1
+        return added
+
+    def oldest_history_id(self):
+        """History id of the oldest buffered entry, if it came from the history store"""
+        return self.entries[0][2] if self.entries else None
+
+    def has_room(self):
+        """True while older entries can still be added to the buffer"""
+        return len(self.entries) < self.entries.maxlen
+
+    def older(self):
+        """Render the page above the window; returns the view edits ([] at the top of the buffer)"""
+        if self.render_start <= self.first_seq:
+            return []
+        start = max(self.first_seq, self.render_start - self.page)
+        text, counts = self._render(start, self.render_start)
+        edits = [("prepend", text)]
+        self.rendered_lines.extendleft(reversed(counts))
+        self.render_start = start
+        self.stats["pages_loaded"] += 1
+        if self.rendered > self.window + self.trim_batch:
+            edits.append(self._trim_bottom(self.rendered - self.window))
+        return edits
+
+    def newer(self):
+        """Render the page below the window; returns the view edits ([] when following)"""
+        if self.following:
+            return []
+        if self.render_start < self.first_seq:
+            return self.latest()  # Rendered lines fell out of the buffer while scrolled up
+        end = min(self.next_seq, self.render_end + self.page)
+        text, counts = self._render(self.render_end, end)
+        edits = [("append", text)]
+        self.rendered_lines.extend(counts)
+        self.render_end = end
+        self.stats["pages_loaded"] += 1
+        if self.rendered > self.window + self.trim_batch:
+            edits.append(self._trim_top(self.rendered - self.window))
+        return edits
+
+    def latest(self):
+        """Re-render the newest window (jump to bottom)"""
+        self.render_end = self.next_seq
+        self.render_start = max(self.first_seq, self.render_end - self.window)
+        text, counts = self._render(self.render_start, self.render_end)
+        self.rendered_lines = deque(counts)
+        return [("replace", text)]
+
+    def _trim_top(self, count):
+        self.render_start += count
+        self.stats["trimmed"] += count
+        return ("trim_top", sum(self.rendered_lines.popleft() for _ in range(count)))
+
+    def _trim_bottom(self, count):
+        self.render_end -= count
+        self.stats["trimmed"] += count
+        return ("trim_bottom", sum(self.rendered_lines.pop() for _ in range(count)))
@@ -0,0 +1,115 @@
+"""
+MQChat cipher suites
+Every suite takes the same 32-byte room key and exposes
+encrypt(plaintext, aad) / decrypt(data, aad) on raw bytes. The suite id is
+carried in the v2 envelope header so receivers pick the right one.
+
+    fernet             AES-128-CBC + HMAC-SHA256 (original, works with wire v1)
+    aes-gcm            AES-256-GCM, single AEAD pass, 28 bytes overhead
+    chacha20-poly1305  ChaCha20-Poly1305, fast without AES hardware (phones)
+"""
+
+import base64
+import os
+
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from . import wire
+
+SUITE_FERNET = wire.SUITE_FERNET
+SUITE_AES_GCM = 1
+SUITE_CHACHA20 = 2
+
+DEFAULT_SUITE = "fernet"
+
+
+class FernetSuite:
+    suite_id = SUITE_FERNET
+    name = "fernet"
+
+    def __init__(self, key):
+        self._fernet = Fernet(key)
+
+    def encrypt_token(self, plaintext):
+        """Encrypt to a standard (urlsafe-base64) Fernet token"""
+        return self._fernet.encrypt(plaintext)
+
+    def decrypt_token(self, token):
+        """Decrypt a standard Fernet token"""
+        return self._fernet.decrypt(token)
+
+    def encrypt(self, plaintext, aad=b""):
+        # Fernet authenticates the whole token itself and has no AAD input
+        return wire.fernet_to_binary(self._fernet.encrypt(plaintext))
+
+    def decrypt(self, data, aad=b""):
+        return self._fernet.decrypt(wire.binary_to_fernet(data))
+
+
+class AEADSuite:
+    """Shared nonce handling for the AEAD suites: nonce || ciphertext || tag"""
+    suite_id = None
+    name = None
+    aead_class = None
+    hkdf_info = None
+    NONCE_SIZE = 12
+
+    def __init__(self, key):
+        # Give each suite its own subkey instead of reusing the Fernet key bytes
+        raw_key = base64.urlsafe_b64decode(key)
+        subkey = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                      info=self.hkdf_info).derive(raw_key)
+        self._aead = self.aead_class(subkey)
+
+    def encrypt(self, plaintext, aad=b""):
+        nonce = os.urandom(self.NONCE_SIZE)
+        return nonce + self._aead.encrypt(nonce, plaintext, aad)
+
+    def decrypt(self, data, aad=b""):
+        nonce = data[:self.NONCE_SIZE]
+        return self._aead.decrypt(nonce, data[self.NONCE_SIZE:], aad)
+
+
+class AESGCMSuite(AEADSuite):
+    suite_id = SUITE_AES_GCM
+    name = "aes-gcm"
+    aead_class = AESGCM
+    hkdf_info = b"mqchat aes-256-gcm v1"
+
+
+class ChaCha20Suite(AEADSuite):
+    suite_id = SUITE_CHACHA20
+    name = "chacha20-poly1305"
+    aead_class = ChaCha20Poly1305
+    hkdf_info = b"mqchat chacha20-poly1305 v1"
+
+
+SUITES = {suite.name: suite for suite in (FernetSuite, AESGCMSuite, ChaCha20Suite)}
+SUITES_BY_ID = {suite.suite_id: suite for suite in SUITES.values()}
+
+
+class CipherSet:
+    """All cipher suites for one room key, built on first use"""
+
+    def __init__(self, key):
+        self.key = key
+        self._suites = {}
+
+    def get(self, suite_id):
+        """Return the suite instance for an envelope suite id"""
+        suite = self._suites.get(suite_id)
+        if suite is None:
+            suite_class = SUITES_BY_ID.get(suite_id)
+            if suite_class is None:
+                raise wire.WireError(f"Unknown cipher suite {suite_id}")
+            suite = self._suites[suite_id] = suite_class(self.key)
+        return suite
+
+    def by_name(self, name):
+        """Return the suite instance for a room config suite name"""
+        if name not in SUITES:
+            raise ValueError(f"Unknown cipher suite: {name}")
+        return self.get(SUITES[name].suite_id)
@@ -0,0 +1,174 @@
+"""
+MQChat payload compression
+The JSON plaintext is compressed before encryption (ciphertext doesn't
+compress) when it is at least `threshold` bytes and compression actually
+makes it smaller, so one-word messages go out untouched. The method and the
+dictionary id are recorded in the v2 header, so receivers handle compressed
+and plain payloads alike.
+
+    zlib   always available (raw deflate)
+    zstd   needs the optional `zstandard` package (pip install zstandard)
+
+A dictionary primes the compressor with text common to the room's messages,
+which is what makes short messages compressible at all. Every client knows
+the built-in dictionary (the JSON chat boilerplate); a room can also carry
+its own trained dictionary, which every member needs in their room config.
+"""
+
+import base64
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import wire
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD)
+
+DEFAULT_THRESHOLD = 64  # Bytes of JSON below which messages are never compressed
+MAX_DECOMPRESSED = 1024 * 1024  # Refuse to inflate a single message beyond 1 MB
+MAX_DICT_SIZE = 32 * 1024  # zlib only looks back 32 KB, so bigger dictionaries don't help
+
+# Text that appears in every chat message; the most common parts go last,
+# where deflate finds them with the shortest distances
+BUILTIN_DICTIONARY = (
+    b" the to and you that it is in for of on with this was have just but not what "
+    b"can https://www. http:// .com lol ok yes no thanks :) "
+    b'", "timestamp": 17'
+    b'{"user": "", "message": "'
+)
+
+COMPRESSION_FLAGS = wire.FLAG_ZLIB | wire.FLAG_ZSTD
+
+
+def zstd_available():
+    return zstandard is not None
+
+
+def dictionary_id(dictionary):
+    """4-byte id carried in the header so receivers pick the same dictionary"""
+    return hashlib.sha256(b"mqchat dict v1|" + dictionary).digest()[:wire.DICT_ID_SIZE]
+
+
+def encode_dictionary(dictionary):
+    """Room config form of a dictionary (base64 text)"""
+    return base64.b64encode(dictionary).decode()
+
+
+def decode_dictionary(text):
+    return base64.b64decode(text) if text else None
+
+
+def train_dictionary(samples, method=COMPRESSION_ZLIB, size=4096):
+    """
+    Build a room dictionary from sample plaintexts (e.g. recent message JSON).
+
+    zstd can train a real dictionary when given enough samples; otherwise the
+    dictionary is the most recent sample text, which both methods can use.
+    """
+    samples = [s if isinstance(s, bytes) else s.encode() for s in samples]
+    size = min(size, MAX_DICT_SIZE)
+    if method == COMPRESSION_ZSTD and zstandard is not None:
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            pass  # Too few samples to train on
+    return b"".join(samples)[-size:]
+
+
+class DictionarySet:
+    """Compression dictionaries this client can read, by id (always includes the built-in one)"""
+
+    def __init__(self):
+        self._dictionaries = {}  # dict_id -> bytes
+        self._zstd_dicts = {}  # dict_id -> zstandard.ZstdCompressionDict
+        self.add(BUILTIN_DICTIONARY)
+
+    def add(self, dictionary):
+        """Register a dictionary and return its id"""
+        dict_id = dictionary_id(dictionary)
+        self._dictionaries[dict_id] = dictionary
+        return dict_id
+
+    def get(self, dict_id):
+        return self._dictionaries.get(dict_id)
+
+    def zstd_dict(self, dict_id):
+        """Prepared zstd dictionary (built once per id)"""
+        if dict_id not in self._zstd_dicts:
+            self._zstd_dicts[dict_id] = zstandard.ZstdCompressionDict(self._dictionaries[dict_id])
+        return self._zstd_dicts[dict_id]
+
+    def __contains__(self, dict_id):
+        return dict_id in self._dictionaries
+
+    def decompress(self, data, flags, dict_id=None):
+        """Undo the compression described by the header flags"""
+        dictionary = self._dictionaries.get(dict_id) if dict_id is not None else None
+        if dict_id is not None and dictionary is None:
+            raise wire.WireError("Unknown compression dictionary")
+
+        if flags & wire.FLAG_ZLIB:
+            if dictionary is None:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            else:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+            plaintext = decompressor.decompress(data, MAX_DECOMPRESSED)
+            if decompressor.unconsumed_tail:
+                raise wire.WireError("Compressed message too large")
+            return plaintext
+
+        if flags & wire.FLAG_ZSTD:
+            if zstandard is None:
+                raise wire.WireError("zstd message received but zstandard is not installed")
+            dict_data = self.zstd_dict(dict_id) if dictionary is not None else None
+            decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+            return decompressor.decompress(data, max_output_size=MAX_DECOMPRESSED)
+
+        return data
+
+
+class Compressor:
+    """Sending side: compresses plaintexts for one room"""
+
+    def __init__(self, method=COMPRESSION_NONE, threshold=DEFAULT_THRESHOLD, dictionary=None,
+                 dictionaries=None):
+        if method not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {method}")
+        if method == COMPRESSION_ZSTD and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package (pip install zstandard)")
+
+        self.method = method
+        self.threshold = threshold
+        self.dictionaries = dictionaries or DictionarySet()
+        self.dict_id = self.dictionaries.add(dictionary or BUILTIN_DICTIONARY)
+        self.dictionary = self.dictionaries.get(self.dict_id)
+
+        self._zstd = None
+        if method == COMPRESSION_ZSTD:
+            # The dictionary id is in our header, so zstd doesn't need its own
+            self._zstd = zstandard.ZstdCompressor(level=3, dict_data=self.dictionaries.zstd_dict(self.dict_id),
+                                                  write_dict_id=False)
+
+    def compress(self, plaintext):
+        """Return (flags, dict_id, data); data is the plaintext itself when compression doesn't pay"""
+        if self.method == COMPRESSION_NONE or len(plaintext) < self.threshold:
+            return 0, None, plaintext
+
+        if self.method == COMPRESSION_ZLIB:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary)
+            data = compressor.compress(plaintext) + compressor.flush()
+            flags = wire.FLAG_ZLIB
+        else:
+            data = self._zstd.compress(plaintext)
+            flags = wire.FLAG_ZSTD
+
+        if len(data) + wire.DICT_ID_SIZE >= len(plaintext):
+            return 0, None, plaintext
+        return flags, self.dict_id, data
@@ -0,0 +1,113 @@
+"""
+MQChat dispatch queue
+Thread-safe inbox between paho's network thread and a GUI main loop. The
+network side puts events; the GUI drains them in batches once per frame.
+"""
+
+import threading
+import time
+from collections import deque
+
+
+class EventQueue:
+    def __init__(self):
+        self._items = deque()
+        self._lock = threading.Lock()
+
+        # Stats for debugging and the benchmarks
+        self.enqueued = 0
+        self.drained = 0
+        self.max_depth = 0
+        self.drain_count = 0
+        self.last_drain_ms = 0.0
+        self.max_drain_ms = 0.0
+        self.total_drain_ms = 0.0
+
+    def put(self, kind, *args):
+        """Queue an event from any thread"""
+        with self._lock:
+            self._items.append((kind, args))
+            self.enqueued += 1
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+
+    def drain(self, max_items=None):
+        """Take up to max_items pending events (all of them by default)"""
+        with self._lock:
+            if max_items is None or max_items >= len(self._items):
+                items = list(self._items)
+                self._items.clear()
+            else:
+                items = [self._items.popleft() for _ in range(max_items)]
+            self.drained += len(items)
+        return items
+
+    def record_drain(self, seconds):
+        """Record how long the GUI spent applying one drain"""
+        ms = seconds * 1000.0
+        self.drain_count += 1
+        self.last_drain_ms = ms
+        self.total_drain_ms += ms
+        if ms > self.max_drain_ms:
+            self.max_drain_ms = ms
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Return a snapshot of the queue stats"""
+        average = self.total_drain_ms / self.drain_count if self.drain_count else 0.0
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "drained": self.drained,
+            "drains": self.drain_count,
+            "last_drain_ms": self.last_drain_ms,
+            "avg_drain_ms": average,
+            "max_drain_ms": self.max_drain_ms,
+        }
+
+
+def coalesce(events):
+    """
+    Fold a batch of drained events into what a frame actually needs to apply.
+
+    Returns a list of steps in arrival order: ("lines", [event, ...]) for runs
+    of chat/system lines that can be rendered with one insert, ("users",
+    changes) with every roster change of the batch in order, and ("call",
+    (callback, args)) for anything else. Lines queued before a call are
+    flushed first so ordering is kept.
+    """
+    steps = []
+    lines = []
+    users = []
+    for kind, args in events:
+        if kind in ("chat", "system"):
+            lines.append((kind, args))
+        elif kind == "users":
+            users.extend(args[0])
+        else:
+            if lines:
+                steps.append(("lines", lines))
+                lines = []
+            steps.append(("call", args))
+    if lines:
+        steps.append(("lines", lines))
+    if users:
+        steps.append(("users", users))
+    return steps
+
+
+class FrameTimer:
+    """Tiny helper for keeping a drain inside its frame budget"""
+
+    def __init__(self, budget_ms):
+        self.budget = budget_ms / 1000.0
+        self.start = time.perf_counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def expired(self):
+        return self.elapsed() >= self.budget
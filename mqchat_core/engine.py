@@ -0,0 +1,869 @@
+"""
+MQChat engine
+GUI-free chat protocol: owns the MQTT client, cipher, roster and timers and
+emits events to whichever front end subscribes (Tkinter, Kivy or a script).
+"""
+
+import json
+import secrets
+import textwrap
+import threading
+import time
+
+from cryptography.fernet import InvalidToken
+
+from . import roster, wire
+from .ciphers import SUITES, DEFAULT_SUITE
+from .batcher import OutboundBatcher
+from .compress import (Compressor, DictionarySet, COMPRESSION_FLAGS, COMPRESSION_NONE,
+                       DEFAULT_THRESHOLD, decode_dictionary)
+from .transfer import FileTransfers
+from .scheduler import default_scheduler
+from .session import BrokerSession, TopicRouter, LEAVE_TIMEOUT, session_client_id
+from .mqtt5 import (TopicAliases, PROTOCOLS, PROTOCOL_V311, PROTOCOL_V5, PROTOCOL_AUTO, CHAT_MESSAGE_EXPIRY,
+                    subscribe_options)
+from .presence import (LivenessProbe, HEARTBEAT_INTERVAL, PRESENCE_MODES, PRESENCE_HEARTBEAT,
+                       PRESENCE_LEAN)
+from .keys import (RoomKeyring, derive_room_key, generate_passphrase, room_salt, is_cached,
+                   KDFS, KDF_LEGACY, KDF_SCRYPT)
+
+# Events emitted by ChatEngine. Callbacks run on the thread that produced the
+# event (usually paho's network thread), so GUI front ends must hop back to
+# their own main loop before touching widgets.
+EVENT_CONNECTED = "connected"                  # ()
+EVENT_CONNECTION_FAILED = "connection_failed"  # (rc)
+EVENT_DISCONNECTED = "disconnected"            # (rc)
+EVENT_RECONNECTING = "reconnecting"            # (attempt, delay) - lost the broker, retrying
+EVENT_RECONNECTED = "reconnected"              # (session_present)
+EVENT_CHAT_MESSAGE = "chat_message"            # (username, message, timestamp)
+EVENT_SYSTEM_MESSAGE = "system_message"        # (message)
+EVENT_USERS_CHANGED = "users_changed"          # (list of roster changes, see mqchat_core.roster)
+EVENT_KEY_ROTATED = "key_rotated"              # (epoch, new_passphrase, old_passphrase)
+EVENT_KEY_DERIVED = "key_derived"              # (cache_id, key, passphrase) - worth saving
+# File transfer events (EVENT_FILE_OFFERED, EVENT_FILE_PROGRESS, EVENT_FILE_DONE) are in transfer.py
+
+RECONCILE_GRACE = 1.0  # Seconds after resubscribing for retained presence to arrive
+JOIN_ANNOUNCE_INTERVAL = 60  # Don't repeat "joined" for the same user within this window
+ROTATION_GRACE = 600  # Seconds old keys stay readable after a key rotation
+
+# Per-room options stored alongside the saved room config
+ROOM_OPTION_DEFAULTS = {
+    "wire_version": wire.WIRE_V1,  # v1 until every client in the room can read v2
+    "cipher_suite": DEFAULT_SUITE,  # AEAD suites need wire v2 (suite id lives in its header)
+    "kdf": KDF_LEGACY,  # Rooms saved before scrypt existed keep the original derivation
+    "compression": COMPRESSION_NONE,  # zlib / zstd need wire v2 (the method lives in its header)
+    "compress_threshold": DEFAULT_THRESHOLD,  # Smaller messages are sent uncompressed
+    "compression_dict": "",  # Base64 room dictionary; empty uses the built-in one
+    "batch_window_ms": 0,  # Coalesce bursts of sends into one frame (wire v2); 0 sends each at once
+    "file_chunk_kb": 64,  # File transfer chunk size
+    "file_window": 16,  # File chunks in flight (published, not yet acknowledged)
+    "file_max_mb": 256,  # Larger incoming files are not downloaded
+    "presence": PRESENCE_HEARTBEAT,  # "lean" publishes presence only on change (see presence.py)
+    "presence_expiry": 0,  # Seconds before a silent heartbeat member is pinged; 0 = 2.5 of their intervals
+    "mqtt_protocol": PROTOCOL_V311,  # "5" or "auto" (v5, falling back to 3.1.1) - see mqtt5.py
+}
+
+# Options for rooms created from scratch in a front end
+NEW_ROOM_OPTIONS = dict(ROOM_OPTION_DEFAULTS, kdf=KDF_SCRYPT, presence=PRESENCE_LEAN,
+                        mqtt_protocol=PROTOCOL_AUTO)
+
+
+class ChatEngine:
+    def __init__(self, username="", channel="", scheduler=None, driver=None, install_id=None):
+        # Timed jobs (heartbeats, retries, key retirement) run on a scheduler shared by every room,
+        # or on the GUI loop with the connection when a LoopDriver is given (see eventloop.py)
+        self.driver = driver
+        self.scheduler = scheduler or (driver.scheduler if driver is not None else default_scheduler())
+
+        # MQTT and crypto variables. The broker session sets mqtt_client, connected
+        # and protocol (see session.py)
+        self.session = None
+        # Part of our persistent MQTT client id; front ends pass the one stored for the install
+        # (see session.load_install_id), otherwise it lasts as long as this engine
+        self.install_id = install_id or secrets.token_hex(16)
+        self.session_options = {}  # Extra BrokerSession arguments for connect() (keepalive, meter)
+        self.mqtt_client = None
+        self.keyring = RoomKeyring()  # Active key epochs, indexed by key id
+        self.key_retire_jobs = []
+        self.connected = False
+        self.username = username
+        self.channel = ""
+
+        # Topics
+        self.messages_topic = ""
+        self.presence_topic = ""
+        self.userlist_topic = ""
+        self.keys_topic = ""
+        self.files_topic = ""
+        self.probe_topic = ""
+
+        # Room options (see ROOM_OPTION_DEFAULTS)
+        self.wire_version = wire.WIRE_V1
+        self.cipher_suite = DEFAULT_SUITE
+        self.kdf = KDF_LEGACY
+        self.key_cache = {}  # KDF cache id -> derived key string (persisted by the front end)
+        self.dictionaries = DictionarySet()
+        self.compressor = Compressor(dictionaries=self.dictionaries)
+        self.batcher = None  # OutboundBatcher when the room has a batch window
+        self.files = FileTransfers(self)
+        self.presence_mode = PRESENCE_HEARTBEAT
+
+        # User tracking
+        self.online_users = set()
+        self.heartbeat_interval = HEARTBEAT_INTERVAL  # Heartbeat rooms; 0 leaves liveness to our last will
+        self.heartbeat_job = None
+        self.probe = LivenessProbe(self)  # Pings members whose presence is in doubt
+        self.recent_joins = {}  # Track recent joins to prevent spam
+
+        # Event subscribers: event name -> list of callbacks
+        self._listeners = {}
+
+        # Counters for debugging and benchmarks
+        self.stats = {"dropped_unknown_key": 0, "undecryptable": 0,
+                      "compressed": 0, "compression_saved_bytes": 0, "frames_saved": 0}
+
+        # Milliseconds from connect() to CONNACK ("connect"), to every SUBACK ("subscribed") and to
+        # the first message ("first_message"), and from disconnect() to the broker acknowledging
+        # our leave ("leave") and to the connection closing ("disconnect")
+        self.timings = {}
+        self._connect_started = None
+        self._pending_subscriptions = set()
+        self._awaiting_first_message = False
+
+        # Reconnecting (the session's network loop retries; rooms catch up on their own)
+        self._joined = False  # Set once the room has been joined on this connect() or join()
+        self._unconfirmed = set()  # Roster members not seen again since a sessionless reconnect
+        self._reconcile_job = None
+        self.stats["reconnects"] = 0
+
+        # MQTT protocol: the room's choice, and what its connection speaks
+        self.mqtt_protocol = PROTOCOL_V311
+        self.protocol = PROTOCOL_V311
+        self.aliases = TopicAliases()  # v5 topic aliases (the session's, once attached)
+        self.router = TopicRouter()  # This room's topics -> handlers
+
+        if channel:
+            self.set_channel(channel)
+
+    def on(self, event, callback):
+        """Subscribe a callback to an engine event"""
+        self._listeners.setdefault(event, []).append(callback)
+
+    def off(self, event, callback):
+        """Remove a previously subscribed callback"""
+        callbacks = self._listeners.get(event, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def emit(self, event, *args):
+        """Deliver an event to every subscriber"""
+        for callback in list(self._listeners.get(event, ())):
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in {event} handler: {e}")
+
+    def set_channel(self, channel):
+        """Set the chat channel and derive its topics"""
+        self.channel = channel
+        self.messages_topic = f"chat/{channel}/messages"
+        self.presence_topic = f"chat/{channel}/presence"
+        self.userlist_topic = f"chat/{channel}/users"
+        self.keys_topic = f"chat/{channel}/keys"
+        self.files_topic = f"chat/{channel}/files"
+        self.probe_topic = f"chat/{channel}/probe"
+        self.router = TopicRouter()
+        for topic, handler in self.routes():
+            self.router.add(topic, handler)
+
+    def routes(self):
+        """(topic, handler) for each of the room's topics; a topic ending in "/" covers every topic below it"""
+        return [
+            # Chat payloads may be binary (wire v2), so pass the raw bytes
+            (self.messages_topic, lambda msg: self.handle_chat_message(msg.payload)),
+            (self.presence_topic + "/", lambda msg: self.handle_presence_message(msg.topic, msg.payload.decode(),
+                                                                                 msg.retain)),
+            (self.keys_topic, lambda msg: self.handle_key_message(msg.payload)),
+            (self.probe_topic, lambda msg: self.probe.handle_message(msg.payload)),
+            (self.files_topic + "/", lambda msg: self.files.handle_message(msg.topic, msg.payload)),
+        ]
+
+    def hot_topics(self):
+        """Topics we publish most at QoS 0 (our heartbeats), for v5 topic aliases"""
+        return [f"{self.presence_topic}/{self.username}"]
+
+    def apply_room_options(self, options=None):
+        """Apply per-room options from a saved room config, using defaults for missing keys"""
+        options = options or {}
+        wire_version = int(options.get("wire_version", ROOM_OPTION_DEFAULTS["wire_version"]))
+        if wire_version not in wire.WIRE_VERSIONS:
+            raise ValueError(f"Unsupported wire version: {wire_version}")
+        cipher_suite = options.get("cipher_suite", ROOM_OPTION_DEFAULTS["cipher_suite"])
+        if cipher_suite not in SUITES:
+            raise ValueError(f"Unknown cipher suite: {cipher_suite}")
+        if cipher_suite != "fernet" and wire_version == wire.WIRE_V1:
+            raise ValueError(f"Cipher suite {cipher_suite} needs wire format v2")
+        kdf = options.get("kdf", ROOM_OPTION_DEFAULTS["kdf"])
+        if kdf not in KDFS:
+            raise ValueError(f"Unknown key derivation: {kdf}")
+        compression = options.get("compression", ROOM_OPTION_DEFAULTS["compression"])
+        if compression != COMPRESSION_NONE and wire_version == wire.WIRE_V1:
+            raise ValueError(f"{compression} compression needs wire format v2")
+        threshold = int(options.get("compress_threshold", ROOM_OPTION_DEFAULTS["compress_threshold"]))
+        compressor = Compressor(compression, threshold, decode_dictionary(options.get("compression_dict")),
+                                self.dictionaries)
+        batch_window_ms = float(options.get("batch_window_ms", ROOM_OPTION_DEFAULTS["batch_window_ms"]))
+        if batch_window_ms and wire_version == wire.WIRE_V1:
+            raise ValueError("Send batching needs wire format v2")
+        presence_mode = options.get("presence", ROOM_OPTION_DEFAULTS["presence"])
+        if presence_mode not in PRESENCE_MODES:
+            raise ValueError(f"Unknown presence mode: {presence_mode}")
+        presence_expiry = float(options.get("presence_expiry", ROOM_OPTION_DEFAULTS["presence_expiry"]))
+        if presence_expiry < 0:
+            raise ValueError("Presence expiry can't be negative")
+        mqtt_protocol = options.get("mqtt_protocol", ROOM_OPTION_DEFAULTS["mqtt_protocol"])
+        if mqtt_protocol not in PROTOCOLS:
+            raise ValueError(f"Unknown MQTT protocol: {mqtt_protocol}")
+
+        self.wire_version = wire_version
+        self.cipher_suite = cipher_suite
+        self.kdf = kdf
+        self.presence_mode = presence_mode
+        self.probe.expiry = presence_expiry
+        self.mqtt_protocol = mqtt_protocol
+        self.key_cache = dict(options.get("derived_keys") or {})
+        self.compressor = compressor
+        if self.batcher is not None:
+            self.batcher.flush()
+        self.batcher = (OutboundBatcher(self.publish_batch, batch_window_ms, scheduler=self.scheduler,
+                                        error_callback=self.batch_failed)
+                        if batch_window_ms else None)
+        self.files.configure(
+            chunk_size=float(options.get("file_chunk_kb", ROOM_OPTION_DEFAULTS["file_chunk_kb"])) * 1024,
+            window=options.get("file_window", ROOM_OPTION_DEFAULTS["file_window"]),
+            max_file_size=float(options.get("file_max_mb", ROOM_OPTION_DEFAULTS["file_max_mb"])) * 1024 * 1024)
+
+    def set_encryption_key(self, encryption_key):
+        """Set up the room keyring from the shared passphrase"""
+        self.install_key(encryption_key, *derive_room_key(encryption_key, self.kdf, room_salt(self.channel),
+                                                          self.key_cache))
+
+    def load_key(self, encryption_key, then):
+        """Set the room key, then call then(); a key not in the cache is derived on a worker thread"""
+        if is_cached(encryption_key, self.kdf, room_salt(self.channel), self.key_cache):
+            self.set_encryption_key(encryption_key)
+            then()
+            return
+        # scrypt takes hundreds of ms on a phone: keep it off the UI thread, and
+        # finish on the scheduler (the loop thread, with a LoopDriver)
+        threading.Thread(target=self._derive_key, args=(encryption_key, then),
+                         name="mqchat-kdf", daemon=True).start()
+
+    def _derive_key(self, encryption_key, then):
+        derived = derive_room_key(encryption_key, self.kdf, room_salt(self.channel), self.key_cache)
+        self.scheduler.call_later(0, lambda: self._key_derived(encryption_key, derived, then),
+                                  name="join after key derivation")
+
+    def _key_derived(self, encryption_key, derived, then):
+        try:
+            self.install_key(encryption_key, *derived)
+            then()
+        except Exception as e:
+            print(f"Failed to join #{self.channel}: {e}")
+            self.emit(EVENT_CONNECTION_FAILED, str(e))
+
+    def install_key(self, encryption_key, key, cache_id, cached):
+        """Make a derived key the room's only key"""
+        if not cached:
+            # scrypt ran - let the front end store the result so the next connect skips it
+            self.key_cache[cache_id] = key.decode()
+            self.emit(EVENT_KEY_DERIVED, cache_id, key.decode(), encryption_key)
+
+        self.cancel_key_retirement()
+        self.keyring.clear()
+        self.keyring.add(encryption_key, make_current=True, key=key)
+
+    def setup_room(self, channel, username, encryption_key, options=None):
+        """Set up the room's topics, options and keys before joining it (raises on bad options)"""
+        self.prepare_room(channel, username, options)
+        self.set_encryption_key(encryption_key)
+
+    def prepare_room(self, channel, username, options=None):
+        """Set up the room's topics and options (raises on bad options)"""
+        self.username = username
+        self.set_channel(channel)
+        self.apply_room_options(options)
+        self.timings = {}
+        self._connect_started = time.perf_counter()
+        self._joined = False
+
+    def connect(self, server, port, channel, username, encryption_key,
+                mqtt_username="", mqtt_password="", options=None):
+        """Connect to the MQTT broker on a connection of our own (raises on failure, or emits
+        EVENT_CONNECTION_FAILED if it comes after a key derivation)"""
+        self.prepare_room(channel, username, options)
+
+        # Set MQTT authentication if provided
+        if mqtt_username:
+            self.emit(EVENT_SYSTEM_MESSAGE, f"Using MQTT authentication for user: {mqtt_username}")
+        else:
+            self.emit(EVENT_SYSTEM_MESSAGE, "Connecting with anonymous MQTT access")
+
+        def open_session():
+            session = BrokerSession(server, port, mqtt_username, mqtt_password,
+                                    client_id=session_client_id(self.install_id, username, channel),
+                                    mqtt_protocol=self.mqtt_protocol, scheduler=self.scheduler,
+                                    driver=self.driver, **self.session_options)
+            session.add_room(self, owner=True)
+            session.connect()
+
+        self.load_key(encryption_key, open_session)
+
+    def join(self, session, channel, username, encryption_key, options=None):
+        """Join a room on a broker session shared with other rooms (raises on bad options)"""
+        self.prepare_room(channel, username, options)
+        # Claimed now, so a session connecting before our key is ready already carries our will
+        if not session.claim_will(self) and self.presence_mode == PRESENCE_LEAN:
+            # The connection's last will is another room's: heartbeats are how members notice we've gone
+            self.presence_mode = PRESENCE_HEARTBEAT
+            self.emit(EVENT_SYSTEM_MESSAGE, "Lean presence needs the connection's last will, which belongs to "
+                                            "another room here - sending heartbeats instead")
+        self.load_key(encryption_key, lambda: session.add_room(self))
+
+    def last_will(self):
+        """(topic, payload) the broker publishes for us if we vanish"""
+        will_msg = json.dumps({"user": self.username, "status": "offline", "timestamp": time.time()})
+        return f"{self.presence_topic}/{self.username}", will_msg
+
+    def system_message(self, message):
+        self.emit(EVENT_SYSTEM_MESSAGE, message)
+
+    def session_connected(self, client, session_present):
+        """The session's connection is up: join the room, or catch up after a reconnect"""
+        self.connected = True
+        reconnect, self._joined = self._joined, True
+
+        if not reconnect:
+            self.mark_time("connect")
+
+            # Clear any presence left over from a previous session (lean rooms
+            # skip this: our announcement below replaces the retained record).
+            # Publishes on one connection arrive in order, so no need to wait
+            if self.presence_mode == PRESENCE_HEARTBEAT:
+                self.clear_my_presence()
+
+            # Clear our local user list
+            self.online_users.clear()
+            self.recent_joins.clear()
+            self.emit(EVENT_USERS_CHANGED, [(roster.SYNC, [])])
+
+            # Subscribing again (even to a kept session) replays the retained presence
+            self.subscribe_all(client)
+        elif session_present and not self._pending_subscriptions:
+            # The broker kept our subscriptions and queued the QoS 1 presence
+            # changes (joins, leaves, wills) we missed: they arrive next and
+            # update the roster like any other, so there is nothing to rebuild
+            pass
+        elif session_present:
+            # Dropped before every SUBACK came back, so the broker may hold only
+            # some of our subscriptions: make them again
+            self.subscribe_all(client)
+        else:
+            # Session lost (e.g. the broker restarted): resubscribe, then drop only
+            # the members whose retained presence doesn't come back
+            self._unconfirmed = set(self.online_users) - {self.username}
+            self.subscribe_all(client)
+
+        # Announce our presence (at QoS 1, so a reconnecting room hears it);
+        # heartbeat rooms keep re-announcing it, lean rooms leave liveness to
+        # the keepalive and our last will
+        self.announce_presence("online", qos=1)
+        if self.presence_mode == PRESENCE_HEARTBEAT:
+            self.start_heartbeat()
+        self.probe.probe([])  # Send any pings held back while we were offline
+
+        if reconnect:
+            self.stats["reconnects"] += 1
+            self.emit(EVENT_SYSTEM_MESSAGE, "Reconnected")
+            self.emit(EVENT_RECONNECTED, session_present)
+        else:
+            self.emit(EVENT_CONNECTED)
+
+    def session_failed(self, rc):
+        """The broker refused the session's connection"""
+        self.emit(EVENT_CONNECTION_FAILED, rc)
+
+    def session_reconnecting(self, attempt, delay):
+        """The session lost the broker and tries again in delay seconds"""
+        if attempt == 1:
+            self.emit(EVENT_SYSTEM_MESSAGE, "Connection lost - reconnecting...")
+        self.emit(EVENT_RECONNECTING, attempt, delay)
+
+    def session_lost(self, rc):
+        """The session's connection dropped (it reconnects unless we asked to leave)"""
+        self.connected = False
+        self.stop_heartbeat()
+        self.emit(EVENT_DISCONNECTED, rc)
+
+    def subscriptions(self):
+        """(topic, qos, no_local) for each of the room's subscriptions"""
+        # Chat and presence at QoS 1, so the broker queues them for our session while we reconnect.
+        # On v5 the broker doesn't echo our own chat messages and pings back (no-local)
+        subscriptions = [(self.messages_topic, 1, True), (f"{self.presence_topic}/+", 1, False),
+                         (self.keys_topic, 1, False), (self.probe_topic, 0, True)]
+        return subscriptions + [(topic, 1, False) for topic in self.files.subscriptions()]
+
+    def subscribe_all(self, client):
+        """Subscribe to the room's topics (SUBACKs arrive on the network thread, after we return)"""
+        self._awaiting_first_message = True
+        self._pending_subscriptions = {self.subscribe(client, topic, qos, no_local)
+                                       for topic, qos, no_local in self.subscriptions()}
+
+    def subscribe(self, client, topic, qos, no_local=False):
+        """Subscribe to one topic; returns the message id its SUBACK will carry"""
+        if self.protocol == PROTOCOL_V5:
+            return client.subscribe(topic, options=subscribe_options(qos, no_local))[1]
+        return client.subscribe(topic, qos=qos)[1]
+
+    def on_mqtt_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        """Called when the broker acknowledges a subscription"""
+        if mid not in self._pending_subscriptions:
+            return  # Another room's (or a file transfer's)
+        self._pending_subscriptions.discard(mid)
+        if self._pending_subscriptions:
+            return
+        if "subscribed" not in self.timings:
+            self.mark_time("subscribed")
+        if self._unconfirmed and self._reconcile_job is None:
+            self._reconcile_job = self.scheduler.call_later(RECONCILE_GRACE, self.finish_reconcile,
+                                                            name="roster reconcile")
+
+    def finish_reconcile(self):
+        """Drop members whose retained presence didn't come back after a sessionless reconnect"""
+        self._reconcile_job = None
+        gone, self._unconfirmed = self._unconfirmed, set()
+        for user in gone:
+            self.remove_user(user)
+
+    def mark_time(self, name):
+        """Record milliseconds since connect() under timings[name]"""
+        if self._connect_started is not None:
+            self.timings[name] = (time.perf_counter() - self._connect_started) * 1000
+
+    def on_mqtt_message(self, client, userdata, msg):
+        """Called when MQTT message received (for this room alone; a session routes to its rooms itself)"""
+        handler = self.router.match(msg.topic)
+        if handler is not None:
+            self.deliver(handler, msg)
+
+    def deliver(self, handler, msg):
+        """Run the room's handler for a message on one of its topics"""
+        if self._awaiting_first_message:
+            self._awaiting_first_message = False
+            self.mark_time("first_message")
+        try:
+            handler(msg)
+        except Exception as e:
+            print(f"Error handling message: {e}")
+
+    def decrypt_message(self, encrypted_payload):
+        """Decrypt a v1 or v2 chat payload into its message dict (None for unknown keys)"""
+        envelope = wire.unpack(encrypted_payload)
+
+        # One lookup picks the key epoch; payloads without a key id (v1) are
+        # tried with the current key, then with the older epochs still held
+        if envelope.key_id is None:
+            return self.decrypt_v1(envelope)
+        room_key = self.keyring.get(envelope.key_id)
+        if room_key is None:
+            # Not a key we hold - drop it without attempting decryption
+            self.stats["dropped_unknown_key"] += 1
+            self.note_unreadable()
+            return None
+
+        # The sender's suite comes from the envelope, not from our room options
+        suite = room_key.ciphers.get(envelope.suite)
+        decrypted_data = suite.decrypt(envelope.body, aad=envelope.header)
+        if envelope.flags & COMPRESSION_FLAGS:
+            decrypted_data = self.dictionaries.decompress(decrypted_data, envelope.flags,
+                                                          envelope.dict_id)
+        return json.loads(decrypted_data.decode())
+
+    def decrypt_v1(self, envelope):
+        """Decrypt a v1 Fernet token with whichever key epoch we hold can read it"""
+        error = None
+        for room_key in self.keyring.newest_first():
+            try:
+                decrypted_data = room_key.ciphers.get(envelope.suite).decrypt_token(envelope.body)
+            except InvalidToken as e:
+                error = e  # Sealed with another epoch (or not for this room at all)
+                continue
+            return json.loads(decrypted_data.decode())
+        raise error or InvalidToken()
+
+    def handle_chat_message(self, encrypted_payload):
+        """Handle incoming chat message (or a batch of them)"""
+        try:
+            data = self.decrypt_message(encrypted_payload)
+            if data is None:
+                return
+
+            # Batched frames carry a list of messages, delivered in order
+            for message_data in (data if isinstance(data, list) else [data]):
+                username = message_data.get("user", "Unknown")
+                message = message_data.get("message", "")
+                timestamp = message_data.get("timestamp", time.time())
+
+                # Don't show our own messages (send_message already echoed them)
+                if username != self.username:
+                    self.emit(EVENT_CHAT_MESSAGE, username, message, timestamp)
+                    if self.session is not None:
+                        self.session.note_chat(self)
+
+        except Exception as e:
+            self.stats["undecryptable"] += 1
+            self.note_unreadable()
+            print(f"Error decrypting message: {e}")
+
+    def note_unreadable(self):
+        """Explain the first unreadable message (usually a key or key derivation mismatch)"""
+        if self.stats["dropped_unknown_key"] + self.stats["undecryptable"] == 1:
+            self.emit(EVENT_SYSTEM_MESSAGE, "Can't read some messages in this room - check that "
+                                            "the encryption key and key derivation match the other members")
+
+    def handle_presence_message(self, topic, payload, retained=False):
+        """Handle user presence updates - ANTI-SPAM DUPLICATE PREVENTION"""
+        try:
+            # Extract username from topic path
+            user_from_topic = topic.split('/')[-1]
+
+            # Handle empty payload (user leaving/clearing presence)
+            if not payload.strip():
+                self.remove_user(user_from_topic)
+                return
+
+            # Parse the JSON payload
+            data = json.loads(payload)
+            user = data.get("user", "")
+            status = data.get("status", "")
+
+            # Validate that topic user matches payload user
+            if user != user_from_topic:
+                print(f"Warning: User mismatch - topic: {user_from_topic}, payload: {user}")
+                return
+
+            if status == "online":
+                # Schedule when this record expires (its owner is pinged then)
+                self.probe.note(user, data, retained)
+                self._unconfirmed.discard(user)
+
+                # A heartbeat from someone already online changes nothing
+                if user in self.online_users:
+                    return
+                self.online_users.add(user)
+                self.emit(EVENT_USERS_CHANGED, [(roster.JOIN, user)])
+
+                # Anti-spam: Only announce if we haven't announced this user recently
+                current_time = time.time()
+                last_join_time = self.recent_joins.get(user, 0)
+
+                if (user != self.username and
+                        current_time - last_join_time > JOIN_ANNOUNCE_INTERVAL):
+                    self.emit(EVENT_SYSTEM_MESSAGE, f"{user} joined the chat")
+                    self.recent_joins[user] = current_time
+
+            elif status == "offline":
+                if user == self.username and self.connected:
+                    return  # Our will, from the connection we just replaced
+                self.remove_user(user)
+
+        except json.JSONDecodeError:
+            print(f"Invalid JSON in presence message: {payload}")
+        except Exception as e:
+            print(f"Error handling presence: {e}")
+
+    def remove_user(self, user):
+        """Drop a user from the roster and announce that they left"""
+        self.probe.forget(user)
+        if user in self.online_users:
+            self.online_users.remove(user)
+            self.emit(EVENT_USERS_CHANGED, [(roster.LEAVE, user)])
+            if user != self.username:
+                self.emit(EVENT_SYSTEM_MESSAGE, f"{user} left the chat")
+            # Clear from recent joins when they leave
+            self.recent_joins.pop(user, None)
+
+    def encrypt_message(self, message_data):
+        """Encrypt a message dict (or a list of them, wire v2 only) into a chat payload (bytes)"""
+        json_data = json.dumps(message_data).encode()
+        room_key = self.keyring.current
+        suite = room_key.ciphers.by_name(self.cipher_suite)
+        if self.wire_version == wire.WIRE_V1:
+            return wire.pack_v1(suite.encrypt_token(json_data))
+
+        # Compress before encrypting (ciphertext doesn't compress); small messages are left as is
+        flags, dict_id, body = self.compressor.compress(json_data)
+        if flags:
+            self.stats["compressed"] += 1
+            self.stats["compression_saved_bytes"] += len(json_data) - len(body) - wire.DICT_ID_SIZE
+        if isinstance(message_data, list):
+            flags |= wire.FLAG_BATCH
+
+        # The header (including the key and dictionary ids) is authenticated by the AEAD suites
+        header = wire.header_v2(flags, suite.suite_id, room_key.key_id, dict_id)
+        return header + suite.encrypt(body, aad=header)
+
+    def send_message(self, message_text):
+        """Encrypt and publish a chat message, echoing it locally (raises on failure)"""
+        message_text = message_text.strip()
+        if not self.connected or not message_text:
+            return None
+
+        message_data = {
+            "user": self.username,
+            "message": message_text,
+            "timestamp": time.time()
+        }
+
+        # Publish to MQTT (or hold it briefly to share a frame with the rest of a burst)
+        if self.batcher is not None:
+            self.batcher.add(message_data, len(message_text) + len(self.username) + 64)
+        else:
+            self.publish_chat(self.encrypt_message(message_data))
+
+        # Add to our own chat display
+        self.emit(EVENT_CHAT_MESSAGE, self.username, message_text, message_data["timestamp"])
+        return message_data
+
+    def publish_batch(self, batch):
+        """Publish messages collected by the batcher as one frame"""
+        payload = self.encrypt_message(batch if len(batch) > 1 else batch[0])
+        self.publish_chat(payload)
+        self.stats["frames_saved"] += len(batch) - 1
+
+    def batch_failed(self, batch, error):
+        """Tell the user which of their (already echoed) messages were never sent"""
+        lost = ", ".join(f'"{textwrap.shorten(message["message"], 40, placeholder="...")}"' for message in batch[:3])
+        if len(batch) > 3:
+            lost += f" and {len(batch) - 3} more"
+        self.emit(EVENT_SYSTEM_MESSAGE, f"Failed to send {len(batch)} message(s): {lost} ({error})")
+
+    def publish_chat(self, payload):
+        """Publish a chat frame (QoS 1; on v5 with a message expiry)"""
+        if self.protocol == PROTOCOL_V5:
+            return self.aliases.publish(self.mqtt_client, self.messages_topic, payload, qos=1,
+                                        expiry=CHAT_MESSAGE_EXPIRY)
+        return self.mqtt_client.publish(self.messages_topic, payload, qos=1)
+
+    def send_file(self, path):
+        """Stream a file to the room in the background; returns the transfer id"""
+        return self.files.send(path)
+
+    def accept_file(self, transfer_id):
+        """Download a file offered to the room (EVENT_FILE_OFFERED); False if it can't be"""
+        return self.files.accept(transfer_id)
+
+    def decline_file(self, transfer_id):
+        """Ignore a file offered to the room"""
+        self.files.decline(transfer_id)
+
+    def rotate_key(self, grace=ROTATION_GRACE):
+        """Announce a new key epoch; old keys stay readable for `grace` seconds"""
+        if not self.connected:
+            return None
+
+        current = self.keyring.current
+        # The new passphrase is random, so every epoch after the first uses the
+        # cheap legacy derivation regardless of the room's kdf option
+        announcement = {
+            "type": "rekey",
+            "user": self.username,
+            "epoch": current.epoch + 1,
+            "key": generate_passphrase(),
+            "grace": grace,
+            "timestamp": time.time()
+        }
+        # Encrypted under the current key and retained, so members who join
+        # later with the old passphrase still learn about the new epoch
+        self.mqtt_client.publish(self.keys_topic, self.encrypt_message(announcement), retain=True)
+        return announcement
+
+    def handle_key_message(self, encrypted_payload):
+        """Handle a key rotation announcement"""
+        if not encrypted_payload:
+            return  # Retained announcement cleared
+        try:
+            data = self.decrypt_message(encrypted_payload)
+            if not data or data.get("type") != "rekey":
+                return
+
+            old_key = self.keyring.current
+            if int(data["epoch"]) <= old_key.epoch:
+                return  # Already on this epoch (e.g. our own retained announcement)
+            new_key = self.keyring.add(data["key"], epoch=int(data["epoch"]))
+
+            # Send with the new key right away; keep reading the old ones until the grace ends
+            self.keyring.current_id = new_key.key_id
+            retire_at = float(data.get("timestamp", time.time())) + float(data.get("grace", ROTATION_GRACE))
+            self.schedule_key_retirement(new_key.key_id, max(0, retire_at - time.time()))
+
+            self.emit(EVENT_SYSTEM_MESSAGE,
+                      f"{data.get('user', 'Someone')} rotated the room key (epoch {new_key.epoch})")
+            self.emit(EVENT_KEY_ROTATED, new_key.epoch, new_key.passphrase, old_key.passphrase)
+
+        except Exception as e:
+            print(f"Error handling key rotation: {e}")
+
+    def schedule_key_retirement(self, keep_id, delay):
+        """Retire every key except keep_id after delay seconds"""
+        def _retire():
+            for key_id in self.keyring.key_ids():
+                if key_id != keep_id:
+                    self.keyring.retire(key_id)
+
+        if delay <= 0:
+            _retire()
+            return
+        self.key_retire_jobs.append(self.scheduler.call_later(delay, _retire, name="retire old keys"))
+
+    def cancel_key_retirement(self):
+        """Cancel pending key retirements"""
+        for job in self.key_retire_jobs:
+            job.cancel()
+        self.key_retire_jobs = []
+
+    def clear_my_presence(self, qos=0):
+        """Clear our own presence message to prevent duplicates"""
+        if self.mqtt_client and self.username:
+            return self.mqtt_client.publish(f"{self.presence_topic}/{self.username}", "",
+                                            qos=qos, retain=True)
+
+    def leave_presence(self, timeout=LEAVE_TIMEOUT):
+        """Tell the room we are leaving and remove our retained presence record (blocks until acknowledged)"""
+        # Receivers treat the cleared record as a leave, so lean rooms send just that.
+        # QoS 1, so we know when the broker has them: a lean record left behind
+        # would never be doubted
+        pending = []
+        if self.presence_mode == PRESENCE_HEARTBEAT:
+            pending.append(self._publish_presence("offline", qos=1))
+        pending.append(self.clear_my_presence(qos=1))
+        if self.driver is not None and self.driver.on_loop_thread():
+            # Nothing else reads the acknowledgements while this thread waits: poll for them here
+            self.driver.run_until(lambda: all(info is None or info.is_published() for info in pending), timeout)
+        deadline = time.monotonic() + timeout
+        for info in pending:
+            if info is None:
+                continue
+            try:
+                info.wait_for_publish(timeout=max(0.0, deadline - time.monotonic()))
+            except (RuntimeError, ValueError) as e:
+                print(f"Error publishing leave: {e}")
+                return False
+        return all(info is None or info.is_published() for info in pending)
+
+    def announce_presence(self, status, qos=0):
+        """Announce our online/offline status"""
+        if self.mqtt_client and self.connected:
+            self._publish_presence(status, qos)
+
+    def _publish_presence(self, status, qos=0):
+        """Publish our retained presence record"""
+        presence_data = {
+            "user": self.username,
+            "status": status,
+            "timestamp": time.time(),
+            "hb": self.heartbeat_interval if self.presence_mode == PRESENCE_HEARTBEAT else 0,
+        }
+        topic = f"{self.presence_topic}/{self.username}"
+        if self.protocol == PROTOCOL_V5:
+            return self.aliases.publish(self.mqtt_client, topic, json.dumps(presence_data), qos=qos, retain=True)
+        return self.mqtt_client.publish(topic, json.dumps(presence_data), qos=qos, retain=True)
+
+    def start_heartbeat(self):
+        """Start re-announcing our presence every heartbeat_interval (connecting announces it first)"""
+        self.stop_heartbeat()
+        if self.connected and self.heartbeat_interval:
+            # Jittered, so members who joined together don't heartbeat in lockstep
+            self.heartbeat_job = self.scheduler.call_every(self.heartbeat_interval, self.send_heartbeat,
+                                                           name=f"heartbeat {self.channel}")
+
+    def set_heartbeat_interval(self, interval):
+        """Heartbeat every interval seconds from now on (0: none, members rely on our last will)"""
+        if not interval and (self.session is None or self.session.will_room is not self):
+            interval = HEARTBEAT_INTERVAL  # The connection has no last will for this room
+        if interval == self.heartbeat_interval:
+            return
+        self.heartbeat_interval = interval
+        if self.presence_mode == PRESENCE_HEARTBEAT and self.connected:
+            # Our record carries the interval: re-announce it so members know how long to wait
+            self.announce_presence("online", qos=1)
+            self.start_heartbeat()
+
+    def send_heartbeat(self):
+        if self.connected:
+            self.announce_presence("online")
+
+    def stop_heartbeat(self):
+        """Cancel the heartbeat job"""
+        if self.heartbeat_job:
+            self.heartbeat_job.cancel()
+            self.heartbeat_job = None
+
+    def clean_users(self):
+        """Force clean the users list by removing duplicates and pinging anyone in doubt"""
+        self.online_users = set(self.online_users)
+        self.emit(EVENT_USERS_CHANGED, [(roster.SYNC, list(self.online_users))])
+        self.probe.probe(self.probe.doubtful_users())
+
+    def reset_users(self):
+        """Forget every tracked user (after disconnect, or to rebuild the list from fresh presence)"""
+        for user in self.online_users | set(self.probe.last_seen):
+            self.probe.forget(user)
+        self.online_users.clear()
+        self.recent_joins.clear()
+        self.emit(EVENT_USERS_CHANGED, [(roster.SYNC, [])])
+
+    def rebuild_users(self):
+        """Rebuild the users list from the retained presence records, as when joining"""
+        listed = set(self.online_users)
+        self.reset_users()
+        # Members coming straight back aren't announced as joining again
+        now = time.time()
+        self.recent_joins.update((user, now) for user in listed)
+        if self.mqtt_client and self.connected:
+            # Subscribing again makes the broker send the retained records (ours included)
+            topic = f"{self.presence_topic}/+"
+            self.mqtt_client.unsubscribe(topic)
+            self.subscribe(self.mqtt_client, topic, 1)
+
+    def disconnect(self):
+        """Announce offline, clear presence and leave the room, closing its connection if it is ours (blocking)"""
+        session = self.session
+        own = session is not None and session.owner is self
+        if own:
+            session.stop_reconnecting()
+        try:
+            # Front ends flip `connected` off before calling us, so ask paho
+            if self.mqtt_client and self.mqtt_client.is_connected():
+                started = time.perf_counter()
+                self.connected = False
+                if self.batcher is not None:
+                    self.batcher.flush()  # Don't lose the tail of a burst
+                self.files.cancel_all()
+                self.leave_presence()
+                self.timings["leave"] = (time.perf_counter() - started) * 1000
+                if own:
+                    session.close()
+                    self.timings["disconnect"] = (time.perf_counter() - started) * 1000
+        finally:
+            if session is not None:
+                session.remove_room(self)
+                if own:
+                    session.close()  # Still reconnecting: end the attempt in progress
+            self.connected = False
+            self.stop_heartbeat()
+            self.probe.cancel()
+            if self._reconcile_job is not None:
+                self._reconcile_job.cancel()
+                self._reconcile_job = None
+            self._unconfirmed = set()
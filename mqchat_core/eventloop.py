@@ -0,0 +1,113 @@
+"""
+MQChat main-loop networking
+By default every BrokerSession runs paho on a network thread of its own, and
+timed jobs run on the shared scheduler thread. A LoopDriver runs both from a
+GUI's main loop instead: it services the sockets of the sessions given to it
+and a Scheduler(threaded=False) for their rooms, so the whole chat runs on
+one thread. Nothing else wakes the CPU between frames, and engine events
+arrive already on the GUI thread.
+
+The front end calls poll() often: every Kivy frame, or from Tk's after().
+poll() runs the jobs that are due, then select()s the sessions' sockets
+without blocking, reads what has arrived and writes what is queued. About
+once a second it lets paho send keepalive pings and notice a dead broker.
+Tk can also call service() from a file handler, so an inbound message is
+handled as soon as it arrives instead of at the next poll.
+
+Sessions tell paho that the driver does the writing. Publishing from another
+thread (a front end's disconnect worker, say) only queues the packet, and
+the next poll sends it.
+"""
+
+import select
+import threading
+import time
+
+from .scheduler import Scheduler
+
+HOUSEKEEPING_INTERVAL = 1.0  # Seconds between keepalive and timeout checks
+
+
+class LoopDriver:
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler or Scheduler(threaded=False)
+        self.sessions = []
+        self._thread = None  # The thread that polls (set by the first poll)
+        self._last_housekeeping = 0.0
+        self.stats = {"polls": 0, "reads": 0, "writes": 0}
+
+    def attach(self, session):
+        """Start servicing a session's socket"""
+        if session not in self.sessions:
+            self.sessions.append(session)
+
+    def detach(self, session):
+        if session in self.sessions:
+            self.sessions.remove(session)
+
+    def on_loop_thread(self):
+        return self._thread is threading.current_thread()
+
+    def write_wanted(self, client, userdata, sock):
+        """paho queued a packet; the next poll writes it"""
+
+    def sockets(self):
+        """socket -> session for every session with an open connection"""
+        sockets = {}
+        for session in list(self.sessions):
+            client = session.mqtt_client
+            sock = client.socket() if client is not None else None
+            if sock is not None:
+                sockets[sock] = session
+        return sockets
+
+    def poll(self, *args, wait=0.0):
+        """Run due jobs and service every ready socket, waiting at most `wait` for one (takes Kivy's dt, unused)"""
+        self._thread = threading.current_thread()
+        self.stats["polls"] += 1
+        self.scheduler.run_pending()
+
+        sockets = {}
+        wanted = []
+        for session in list(self.sessions):
+            client = session.mqtt_client
+            sock = client.socket() if client is not None else None
+            if sock is not None:
+                sockets[sock] = session
+                if client.want_write():
+                    wanted.append(sock)
+        if sockets:
+            readable, writable, _ = select.select(list(sockets), wanted, [], wait)
+            for sock in set(readable) | set(writable):
+                self.service(sockets[sock], sock in readable, sock in writable)
+
+        now = time.monotonic()
+        if now - self._last_housekeeping >= HOUSEKEEPING_INTERVAL:
+            self._last_housekeeping = now
+            for session in list(self.sessions):
+                session.housekeeping()
+
+    def run_until(self, condition, timeout):
+        """Poll on the loop thread until condition() holds or timeout passes (for waits made on that thread)"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.poll(wait=min(0.05, remaining))
+        return True
+
+    def service(self, session, readable=True, writable=False):
+        """Read (and write) one session's socket"""
+        self._thread = threading.current_thread()
+        self.stats["reads"] += readable
+        self.stats["writes"] += writable
+        session.service(readable, writable)
+
+    def next_due_in(self, limit):
+        """Seconds until the driver next has work (at most limit), for loops that sleep between polls"""
+        if any(session.mqtt_client is not None and session.mqtt_client.want_write() for session in self.sessions):
+            return 0.0
+        due = self.scheduler.next_due_in()
+        housekeeping = max(0.0, self._last_housekeeping + HOUSEKEEPING_INTERVAL - time.monotonic())
+        return min(limit, housekeeping, limit if due is None else due)
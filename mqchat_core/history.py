@@ -0,0 +1,217 @@
+"""
+MQChat message history
+Every chat message is kept in a local SQLite database, encrypted at rest:
+
+    messages        id, room, timestamp, AES-256-GCM(user + message)
+    message_index   FTS5 index of blind word tokens (contentless)
+
+Nothing is stored in the clear. Rooms are identified by an HMAC of the
+channel name, and the search index holds HMAC tokens of each lower-cased
+word (scoped to the room) instead of the words themselves, so search works
+on whole words without decrypting anything. Only the matching rows are
+decrypted.
+
+Writes are queued and committed in batches by a background thread, so the
+network and GUI threads never wait for the disk.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+BATCH_SIZE = 500  # Messages per write transaction
+BATCH_DELAY = 0.1  # Seconds the writer waits for more messages before committing
+MAX_TOKENS = 256  # Words indexed per message
+TOKEN_CACHE_SIZE = 100000  # (room, word) tokens kept in memory; chat vocabulary repeats a lot
+NONCE_SIZE = 12
+
+WORD = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    room TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_room ON messages (room, id);
+CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(tokens, content='', detail='none');
+"""
+
+
+def words(text):
+    """Distinct lower-cased words of a message, in order"""
+    return list(dict.fromkeys(WORD.findall(text.lower())))
+
+
+class MessageHistory:
+    """Encrypted, searchable store of chat messages for every room"""
+
+    def __init__(self, path, key):
+        # key: the room store's Fernet key; history uses its own subkeys of it
+        raw_key = base64.urlsafe_b64decode(key)
+        self._aead = AESGCM(self._subkey(raw_key, b"mqchat history data v1"))
+        self._mac_key = self._subkey(raw_key, b"mqchat history index v1")
+
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        # Only the writer thread inserts, so it numbers the rows itself
+        self._next_id = (self._db.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0) + 1
+        self._token_cache = {}
+
+        self._queue = queue.Queue()
+        self.stats = {"written": 0, "batches": 0}
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _subkey(raw_key, info):
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=info).derive(raw_key)
+
+    def _mac(self, data):
+        return hmac.digest(self._mac_key, data.encode(), hashlib.sha256).hex()
+
+    def room_id(self, channel):
+        """Opaque id for a room (the channel name is not stored)"""
+        return self._mac("room\0" + channel)[:32]
+
+    def _tokens(self, room_id, text):
+        """Blind index tokens for the words of a message (scoped to the room)"""
+        cache = self._token_cache
+        if len(cache) > TOKEN_CACHE_SIZE:
+            cache.clear()
+        tokens = []
+        for word in words(text)[:MAX_TOKENS]:
+            key = (room_id, word)
+            token = cache.get(key)
+            if token is None:
+                token = cache[key] = self._mac(room_id + "\0" + word)[:16]
+            tokens.append(token)
+        return tokens
+
+    def append(self, channel, username, message, timestamp):
+        """Queue a message for storage (returns immediately)"""
+        self._queue.put((channel, username, message, timestamp))
+
+    def _encode(self, room_id, username, message, timestamp):
+        nonce = os.urandom(NONCE_SIZE)
+        plaintext = json.dumps({"user": username, "message": message}).encode()
+        data = nonce + self._aead.encrypt(nonce, plaintext, room_id.encode())
+        tokens = " ".join(self._tokens(room_id, f"{username} {message}"))
+        return room_id, float(timestamp), data, tokens
+
+    def _write_loop(self):
+        # None stops the writer; a function is called once everything queued before it is written
+        while True:
+            item = self._queue.get()
+            batch = []
+            try:
+                while item is not None and not callable(item):
+                    batch.append(item)
+                    if len(batch) >= BATCH_SIZE:
+                        break
+                    item = self._queue.get(timeout=BATCH_DELAY)
+            except queue.Empty:
+                item = False
+            if batch:
+                self._write(batch)
+            if item is None:
+                return
+            if callable(item):
+                item()
+
+    def _write(self, batch):
+        """Store a batch of messages in one transaction"""
+        room_ids = {}
+        rows = []
+        for row_id, (channel, username, message, timestamp) in enumerate(batch, self._next_id):
+            if channel not in room_ids:
+                room_ids[channel] = self.room_id(channel)
+            rows.append((row_id,) + self._encode(room_ids[channel], username, message, timestamp))
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany("INSERT INTO messages (id, room, timestamp, data) VALUES (?, ?, ?, ?)",
+                                     [row[:4] for row in rows])
+                self._db.executemany("INSERT INTO message_index (rowid, tokens) VALUES (?, ?)",
+                                     [(row[0], row[4]) for row in rows])
+            self._next_id += len(rows)
+            self.stats["written"] += len(rows)
+            self.stats["batches"] += 1
+        except sqlite3.Error as e:
+            print(f"Failed to write message history: {e}")
+
+    def _decode(self, room_id, rows):
+        """Decrypt (id, timestamp, data) rows into (id, username, message, timestamp)"""
+        messages = []
+        for row_id, timestamp, data in rows:
+            try:
+                plaintext = self._aead.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], room_id.encode())
+            except Exception:
+                continue  # Written with a different key
+            message = json.loads(plaintext.decode())
+            messages.append((row_id, message["user"], message["message"], timestamp))
+        return messages
+
+    def search(self, channel, query, limit=100):
+        """Newest messages in a room containing every word of query (whole words, any case)"""
+        room_id = self.room_id(channel)
+        tokens = self._tokens(room_id, query)
+        if not tokens:
+            return []
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT m.id, m.timestamp, m.data FROM message_index "
+                "JOIN messages m ON m.id = message_index.rowid "
+                "WHERE message_index MATCH ? AND m.room = ? "
+                "ORDER BY message_index.rowid DESC LIMIT ?",
+                (" AND ".join(f'"{token}"' for token in tokens), room_id, limit)).fetchall()
+        return self._decode(room_id, rows)
+
+    def recent(self, channel, limit=50, before_id=None):
+        """The latest messages of a room (older than before_id), oldest first"""
+        room_id = self.room_id(channel)
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, timestamp, data FROM messages WHERE room = ? AND id < ? "
+                "ORDER BY id DESC LIMIT ?",
+                (room_id, before_id if before_id is not None else 2 ** 63 - 1, limit)).fetchall()
+        return self._decode(room_id, rows[::-1])
+
+    def count(self, channel=None):
+        """Number of stored messages (in one room, or in all)"""
+        with self._db_lock:
+            if channel is None:
+                return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM messages WHERE room = ?",
+                                    (self.room_id(channel),)).fetchone()[0]
+
+    def flush(self, timeout=None):
+        """Wait until every message queued so far has been written"""
+        done = threading.Event()
+        self._queue.put(done.set)
+        return done.wait(timeout)
+
+    def recent_after_writes(self, channel, limit, callback, before_id=None):
+        """Call callback(recent(...)) on the writer thread once everything queued so far is written"""
+        self._queue.put(lambda: callback(self.recent(channel, limit, before_id)))
+
+    def close(self):
+        """Write what is queued and close the database"""
+        self._queue.put(None)
+        self._writer.join()
+        with self._db_lock:
+            self._db.close()
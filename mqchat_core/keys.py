@@ -0,0 +1,153 @@
+"""
+MQChat room keys
+A room can hold several key epochs at once while a rotation is in progress.
+Each key has a short fingerprint (key id) that travels in the v2 envelope, so
+receivers pick the right key with one dict lookup instead of trial-decrypting.
+
+Room keys are derived from the shared passphrase with either the original
+single SHA-256 (legacy rooms) or scrypt. scrypt is deliberately slow, so its
+result is cached per (kdf, passphrase, salt): in memory for the process and
+in the encrypted room store across restarts.
+"""
+
+import base64
+import hashlib
+import hmac
+import secrets
+
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from .ciphers import CipherSet
+
+KEY_ID_SIZE = 4  # Bytes of fingerprint carried in each envelope
+
+# Key derivation functions
+KDF_LEGACY = "sha256"
+KDF_SCRYPT = "scrypt"
+KDFS = (KDF_LEGACY, KDF_SCRYPT)
+SCRYPT_N = 2 ** 15  # ~32 MB and ~100 ms per derivation
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# Derived keys for this process: cache id -> Fernet key (bytes)
+_derived_keys = {}
+
+
+def derive_key(password):
+    """Derive a Fernet key from a password"""
+    # Use SHA256 to create a 32-byte key, then base64 encode for Fernet
+    hash_obj = hashlib.sha256(password.encode())
+    key = base64.urlsafe_b64encode(hash_obj.digest())
+    return key
+
+
+def room_salt(channel):
+    """Deterministic per-room salt, so every member derives the same key"""
+    return hashlib.sha256(b"mqchat room salt v1|" + channel.encode()).digest()[:16]
+
+
+def kdf_cache_id(kdf, passphrase, salt):
+    """Cache key for one (kdf + parameters, passphrase, salt) derivation"""
+    params = f"{kdf}:{SCRYPT_N}:{SCRYPT_R}:{SCRYPT_P}"
+    digest = hashlib.sha256(params.encode() + b"|" + salt + b"|" + passphrase.encode())
+    return digest.hexdigest()[:32]
+
+
+def derive_room_key(passphrase, kdf=KDF_LEGACY, salt=b"", cache=None):
+    """
+    Derive a room's Fernet key from its passphrase.
+
+    Returns (key, cache_id, cached). `cache` is an optional dict of
+    cache id -> key string (e.g. from the room store); cache_id is None for
+    the legacy KDF, which is too cheap to be worth caching.
+    """
+    if kdf == KDF_LEGACY:
+        return derive_key(passphrase), None, True
+    if kdf != KDF_SCRYPT:
+        raise ValueError(f"Unknown key derivation: {kdf}")
+
+    cache_id = kdf_cache_id(kdf, passphrase, salt)
+    if is_cached(passphrase, kdf, salt, cache):
+        key = _derived_keys.get(cache_id) or cache[cache_id].encode()
+        _derived_keys[cache_id] = key
+        return key, cache_id, True
+
+    raw_key = Scrypt(salt=salt, length=32, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P).derive(passphrase.encode())
+    key = base64.urlsafe_b64encode(raw_key)
+    _derived_keys[cache_id] = key
+    return key, cache_id, False
+
+
+def is_cached(passphrase, kdf=KDF_LEGACY, salt=b"", cache=None):
+    """True if derive_room_key will return at once (no scrypt run)"""
+    if kdf != KDF_SCRYPT:
+        return True
+    cache_id = kdf_cache_id(kdf, passphrase, salt)
+    return cache_id in _derived_keys or bool(cache and cache_id in cache)
+
+
+def key_fingerprint(key):
+    """Short public id for a room key (an HMAC, so it reveals nothing about the key)"""
+    raw_key = base64.urlsafe_b64decode(key)
+    return hmac.new(raw_key, b"mqchat key id v1", hashlib.sha256).digest()[:KEY_ID_SIZE]
+
+
+def generate_passphrase():
+    """Random passphrase for a new key epoch"""
+    return secrets.token_urlsafe(32)
+
+
+class RoomKey:
+    def __init__(self, passphrase, key, epoch):
+        self.passphrase = passphrase
+        self.key_id = key_fingerprint(key)
+        self.epoch = epoch
+        self.ciphers = CipherSet(key)
+
+
+class RoomKeyring:
+    """Active keys of one room, indexed by key id"""
+
+    def __init__(self):
+        self._keys = {}  # key_id -> RoomKey
+        self.current_id = None
+
+    def add(self, passphrase, epoch=0, make_current=False, key=None):
+        """Add a key epoch (key defaults to the legacy derivation of the passphrase)"""
+        room_key = RoomKey(passphrase, key or derive_key(passphrase), epoch)
+        self._keys.setdefault(room_key.key_id, room_key)
+        if make_current or self.current_id is None:
+            self.current_id = room_key.key_id
+        return self._keys[room_key.key_id]
+
+    def get(self, key_id):
+        """Return the RoomKey for a key id, or None if we don't hold it"""
+        return self._keys.get(key_id)
+
+    @property
+    def current(self):
+        """The key we encrypt with"""
+        return self._keys.get(self.current_id)
+
+    def newest_first(self):
+        """Every key we hold, the current one first and then by epoch, newest first"""
+        return sorted(self._keys.values(),
+                      key=lambda room_key: (room_key.key_id != self.current_id, -room_key.epoch))
+
+    def retire(self, key_id):
+        """Forget a key (the current key can't be retired)"""
+        if key_id != self.current_id:
+            self._keys.pop(key_id, None)
+
+    def clear(self):
+        self._keys.clear()
+        self.current_id = None
+
+    def key_ids(self):
+        return list(self._keys)
+
+    def __contains__(self, key_id):
+        return key_id in self._keys
+
+    def __len__(self):
+        return len(self._keys)
@@ -0,0 +1,192 @@
+"""
+MQChat MQTT v5 support
+The "mqtt_protocol" room option picks the protocol:
+
+    3.1.1   the original protocol
+    5       MQTT v5 (fails on brokers that don't speak it)
+    auto    try v5, and fall back to 3.1.1 if the broker turns it down
+            (or doesn't answer within V5_CONNACK_TIMEOUT)
+
+"auto" remembers the protocol each broker settled on in a ProtocolCache
+(known_protocols, kept in a file once a front end opens one), and later
+connects to that broker start with it: only the first connect to a 3.1.1
+broker pays for the refused v5 attempt.
+
+On v5 the engine:
+  * subscribes to the chat and probe topics with no-local, so the broker
+    doesn't send our own messages back for us to decrypt and throw away
+  * sends the topics it publishes most at QoS 0 (our presence heartbeats)
+    as topic aliases: the full topic once per connection, then a 2-byte
+    alias. QoS 1 publishes keep their full topic, because paho re-sends
+    unacknowledged ones as stored after a reconnect, when the broker has
+    forgotten the connection's aliases
+  * gives chat messages a message expiry, so a broker queueing them for an
+    offline session drops them after CHAT_MESSAGE_EXPIRY
+  * asks the broker to keep our session for SESSION_EXPIRY after we vanish,
+    and to drop it when we close on purpose (3.1.1 sessions are kept until
+    the broker's own limits clear them, so there we unsubscribe first)
+"""
+
+import json
+import threading
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+from paho.mqtt.subscribeoptions import SubscribeOptions
+
+PROTOCOL_V311 = "3.1.1"
+PROTOCOL_V5 = "5"
+PROTOCOL_AUTO = "auto"
+PROTOCOLS = (PROTOCOL_V311, PROTOCOL_V5, PROTOCOL_AUTO)
+
+SESSION_EXPIRY = 3600  # Seconds the broker keeps our session (and queues for it) after we vanish
+CHAT_MESSAGE_EXPIRY = 3600  # Seconds a queued chat message stays deliverable
+
+UNSUPPORTED_PROTOCOL = 0x84  # CONNACK reason code (paho also reports a 3.1.1 refusal as this)
+V5_CONNACK_TIMEOUT = 3.0  # Seconds "auto" waits for a v5 CONNACK before trying 3.1.1
+
+
+class ProtocolCache:
+    """The protocol "auto" settled on per broker, optionally kept in a JSON file"""
+
+    def __init__(self):
+        self.path = None
+        self._protocols = {}  # "host:port" -> protocol
+        self._lock = threading.Lock()
+
+    def open(self, path):
+        """Load the protocols saved in path, and save changes there from now on"""
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = {}
+        with self._lock:
+            self.path = path
+            self._protocols.update({broker: protocol for broker, protocol in saved.items()
+                                    if protocol in (PROTOCOL_V311, PROTOCOL_V5)})
+
+    def get(self, server, port):
+        """The protocol the broker settled on last time (None if we haven't connected to it)"""
+        return self._protocols.get(f"{server}:{port}")
+
+    def remember(self, server, port, protocol):
+        """Note the protocol a broker accepted"""
+        broker = f"{server}:{port}"
+        with self._lock:
+            if self._protocols.get(broker) == protocol:
+                return
+            self._protocols[broker] = protocol
+            path, saved = self.path, dict(self._protocols)
+            if path is None:
+                return
+            try:
+                with open(path, 'w') as f:
+                    json.dump(saved, f)
+            except OSError as e:
+                print(f"Failed to save MQTT protocols: {e}")
+
+
+known_protocols = ProtocolCache()  # Shared by every session that isn't given a cache
+
+
+def paho_protocol(protocol):
+    return mqtt.MQTTv5 if protocol == PROTOCOL_V5 else mqtt.MQTTv311
+
+
+def connect_properties():
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = SESSION_EXPIRY
+    return properties
+
+
+def end_session_properties():
+    """DISCONNECT properties that have the broker drop our session at once (we are leaving for good)"""
+    properties = Properties(PacketTypes.DISCONNECT)
+    properties.SessionExpiryInterval = 0
+    return properties
+
+
+def subscribe_options(qos, no_local=False):
+    return SubscribeOptions(qos=qos, noLocal=no_local)
+
+
+class PackedProperties(Properties):
+    """PUBLISH properties that are serialized once (paho's pack() walks every property name per call)"""
+
+    def pack(self):
+        packed = self.__dict__.get("_packed")
+        if packed is None:
+            packed = super().pack()
+            object.__setattr__(self, "_packed", packed)
+        return packed
+
+
+class TopicAliases:
+    """Per-connection topic aliases for the topics we publish most"""
+
+    def __init__(self):
+        self.topics = []  # Hot topics, most frequent first
+        self._aliases = {}  # topic -> alias on this connection
+        self._known = set()  # Aliases the broker has learned on this connection
+        self._maximum = 0  # Aliases the broker accepts on this connection
+        self._properties = {}  # (alias, expiry) -> shared PackedProperties
+        self._lock = threading.Lock()
+
+    def set_topics(self, topics):
+        self.topics = list(topics)
+
+    def add_topics(self, topics):
+        """Alias a room's topics too (joined while connected: they get aliases the broker has left)"""
+        with self._lock:
+            for topic in topics:
+                if topic in self.topics:
+                    continue
+                self.topics.append(topic)
+                if len(self._aliases) < self._maximum:
+                    self._aliases[topic] = len(self._aliases) + 1
+
+    def connected(self, properties):
+        """Start a connection; the broker's CONNACK says how many aliases it accepts"""
+        maximum = getattr(properties, "TopicAliasMaximum", 0) if properties is not None else 0
+        with self._lock:
+            self._maximum = maximum
+            self._aliases = {topic: alias for alias, topic in enumerate(self.topics[:maximum], start=1)}
+            self._known.clear()
+
+    def disconnected(self):
+        """Aliases die with the connection (only QoS 0 publishes use them, and paho doesn't re-send those)"""
+        with self._lock:
+            self._maximum = 0
+            self._aliases = {}
+            self._known.clear()
+
+    def properties(self, alias, expiry):
+        """Shared PUBLISH properties for an alias and expiry (None if there are none)"""
+        if alias is None and not expiry:
+            return None
+        key = (alias, expiry)
+        properties = self._properties.get(key)
+        if properties is None:
+            properties = PackedProperties(PacketTypes.PUBLISH)
+            if expiry:
+                properties.MessageExpiryInterval = expiry
+            if alias is not None:
+                properties.TopicAlias = alias
+            self._properties[key] = properties
+        return properties
+
+    def publish(self, client, topic, payload, qos=0, retain=False, expiry=None):
+        """Publish through the alias for topic, if it has one on this connection and qos is 0"""
+        with self._lock:
+            alias = self._aliases.get(topic) if qos == 0 else None
+            known = alias in self._known
+            properties = self.properties(alias, expiry)
+        info = client.publish("" if known else topic, payload, qos=qos, retain=retain, properties=properties)
+        if alias is not None and not known and info.rc == mqtt.MQTT_ERR_SUCCESS:
+            with self._lock:
+                # Queued behind the packet that teaches the broker the alias
+                if self._aliases.get(topic) == alias:
+                    self._known.add(alias)
+        return info
@@ -0,0 +1,185 @@
+"""
+MQChat power policy
+On a phone, most of what an idle chat connection costs is radio time. Every
+packet sent or received wakes the cellular radio, which then stays in its
+high-power state for RADIO_TAIL seconds. With the desktop settings (a 60 s
+keepalive, and a retained heartbeat every 30 s per room), an idle room wakes
+the radio over a hundred times an hour.
+
+PowerPolicy picks the keepalive and the heartbeat for the app's state:
+
+    foreground          chat on screen: 60 s keepalive, heartbeat every 30 s
+    foreground_metered  the same on a metered (cellular) network, but heartbeat every 60 s
+    background          app not visible: 300 s keepalive, no heartbeats
+
+The keepalive is fixed when the connection is made, so a state with another
+keepalive reconnects to negotiate it: a DISCONNECT and a CONNECT that finds
+our session at the broker, which the rooms don't notice. The broker publishes
+our last will about 1.5 x the keepalive after the phone drops off the
+network: 90 s in the foreground, 450 s in the background. In the background
+our presence record says "hb": 0, so members stop expecting heartbeats and
+rely on the will, as in lean rooms.
+
+TrafficMeter counts the bytes a connection sends and receives, and the radio
+wakeups they cost: traffic after RADIO_TAIL seconds of quiet. It reads the
+kernel's counters for the socket (TCP_INFO, on Linux and Android) each time
+the session services it, so traffic is timed to within the network loop's
+1 s poll. The policy restarts the meter on every state change, so its rates
+per hour are for the current state.
+"""
+
+import socket
+import struct
+import threading
+import time
+
+from .engine import EVENT_CONNECTED
+from .presence import HEARTBEAT_INTERVAL
+from .session import KEEPALIVE
+
+RADIO_TAIL = 10.0  # Seconds an LTE radio stays in its high-power state after the last packet
+BACKGROUND_KEEPALIVE = 300  # Seconds; mobile NATs may drop connections left idle much longer than this
+
+FOREGROUND = "foreground"
+FOREGROUND_METERED = "foreground_metered"
+BACKGROUND = "background"
+
+# state -> (keepalive, heartbeat interval; 0 = no heartbeats)
+PROFILES = {
+    FOREGROUND: (KEEPALIVE, HEARTBEAT_INTERVAL),
+    FOREGROUND_METERED: (KEEPALIVE, 2 * HEARTBEAT_INTERVAL),
+    BACKGROUND: (BACKGROUND_KEEPALIVE, 0),
+}
+
+
+# tcpi_bytes_acked and tcpi_bytes_received in Linux's struct tcp_info (kernel 4.1+)
+TCP_INFO_BYTES = struct.Struct("=QQ")
+TCP_INFO_BYTES_OFFSET = 120
+
+
+def tcp_counters(sock):
+    """(bytes received, bytes sent) on a TCP socket so far, or None where the kernel doesn't say"""
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO_BYTES_OFFSET + TCP_INFO_BYTES.size)
+    except (AttributeError, OSError):
+        return None  # Not Linux, or not a TCP socket (e.g. websockets)
+    if len(info) < TCP_INFO_BYTES_OFFSET + TCP_INFO_BYTES.size:
+        return None
+    sent, received = TCP_INFO_BYTES.unpack_from(info, TCP_INFO_BYTES_OFFSET)
+    return received, sent
+
+
+def app_state(visible, metered=False):
+    """Policy state for an app that is (or isn't) on screen, on a metered network or not"""
+    if not visible:
+        return BACKGROUND
+    return FOREGROUND_METERED if metered else FOREGROUND
+
+
+class TrafficMeter:
+    """Bytes in and out of a connection's socket, and the radio wakeups they cost"""
+
+    def __init__(self, tail=RADIO_TAIL, clock=time.monotonic):
+        self.tail = tail
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._sock = None  # The socket being counted
+        self._counted = (0, 0)  # Its (received, sent) counters when last sampled
+        self.reset()
+
+    def reset(self):
+        """Start counting afresh"""
+        with self._lock:
+            self.started = self.clock()
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.wakeups = 0
+            self._last_traffic = None
+
+    def note(self, received, sent):
+        """Count a socket read or write; the first after tail seconds of quiet wakes the radio"""
+        now = self.clock()
+        with self._lock:
+            if self._last_traffic is None or now - self._last_traffic > self.tail:
+                self.wakeups += 1
+            self._last_traffic = now
+            self.bytes_in += received
+            self.bytes_out += sent
+
+    def watch(self, client):
+        """Count the traffic of each socket a paho client opens (the session calls sample())"""
+        client.on_socket_open = self._socket_open
+        client.on_socket_close = self._socket_close
+        return client
+
+    def _socket_open(self, client, userdata, sock):
+        with self._lock:
+            self._sock = sock
+            self._counted = tcp_counters(sock) or (0, 0)
+
+    def _socket_close(self, client, userdata, sock):
+        self.sample()  # Count the last packets before the counters go
+        with self._lock:
+            if self._sock is sock:
+                self._sock = None
+
+    def sample(self):
+        """Count the traffic since the last sample"""
+        with self._lock:
+            sock = self._sock
+        if sock is None:
+            return
+        counters = tcp_counters(sock)
+        if counters is None:
+            return
+        with self._lock:
+            if sock is not self._sock:
+                return
+            received, sent = (now - before for now, before in zip(counters, self._counted))
+            self._counted = counters
+        if received or sent:
+            self.note(received, sent)
+
+    def per_hour(self):
+        """Wakeups and bytes per hour since the meter started, and the minutes that covers"""
+        with self._lock:
+            hours = max(self.clock() - self.started, 1.0) / 3600
+            return {"wakeups": self.wakeups / hours, "bytes_in": self.bytes_in / hours,
+                    "bytes_out": self.bytes_out / hours, "minutes": hours * 60}
+
+
+class PowerPolicy:
+    """Keeps a room's keepalive and heartbeats in line with the app's state"""
+
+    def __init__(self, engine, profiles=PROFILES, state=FOREGROUND):
+        self.engine = engine
+        self.profiles = profiles
+        self.state = state
+        self.meter = TrafficMeter()
+
+        engine.session_options.update(keepalive=profiles[state][0], meter=self.meter)
+        engine.on(EVENT_CONNECTED, self.apply)
+
+    def set_state(self, state):
+        """Switch profiles (the engine's connection changes right away, reconnecting for a new keepalive)"""
+        if state == self.state:
+            return
+        stats = self.meter.per_hour()
+        print(f"Power: {self.state} for {stats['minutes']:.0f} min, {stats['wakeups']:.0f} wakeups/h, "
+              f"{(stats['bytes_in'] + stats['bytes_out']) / 1024:.1f} KB/h; now {state}")
+        self.state = state
+        self.meter.reset()
+        self.apply()
+
+    def apply(self):
+        """Set the current profile's keepalive and heartbeat on the engine and its connection"""
+        keepalive, heartbeat = self.profiles[self.state]
+        self.engine.session_options["keepalive"] = keepalive  # For the next connect()
+        session = self.engine.session
+        if session is not None:
+            session.set_keepalive(keepalive)
+        self.engine.set_heartbeat_interval(heartbeat)
+
+    def stats(self):
+        """The current state and its traffic per hour"""
+        return dict(self.meter.per_hour(), state=self.state)
@@ -0,0 +1,219 @@
+"""
+MQChat presence liveness
+Two presence modes, chosen per room (the "presence" room option):
+
+    heartbeat   re-publish the retained presence record every 30 seconds
+    lean        publish it only when our status changes; liveness comes from
+                the MQTT keepalive and the last will, which the broker
+                publishes for us if the connection drops
+
+Every retained publish is delivered to every member, so heartbeats cost
+N^2/30 deliveries per second in a room of N users. Lean members send
+nothing while their status is unchanged.
+
+Each presence record carries "hb": the sender's heartbeat interval (0 for
+lean). Every heartbeat member's record expires DOUBT_FACTOR intervals after
+it was last seen (or after the room's "presence_expiry" seconds), counted
+from when we received it - or, for retained records delivered on subscribe,
+from the timestamp inside it. Expiries sit in a timing wheel ticked once a
+second, so a tick only touches the members due in it. A member whose record
+expired is in doubt. Members in doubt are pinged on chat/<room>/probe,
+batched into one message. A pinged member answers by re-publishing its
+presence; members that stay silent past PROBE_TIMEOUT are evicted from the
+roster.
+
+Lean records are normally cleared through the will, but a will can be lost
+(a broker restart without persistence, say), leaving a retained "online"
+record nobody will ever clear. So they expire too, after LEAN_EXPIRY, on a
+second wheel that ticks once a minute: a retained lean record that old is
+pinged within a minute of our joining (or at once by Clean Users), and a
+live lean member answers a ping about once an hour.
+"""
+
+import json
+import threading
+import time
+
+from .timingwheel import TimingWheel
+
+PRESENCE_HEARTBEAT = "heartbeat"
+PRESENCE_LEAN = "lean"
+PRESENCE_MODES = (PRESENCE_HEARTBEAT, PRESENCE_LEAN)
+
+HEARTBEAT_INTERVAL = 30.0  # Seconds between presence heartbeats (heartbeat mode)
+LEGACY_HEARTBEAT = 30.0  # Assumed for records from clients that predate the "hb" field
+DOUBT_FACTOR = 2.5  # Heartbeat intervals a record may miss before its owner is in doubt
+PROBE_DELAY = 0.5  # Seconds to collect members in doubt into one ping
+PROBE_TIMEOUT = 10.0  # Seconds a pinged member has to answer
+ANSWER_INTERVAL = 5.0  # Answer pings at most this often
+EXPIRY_TICK = 1.0  # Seconds between checks for expired presence records
+LEAN_EXPIRY = 3600.0  # Seconds a lean record stays fresh (its will should clear it long before)
+LEAN_TICK = 60.0  # Seconds between checks for expired lean records
+
+
+class LivenessProbe:
+    """Pings members whose presence is in doubt and drops the ones that don't answer"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.expiry = 0  # Seconds a heartbeat record stays fresh; 0 means DOUBT_FACTOR x its interval
+        self.last_seen = {}  # user -> (time last seen, heartbeat interval)
+        self.wheel = TimingWheel(tick=EXPIRY_TICK)  # user -> when their record expires
+        self.lean_wheel = TimingWheel(tick=LEAN_TICK)  # The same for lean records
+        self._lock = threading.Lock()
+        self._queued = set()  # In doubt, not pinged yet
+        self._pinged = {}  # user -> time the ping went out
+        self._flush_timer = None
+        self._timeout_timer = None
+        self._tick_timer = None
+        self._lean_timer = None
+        self._last_answer = 0.0
+        self.stats = {"pings": 0, "answers": 0, "evicted": 0}
+
+    def expiry_for(self, heartbeat):
+        if not heartbeat:
+            return LEAN_EXPIRY
+        return self.expiry or heartbeat * DOUBT_FACTOR
+
+    def note(self, user, data, retained=False):
+        """Record an "online" presence record and (re)schedule when it expires"""
+        heartbeat = data.get("hb", LEGACY_HEARTBEAT)
+        # A retained record may be hours old; a live one was just published
+        seen = float(data.get("timestamp", 0) or 0) if retained else time.time()
+        self.last_seen[user] = (seen, heartbeat)
+        with self._lock:
+            self._pinged.pop(user, None)
+            self._queued.discard(user)
+            if user == self.engine.username:
+                return
+            if heartbeat:
+                self.lean_wheel.cancel(user)
+                self.wheel.schedule(user, seen + self.expiry_for(heartbeat))
+                if self._tick_timer is None:
+                    self._start_tick()
+            else:
+                self.wheel.cancel(user)
+                self.lean_wheel.schedule(user, seen + LEAN_EXPIRY)
+                if self._lean_timer is None:
+                    self._start_lean_tick()
+
+    def forget(self, user):
+        self.last_seen.pop(user, None)
+        with self._lock:
+            self._pinged.pop(user, None)
+            self._queued.discard(user)
+            self.wheel.cancel(user)
+            self.lean_wheel.cancel(user)
+
+    def in_doubt(self, user, now=None):
+        """True if the user's presence record is older than expiry_for() allows"""
+        if user not in self.last_seen:
+            return False
+        seen, heartbeat = self.last_seen[user]
+        return (now or time.time()) - seen > self.expiry_for(heartbeat)
+
+    def doubtful_users(self):
+        now = time.time()
+        return [user for user in list(self.last_seen)
+                if user != self.engine.username and self.in_doubt(user, now)]
+
+    def _start_tick(self):
+        self._tick_timer = self.engine.scheduler.call_later(EXPIRY_TICK, self.tick, name="presence expiry")
+
+    def tick(self):
+        """Ping everyone whose record expired since the last tick; keeps ticking while anyone can expire"""
+        with self._lock:
+            expired = self.wheel.advance(time.time())
+            self._tick_timer = None
+            if len(self.wheel):
+                self._start_tick()
+        if expired:
+            self.probe(expired)
+
+    def _start_lean_tick(self):
+        self._lean_timer = self.engine.scheduler.call_later(LEAN_TICK, self.lean_tick, name="lean presence expiry")
+
+    def lean_tick(self):
+        """Ping lean members whose record expired; keeps ticking while any are tracked"""
+        with self._lock:
+            expired = self.lean_wheel.advance(time.time())
+            self._lean_timer = None
+            if len(self.lean_wheel):
+                self._start_lean_tick()
+        if expired:
+            self.probe(expired)
+
+    def probe(self, users):
+        """Ping users (batched with others in doubt over the next PROBE_DELAY seconds)"""
+        with self._lock:
+            self._queued.update(user for user in users if user not in self._pinged)
+            if self._queued and self._flush_timer is None:
+                self._flush_timer = self.engine.scheduler.call_later(PROBE_DELAY, self._send_ping,
+                                                                     name="liveness ping")
+
+    def _send_ping(self):
+        with self._lock:
+            self._flush_timer = None
+            if not self.engine.connected:
+                return  # Held until we reconnect (the engine calls probe([]) then)
+            users, self._queued = sorted(self._queued), set()
+            now = time.time()
+            for user in users:
+                self._pinged[user] = now
+            if users and self._timeout_timer is None:
+                self._timeout_timer = self.engine.scheduler.call_later(PROBE_TIMEOUT, self._expire,
+                                                                       name="liveness timeout")
+        client = self.engine.mqtt_client
+        if not users or client is None or not self.engine.connected:
+            return
+        ping = {"type": "ping", "from": self.engine.username, "users": users}
+        client.publish(self.engine.probe_topic, json.dumps(ping))
+        self.stats["pings"] += 1
+
+    def _expire(self):
+        """Drop pinged members that never answered"""
+        cutoff = time.time() - PROBE_TIMEOUT
+        with self._lock:
+            self._timeout_timer = None
+            if not self.engine.connected:
+                # They can't have answered while we were offline: ping them again once back
+                self._queued.update(self._pinged)
+                self._pinged.clear()
+                return
+            silent = [user for user, pinged in self._pinged.items() if pinged <= cutoff]
+            for user in silent:
+                del self._pinged[user]
+            if self._pinged:
+                self._timeout_timer = self.engine.scheduler.call_later(PROBE_TIMEOUT, self._expire,
+                                                                       name="liveness timeout")
+        for user in silent:
+            self.stats["evicted"] += 1
+            self.last_seen.pop(user, None)
+            self.engine.remove_user(user)
+
+    def handle_message(self, payload):
+        """A ping on the probe topic; answer it if we are named"""
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        if data.get("type") != "ping" or self.engine.username not in data.get("users", ()):
+            return
+        now = time.time()
+        if now - self._last_answer < ANSWER_INTERVAL:
+            return
+        self._last_answer = now
+        self.stats["answers"] += 1
+        self.engine.announce_presence("online")
+
+    def cancel(self):
+        with self._lock:
+            for timer in (self._flush_timer, self._timeout_timer, self._tick_timer, self._lean_timer):
+                if timer is not None:
+                    timer.cancel()
+            self._flush_timer = self._timeout_timer = self._tick_timer = self._lean_timer = None
+            self._queued.clear()
+            self._pinged.clear()
+            self.wheel = TimingWheel(tick=EXPIRY_TICK)
+            self.lean_wheel = TimingWheel(tick=LEAN_TICK)
+        self.last_seen.clear()
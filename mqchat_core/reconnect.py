@@ -0,0 +1,36 @@
+"""
+MQChat reconnect policy
+When the broker drops us, the BrokerSession carrying our rooms waits
+next_delay() seconds before each reconnect attempt: its network loop
+thread sleeps that long, or with a LoopDriver, socket_closed() schedules
+the attempt. The delay is exponential backoff capped at
+max_delay, with "equal jitter" (a random point in the upper half of the
+step) so a room full of clients cut off by the same broker restart doesn't
+come back in one thundering herd.
+"""
+
+import random
+
+RECONNECT_MIN_DELAY = 1.0  # Seconds before the first attempt
+RECONNECT_MAX_DELAY = 60.0  # Backoff stops growing here
+
+# CONNACK codes that retrying won't fix (protocol version, client id, credentials, authorization),
+# as MQTT 3.1.1 return codes and v5 reason codes
+FATAL_CONNACK_CODES = (1, 2, 4, 5, 0x84, 0x85, 0x86, 0x87, 0x8C)
+
+
+class Backoff:
+    def __init__(self, min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY, rng=None):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.attempts = 0
+        self._random = rng or random.Random()
+
+    def next_delay(self):
+        """Seconds to wait before the next attempt"""
+        step = min(self.max_delay, self.min_delay * 2 ** min(self.attempts, 32))
+        self.attempts += 1
+        return step / 2 + self._random.uniform(0, step / 2)
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,196 @@
+"""
+MQChat saved room store
+One encrypted record file per room plus a small encrypted index, so saving,
+editing or deleting a room rewrites only that room's record and the index.
+
+    mqtt_chat_rooms/
+        index           name -> {"id", "channel", "saved_date"} (one Fernet token)
+        records/<id>    one room config (one Fernet token)
+
+The index is all the Saved Rooms list needs; a record is decrypted the first
+time its room is opened, or all at once by preload() (the Android app does
+this on a background thread at startup, so its UI never touches the disk to
+show or open a room). Files are replaced atomically (temp file, fsync,
+os.replace), so a crash leaves either the old or the new version. Records are
+written before the index, and if the index is lost it is rebuilt from the
+records, which carry their room name.
+"""
+
+import json
+import os
+import secrets
+from collections.abc import MutableMapping
+
+INDEX_FILE = "index"
+RECORDS_DIR = "records"
+
+
+def atomic_write(path, data):
+    """Replace path with data so readers never see a partial file"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # Persist the rename itself (not possible on Windows, where replace is already durable)
+    try:
+        dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+class RoomStore(MutableMapping):
+    """Saved rooms by name, backed by per-room encrypted records"""
+
+    def __init__(self, path, cipher, channel_field="channel"):
+        self.path = path
+        self.cipher = cipher  # Fernet instance for the index and records
+        self.channel_field = channel_field  # Config key indexed for names_for_channel ("room" on Android)
+        self.records_path = os.path.join(path, RECORDS_DIR)
+        os.makedirs(self.records_path, exist_ok=True)
+
+        self._index = {}  # name -> {"id", "channel", "saved_date"}
+        self._cache = {}  # name -> decrypted config
+        self.stats = {"records_decrypted": 0, "records_written": 0, "index_writes": 0}
+        self.load_index()
+
+    def load_index(self):
+        """Read the index, rebuilding it from the records if it is missing or unreadable"""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'rb') as f:
+                    self._index = json.loads(self.cipher.decrypt(f.read()).decode())
+                return
+            except Exception as e:
+                print(f"Room index unreadable, rebuilding: {e}")
+        self.rebuild_index()
+
+    def rebuild_index(self):
+        """Recreate the index by decrypting every record"""
+        self._index = {}
+        for record_id in os.listdir(self.records_path):
+            if record_id.endswith(".tmp"):
+                continue
+            try:
+                name, config = self._read_record(record_id)
+            except Exception as e:
+                print(f"Skipping unreadable room record {record_id}: {e}")
+                continue
+            self._index[name] = self._index_entry(record_id, config)
+            self._cache[name] = config
+        if self._index:
+            self._write_index()
+
+    def _index_entry(self, record_id, config):
+        return {"id": record_id, "channel": config.get(self.channel_field, ""),
+                "saved_date": config.get("saved_date", "")}
+
+    def _record_path(self, record_id):
+        return os.path.join(self.records_path, record_id)
+
+    def _read_record(self, record_id):
+        with open(self._record_path(record_id), 'rb') as f:
+            record = json.loads(self.cipher.decrypt(f.read()).decode())
+        self.stats["records_decrypted"] += 1
+        return record["name"], record["config"]
+
+    def _write_index(self):
+        data = self.cipher.encrypt(json.dumps(self._index).encode())
+        atomic_write(os.path.join(self.path, INDEX_FILE), data)
+        self.stats["index_writes"] += 1
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            entry = self._index[name]  # KeyError for unknown rooms
+            self._cache[name] = self._read_record(entry["id"])[1]
+        return dict(self._cache[name])
+
+    def __setitem__(self, name, config):
+        self.update({name: config})
+
+    def __delitem__(self, name):
+        entry = self._index.pop(name)
+        self._cache.pop(name, None)
+        self._write_index()
+        try:
+            os.remove(self._record_path(entry["id"]))
+        except OSError as e:
+            print(f"Failed to remove room record: {e}")
+
+    def __iter__(self):
+        return iter(list(self._index))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def update(self, rooms=(), **kwargs):
+        """Write several rooms with a single index update (used by import)"""
+        rooms = dict(rooms, **kwargs)
+        for name, config in rooms.items():
+            entry = self._index.get(name)
+            record_id = entry["id"] if entry else secrets.token_hex(8)
+            data = self.cipher.encrypt(json.dumps({"name": name, "config": config}).encode())
+            atomic_write(self._record_path(record_id), data)
+            self.stats["records_written"] += 1
+            self._index[name] = self._index_entry(record_id, config)
+            self._cache[name] = dict(config)
+        if rooms:
+            self._write_index()
+
+    def preload(self):
+        """Decrypt every record not yet cached; returns the number read"""
+        loaded = 0
+        for name, entry in list(self._index.items()):
+            if name not in self._cache:
+                try:
+                    self._cache[name] = self._read_record(entry["id"])[1]
+                    loaded += 1
+                except Exception as e:
+                    print(f"Failed to load room {name}: {e}")
+        return loaded
+
+    def names_for_channel(self, channel):
+        """Names of the saved rooms for a channel (from the index, no decryption)"""
+        return [name for name, entry in self._index.items() if entry.get("channel") == channel]
+
+    def migrate(self, legacy_file):
+        """Import the old single-blob rooms file once; returns the number of rooms moved"""
+        if not os.path.exists(legacy_file):
+            return 0
+        with open(legacy_file, 'rb') as f:
+            rooms = json.loads(self.cipher.decrypt(f.read()).decode())
+        self.update({name: config for name, config in rooms.items() if name not in self._index})
+        os.replace(legacy_file, legacy_file + ".migrated")
+        return len(rooms)
+
+    def migrate_files(self, legacy_dir, suffix=".json"):
+        """Move the old plain-text <name>.json room files into the store; returns the number moved"""
+        if not os.path.isdir(legacy_dir):
+            return 0
+        rooms = {}
+        for file_name in os.listdir(legacy_dir):
+            if not file_name.endswith(suffix):
+                continue
+            name = file_name[:-len(suffix)]
+            try:
+                with open(os.path.join(legacy_dir, file_name), 'r') as f:
+                    rooms[name] = json.load(f)
+            except Exception as e:
+                print(f"Skipping unreadable room file {file_name}: {e}")
+        self.update({name: config for name, config in rooms.items() if name not in self._index})
+        # The files hold room keys and broker passwords unencrypted, so don't keep them
+        for name in rooms:
+            os.remove(os.path.join(legacy_dir, name + suffix))
+        return len(rooms)
@@ -0,0 +1,82 @@
+"""
+MQChat roster
+The engine reports membership changes, not the whole user list:
+
+    ("join", user)     user came online
+    ("leave", user)    user went offline
+    ("sync", users)    the full list (after connecting, resetting or cleaning)
+
+Heartbeats from users already online change nothing and are not reported.
+A front end keeps a SortedRoster mirror, applies a frame's worth of changes
+to it and gets back the exact rows to insert into or delete from its list
+widget, found by bisection.
+"""
+
+import bisect
+
+JOIN = "join"
+LEAVE = "leave"
+SYNC = "sync"
+
+
+class SortedRoster:
+    """Usernames in display order, updated in place"""
+
+    def __init__(self, users=()):
+        self.users = sorted(set(users))
+        self._members = set(self.users)
+
+    def __contains__(self, user):
+        return user in self._members
+
+    def __len__(self):
+        return len(self.users)
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def add(self, user):
+        """Insert a user; returns the row index, or None if already present"""
+        if user in self._members:
+            return None
+        index = bisect.bisect_left(self.users, user)
+        self.users.insert(index, user)
+        self._members.add(user)
+        return index
+
+    def remove(self, user):
+        """Remove a user; returns the row index it had, or None if absent"""
+        if user not in self._members:
+            return None
+        index = bisect.bisect_left(self.users, user)
+        del self.users[index]
+        self._members.discard(user)
+        return index
+
+    def apply(self, changes):
+        """
+        Apply a batch of changes and return the row edits for a list widget:
+        ("insert", index, user) and ("delete", index, user), to be applied in
+        order. A user who joins and leaves within the batch produces no edit.
+        """
+        # Net effect per user, relative to the current rows
+        target = {}
+        for change, value in changes:
+            if change == SYNC:
+                users = set(value)
+                target = {user: True for user in users}
+                target.update({user: False for user in self._members - users})
+            else:
+                target[value] = change == JOIN
+
+        edits = []
+        for user, online in sorted(target.items()):
+            if online:
+                index = self.add(user)
+                if index is not None:
+                    edits.append(("insert", index, user))
+            else:
+                index = self.remove(user)
+                if index is not None:
+                    edits.append(("delete", index, user))
+        return edits
@@ -0,0 +1,178 @@
+"""
+MQChat scheduler
+One thread runs the timed jobs of every room: presence heartbeats, expiry
+ticks and liveness pings, send-batch windows, file stall checks and key
+retirements. Jobs wait in a heap ordered by due time and the thread sleeps
+until the earliest one is due (or a sooner job is added), instead of each
+job starting a threading.Timer thread of its own.
+
+Periodic jobs are jittered: each run lands within +/- jitter of its interval,
+so members who joined together don't heartbeat in lockstep. Callbacks run on
+the scheduler thread one at a time and must not block; an exception is
+printed and a periodic job keeps its schedule.
+
+A front end that would rather run jobs on its own loop creates a
+Scheduler(threaded=False) and calls run_pending() from it. jobs() lists what
+is scheduled, for debugging.
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+DEFAULT_JITTER = 0.1  # Periodic jobs run within +/- 10% of their interval
+
+
+class Job:
+    """A scheduled callback; cancel() stops it"""
+
+    def __init__(self, scheduler, callback, due, interval, jitter, name):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.due = due  # time.monotonic() when it next runs
+        self.interval = interval  # None for one-shot jobs
+        self.jitter = jitter
+        self.name = name or getattr(callback, "__name__", "job")
+        self.runs = 0
+        self.cancelled = False
+        self.queued = False  # In the heap (not running or finished)
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+
+class Scheduler:
+    def __init__(self, threaded=True):
+        self.threaded = threaded
+        self._heap = []  # (due, seq, job)
+        self._seq = itertools.count()
+        self._dead = 0  # Cancelled jobs still in the heap
+        self._cond = threading.Condition()
+        self._thread = None
+        self._random = random.Random()
+        self.stats = {"runs": 0, "errors": 0, "max_late_ms": 0.0}
+
+    def call_later(self, delay, callback, name=""):
+        """Run callback once, delay seconds from now"""
+        return self._push(Job(self, callback, time.monotonic() + delay, None, 0, name))
+
+    def call_every(self, interval, callback, name="", jitter=DEFAULT_JITTER, first=None):
+        """Run callback every interval seconds (jittered); the first run is after `first` seconds"""
+        job = Job(self, callback, 0, interval, jitter, name)
+        job.due = time.monotonic() + (self._next_interval(job) if first is None else first)
+        return self._push(job)
+
+    def cancel(self, job):
+        with self._cond:
+            if job.cancelled:
+                return
+            job.cancelled = True
+            if job.queued:
+                self._dead += 1
+                # Batch windows cancel a job per burst; don't let the heap fill with them
+                if self._dead > 64 and self._dead > len(self._heap) // 2:
+                    self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                    heapq.heapify(self._heap)
+                    self._dead = 0
+
+    def _next_interval(self, job):
+        if not job.jitter:
+            return job.interval
+        return job.interval * (1 + self._random.uniform(-job.jitter, job.jitter))
+
+    def _push(self, job):
+        with self._cond:
+            heapq.heappush(self._heap, (job.due, next(self._seq), job))
+            job.queued = True
+            if self.threaded and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mqchat-scheduler", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return job
+
+    def _pop_due(self, now):
+        """Remove and return the earliest job if it is due (caller holds the lock)"""
+        while self._heap:
+            due, _, job = self._heap[0]
+            if job.cancelled:
+                heapq.heappop(self._heap)
+                self._dead -= 1
+                continue
+            if due > now:
+                return None
+            heapq.heappop(self._heap)
+            job.queued = False
+            return job
+        return None
+
+    def next_due_in(self):
+        """Seconds until the next job is due (None if nothing is scheduled)"""
+        with self._cond:
+            for due, _, job in sorted(self._heap):
+                if not job.cancelled:
+                    return max(0.0, due - time.monotonic())
+        return None
+
+    def run_pending(self, now=None):
+        """Run every job that is due; returns how many ran"""
+        now = time.monotonic() if now is None else now
+        heap = self._heap
+        if not heap or heap[0][0] > now:
+            return 0  # Nothing due: skip the lock (GUI loops call this every frame)
+        ran = 0
+        while True:
+            with self._cond:
+                job = self._pop_due(now)
+            if job is None:
+                return ran
+            self._run_job(job, now)
+            ran += 1
+
+    def _run_job(self, job, now):
+        self.stats["max_late_ms"] = max(self.stats["max_late_ms"], (now - job.due) * 1000)
+        try:
+            job.callback()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error in scheduled job {job.name}: {e}")
+        job.runs += 1
+        self.stats["runs"] += 1
+        with self._cond:
+            if job.interval is not None and not job.cancelled:
+                # Keep to the schedule rather than drifting by the callback's run time
+                job.due = max(job.due + self._next_interval(job), now)
+                heapq.heappush(self._heap, (job.due, next(self._seq), job))
+                job.queued = True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                job = self._pop_due(now)
+                if job is None:
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                    continue
+            self._run_job(job, now)
+
+    def jobs(self):
+        """(name, seconds until due, interval, runs) for every scheduled job, soonest first"""
+        now = time.monotonic()
+        with self._cond:
+            entries = sorted(self._heap)
+        return [(job.name, max(0.0, due - now), job.interval, job.runs)
+                for due, _, job in entries if not job.cancelled]
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler():
+    """The scheduler shared by every ChatEngine that isn't given one"""
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+        return _default
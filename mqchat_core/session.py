@@ -0,0 +1,533 @@
+"""
+MQChat broker sessions
+A BrokerSession is one MQTT connection carrying every room a user has open on
+a broker: one TCP session, one keepalive and one network thread whether that
+is 1 room or 30. Each room is a ChatEngine; inbound messages reach the right
+one through a TopicRouter, a dict lookup per topic level however many rooms
+are open, instead of testing each room's topics in turn.
+
+ChatEngine.connect() opens a private session owned by its one room. A front
+end that keeps several rooms open creates a BrokerSession, calls connect()
+and has a ChatEngine join() it per room. MQTT allows one last will per
+connection, fixed when it is made: it is the offline record of the owner of a
+private session, or of the first room to join a shared one before it
+connects. The other rooms on a shared session send heartbeat presence
+whatever their option says, so members notice we've gone when the heartbeats
+stop (see presence.py).
+
+Chat messages from other members count towards unread[channel] until the
+front end makes that room the active one.
+
+Given a LoopDriver, a session has no network thread: the front end's main
+loop services its socket and runs its reconnects (see eventloop.py).
+
+A session can change its keepalive while connected (it reconnects quietly to
+negotiate it) and count its traffic with a TrafficMeter (the Android app's
+power policy uses both, see power.py).
+"""
+
+import hashlib
+import secrets
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from .scheduler import default_scheduler
+from .reconnect import Backoff, FATAL_CONNACK_CODES
+from .mqtt5 import (TopicAliases, PROTOCOL_V311, PROTOCOL_V5, PROTOCOL_AUTO, UNSUPPORTED_PROTOCOL,
+                    V5_CONNACK_TIMEOUT, connect_properties, end_session_properties, known_protocols,
+                    paho_protocol)
+
+EVENT_UNREAD_CHANGED = "unread_changed"  # (channel, count)
+
+KEEPALIVE = 60  # MQTT keepalive; the broker publishes our will about 1.5x this after we vanish
+LEAVE_TIMEOUT = 1.0  # Seconds to wait for the broker to acknowledge a leave or a DISCONNECT
+
+
+def new_mqtt_client(client_id="", clean_session=True, protocol=PROTOCOL_V311):
+    """Create a paho client with the VERSION1 callback signatures we use"""
+    kwargs = {"client_id": client_id, "protocol": paho_protocol(protocol)}
+    if protocol != PROTOCOL_V5:
+        kwargs["clean_session"] = clean_session  # v5 sets clean start on connect instead
+    # paho-mqtt 1.x (still pinned on Android) has no CallbackAPIVersion
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, **kwargs)
+    return mqtt.Client(**kwargs)
+
+
+def load_install_id(path):
+    """This install's random id: created on first use and kept in path"""
+    try:
+        with open(path, 'r') as f:
+            install_id = f.read().strip()
+        if install_id:
+            return install_id
+    except OSError:
+        pass
+    install_id = secrets.token_hex(16)
+    try:
+        with open(path, 'w') as f:
+            f.write(install_id)
+    except OSError as e:
+        print(f"Failed to save the install id (sessions won't survive a restart): {e}")
+    return install_id
+
+
+def session_client_id(install_id, username, channel="+"):
+    """Stable MQTT client id for this install's user in a room ("+", which no room can be, for a shared session)"""
+    # The install id keeps two people with the same nickname from taking over each other's session.
+    # 23 characters: the longest id every MQTT 3.1.1 broker must accept
+    return "mqchat-" + hashlib.sha256(f"{install_id}/{username}/{channel}".encode()).hexdigest()[:16]
+
+
+class TopicRouter:
+    """Topic -> handler map; a route ending in "/" covers every topic below it"""
+
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = {}
+
+    def add(self, topic, handler):
+        (self._prefixes if topic.endswith("/") else self._exact)[topic] = handler
+
+    def remove(self, topic):
+        (self._prefixes if topic.endswith("/") else self._exact).pop(topic, None)
+
+    def match(self, topic):
+        """The handler for topic (exact route first, then the longest prefix), or None"""
+        handler = self._exact.get(topic)
+        if handler is not None:
+            return handler
+        end = topic.rfind("/")
+        while end >= 0:
+            handler = self._prefixes.get(topic[:end + 1])
+            if handler is not None:
+                return handler
+            end = topic.rfind("/", 0, end)
+        return None
+
+    def __len__(self):
+        return len(self._exact) + len(self._prefixes)
+
+
+class BrokerSession:
+    def __init__(self, server, port, mqtt_username="", mqtt_password="", client_id="",
+                 mqtt_protocol=PROTOCOL_V311, scheduler=None, driver=None, keepalive=KEEPALIVE, meter=None,
+                 protocols=None):
+        self.server = server
+        self.port = port
+        self.mqtt_username = mqtt_username
+        self.mqtt_password = mqtt_password
+        self.client_id = client_id
+        self.driver = driver  # Services the socket from a GUI main loop instead of a network thread
+        self.scheduler = scheduler or (driver.scheduler if driver is not None else default_scheduler())
+        self.mqtt_client = None
+        self.connected = False
+
+        # Keepalive: negotiated on CONNECT; set_keepalive() reconnects to change it
+        self.keepalive = keepalive
+        self._sent_keepalive = None  # The keepalive of our last CONNECT
+        self.meter = meter  # TrafficMeter counting the socket's bytes and radio wakeups
+
+        # MQTT protocol: the rooms' choice, and what this connection speaks
+        self.mqtt_protocol = mqtt_protocol
+        self.protocol = PROTOCOL_V311
+        self.protocols = protocols or known_protocols  # What "auto" settled on per broker
+        self.aliases = TopicAliases()  # v5 topic aliases for the topics we publish most
+
+        # Rooms on this connection
+        self.rooms = {}  # channel -> ChatEngine
+        self.router = TopicRouter()  # topic -> (room, handler)
+        self.owner = None  # The room of a private session
+        self.will_room = None  # The room whose offline record is our last will
+        self.unread = {}  # channel -> chat messages since the room was last active
+        self.active_room = None
+        self._listeners = {}
+
+        # Reconnecting: our own network loop thread (or the driver's scheduler) retries with jittered backoff
+        self.backoff = Backoff()
+        self._network_thread = None
+        self._stopping = threading.Event()
+        self._socket_closed = threading.Event()  # Driven sessions: set while there is no socket
+        self._socket_closed.set()
+        self._reconnect_job = None
+        self._joined = False  # Set once the first CONNACK of this connect() arrived
+        self._fallback_pending = False
+        self._connect_started = None
+        self._renegotiating = False  # Closed by set_keepalive(): reconnect at once, without telling the rooms
+        self._quiet_reconnect = False  # That reconnect is waiting for its CONNACK
+        self.stats = {"reconnects": 0, "renegotiations": 0}
+
+    def on(self, event, callback):
+        """Subscribe a callback to a session event"""
+        self._listeners.setdefault(event, []).append(callback)
+
+    def emit(self, event, *args):
+        for callback in list(self._listeners.get(event, ())):
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in {event} handler: {e}")
+
+    def add_room(self, engine, owner=False):
+        """Carry a room on this connection (it joins right away if we are connected)"""
+        if engine.channel in self.rooms:
+            raise ValueError(f"Already in #{engine.channel} on this connection")
+        self.rooms[engine.channel] = engine
+        self.unread[engine.channel] = 0
+        if owner:
+            self.owner = engine
+            self.will_room = engine
+        for topic, handler in engine.routes():
+            self.router.add(topic, (engine, handler))
+        self.aliases.add_topics(engine.hot_topics())
+        engine.session = self
+        self._attach(engine)
+        if self.connected:
+            engine.session_connected(self.mqtt_client, False)
+
+    def remove_room(self, engine):
+        """Stop carrying a room (its leave must already be published)"""
+        if self.rooms.get(engine.channel) is not engine:
+            return
+        del self.rooms[engine.channel]
+        self.unread.pop(engine.channel, None)
+        for topic, _ in engine.routes():
+            self.router.remove(topic)
+        if self.connected:
+            self.mqtt_client.unsubscribe([topic for topic, _, _ in engine.subscriptions()])
+        if self.owner is engine:
+            self.owner = None
+        if self.will_room is engine:
+            # Its offline record stays our will until the next CONNECT
+            self.will_room = None
+            if self.mqtt_client is not None:
+                self.mqtt_client.will_clear()
+        if self.active_room == engine.channel:
+            self.active_room = None
+        engine.session = None
+
+    def claim_will(self, engine):
+        """Make a room's offline record our last will if the connection has none yet (returns whether it is)"""
+        if self.will_room is None and self.mqtt_client is None:
+            self.will_room = engine
+        return self.will_room is engine
+
+    def _attach(self, engine):
+        """Point a room at this session's current client"""
+        engine.mqtt_client = self.mqtt_client
+        engine.protocol = self.protocol
+        engine.aliases = self.aliases
+
+    def set_active(self, channel):
+        """Make channel the room on screen (its unread count resets)"""
+        self.active_room = channel
+        if self.unread.get(channel):
+            self.unread[channel] = 0
+            self.emit(EVENT_UNREAD_CHANGED, channel, 0)
+
+    def note_chat(self, engine):
+        """Count a chat message from someone else towards its room's unread count"""
+        if engine.channel != self.active_room and engine.channel in self.unread:
+            self.unread[engine.channel] += 1
+            self.emit(EVENT_UNREAD_CHANGED, engine.channel, self.unread[engine.channel])
+
+    def connect(self):
+        """Open the connection (raises if the broker is unreachable); rooms join when it is acknowledged"""
+        # "auto" starts with what the broker accepted last time, else v5; the network
+        # loop falls back if the broker refuses v5
+        self._connect_started = time.perf_counter()
+        self._joined = False
+        self._stopping.clear()
+        self.backoff.reset()
+        if self.mqtt_protocol == PROTOCOL_AUTO:
+            self.start_client(self.protocols.get(self.server, self.port) or PROTOCOL_V5)
+        else:
+            self.start_client(self.mqtt_protocol)
+        if self.driver is not None:
+            self.driver.attach(self)
+            return
+        self._network_thread = threading.Thread(target=self._network_loop, name="mqchat-network", daemon=True)
+        self._network_thread.start()
+
+    def start_client(self, protocol):
+        """Create the paho client for protocol and send CONNECT (raises if the broker is unreachable)"""
+        self.protocol = protocol
+
+        # A persistent session keeps our subscriptions and queued QoS 1 messages
+        # at the broker while we reconnect
+        self.mqtt_client = new_mqtt_client(self.client_id, clean_session=False, protocol=protocol)
+        self.mqtt_client.on_connect = self.on_mqtt_connect
+        self.mqtt_client.on_subscribe = self.on_mqtt_subscribe
+        self.mqtt_client.on_message = self.on_mqtt_message
+        self.mqtt_client.on_disconnect = self.on_mqtt_disconnect
+        if self.meter is not None:
+            self.meter.watch(self.mqtt_client)
+        if self.driver is not None:
+            # The driver writes queued packets from its loop (paho 1.x still writes from the publishing thread)
+            self.mqtt_client.on_socket_register_write = self.driver.write_wanted
+        if self.mqtt_username:
+            self.mqtt_client.username_pw_set(self.mqtt_username, self.mqtt_password)
+
+        # Set last will (sent when we disconnect unexpectedly)
+        if self.will_room is not None:
+            will_topic, will_msg = self.will_room.last_will()
+            self.mqtt_client.will_set(will_topic, will_msg, qos=1, retain=True)
+
+        self.aliases.set_topics([topic for engine in self.rooms.values() for topic in engine.hot_topics()])
+        for engine in self.rooms.values():
+            self._attach(engine)
+
+        self._connect_client(self.mqtt_client)
+        self._socket_closed.clear()
+
+    def _connect_client(self, client):
+        """Send CONNECT with our current keepalive (raises if the broker is unreachable)"""
+        self._sent_keepalive = self.keepalive
+        if self.protocol == PROTOCOL_V5:
+            client.connect(self.server, self.port, self.keepalive, clean_start=False,
+                           properties=connect_properties())
+        else:
+            client.connect(self.server, self.port, self.keepalive)
+
+    def set_keepalive(self, seconds):
+        """Negotiate a new keepalive (if we are connected, by reconnecting without the rooms noticing)"""
+        self.keepalive = seconds
+        if (self.connected and seconds != self._sent_keepalive and not self._renegotiating
+                and not self._stopping.is_set()):
+            # A DISCONNECT, so the broker drops our will instead of publishing it
+            self._renegotiating = True
+            self.stats["renegotiations"] += 1
+            self.mqtt_client.disconnect()
+
+    def _reconnect_client(self, client):
+        """Reconnect paho's client (raises like connect()), negotiating our current keepalive"""
+        self._connect_client(client)
+
+    def _renegotiate(self):
+        """Reconnect straight after set_keepalive() closed the connection (False if the broker is unreachable)"""
+        self._renegotiating = False
+        self._quiet_reconnect = True
+        try:
+            self._reconnect_client(self.mqtt_client)
+            return True
+        except (OSError, ValueError) as e:
+            print(f"Reconnecting for a new keepalive failed: {e}")
+            self._rooms_lost(mqtt.MQTT_ERR_CONN_LOST)
+            return False
+
+    def _network_loop(self):
+        """paho's network loop, reconnecting with jittered exponential backoff when the broker drops us"""
+        while True:
+            client = self.mqtt_client
+            rc = client.loop(timeout=1.0)
+            if self.meter is not None:
+                self.meter.sample()
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                if self._connack_overdue():
+                    self._fallback_pending = True
+                    client.disconnect()
+                continue
+            if self._fallback_pending and not self._stopping.is_set() and self._fall_back():
+                continue
+            if self._renegotiating and not self._stopping.is_set() and self._renegotiate():
+                continue
+            # Connection closed: by close() (stop), or lost (on_disconnect has run)
+            client = self.mqtt_client
+            while not self._stopping.is_set():
+                delay = self.backoff.next_delay()
+                for engine in list(self.rooms.values()):
+                    engine.session_reconnecting(self.backoff.attempts, delay)
+                if self._stopping.wait(delay):
+                    break
+                try:
+                    self._reconnect_client(client)
+                    break
+                except (OSError, ValueError) as e:
+                    print(f"Reconnect attempt {self.backoff.attempts} failed: {e}")
+            if self._stopping.is_set():
+                return
+
+    def _connack_overdue(self):
+        """True once an "auto" session has waited too long for a v5 CONNACK"""
+        # Some 3.1.1 brokers neither answer nor hang up on a v5 CONNECT
+        return self.can_fall_back() and time.perf_counter() - self._connect_started > V5_CONNACK_TIMEOUT
+
+    def _fall_back(self):
+        """The broker turned down (or hung up on) our v5 CONNECT: start over on 3.1.1 (False if that failed)"""
+        self._fallback_pending = False
+        for engine in list(self.rooms.values()):
+            engine.system_message("Broker doesn't support MQTT v5 - using 3.1.1")
+        try:
+            self.start_client(PROTOCOL_V311)
+            return True
+        except OSError as e:
+            print(f"Connecting with MQTT 3.1.1 failed: {e}")
+            return False
+
+    def service(self, readable, writable):
+        """Driven sessions: read and write what the socket is ready for"""
+        client = self.mqtt_client
+        if readable:
+            client.loop_read()
+        if client.socket() is not None and (writable or client.want_write()):
+            client.loop_write()  # Includes what the callbacks just queued
+        if self.meter is not None:
+            self.meter.sample()
+        if client.socket() is None:
+            self.socket_closed()
+
+    def housekeeping(self):
+        """Driven sessions: keepalive pings and timeouts (the driver calls this about once a second)"""
+        client = self.mqtt_client
+        if client is None:
+            return
+        if client.socket() is None:
+            self.socket_closed()  # Closed outside service(), e.g. a failed write from another thread
+            return
+        if self._connack_overdue():
+            self._fallback_pending = True
+            client.disconnect()
+            client.loop_write()
+        else:
+            client.loop_misc()
+        if self.meter is not None:
+            self.meter.sample()
+        if client.socket() is None:
+            self.socket_closed()
+
+    def socket_closed(self):
+        """Driven sessions: the connection closed; fall back, retry after a backoff delay, or finish closing"""
+        if self._socket_closed.is_set():
+            return
+        self._socket_closed.set()
+        if self._stopping.is_set():
+            return
+        if self._fallback_pending and self._fall_back():
+            return
+        if self._renegotiating and self._renegotiate():
+            self._socket_closed.clear()
+            return
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        delay = self.backoff.next_delay()
+        for engine in list(self.rooms.values()):
+            engine.session_reconnecting(self.backoff.attempts, delay)
+        self._reconnect_job = self.scheduler.call_later(delay, self._reconnect, name="reconnect")
+
+    def _reconnect(self):
+        self._reconnect_job = None
+        if self._stopping.is_set():
+            return
+        try:
+            self._reconnect_client(self.mqtt_client)
+            self._socket_closed.clear()
+        except (OSError, ValueError) as e:
+            print(f"Reconnect attempt {self.backoff.attempts} failed: {e}")
+            self._schedule_reconnect()
+
+    def can_fall_back(self):
+        """True while an "auto" session is still trying its first v5 connection"""
+        return self.mqtt_protocol == PROTOCOL_AUTO and self.protocol == PROTOCOL_V5 and not self._joined
+
+    def on_mqtt_connect(self, client, userdata, flags, rc, properties=None):
+        """Called when MQTT connects"""
+        quiet, self._quiet_reconnect = self._quiet_reconnect, False
+        if rc == 0:
+            if self.protocol == PROTOCOL_V5:
+                self.aliases.connected(properties)
+            self.connected = True
+            self.backoff.reset()
+            session_present = bool(flags.get("session present"))
+            if quiet and session_present:
+                return  # Back after set_keepalive(), with our subscriptions: nothing for the rooms to do
+            reconnect, self._joined = self._joined, True
+            if reconnect:
+                self.stats["reconnects"] += 1
+            elif self.mqtt_protocol == PROTOCOL_AUTO:
+                self.protocols.remember(self.server, self.port, self.protocol)
+            for engine in list(self.rooms.values()):
+                engine.session_connected(client, session_present)
+        elif self.can_fall_back() and rc == UNSUPPORTED_PROTOCOL:
+            self._fallback_pending = True  # The network loop reconnects on 3.1.1
+        else:
+            if quiet:
+                self._rooms_lost(rc)  # The rooms still think they are connected
+            if rc in FATAL_CONNACK_CODES:
+                self._stopping.set()  # Retrying won't fix refused credentials
+            for engine in list(self.rooms.values()):
+                engine.session_failed(rc)
+
+    def on_mqtt_subscribe(self, client, userdata, mid, granted_qos, properties=None):
+        """Called when the broker acknowledges a subscription (each room checks whether it is one of its own)"""
+        for engine in list(self.rooms.values()):
+            engine.on_mqtt_subscribe(client, userdata, mid, granted_qos)
+
+    def on_mqtt_message(self, client, userdata, msg):
+        """Called when MQTT message received: hand it to its room"""
+        route = self.router.match(msg.topic)
+        if route is not None:
+            engine, handler = route
+            engine.deliver(handler, msg)
+
+    def on_mqtt_disconnect(self, client, userdata, rc, properties=None):
+        """Called when MQTT disconnects (the network loop reconnects unless we were closed)"""
+        if self.can_fall_back():
+            self._fallback_pending = True  # Refused our v5 CONNECT: the network loop retries on 3.1.1
+            return
+        if self.protocol == PROTOCOL_V5:
+            self.aliases.disconnected()
+        self.connected = False
+        if self._renegotiating:
+            return  # set_keepalive() closed it; the network loop reconnects straight away
+        if self._quiet_reconnect:
+            self._quiet_reconnect = False  # Lost before the CONNACK: now the rooms need to know
+        self._rooms_lost(rc)
+
+    def _rooms_lost(self, rc):
+        for engine in list(self.rooms.values()):
+            engine.session_lost(rc)
+
+    def stop_reconnecting(self):
+        self._stopping.set()
+        if self._reconnect_job is not None:
+            self._reconnect_job.cancel()
+            self._reconnect_job = None
+
+    def close(self):
+        """End the session and close the connection (blocking until the broker has our DISCONNECT,
+        at most LEAVE_TIMEOUT)"""
+        self.stop_reconnecting()
+        if self.mqtt_client is not None:
+            # The loop sends DISCONNECT and exits once the broker has it (or ends an attempt in progress)
+            self.mqtt_client.disconnect(properties=self._end_session())
+
+    def _end_session(self):
+        """Stop the broker queueing chat for us once we are gone; returns the DISCONNECT properties"""
+        if self.protocol == PROTOCOL_V5:
+            return end_session_properties()
+        # 3.1.1 keeps a persistent session for good: leave it with nothing subscribed
+        topics = [topic for engine in self.rooms.values() for topic, _, _ in engine.subscriptions()]
+        if self.connected and topics:
+            self.mqtt_client.unsubscribe(topics)
+        return None
+        self.stop_network_loop()
+        self.connected = False
+
+    def stop_network_loop(self):
+        """Wait for the network loop thread to finish (close() has told it to stop)"""
+        if self.driver is not None:
+            # Driven: wait for the driver to send our DISCONNECT, or send it ourselves on its thread
+            if self.driver.on_loop_thread():
+                if self.mqtt_client is not None and self.mqtt_client.socket() is not None:
+                    self.mqtt_client.loop_write()
+                self._socket_closed.set()
+            else:
+                self._socket_closed.wait(LEAVE_TIMEOUT)
+            self.driver.detach(self)
+            return
+        thread, self._network_thread = self._network_thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=LEAVE_TIMEOUT)
@@ -0,0 +1,78 @@
+"""
+MQChat timing wheel
+Deadlines for many keys (e.g. when each member's presence expires), checked
+once per tick. Keys are hashed into slots by deadline, so a tick only looks
+at the keys due in that slot; scheduling, refreshing and cancelling are O(1).
+
+A refresh that pushes a deadline back only records it. When the key's old
+slot comes round it is moved to the slot of its current deadline, so a
+member who heartbeats every 30 seconds costs one dict update per heartbeat
+plus one move per expiry period.
+"""
+
+import math
+
+
+class TimingWheel:
+    def __init__(self, tick=1.0, slots=256):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}  # key -> deadline (seconds, same clock as advance())
+        self._slot_of = {}  # key -> slot index it currently sits in
+        self._next_tick = None  # Index of the next tick to process
+
+    def _tick_index(self, when):
+        return math.floor(when / self.tick)
+
+    def _place(self, key, deadline):
+        index = max(self._tick_index(deadline), self._next_tick or 0)
+        slot = index % len(self.slots)
+        self.slots[slot].add(key)
+        self._slot_of[key] = slot
+
+    def schedule(self, key, deadline):
+        """Set (or move) key's deadline"""
+        previous = self.deadlines.get(key)
+        if previous is None:
+            self._place(key, deadline)
+        elif deadline < previous:
+            # Sooner than its slot: move it now (later deadlines move when the slot comes round)
+            self.slots[self._slot_of[key]].discard(key)
+            self._place(key, deadline)
+        self.deadlines[key] = deadline
+
+    def cancel(self, key):
+        if self.deadlines.pop(key, None) is not None:
+            self.slots[self._slot_of.pop(key)].discard(key)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def advance(self, now):
+        """Process every tick up to now; returns the keys whose deadline has passed"""
+        current = self._tick_index(now)
+        if self._next_tick is None:
+            self._next_tick = current - len(self.slots) + 1  # First tick: look at every slot once
+        expired = []
+        # Past a full turn every slot is visited once; later ticks would repeat them
+        first = max(self._next_tick, current - len(self.slots) + 1)
+        for index in range(first, current + 1):
+            slot = self.slots[index % len(self.slots)]
+            for key in list(slot):
+                deadline = self.deadlines[key]
+                if deadline <= now:
+                    slot.discard(key)
+                    del self.deadlines[key]
+                    del self._slot_of[key]
+                    expired.append(key)
+                elif self._tick_index(deadline) != index:
+                    # Refreshed (or due on a later turn): move to its current slot
+                    slot.discard(key)
+                    self._next_tick = index + 1
+                    self._place(key, deadline)
+        # Keys due later in the current tick are still waiting: look at it again next time
+        self._next_tick = current
+        return expired
@@ -0,0 +1,526 @@
+"""
+MQChat file transfer
+Files are streamed as fixed-size encrypted chunks on per-transfer topics:
+
+    chat/{channel}/files/{id}/manifest   name, size, chunk size, chunk count, SHA-256
+    chat/{channel}/files/{id}/chunk      one chunk per message
+    chat/{channel}/files/{id}/done       the sender has published every chunk
+    chat/{channel}/files/{id}/resend     a receiver asks for the chunks it is missing
+
+Control messages use the room's normal message encryption. A chunk is
+
+    index (4 bytes) | v2 header (suite, key id) | ciphertext
+
+with the transfer id, index and header authenticated as AAD, so chunks can't
+be moved between positions or transfers; the whole file is then checked
+against the manifest's SHA-256.
+
+A manifest is only an offer: the receiver creates the .part file and
+subscribes to the chunks once the user accept()s it (EVENT_FILE_OFFERED asks
+the front end). Chunks published before that are fetched with a resend
+request, so an offer can be accepted for as long as the sender answers them.
+Downloads in progress may take up max_incoming bytes between them.
+
+Neither side holds the whole file in memory: the sender reads one chunk at a
+time and keeps at most `window` chunks waiting for the broker's PUBACK, and
+the receiver writes each chunk at its offset in a .part file and hashes the
+finished file from disk on a worker thread.
+"""
+
+import hashlib
+import os
+import secrets
+import struct
+import threading
+import time
+from collections import deque
+
+from . import wire
+
+# Events (emitted through the ChatEngine)
+EVENT_FILE_OFFERED = "file_offered"    # (transfer_id, sender, name, size) - accept() or decline() it
+EVENT_FILE_PROGRESS = "file_progress"  # (transfer_id, direction, name, done_bytes, total_bytes)
+EVENT_FILE_DONE = "file_done"          # (transfer_id, direction, name, path, error) - error None on success
+
+SEND = "send"
+RECEIVE = "receive"
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_WINDOW = 16  # Chunks published but not yet acknowledged by the broker
+DEFAULT_MAX_FILE_SIZE = 256 * 1024 * 1024  # Larger offers are ignored
+DEFAULT_MAX_INCOMING = 512 * 1024 * 1024  # Bytes all downloads in progress may take on disk
+MAX_PENDING_OFFERS = 20  # Offers waiting for an answer; the oldest is dropped beyond this
+MANIFEST_LEAD = 0.3  # Seconds between the manifest and the first chunk, so receivers can subscribe
+PROGRESS_INTERVAL = 0.25  # Seconds between progress events
+STALL_TIMEOUT = 3.0  # Ask for missing chunks after this long without any
+MAX_RESEND_REQUESTS = 10  # Give up on a transfer after this many unanswered requests
+SERVE_RESENDS_FOR = 600  # Seconds a sender keeps answering resend requests
+PUBLISH_TIMEOUT = 30  # Seconds to wait for the broker to acknowledge a chunk
+HASH_BLOCK = 1024 * 1024
+
+CHUNK_INDEX = struct.Struct("!I")
+
+
+def safe_filename(name):
+    """Strip any path from a received file name"""
+    name = os.path.basename(str(name).replace("\\", "/")).strip().lstrip(".")
+    return name or "file"
+
+
+def unique_path(directory, name):
+    """A path in directory for name that doesn't overwrite an existing file"""
+    path = os.path.join(directory, name)
+    stem, ext = os.path.splitext(name)
+    count = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem} ({count}){ext}")
+        count += 1
+    return path
+
+
+def file_sha256(path):
+    """Hash a file from disk a block at a time"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def to_ranges(indices):
+    """[1, 2, 3, 7] -> [[1, 3], [7, 7]] (compact resend requests)"""
+    ranges = []
+    for index in indices:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+class OutgoingTransfer:
+    def __init__(self, transfer_id, path, manifest):
+        self.id = transfer_id
+        self.path = path
+        self.manifest = manifest
+        self.cancelled = False
+        self.finished_at = None
+        self.resend_pending = set()
+        self.resend_thread = None
+
+
+class IncomingTransfer:
+    def __init__(self, transfer_id, manifest, part_path):
+        self.id = transfer_id
+        self.manifest = manifest
+        self.name = manifest["name"]
+        self.size = manifest["size"]
+        self.chunk_size = manifest["chunk_size"]
+        self.chunks = manifest["chunks"]
+        self.part_path = part_path
+        self.file = open(part_path, 'wb')
+        self.file.truncate(self.size)
+        self.received = bytearray(self.chunks)  # 1 per chunk we have
+        self.received_count = 0
+        self.received_bytes = 0
+        self.last_activity = time.time()
+        self.last_progress = 0
+        self.resend_requests = 0
+        self.lock = threading.Lock()
+
+    def missing(self):
+        return [i for i, have in enumerate(self.received) if not have]
+
+
+class FileTransfers:
+    """Sends and receives files for one ChatEngine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.download_dir = "received_files"
+        self.chunk_size = DEFAULT_CHUNK_SIZE
+        self.window = DEFAULT_WINDOW
+        self.max_file_size = DEFAULT_MAX_FILE_SIZE
+        self.max_incoming = DEFAULT_MAX_INCOMING
+
+        self.outgoing = {}  # transfer id -> OutgoingTransfer
+        self.offers = {}  # transfer id -> manifest of an offer not yet accepted (oldest first)
+        self.incoming = {}  # transfer id -> IncomingTransfer
+        self._lock = threading.Lock()
+        self._check_timer = None
+        self.stats = {"chunks_sent": 0, "chunks_received": 0, "chunks_resent": 0,
+                      "duplicate_chunks": 0, "resend_requests": 0}
+
+    def configure(self, chunk_size=None, window=None, max_file_size=None):
+        """Apply per-room transfer options"""
+        if chunk_size:
+            self.chunk_size = int(chunk_size)
+        if window:
+            self.window = max(1, int(window))
+        if max_file_size:
+            self.max_file_size = int(max_file_size)
+
+    def topic(self, transfer_id, kind):
+        return f"{self.engine.files_topic}/{transfer_id}/{kind}"
+
+    def subscriptions(self):
+        """Topics to subscribe to on connect, with the chunk topics of downloads in progress"""
+        with self._lock:
+            downloads = list(self.incoming)
+        return ([self.topic("+", "manifest"), self.topic("+", "done"), self.topic("+", "resend")] +
+                [self.topic(transfer_id, "chunk") for transfer_id in downloads])
+
+    def _publish_control(self, transfer_id, kind, data, qos=1):
+        return self.engine.mqtt_client.publish(self.topic(transfer_id, kind),
+                                               self.engine.encrypt_message(data), qos=qos)
+
+    def _seal_chunk(self, transfer_id, index, data):
+        room_key = self.engine.keyring.current
+        suite = room_key.ciphers.by_name(self.engine.cipher_suite)
+        prefix = CHUNK_INDEX.pack(index)
+        header = wire.header_v2(suite=suite.suite_id, key_id=room_key.key_id)
+        return prefix + header + suite.encrypt(data, aad=transfer_id.encode() + prefix + header)
+
+    def _open_chunk(self, transfer_id, payload):
+        """Return (index, data) for a chunk frame, or None if we can't read it"""
+        if len(payload) < CHUNK_INDEX.size:
+            raise wire.WireError("Truncated chunk")
+        prefix = payload[:CHUNK_INDEX.size]
+        envelope = wire.unpack(payload[CHUNK_INDEX.size:])
+        if envelope.version != wire.WIRE_V2:
+            raise wire.WireError("File chunks must use wire format v2")
+        room_key = self.engine.keyring.get(envelope.key_id) if envelope.key_id else self.engine.keyring.current
+        if room_key is None:
+            return None
+        suite = room_key.ciphers.get(envelope.suite)
+        data = suite.decrypt(envelope.body, aad=transfer_id.encode() + prefix + envelope.header)
+        return CHUNK_INDEX.unpack(prefix)[0], data
+
+    def send(self, path):
+        """Start sending a file to the room in the background; returns the transfer id"""
+        if not self.engine.connected:
+            raise RuntimeError("Not connected")
+        size = os.path.getsize(path)
+        transfer_id = secrets.token_hex(8)
+        manifest = {
+            "type": "manifest",
+            "id": transfer_id,
+            "sender": self.engine.username,
+            "name": safe_filename(path),
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "chunks": max(1, -(-size // self.chunk_size)),
+            "timestamp": time.time()
+        }
+        transfer = OutgoingTransfer(transfer_id, path, manifest)
+        with self._lock:
+            # Forget finished transfers that no longer answer resend requests
+            for old in list(self.outgoing.values()):
+                if old.finished_at and time.time() - old.finished_at > SERVE_RESENDS_FOR:
+                    del self.outgoing[old.id]
+            self.outgoing[transfer_id] = transfer
+        threading.Thread(target=self._send_worker, args=(transfer,), daemon=True).start()
+        return transfer_id
+
+    def _send_worker(self, transfer):
+        manifest = transfer.manifest
+        try:
+            manifest["sha256"] = file_sha256(transfer.path)
+            self._publish_control(transfer.id, "manifest", manifest).wait_for_publish(PUBLISH_TIMEOUT)
+            time.sleep(MANIFEST_LEAD)
+
+            self._publish_chunks(transfer, range(manifest["chunks"]), report_progress=True)
+            if transfer.cancelled:
+                raise RuntimeError("Cancelled")
+            self._publish_control(transfer.id, "done", {"type": "done", "id": transfer.id})
+            transfer.finished_at = time.time()
+            self.engine.emit(EVENT_FILE_DONE, transfer.id, SEND, manifest["name"], transfer.path, None)
+        except Exception as e:
+            with self._lock:
+                self.outgoing.pop(transfer.id, None)
+            self.engine.emit(EVENT_FILE_DONE, transfer.id, SEND, manifest["name"], transfer.path, str(e))
+
+    def _publish_chunks(self, transfer, indices, report_progress=False):
+        """Publish chunks, keeping at most `window` of them unacknowledged"""
+        manifest = transfer.manifest
+        chunk_size = manifest["chunk_size"]
+        in_flight = deque()
+        sent_bytes = 0
+        last_progress = 0
+
+        with open(transfer.path, 'rb') as f:
+            for index in indices:
+                if transfer.cancelled:
+                    return
+                f.seek(index * chunk_size)
+                data = f.read(chunk_size)
+                frame = self._seal_chunk(transfer.id, index, data)
+                in_flight.append(self.engine.mqtt_client.publish(self.topic(transfer.id, "chunk"), frame, qos=1))
+                self.stats["chunks_sent"] += 1
+                if len(in_flight) >= self.window:
+                    in_flight.popleft().wait_for_publish(PUBLISH_TIMEOUT)
+
+                sent_bytes += len(data)
+                now = time.time()
+                if report_progress and now - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = now
+                    self.engine.emit(EVENT_FILE_PROGRESS, transfer.id, SEND, manifest["name"],
+                                     sent_bytes, manifest["size"])
+
+        while in_flight:
+            in_flight.popleft().wait_for_publish(PUBLISH_TIMEOUT)
+        if report_progress:
+            self.engine.emit(EVENT_FILE_PROGRESS, transfer.id, SEND, manifest["name"],
+                             manifest["size"], manifest["size"])
+
+    def handle_message(self, topic, payload):
+        """Route a message from chat/{channel}/files/..."""
+        parts = topic[len(self.engine.files_topic) + 1:].split("/")
+        if len(parts) != 2:
+            return
+        transfer_id, kind = parts
+        if kind == "chunk":
+            self._on_chunk(transfer_id, payload)
+        elif kind == "manifest":
+            self._on_manifest(transfer_id, payload)
+        elif kind == "done":
+            self._on_done(transfer_id, payload)
+        elif kind == "resend":
+            self._on_resend(transfer_id, payload)
+
+    def _on_manifest(self, transfer_id, payload):
+        if transfer_id in self.outgoing or transfer_id in self.offers or transfer_id in self.incoming:
+            return  # Our own offer, or one we've already seen
+        manifest = self.engine.decrypt_message(payload)
+        if not manifest or manifest.get("type") != "manifest" or manifest.get("id") != transfer_id:
+            return
+
+        manifest["name"] = safe_filename(manifest.get("name", ""))
+        size, chunk_size, chunks = (manifest.get(key) for key in ("size", "chunk_size", "chunks"))
+        if not all(type(value) is int for value in (size, chunk_size, chunks)):
+            return  # Also rejects floats and bools, which int() would quietly accept
+        if size < 0 or chunk_size <= 0 or chunks != max(1, -(-size // chunk_size)):
+            return
+        if size > self.max_file_size:
+            self.engine.emit(EVENT_FILE_DONE, transfer_id, RECEIVE, manifest["name"], None,
+                             f"Not downloaded: {size / 1e6:.1f} MB is over the "
+                             f"{self.max_file_size / 1e6:.0f} MB limit")
+            return
+
+        manifest["offered_at"] = time.time()
+        with self._lock:
+            self.offers[transfer_id] = manifest
+            while len(self.offers) > MAX_PENDING_OFFERS:
+                del self.offers[next(iter(self.offers))]
+        self.engine.emit(EVENT_FILE_OFFERED, transfer_id, manifest.get("sender", "Unknown"),
+                         manifest["name"], size)
+
+    def accept(self, transfer_id):
+        """Start downloading an offered file (False if the offer is gone, expired or over the quota)"""
+        with self._lock:
+            manifest = self.offers.pop(transfer_id, None)
+            if manifest is None:
+                return False
+            if time.time() - manifest["offered_at"] > SERVE_RESENDS_FOR:
+                error = "Offer expired"
+            elif sum(t.size for t in self.incoming.values()) + manifest["size"] > self.max_incoming:
+                error = f"Not downloaded: over the {self.max_incoming / 1e6:.0f} MB allowed for downloads in progress"
+            else:
+                error = None
+        if error:
+            self.engine.emit(EVENT_FILE_DONE, transfer_id, RECEIVE, manifest["name"], None, error)
+            return False
+        if not self.engine.connected:
+            self.engine.emit(EVENT_FILE_DONE, transfer_id, RECEIVE, manifest["name"], None, "Not connected")
+            return False
+
+        os.makedirs(self.download_dir, exist_ok=True)
+        part_path = unique_path(self.download_dir, manifest["name"] + ".part")
+        transfer = IncomingTransfer(transfer_id, manifest, part_path)
+        with self._lock:
+            self.incoming[transfer_id] = transfer
+        self.engine.mqtt_client.subscribe(self.topic(transfer_id, "chunk"), qos=1)
+        if manifest.get("done"):
+            self._request_resend(transfer)  # Sent before we accepted: ask for all of it
+        self._start_stall_checks()
+        return True
+
+    def decline(self, transfer_id):
+        """Forget an offered file"""
+        with self._lock:
+            self.offers.pop(transfer_id, None)
+
+    def _on_chunk(self, transfer_id, payload):
+        transfer = self.incoming.get(transfer_id)
+        if transfer is None:
+            return
+        try:
+            opened = self._open_chunk(transfer_id, payload)
+        except Exception as e:
+            print(f"Error decrypting file chunk: {e}")
+            return
+        if opened is None:
+            return
+        index, data = opened
+
+        with transfer.lock:
+            if transfer.file is None or index >= transfer.chunks:
+                return
+            offset = index * transfer.chunk_size
+            if len(data) > transfer.chunk_size or offset + len(data) > transfer.size:
+                return  # Would overwrite the next chunk or grow the file past the manifest's size
+            if transfer.received[index]:
+                self.stats["duplicate_chunks"] += 1
+                return
+            transfer.file.seek(offset)
+            transfer.file.write(data)
+            transfer.received[index] = 1
+            transfer.received_count += 1
+            transfer.received_bytes += len(data)
+            transfer.last_activity = time.time()
+            self.stats["chunks_received"] += 1
+            complete = transfer.received_count == transfer.chunks
+
+        now = time.time()
+        if complete or now - transfer.last_progress >= PROGRESS_INTERVAL:
+            transfer.last_progress = now
+            self.engine.emit(EVENT_FILE_PROGRESS, transfer_id, RECEIVE, transfer.name,
+                             transfer.received_bytes, transfer.size)
+        if complete:
+            self._finish(transfer)
+
+    def _on_done(self, transfer_id, payload):
+        offer = self.offers.get(transfer_id)
+        if offer is not None:
+            offer["done"] = True  # Accepting it must ask for every chunk
+            return
+        transfer = self.incoming.get(transfer_id)
+        if transfer is not None and transfer.received_count < transfer.chunks:
+            # Everything was sent but something didn't arrive - ask now rather than after a stall
+            self._request_resend(transfer)
+
+    def _on_resend(self, transfer_id, payload):
+        transfer = self.outgoing.get(transfer_id)
+        if transfer is None or transfer.cancelled:
+            return
+        if transfer.finished_at and time.time() - transfer.finished_at > SERVE_RESENDS_FOR:
+            return
+        request = self.engine.decrypt_message(payload)
+        if not request or request.get("type") != "resend":
+            return
+
+        chunks = transfer.manifest["chunks"]
+        with self._lock:
+            for start, end in request.get("missing", []):
+                transfer.resend_pending.update(range(max(0, int(start)), min(chunks - 1, int(end)) + 1))
+            if transfer.resend_thread is None or not transfer.resend_thread.is_alive():
+                transfer.resend_thread = threading.Thread(target=self._resend_worker, args=(transfer,),
+                                                          daemon=True)
+                transfer.resend_thread.start()
+
+    def _resend_worker(self, transfer):
+        """Publish requested chunks (requests from several receivers are merged)"""
+        try:
+            while True:
+                with self._lock:
+                    indices = sorted(transfer.resend_pending)
+                    transfer.resend_pending.clear()
+                if not indices:
+                    return
+                self._publish_chunks(transfer, indices)
+                self.stats["chunks_resent"] += len(indices)
+                if transfer.finished_at:
+                    self._publish_control(transfer.id, "done", {"type": "done", "id": transfer.id})
+        except Exception as e:
+            print(f"Error resending file chunks: {e}")
+
+    def _request_resend(self, transfer):
+        missing = transfer.missing()
+        if not missing or not self.engine.connected:
+            return
+        transfer.resend_requests += 1
+        transfer.last_activity = time.time()
+        self.stats["resend_requests"] += 1
+        self._publish_control(transfer.id, "resend", {"type": "resend", "id": transfer.id,
+                                                      "missing": to_ranges(missing)})
+
+    def _finish(self, transfer):
+        """Close a completed download and verify it on a worker (hashing it would stall the network thread)"""
+        with transfer.lock:
+            if transfer.file is None:
+                return
+            transfer.file.close()
+            transfer.file = None
+        self._drop_incoming(transfer)
+        threading.Thread(target=self._verify, args=(transfer,), name="mqchat-file-verify", daemon=True).start()
+
+    def _verify(self, transfer):
+        """Check a completed download against its manifest and move it into place"""
+        try:
+            if file_sha256(transfer.part_path) != transfer.manifest.get("sha256"):
+                os.remove(transfer.part_path)
+                self.engine.emit(EVENT_FILE_DONE, transfer.id, RECEIVE, transfer.name, None,
+                                 "Integrity check failed")
+                return
+            path = unique_path(self.download_dir, transfer.name)
+            os.replace(transfer.part_path, path)
+        except OSError as e:
+            self.engine.emit(EVENT_FILE_DONE, transfer.id, RECEIVE, transfer.name, None, f"Saving failed: {e}")
+            return
+        self.engine.emit(EVENT_FILE_DONE, transfer.id, RECEIVE, transfer.name, path, None)
+
+    def _fail(self, transfer, error):
+        with transfer.lock:
+            if transfer.file is None:
+                return
+            transfer.file.close()
+            transfer.file = None
+        self._drop_incoming(transfer)
+        try:
+            os.remove(transfer.part_path)
+        except OSError:
+            pass
+        self.engine.emit(EVENT_FILE_DONE, transfer.id, RECEIVE, transfer.name, None, error)
+
+    def _drop_incoming(self, transfer):
+        with self._lock:
+            self.incoming.pop(transfer.id, None)
+        if self.engine.mqtt_client and self.engine.connected:
+            self.engine.mqtt_client.unsubscribe(self.topic(transfer.id, "chunk"))
+
+    def _start_stall_checks(self):
+        with self._lock:
+            if self._check_timer is None:
+                self._check_timer = self.engine.scheduler.call_later(1.0, self._check_stalled,
+                                                                     name="file stall check")
+
+    def _check_stalled(self):
+        """Ask for missing chunks of transfers that stopped making progress"""
+        with self._lock:
+            self._check_timer = None
+            transfers = list(self.incoming.values())
+        now = time.time()
+        for transfer in transfers:
+            if now - transfer.last_activity < STALL_TIMEOUT:
+                continue
+            if transfer.resend_requests >= MAX_RESEND_REQUESTS:
+                self._fail(transfer, "Sender stopped responding")
+            else:
+                self._request_resend(transfer)
+        if self.incoming:
+            self._start_stall_checks()
+
+    def cancel_all(self):
+        """Stop every transfer (on disconnect); partial downloads are deleted"""
+        with self._lock:
+            outgoing = list(self.outgoing.values())
+            incoming = list(self.incoming.values())
+            self.outgoing.clear()
+            self.offers.clear()
+            if self._check_timer is not None:
+                self._check_timer.cancel()
+                self._check_timer = None
+        for transfer in outgoing:
+            transfer.cancelled = True
+        for transfer in incoming:
+            self._fail(transfer, "Disconnected")
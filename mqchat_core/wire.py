@@ -0,0 +1,126 @@
+"""
+MQChat wire format
+v1: base64 text of a Fernet token (the original format, token is itself
+    urlsafe-base64, so chat payloads are base64'd twice).
+v2: raw bytes - a 4-byte header followed by the binary ciphertext.
+
+    +-------+---------+-------+-------+------------------+
+    | magic | version | flags | suite | body ...         |
+    | 0xC3  |    2    |       |       |                  |
+    +-------+---------+-------+-------+------------------+
+
+The magic byte is not a base64 character, so receivers can tell v1 and v2
+payloads apart from the first byte and mixed rooms keep working.
+
+Flags describe optional header fields and body transforms:
+    FLAG_KEY_ID  a 4-byte room key fingerprint follows the fixed header
+    FLAG_ZLIB    the plaintext was zlib-compressed before encryption
+    FLAG_ZSTD    the plaintext was zstd-compressed before encryption
+    FLAG_DICT    a 4-byte compression dictionary id follows (after the key id)
+    FLAG_BATCH   the plaintext is a JSON list of several chat messages
+"""
+
+import base64
+import binascii
+import struct
+from collections import namedtuple
+
+WIRE_V1 = 1
+WIRE_V2 = 2
+WIRE_VERSIONS = (WIRE_V1, WIRE_V2)
+
+MAGIC = 0xC3
+HEADER = struct.Struct("!BBBB")  # magic, version, flags, suite
+
+# Cipher suites (body encoding depends on the suite)
+SUITE_FERNET = 0
+
+# Header flags
+FLAG_KEY_ID = 0x01
+FLAG_ZLIB = 0x02
+FLAG_ZSTD = 0x04
+FLAG_DICT = 0x08
+FLAG_BATCH = 0x10
+KEY_ID_SIZE = 4
+DICT_ID_SIZE = 4
+
+Envelope = namedtuple("Envelope", "version flags suite key_id dict_id body header")
+
+
+class WireError(ValueError):
+    """Raised for payloads that are not a valid v1 or v2 envelope"""
+
+
+def pack_v1(fernet_token):
+    """Frame a Fernet token as a v1 payload (base64 text)"""
+    return base64.b64encode(fernet_token)
+
+
+def pack_v2(body, flags=0, suite=SUITE_FERNET, key_id=None, dict_id=None):
+    """Frame binary ciphertext as a v2 payload"""
+    return header_v2(flags, suite, key_id, dict_id) + body
+
+
+def header_v2(flags=0, suite=SUITE_FERNET, key_id=None, dict_id=None):
+    """Build the v2 header (4 bytes, plus the key id and dictionary id when given)"""
+    flags &= ~(FLAG_KEY_ID | FLAG_DICT)
+    extra = b""
+    if key_id is not None:
+        if len(key_id) != KEY_ID_SIZE:
+            raise WireError(f"Key id must be {KEY_ID_SIZE} bytes")
+        flags |= FLAG_KEY_ID
+        extra += key_id
+    if dict_id is not None:
+        if len(dict_id) != DICT_ID_SIZE:
+            raise WireError(f"Dictionary id must be {DICT_ID_SIZE} bytes")
+        flags |= FLAG_DICT
+        extra += dict_id
+    return HEADER.pack(MAGIC, WIRE_V2, flags, suite) + extra
+
+
+def unpack(payload):
+    """Parse a v1 or v2 payload into an Envelope"""
+    if isinstance(payload, str):
+        payload = payload.encode()
+    if not payload:
+        raise WireError("Empty payload")
+
+    if payload[0] == MAGIC:
+        if len(payload) < HEADER.size:
+            raise WireError("Truncated v2 header")
+        magic, version, flags, suite = HEADER.unpack_from(payload)
+        if version != WIRE_V2:
+            raise WireError(f"Unsupported wire version {version}")
+
+        header_size = HEADER.size
+        key_id = None
+        if flags & FLAG_KEY_ID:
+            key_id = payload[header_size:header_size + KEY_ID_SIZE]
+            header_size += KEY_ID_SIZE
+            if len(payload) < header_size:
+                raise WireError("Truncated key id")
+        dict_id = None
+        if flags & FLAG_DICT:
+            dict_id = payload[header_size:header_size + DICT_ID_SIZE]
+            header_size += DICT_ID_SIZE
+            if len(payload) < header_size:
+                raise WireError("Truncated dictionary id")
+        return Envelope(version, flags, suite, key_id, dict_id, payload[header_size:],
+                        payload[:header_size])
+
+    # Anything else must be the original base64 text
+    try:
+        token = base64.b64decode(payload, validate=True)
+    except binascii.Error as e:
+        raise WireError(f"Invalid v1 payload: {e}")
+    return Envelope(WIRE_V1, 0, SUITE_FERNET, None, None, token, b"")
+
+
+def fernet_to_binary(token):
+    """Strip Fernet's urlsafe-base64 layer to get the raw token bytes"""
+    return base64.urlsafe_b64decode(token)
+
+
+def binary_to_fernet(raw):
+    """Re-add Fernet's urlsafe-base64 layer so Fernet.decrypt accepts it"""
+    return base64.urlsafe_b64encode(raw)
@@ -0,0 +1,121 @@
+"""ChatLog: the edits it returns keep a view equal to the window it describes"""
+
+import unittest
+
+from mqchat_core.chatlog import ChatLog
+
+
+def format_entry(kind, args):
+    return f"{kind}: {args}\n"
+
+
+class View:
+    """A text widget reduced to a list of lines"""
+
+    def __init__(self):
+        self.lines = []
+
+    def apply(self, edits):
+        for edit, value in edits:
+            if edit == "append":
+                self.lines += value.splitlines()
+            elif edit == "prepend":
+                self.lines[:0] = value.splitlines()
+            elif edit == "trim_top":
+                del self.lines[:value]
+            elif edit == "trim_bottom":
+                del self.lines[len(self.lines) - value:]
+            elif edit == "replace":
+                self.lines = value.splitlines()
+            else:
+                raise AssertionError(f"Unknown edit {edit}")
+
+
+class ChatLogTest(unittest.TestCase):
+    def setUp(self):
+        self.log = ChatLog(format_entry, capacity=100, window=20, page=10, trim_batch=5)
+        self.view = View()
+
+    def add(self, start, count):
+        self.view.apply(self.log.append([("chat", i) for i in range(start, start + count)]))
+
+    def assertShows(self, start, end):
+        self.assertEqual(self.view.lines, [f"chat: {i}" for i in range(start, end)])
+        self.assertEqual(self.log.rendered, end - start)
+
+    def test_capacity_must_exceed_window(self):
+        with self.assertRaises(ValueError):
+            ChatLog(format_entry, capacity=30, window=20, page=10, trim_batch=5)
+
+    def test_follows_the_bottom_and_trims_in_batches(self):
+        self.add(0, 25)
+        self.assertShows(0, 25)  # Within the trim batch
+        self.add(25, 1)
+        self.assertShows(6, 26)
+        self.assertTrue(self.log.following)
+        self.assertEqual(self.log.stats["trimmed"], 6)
+
+    def test_scrolling_up_and_back_down(self):
+        self.add(0, 40)
+        self.assertShows(20, 40)
+        self.view.apply(self.log.older())
+        self.assertShows(10, 30)
+        self.assertFalse(self.log.following)
+        self.add(40, 3)  # Buffered, not rendered, while scrolled up
+        self.assertShows(10, 30)
+        self.assertEqual(self.log.unseen, 13)
+        self.view.apply(self.log.newer())
+        self.assertShows(20, 40)
+        self.view.apply(self.log.newer())
+        self.assertShows(20, 43)
+        self.assertTrue(self.log.following)
+        self.assertEqual(self.log.newer(), [])
+
+    def test_older_stops_at_the_top(self):
+        self.add(0, 30)
+        self.view.apply(self.log.older())
+        self.assertShows(0, 20)
+        self.assertEqual(self.log.older(), [])
+
+    def test_latest_jumps_to_the_bottom(self):
+        self.add(0, 40)
+        self.view.apply(self.log.older())
+        self.add(40, 10)
+        self.view.apply(self.log.latest())
+        self.assertShows(30, 50)
+
+    def test_buffer_overflow(self):
+        self.add(0, 150)
+        self.assertEqual(len(self.log.entries), 100)
+        self.assertEqual(self.log.first_seq, 50)
+        self.assertShows(130, 150)
+        for _ in range(10):
+            self.view.apply(self.log.older())
+        self.assertEqual(self.view.lines[0], "chat: 50")
+
+    def test_history_goes_above_live_messages(self):
+        self.add(0, 2)
+        added = self.log.prepend_history([("chat", f"stored {i}", 100 + i) for i in range(3)])
+        self.assertEqual(added, 3)
+        self.assertEqual(self.log.oldest_history_id(), 100)
+        self.view.apply(self.log.latest())
+        self.assertEqual(self.view.lines, ["chat: stored 0", "chat: stored 1", "chat: stored 2",
+                                           "chat: 0", "chat: 1"])
+
+    def test_history_stops_when_the_buffer_is_full(self):
+        self.add(0, 95)
+        added = self.log.prepend_history([("chat", i, i) for i in range(10)])
+        self.assertEqual(added, 5)
+        self.assertFalse(self.log.has_room())
+        self.assertEqual(self.log.oldest_history_id(), 5)
+
+    def test_clear(self):
+        self.add(0, 30)
+        self.view.apply(self.log.clear())
+        self.assertEqual(self.view.lines, [])
+        self.add(0, 1)
+        self.assertShows(0, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
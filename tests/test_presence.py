@@ -0,0 +1,71 @@
+"""LivenessProbe: stale presence records are pinged, and evicted if nobody answers"""
+
+import json
+import time
+import unittest
+
+from mqchat_core.presence import LivenessProbe, LEAN_EXPIRY
+from mqchat_core.scheduler import Scheduler
+
+
+class FakeEngine:
+    """The parts of ChatEngine the probe uses"""
+
+    def __init__(self):
+        self.username = "alice"
+        self.scheduler = Scheduler(threaded=False)
+        self.connected = True
+        self.mqtt_client = self
+        self.probe_topic = "chat/room/probe"
+        self.pings = []
+        self.removed = []
+
+    def publish(self, topic, payload):
+        self.pings.append(json.loads(payload)["users"])
+
+    def remove_user(self, user):
+        self.removed.append(user)
+
+
+class LeanRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = FakeEngine()
+        self.probe = LivenessProbe(self.engine)
+
+    def test_stale_retained_lean_record_is_pinged_and_evicted(self):
+        stale = {"status": "online", "hb": 0, "timestamp": time.time() - LEAN_EXPIRY - 60}
+        self.probe.note("bob", stale, retained=True)
+        self.probe.note("carol", dict(stale, timestamp=time.time()), retained=True)
+        self.assertEqual(self.probe.doubtful_users(), ["bob"])
+        self.probe.lean_tick()
+        self.probe._send_ping()
+        self.assertEqual(self.engine.pings, [["bob"]])
+        self.probe._pinged["bob"] -= 60  # As if PROBE_TIMEOUT went by without an answer
+        self.probe._expire()
+        self.assertEqual(self.engine.removed, ["bob"])
+        self.assertIn("carol", self.probe.lean_wheel)
+
+    def test_answer_keeps_a_lean_member(self):
+        self.probe.note("bob", {"status": "online", "hb": 0, "timestamp": 0}, retained=True)
+        self.probe.lean_tick()
+        self.probe._send_ping()
+        self.probe.note("bob", {"status": "online", "hb": 0})  # The answer
+        self.probe._expire()
+        self.assertEqual(self.engine.removed, [])
+        self.assertIn("bob", self.probe.lean_wheel)
+        self.assertEqual(self.probe.doubtful_users(), [])
+
+    def test_heartbeat_record_moves_off_the_lean_wheel(self):
+        self.probe.note("bob", {"status": "online", "hb": 0})
+        self.probe.note("bob", {"status": "online", "hb": 30})
+        self.assertNotIn("bob", self.probe.lean_wheel)
+        self.assertIn("bob", self.probe.wheel)
+
+    def test_own_record_is_never_scheduled(self):
+        self.probe.note("alice", {"status": "online", "hb": 0, "timestamp": 0}, retained=True)
+        self.assertEqual(len(self.probe.lean_wheel), 0)
+        self.assertEqual(self.probe.doubtful_users(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
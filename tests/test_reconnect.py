@@ -0,0 +1,128 @@
+"""Rejoining a room after the connection drops, and ending the session when we leave"""
+
+import itertools
+import unittest
+
+from mqchat_core import ChatEngine, BrokerSession
+from mqchat_core.mqtt5 import PROTOCOL_V311, PROTOCOL_V5
+from mqchat_core.scheduler import Scheduler
+
+
+class FakeClient:
+    """Records what the engine subscribes to; nothing reaches a broker"""
+
+    def __init__(self):
+        self._mids = itertools.count(1)
+        self.subscribed = []  # (mid, topic)
+        self.unsubscribed = []
+        self.sent = []  # Packet types in the order they were queued
+        self.disconnect_properties = None
+
+    def subscribe(self, topic, qos=0, options=None):
+        mid = next(self._mids)
+        self.subscribed.append((mid, topic))
+        self.sent.append("subscribe")
+        return 0, mid
+
+    def unsubscribe(self, topics):
+        self.unsubscribed += topics
+        self.sent.append("unsubscribe")
+        return 0, next(self._mids)
+
+    def disconnect(self, reasoncode=None, properties=None):
+        self.disconnect_properties = properties
+        self.sent.append("disconnect")
+
+    def will_clear(self):
+        pass
+
+    def socket(self):
+        return None
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        return None
+
+    def is_connected(self):
+        return True
+
+
+class RejoinTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = ChatEngine(scheduler=Scheduler(threaded=False))
+        self.engine.setup_room("room", "alice", "key", options={"presence": "lean"})
+        self.client = self.engine.mqtt_client = FakeClient()
+        self.engine.session_connected(self.client, False)
+        self.first = [mid for mid, _ in self.client.subscribed]
+        self.topics = sorted(topic for _, topic in self.client.subscribed)
+
+    def ack(self, mids):
+        for mid in mids:
+            self.engine.on_mqtt_subscribe(self.client, None, mid, [1])
+
+    def reconnect(self, session_present):
+        self.client.subscribed.clear()
+        self.engine.session_lost(7)
+        self.engine.session_connected(self.client, session_present)
+        return self.client.subscribed
+
+    def test_kept_session_is_not_resubscribed(self):
+        self.ack(self.first)
+        self.assertEqual(self.reconnect(session_present=True), [])
+
+    def test_socket_cut_before_the_subacks(self):
+        # Only the first SUBACK arrived before the connection dropped
+        self.ack(self.first[:1])
+        again = self.reconnect(session_present=True)
+        self.assertEqual(sorted(topic for _, topic in again), self.topics)
+        self.ack(mid for mid, _ in again)
+        self.assertIn("subscribed", self.engine.timings)
+        self.assertEqual(self.engine._pending_subscriptions, set())
+
+    def test_lost_session_is_resubscribed(self):
+        self.ack(self.first)
+        self.assertEqual(sorted(topic for _, topic in self.reconnect(session_present=False)), self.topics)
+
+
+class CloseTest(unittest.TestCase):
+    """A deliberate close ends the persistent session, so the broker stops queueing chat for us"""
+
+    def open(self, protocol):
+        session = BrokerSession("localhost", 1883, client_id="test", mqtt_protocol=protocol,
+                                scheduler=Scheduler(threaded=False))
+        session.mqtt_client = FakeClient()
+        session.protocol = protocol
+        session.connected = True
+        rooms = []
+        for channel in ("one", "two"):
+            engine = ChatEngine(scheduler=session.scheduler)
+            engine.setup_room(channel, "alice", "key")
+            session.add_room(engine, owner=channel == "one")
+            rooms.append(engine)
+        return session, rooms
+
+    def topics(self, engine):
+        return [topic for topic, _, _ in engine.subscriptions()]
+
+    def test_leaving_a_room_unsubscribes_it(self):
+        session, (owner, other) = self.open(PROTOCOL_V311)
+        session.remove_room(other)
+        session.remove_room(owner)
+        self.assertEqual(session.mqtt_client.unsubscribed, self.topics(other) + self.topics(owner))
+
+    def test_close_on_3_1_1_unsubscribes_before_disconnecting(self):
+        session, rooms = self.open(PROTOCOL_V311)
+        client = session.mqtt_client
+        session.close()
+        self.assertEqual(sorted(client.unsubscribed), sorted(sum((self.topics(room) for room in rooms), [])))
+        self.assertEqual(client.sent[-2:], ["unsubscribe", "disconnect"])
+
+    def test_close_on_v5_expires_the_session(self):
+        session, _ = self.open(PROTOCOL_V5)
+        client = session.mqtt_client
+        session.close()
+        self.assertEqual(client.unsubscribed, [])
+        self.assertEqual(client.disconnect_properties.SessionExpiryInterval, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+"""SortedRoster: row edits for batches of roster changes"""
+
+import random
+import unittest
+
+from mqchat_core.roster import SortedRoster, JOIN, LEAVE, SYNC
+
+
+def apply_edits(rows, edits):
+    """Apply row edits to a plain list, the way a list widget would"""
+    for edit, index, user in edits:
+        if edit == "insert":
+            rows.insert(index, user)
+        else:
+            if rows[index] != user:
+                raise AssertionError(f"Row {index} is {rows[index]}, not {user}")
+            del rows[index]
+    return rows
+
+
+class SortedRosterTest(unittest.TestCase):
+    def test_add_and_remove(self):
+        roster = SortedRoster(["carol", "alice"])
+        self.assertEqual(roster.add("bob"), 1)
+        self.assertIsNone(roster.add("bob"))
+        self.assertEqual(list(roster), ["alice", "bob", "carol"])
+        self.assertEqual(roster.remove("alice"), 0)
+        self.assertIsNone(roster.remove("alice"))
+        self.assertNotIn("alice", roster)
+        self.assertEqual(len(roster), 2)
+
+    def test_duplicates_collapse(self):
+        self.assertEqual(list(SortedRoster(["bob", "bob", "alice"])), ["alice", "bob"])
+
+    def test_join_and_leave(self):
+        roster = SortedRoster(["alice", "carol"])
+        edits = roster.apply([(JOIN, "bob"), (LEAVE, "carol")])
+        self.assertEqual(edits, [("insert", 1, "bob"), ("delete", 2, "carol")])
+        self.assertEqual(list(roster), ["alice", "bob"])
+
+    def test_repeated_join_is_no_edit(self):
+        roster = SortedRoster(["alice"])
+        self.assertEqual(roster.apply([(JOIN, "alice"), (LEAVE, "nobody")]), [])
+
+    def test_join_then_leave_in_one_batch(self):
+        roster = SortedRoster(["alice"])
+        self.assertEqual(roster.apply([(JOIN, "bob"), (LEAVE, "bob")]), [])
+        self.assertEqual(list(roster), ["alice"])
+
+    def test_sync(self):
+        roster = SortedRoster(["alice", "bob", "dave"])
+        edits = roster.apply([(SYNC, ["carol", "bob"])])
+        self.assertEqual(apply_edits(["alice", "bob", "dave"], edits), ["bob", "carol"])
+        self.assertEqual(list(roster), ["bob", "carol"])
+
+    def test_changes_after_sync(self):
+        roster = SortedRoster(["alice"])
+        edits = roster.apply([(SYNC, []), (JOIN, "bob")])
+        self.assertEqual(apply_edits(["alice"], edits), ["bob"])
+
+    def test_random_batches_match_a_rebuilt_list(self):
+        rng = random.Random(1)
+        users = [f"user{i:02d}" for i in range(40)]
+        roster = SortedRoster()
+        rows = []
+        online = set()
+        for _ in range(200):
+            changes = []
+            for _ in range(rng.randint(1, 10)):
+                if rng.random() < 0.05:
+                    online = set(rng.sample(users, rng.randint(0, 10)))
+                    changes.append((SYNC, list(online)))
+                else:
+                    user = rng.choice(users)
+                    if rng.random() < 0.5:
+                        online.add(user)
+                        changes.append((JOIN, user))
+                    else:
+                        online.discard(user)
+                        changes.append((LEAVE, user))
+            apply_edits(rows, roster.apply(changes))
+            self.assertEqual(rows, sorted(online))
+            self.assertEqual(list(roster), rows)
+
+
+if __name__ == "__main__":
+    unittest.main()
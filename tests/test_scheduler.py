@@ -0,0 +1,86 @@
+"""Scheduler: jobs run in due order, on time, and stop when cancelled"""
+
+import threading
+import time
+import unittest
+
+from mqchat_core.scheduler import Scheduler
+
+
+class LoopSchedulerTest(unittest.TestCase):
+    """Scheduler(threaded=False), driven by run_pending() with explicit times"""
+
+    def setUp(self):
+        self.scheduler = Scheduler(threaded=False)
+        self.start = time.monotonic()
+        self.ran = []
+
+    def run_at(self, seconds):
+        return self.scheduler.run_pending(self.start + seconds)
+
+    def test_one_shot_jobs_run_in_due_order(self):
+        for delay in (3, 1, 2):
+            self.scheduler.call_later(delay, lambda delay=delay: self.ran.append(delay))
+        self.assertEqual(self.run_at(0.5), 0)
+        self.assertEqual(self.run_at(10), 3)
+        self.assertEqual(self.ran, [1, 2, 3])
+        self.assertEqual(self.run_at(20), 0)
+
+    def test_periodic_job_keeps_its_schedule(self):
+        self.scheduler.call_every(1, lambda: self.ran.append(1), jitter=0)
+        for second in range(1, 6):
+            self.run_at(second + 0.01)
+        self.assertEqual(len(self.ran), 5)
+
+    def test_jitter_stays_within_bounds(self):
+        job = self.scheduler.call_every(10, lambda: None, jitter=0.1)
+        for _ in range(100):
+            interval = self.scheduler._next_interval(job)
+            self.assertTrue(9 <= interval <= 11, interval)
+
+    def test_cancel(self):
+        job = self.scheduler.call_later(1, lambda: self.ran.append("late"))
+        periodic = self.scheduler.call_every(1, lambda: self.ran.append("tick"), jitter=0)
+        job.cancel()
+        job.cancel()
+        self.run_at(1.5)
+        periodic.cancel()
+        self.run_at(5)
+        self.assertEqual(self.ran, ["tick"])
+        self.assertIsNone(self.scheduler.next_due_in())
+        self.assertEqual(self.scheduler.jobs(), [])
+
+    def test_cancelled_jobs_are_pruned(self):
+        for _ in range(1000):
+            self.scheduler.call_later(60, lambda: None).cancel()
+        self.assertLess(len(self.scheduler._heap), 100)
+
+    def test_error_does_not_stop_a_periodic_job(self):
+        def fail():
+            self.ran.append("fail")
+            raise RuntimeError("boom")
+        self.scheduler.call_every(1, fail, jitter=0)
+        self.run_at(1.01)
+        self.run_at(2.01)
+        self.assertEqual(self.ran, ["fail", "fail"])
+        self.assertEqual(self.scheduler.stats["errors"], 2)
+
+    def test_jobs_lists_what_is_waiting(self):
+        self.scheduler.call_later(5, lambda: None, name="later")
+        self.scheduler.call_every(2, lambda: None, name="often", jitter=0)
+        self.assertEqual([name for name, _, _, _ in self.scheduler.jobs()], ["often", "later"])
+
+
+class ThreadedSchedulerTest(unittest.TestCase):
+    def test_sooner_job_wakes_the_thread(self):
+        scheduler = Scheduler()
+        done = threading.Event()
+        scheduler.call_later(60, lambda: None)
+        started = time.monotonic()
+        scheduler.call_later(0.05, done.set)
+        self.assertTrue(done.wait(5))
+        self.assertLess(time.monotonic() - started, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+"""TimingWheel: deadlines expire once, on time, however they were moved"""
+
+import random
+import unittest
+
+from mqchat_core.timingwheel import TimingWheel
+
+
+class TimingWheelTest(unittest.TestCase):
+    def test_expires_at_deadline(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.schedule("alice", 5.0)
+        self.assertEqual(wheel.advance(4.9), [])
+        self.assertIn("alice", wheel)
+        self.assertEqual(wheel.advance(5.0), ["alice"])
+        self.assertNotIn("alice", wheel)
+        self.assertEqual(wheel.advance(6.0), [])
+
+    def test_refresh_pushes_deadline_back(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.schedule("alice", 3.0)
+        wheel.schedule("alice", 6.0)
+        self.assertEqual(wheel.advance(3.5), [])
+        self.assertEqual(wheel.advance(6.0), ["alice"])
+
+    def test_sooner_deadline_moves_forward(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.advance(0.0)
+        wheel.schedule("alice", 6.0)
+        wheel.schedule("alice", 2.0)
+        self.assertEqual(wheel.advance(2.0), ["alice"])
+        self.assertEqual(len(wheel), 0)
+
+    def test_cancel(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.schedule("alice", 2.0)
+        wheel.cancel("alice")
+        wheel.cancel("nobody")
+        self.assertEqual(wheel.advance(10.0), [])
+        self.assertEqual(len(wheel), 0)
+
+    def test_deadline_beyond_one_turn(self):
+        wheel = TimingWheel(tick=1.0, slots=4)
+        wheel.advance(0.0)
+        wheel.schedule("alice", 10.0)
+        for now in range(1, 10):
+            self.assertEqual(wheel.advance(now), [], now)
+        self.assertEqual(wheel.advance(10.0), ["alice"])
+
+    def test_late_advance_catches_up(self):
+        wheel = TimingWheel(tick=1.0, slots=4)
+        wheel.advance(0.0)
+        for i, user in enumerate(["a", "b", "c"]):
+            wheel.schedule(user, 1.0 + i * 5)
+        self.assertEqual(sorted(wheel.advance(100.0)), ["a", "b", "c"])
+
+    def test_deadline_later_in_the_current_tick(self):
+        wheel = TimingWheel(tick=1.0, slots=8)
+        wheel.schedule("alice", 2.8)
+        self.assertEqual(wheel.advance(2.5), [])
+        self.assertEqual(wheel.advance(2.9), ["alice"])
+
+    def test_random_schedule_matches_a_dict(self):
+        rng = random.Random(1)
+        wheel = TimingWheel(tick=0.5, slots=16)
+        expected = {}
+        now = 0.0
+        for _ in range(2000):
+            now += rng.random() * 0.7
+            user = f"user{rng.randint(0, 30)}"
+            action = rng.random()
+            if action < 0.6:
+                deadline = now + rng.random() * 20
+                wheel.schedule(user, deadline)
+                expected[user] = deadline
+            elif action < 0.7:
+                wheel.cancel(user)
+                expected.pop(user, None)
+            expired = wheel.advance(now)
+            due = sorted(user for user, deadline in expected.items() if deadline <= now)
+            self.assertEqual(sorted(expired), due)
+            for user in due:
+                del expected[user]
+            self.assertEqual(len(wheel), len(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+"""FileTransfers: malformed offers and chunks are dropped before they touch the disk"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mqchat_core import ChatEngine
+from mqchat_core.scheduler import Scheduler
+from mqchat_core.transfer import EVENT_FILE_OFFERED
+
+
+class FakeClient:
+    def __init__(self):
+        self.subscribed = []
+
+    def subscribe(self, topic, qos=0, options=None):
+        self.subscribed.append(topic)
+        return 0, len(self.subscribed)
+
+    def unsubscribe(self, topics):
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        return None
+
+
+class TransferTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = ChatEngine(scheduler=Scheduler(threaded=False))
+        self.engine.setup_room("room", "alice", "key")
+        self.engine.mqtt_client = FakeClient()
+        self.engine.connected = True
+        self.files = self.engine.files
+        self.files.download_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.files.download_dir)
+        self.addCleanup(self.files.cancel_all)
+        self.offered = []
+        self.engine.on(EVENT_FILE_OFFERED, lambda *args: self.offered.append(args[0]))
+
+    def offer(self, transfer_id, **fields):
+        manifest = {"type": "manifest", "id": transfer_id, "sender": "bob", "name": "notes.txt",
+                    "size": 10, "chunk_size": 4, "chunks": 3, "sha256": ""}
+        manifest.update(fields)
+        self.files.handle_message(self.files.topic(transfer_id, "manifest"),
+                                  self.engine.encrypt_message(manifest))
+
+    def chunk(self, transfer_id, index, data):
+        self.files.handle_message(self.files.topic(transfer_id, "chunk"),
+                                  self.files._seal_chunk(transfer_id, index, data))
+
+    def test_bad_sizes_are_not_offered(self):
+        self.offer("negative", size=-1, chunks=1)
+        self.offer("text", size="10")
+        self.offer("fraction", size=10.5)
+        self.offer("miscounted", chunks=2)
+        self.assertEqual(self.offered, [])
+        self.offer("good")
+        self.assertEqual(self.offered, ["good"])
+
+    def test_oversized_chunks_are_dropped(self):
+        self.offer("t1")
+        self.assertTrue(self.files.accept("t1"))
+        transfer = self.files.incoming["t1"]
+        self.chunk("t1", 0, b"12345")  # Longer than chunk_size
+        self.chunk("t1", 2, b"9012")  # The last chunk holds only 2 bytes
+        self.assertEqual(transfer.received_count, 0)
+        self.chunk("t1", 2, b"90")
+        self.assertEqual(transfer.received_count, 1)
+        transfer.file.flush()
+        self.assertEqual(os.path.getsize(transfer.part_path), 10)
+
+    def test_downloads_are_resubscribed(self):
+        self.offer("t1")
+        self.files.accept("t1")
+        self.assertIn(self.files.topic("t1", "chunk"), self.files.subscriptions())
+        self.files.cancel_all()
+        self.assertNotIn(self.files.topic("t1", "chunk"), self.files.subscriptions())
+
+
+if __name__ == "__main__":
+    unittest.main()
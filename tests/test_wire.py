@@ -0,0 +1,99 @@
+"""Wire format: v1/v2 round trips and malformed payloads"""
+
+import base64
+import unittest
+
+from mqchat_core import wire
+
+
+class RoundTripTest(unittest.TestCase):
+    def test_v1(self):
+        token = b"gAAAAABfake-fernet-token=="
+        envelope = wire.unpack(wire.pack_v1(token))
+        self.assertEqual(envelope.version, wire.WIRE_V1)
+        self.assertEqual(envelope.body, token)
+        self.assertIsNone(envelope.key_id)
+        self.assertEqual(envelope.header, b"")
+
+    def test_v1_as_text(self):
+        token = b"gAAAAABfake-fernet-token=="
+        self.assertEqual(wire.unpack(wire.pack_v1(token).decode()).body, token)
+
+    def test_v2_plain(self):
+        payload = wire.pack_v2(b"ciphertext", flags=wire.FLAG_BATCH, suite=3)
+        envelope = wire.unpack(payload)
+        self.assertEqual(envelope.version, wire.WIRE_V2)
+        self.assertEqual(envelope.flags, wire.FLAG_BATCH)
+        self.assertEqual(envelope.suite, 3)
+        self.assertIsNone(envelope.key_id)
+        self.assertIsNone(envelope.dict_id)
+        self.assertEqual(envelope.body, b"ciphertext")
+        self.assertEqual(envelope.header + envelope.body, payload)
+
+    def test_v2_key_and_dictionary_ids(self):
+        payload = wire.pack_v2(b"body", flags=wire.FLAG_ZSTD, key_id=b"KEY1", dict_id=b"DIC1")
+        envelope = wire.unpack(payload)
+        self.assertEqual(envelope.key_id, b"KEY1")
+        self.assertEqual(envelope.dict_id, b"DIC1")
+        self.assertEqual(envelope.flags, wire.FLAG_ZSTD | wire.FLAG_KEY_ID | wire.FLAG_DICT)
+        self.assertEqual(envelope.body, b"body")
+        self.assertEqual(len(envelope.header), wire.HEADER.size + wire.KEY_ID_SIZE + wire.DICT_ID_SIZE)
+
+    def test_v2_empty_body(self):
+        self.assertEqual(wire.unpack(wire.pack_v2(b"", key_id=b"KEY1")).body, b"")
+
+    def test_id_flags_follow_the_ids(self):
+        # Flags for ids that aren't given are dropped, so the header can't lie about its length
+        envelope = wire.unpack(wire.pack_v2(b"body", flags=wire.FLAG_KEY_ID | wire.FLAG_DICT))
+        self.assertEqual(envelope.flags, 0)
+        self.assertEqual(envelope.body, b"body")
+
+    def test_fernet_binary_round_trip(self):
+        token = base64.urlsafe_b64encode(bytes(range(80)))
+        self.assertEqual(wire.binary_to_fernet(wire.fernet_to_binary(token)), token)
+
+
+class MalformedTest(unittest.TestCase):
+    def assertRejected(self, payload):
+        with self.assertRaises(wire.WireError):
+            wire.unpack(payload)
+
+    def test_empty(self):
+        self.assertRejected(b"")
+        self.assertRejected("")
+
+    def test_truncated_header(self):
+        for size in range(1, wire.HEADER.size):
+            self.assertRejected(wire.pack_v2(b"")[:size])
+
+    def test_unknown_version(self):
+        self.assertRejected(bytes([wire.MAGIC, 3, 0, 0]) + b"body")
+        self.assertRejected(bytes([wire.MAGIC, wire.WIRE_V1, 0, 0]) + b"body")
+
+    def test_truncated_key_id(self):
+        payload = wire.pack_v2(b"", key_id=b"KEY1")
+        for size in range(wire.HEADER.size, len(payload)):
+            self.assertRejected(payload[:size])
+
+    def test_truncated_dictionary_id(self):
+        payload = wire.pack_v2(b"", key_id=b"KEY1", dict_id=b"DIC1")
+        for size in range(wire.HEADER.size + wire.KEY_ID_SIZE, len(payload)):
+            self.assertRejected(payload[:size])
+
+    def test_bad_v1_text(self):
+        self.assertRejected(b"not base64!")
+        self.assertRejected(b"abc")  # Bad padding
+        self.assertRejected(b"\x00\xff\x10")
+
+    def test_bad_id_sizes(self):
+        with self.assertRaises(wire.WireError):
+            wire.pack_v2(b"", key_id=b"KEY")
+        with self.assertRaises(wire.WireError):
+            wire.pack_v2(b"", dict_id=b"DICT1")
+
+    def test_wire_error_is_a_value_error(self):
+        self.assertTrue(issubclass(wire.WireError, ValueError))
+
+
+if __name__ == "__main__":
+    unittest.main()